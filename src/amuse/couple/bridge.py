@@ -84,7 +84,10 @@
 # - sync of systems should be checked
 # - timestepping: adaptive dt?
 
+import sys
 import threading
+import time
+import numpy
 
 from amuse.units import quantities
 from amuse.units import units, constants, generic_unit_system, nbody_system
@@ -92,6 +95,57 @@ from amuse import datamodel
 from amuse.support.exceptions import AmuseException
 
 
+class FieldEvaluationCache(object):
+    """
+    Keeps the most recent result of a field calculation (the potential
+    or the gravity at a set of points), together with the state of the
+    sources and the points it was calculated for. The result is
+    returned again for the same method, points and state of the
+    sources.
+    """
+
+    def __init__(self):
+        self.hits = 0
+        self.misses = 0
+        self.clear()
+
+    def clear(self):
+        self.key = None
+        self.result = None
+
+    def get(self, sources, method_name, arguments):
+        if self.key is not None and _is_equal(self.key, (sources, method_name, arguments)):
+            self.hits += 1
+            return _copy_of(self.result)
+        self.misses += 1
+        return None
+
+    def set(self, sources, method_name, arguments, result):
+        self.key = _copy_of((sources, method_name, arguments))
+        self.result = _copy_of(result)
+
+def _is_equal(x, y):
+    if x is y:
+        return True
+    if isinstance(x, (tuple, list)):
+        return (isinstance(y, (tuple, list)) and len(x) == len(y) and
+            all([_is_equal(a, b) for a, b in zip(x, y)]))
+    if quantities.is_quantity(x) or quantities.is_quantity(y):
+        if not (hasattr(x, 'unit') and hasattr(y, 'unit')):
+            return False
+        try:
+            return numpy.array_equal(x.value_in(y.unit), y.number)
+        except Exception:
+            return False
+    return numpy.array_equal(x, y)
+
+def _copy_of(x):
+    if isinstance(x, (tuple, list)):
+        return type(x)([_copy_of(a) for a in x])
+    if hasattr(x, 'copy'):
+        return x.copy()
+    return x
+
 
 class AbstractCalculateFieldForCodes(object):
     """
@@ -99,7 +153,7 @@ class AbstractCalculateFieldForCodes(object):
     of other codes with the code provided.
     """
 
-    def __init__(self, input_codes, verbose=False, required_attributes=None):
+    def __init__(self, input_codes, verbose=False, required_attributes=None, use_cache=False):
         """
         'verbose' indicates whether to output some run info
 
@@ -110,6 +164,14 @@ class AbstractCalculateFieldForCodes(object):
         softening. In the latter case
             required_attributes=['mass', 'x','y','z', 'vx','vy','vz']
         should prevent the radius of the input codes from being used.
+
+        'use_cache' indicates whether the particles of the input codes are
+        kept in the code between calculations. They are only uploaded again
+        when particles were added to or removed from an input code or when
+        the model time of an input code has changed. Particles moved by hand,
+        without evolving the input code, are not seen, call clear_cache
+        after moving particles. The most recent result is also kept and
+        returned again for the same points.
         """
         self.codes_to_calculate_field_for = input_codes
         self.verbose=verbose
@@ -117,33 +179,77 @@ class AbstractCalculateFieldForCodes(object):
             self.required_attributes = lambda p, attribute_name: True
         else:
             self.required_attributes = lambda p, attribute_name: attribute_name in required_attributes
+        self.use_cache = use_cache
+        self.cache = FieldEvaluationCache()
+        self.number_of_uploads = 0
+        self._cached_code = None
+        self._cached_sources = None
 
     def evolve_model(self,tend,timestep=None):
         """
         """
 
     def get_potential_at_point(self,radius,x,y,z):
-        code = self._setup_code()
-        try:
-            for input_code in self.codes_to_calculate_field_for:
-                particles = input_code.particles.copy(filter_attributes = self.required_attributes)
-                code.particles.add_particles(particles)
-            code.commit_particles()
-            return code.get_potential_at_point(radius,x,y,z)
-        finally:
-            self._cleanup_code(code)
+        return self._calculate_field("get_potential_at_point", (radius,x,y,z))
 
     def get_gravity_at_point(self,radius,x,y,z):
-        code = self._setup_code()
-        try:
-            for input_code in self.codes_to_calculate_field_for:
-                particles = input_code.particles.copy(filter_attributes = self.required_attributes)
-                code.particles.add_particles(particles)
-            code.commit_particles()
-            return code.get_gravity_at_point(radius,x,y,z)
-        finally:
+        return self._calculate_field("get_gravity_at_point", (radius,x,y,z))
+
+    def clear_cache(self):
+        """
+        Removes the particles of the input codes from the code
+        and forgets the most recent result
+        """
+        self.cache.clear()
+        self._cached_sources = None
+        if self._cached_code is not None:
+            code = self._cached_code
+            self._cached_code = None
             self._cleanup_code(code)
 
+    def _calculate_field(self, method_name, arguments):
+        if not self.use_cache:
+            code = self._setup_code()
+            try:
+                self._upload_particles(code)
+                return getattr(code, method_name)(*arguments)
+            finally:
+                self._cleanup_code(code)
+
+        sources = self._state_of_input_codes()
+        if not _is_equal(sources, self._cached_sources):
+            self.clear_cache()
+            code = self._setup_code()
+            try:
+                self._upload_particles(code)
+            except:
+                self._cleanup_code(code)
+                raise
+            self._cached_code = code
+            self._cached_sources = sources
+
+        result = self.cache.get(sources, method_name, arguments)
+        if result is None:
+            result = getattr(self._cached_code, method_name)(*arguments)
+            self.cache.set(sources, method_name, arguments, result)
+        return result
+
+    def _state_of_input_codes(self):
+        return [
+            (
+                input_code.particles._get_version(),
+                input_code.model_time if hasattr(input_code, 'model_time') else None
+            )
+            for input_code in self.codes_to_calculate_field_for
+        ]
+
+    def _upload_particles(self, code):
+        for input_code in self.codes_to_calculate_field_for:
+            particles = input_code.particles.copy(filter_attributes = self.required_attributes)
+            code.particles.add_particles(particles)
+        code.commit_particles()
+        self.number_of_uploads += 1
+
     def _setup_code(self):
         pass
 
@@ -210,7 +316,14 @@ class CalculateFieldForParticles(object):
     """
 
     def __init__(self, particles = None, gravity_constant = None,
-            softening_mode="shared"):
+            softening_mode="shared", use_cache=False):
+        """
+        'use_cache' indicates whether the most recent result is kept and
+        returned again for the same points, as long as the positions,
+        masses and softening lengths of the particles are unchanged
+        """
+        self.use_cache = use_cache
+        self.cache = FieldEvaluationCache()
         if particles is None:
             self.particles=datamodel.Particles()
         else:
@@ -244,12 +357,40 @@ class CalculateFieldForParticles(object):
 
     def cleanup_code(self):
         self.particles = datamodel.Particles()
+        self.cache.clear()
 
     def evolve_model(self,tend,timestep=None):
         """
         """
 
+    def _state_of_particles(self):
+        if len(self.particles) == 0:
+            return (self.particles._get_version(), self._softening_lengths_squared())
+        return (
+            self.particles._get_version(),
+            self.particles.position,
+            self.particles.mass,
+            self._softening_lengths_squared()
+        )
+
+    def _calculate_field(self, method, arguments):
+        if not self.use_cache:
+            return method(*arguments)
+
+        sources = self._state_of_particles()
+        result = self.cache.get(sources, method.__name__, arguments)
+        if result is None:
+            result = method(*arguments)
+            self.cache.set(sources, method.__name__, arguments, result)
+        return result
+
     def get_potential_at_point(self,radius,x,y,z):
+        return self._calculate_field(self._get_potential_at_point, (radius,x,y,z))
+
+    def get_gravity_at_point(self,radius,x,y,z):
+        return self._calculate_field(self._get_gravity_at_point, (radius,x,y,z))
+
+    def _get_potential_at_point(self,radius,x,y,z):
         positions = self.particles.position
         result = quantities.AdaptingVectorQuantity()
 
@@ -264,7 +405,7 @@ class CalculateFieldForParticles(object):
         return result
 
 
-    def get_gravity_at_point(self,radius,x,y,z):
+    def _get_gravity_at_point(self,radius,x,y,z):
         positions = self.particles.position
         m1 = self.particles.mass
         result_ax = quantities.AdaptingVectorQuantity()
@@ -287,12 +428,107 @@ class CalculateFieldForParticles(object):
         return result_ax, result_ay, result_az
 
 
+class PendingKick(object):
+    """
+    A kick of the particles of a code in the field of its field codes,
+    the gravity of the field codes can be set in any order. When the
+    kick is finished the velocities are updated in the order of the
+    field codes and copied to the code.
+    """
+
+    def __init__(self, code_in_field, particles, dt):
+        self.code_in_field = code_in_field
+        self.particles = particles
+        self.dt = dt
+        self.kinetic_energy_before = particles.kinetic_energy()
+        self.field_codes = list(code_in_field.field_codes)
+        self.accelerations = [None] * len(self.field_codes)
+        self.arguments = (
+            code_in_field._softening_lengths(particles),
+            particles.x,
+            particles.y,
+            particles.z
+        )
+
+    def finish(self):
+        for ax, ay, az in self.accelerations:
+            self.code_in_field.update_velocities(self.particles, self.dt, ax, ay, az)
+
+        channel=self.particles.new_channel_to(self.code_in_field.code.particles)
+        channel.copy_attributes(["vx","vy","vz"])
+
+        kinetic_energy_after = self.particles.kinetic_energy()
+        return kinetic_energy_after - self.kinetic_energy_before
+
+
+class PendingKickWithoutCopy(PendingKick):
+    """
+    A kick of the particles of a code without a copy of the particle
+    set. The positions, velocities and softening lengths (and the
+    masses, for the kick energy) are taken from the code in one call,
+    the changes in velocity are summed over the field codes and only
+    the velocities are written back to the code.
+    """
+
+    def __init__(self, code_in_field, particles, dt):
+        self.code_in_field = code_in_field
+        self.particles = particles
+        self.dt = dt
+        self.field_codes = list(code_in_field.field_codes)
+        self.accelerations = [None] * len(self.field_codes)
+        self.indices = particles.get_all_indices_in_store()
+
+        attributes = ["x", "y", "z", "vx", "vy", "vz"]
+        if code_in_field.radius_is_eps:
+            attributes.append("radius")
+        elif code_in_field.h_smooth_is_eps:
+            attributes.append("h_smooth")
+        if code_in_field.track_kick_energy:
+            attributes.append("mass")
+        values = particles.get_values_in_store(self.indices, attributes)
+
+        x, y, z = values[0:3]
+        self.velocities = values[3:6]
+        self.mass = values[-1] if code_in_field.track_kick_energy else None
+
+        if code_in_field.radius_is_eps or code_in_field.h_smooth_is_eps:
+            softening_lengths = values[6]
+        elif code_in_field.zero_smoothing:
+            softening_lengths = 0. * x
+        else:
+            softening_lengths = (code_in_field.code.parameters.epsilon_squared**0.5).as_vector_with_length(len(x))
+        self.arguments = (softening_lengths, x, y, z)
+
+    def finish(self):
+        ax, ay, az = self.accelerations[0]
+        for x in self.accelerations[1:]:
+            ax = ax + x[0]
+            ay = ay + x[1]
+            az = az + x[2]
+        dvx, dvy, dvz = self.dt * ax, self.dt * ay, self.dt * az
+
+        vx, vy, vz = self.velocities
+        self.particles.set_values_in_store(self.indices, ["vx", "vy", "vz"], [vx + dvx, vy + dvy, vz + dvz])
+
+        if self.mass is None:
+            return quantities.zero
+        return (self.mass * (vx * dvx + vy * dvy + vz * dvz + 0.5 * (dvx**2 + dvy**2 + dvz**2))).sum()
+
+
 class GravityCodeInField(object):
 
 
-    def __init__(self, code, field_codes, do_sync=True, verbose=False, radius_is_eps=False, h_smooth_is_eps=False):
+    def __init__(self, code, field_codes, do_sync=True, verbose=False, radius_is_eps=False, h_smooth_is_eps=False,
+            copy_free_kick=False, track_kick_energy=True):
         """
         verbose indicates whether to output some run info
+
+        copy_free_kick indicates whether a kick takes the positions and
+        velocities from the code without copying the particle set and
+        writes back only the velocities
+
+        track_kick_energy indicates whether a copy free kick calculates
+        the change in kinetic energy (the kick returns zero if not)
         """
         self.code = code
         self.field_codes = field_codes
@@ -307,6 +543,8 @@ class GravityCodeInField(object):
         self.timestep=None
         self.radius_is_eps = radius_is_eps
         self.h_smooth_is_eps = h_smooth_is_eps
+        self.copy_free_kick = copy_free_kick
+        self.track_kick_energy = track_kick_energy
 
         required_attributes = ['mass', 'x', 'y', 'z', 'vx', 'vy', 'vz']
         if self.radius_is_eps:
@@ -432,6 +670,9 @@ class GravityCodeInField(object):
         if self.cannot_kick or len(self.code.particles)==0:
             return quantities.zero
 
+        if self.copy_free_kick:
+            return self.kick_without_copy(dt)
+
         particles = self.code.particles.copy(filter_attributes = self.required_attributes)
         kinetic_energy_before = particles.kinetic_energy()
 
@@ -455,6 +696,35 @@ class GravityCodeInField(object):
         return kinetic_energy_after - kinetic_energy_before
 
 
+    def kick_without_copy(self, dt):
+        kick = PendingKickWithoutCopy(self, self.code.particles, dt)
+        for index, field_code in enumerate(kick.field_codes):
+            if(self.verbose):
+                print self.code.__class__.__name__,"receives kick from",field_code.__class__.__name__,
+
+            kick.accelerations[index] = field_code.get_gravity_at_point(*kick.arguments)
+
+            if(self.verbose):
+                print ".. done"
+
+        return kick.finish()
+
+    def start_kick(self, dt):
+        """
+        Returns a pending kick with a copy of the particles (or, for
+        a copy free kick, the positions and velocities), the gravity
+        of the field codes is not yet calculated. Returns None if
+        the particles cannot be kicked.
+        """
+        if self.cannot_kick or len(self.code.particles)==0:
+            return None
+
+        if self.copy_free_kick:
+            return PendingKickWithoutCopy(self, self.code.particles, dt)
+
+        particles = self.code.particles.copy(filter_attributes = self.required_attributes)
+        return PendingKick(self, particles, dt)
+
     def _softening_lengths(self, particles):
         if self.radius_is_eps:
             return particles.radius
@@ -492,29 +762,39 @@ class GravityCodeInField(object):
         self.code.stop()
 
 class Bridge(object):
-    def __init__(self, timestep = None, verbose=False, use_threading=True,method=None):
+    def __init__(self, timestep = None, verbose=False, use_threading=True,method=None,
+            use_async_kicks=False):
         """
-        verbose indicates whether to output some run info
+        verbose indicates whether to output some run info, including the
+        time spent in the kick and drift phase of every step
+
+        use_async_kicks indicates whether the gravity of the field codes
+        is requested from all codes before waiting on the results (off
+        by default, see kick_codes_async)
         """
         self.codes=[]
         self.time=quantities.zero
         self.verbose=verbose
         self.timestep=timestep
         self.kick_energy = quantities.zero
+        self.kick_seconds = 0.0
+        self.drift_seconds = 0.0
         self.use_threading = use_threading
+        self.use_async_kicks = use_async_kicks
         self.time_offsets = dict()
         self.method=method
         self.channels = datamodel.Channels()
 
     def add_system(self, interface, partners=set(),do_sync=True,
-            radius_is_eps=False, h_smooth_is_eps=False):
+            radius_is_eps=False, h_smooth_is_eps=False, copy_free_kick=False,
+            track_kick_energy=True):
         """
         add a system to bridge integrator
         """
 
         if hasattr(interface, "particles"):
             code = GravityCodeInField(interface, partners, do_sync, self.verbose,
-                radius_is_eps, h_smooth_is_eps)
+                radius_is_eps, h_smooth_is_eps, copy_free_kick, track_kick_energy)
             self.add_code(code)
         else:
             if len(partners):
@@ -546,14 +826,17 @@ class Bridge(object):
 
     def evolve_simple_steps(self,tend,timestep):
         while self.time < (tend-timestep/2):
+            seconds_at_start = self._seconds_at_start_of_step()
             self._drift_time=self.time
             self.method(self.kick_codes,self.drift_codes_dt, timestep)
             self.channels.copy()
             self.time=self.time+timestep
+            self._print_seconds_of_step(seconds_at_start)
 
     def evolve_joined_leapfrog(self,tend,timestep):
         first=True
         while self.time < (tend-timestep/2.):
+            seconds_at_start = self._seconds_at_start_of_step()
             if first:
                 self.kick_codes(timestep/2.)
                 first=False
@@ -564,6 +847,7 @@ class Bridge(object):
 
             self.channels.copy()
             self.time += timestep
+            self._print_seconds_of_step(seconds_at_start)
 
         if not first:
             self.kick_codes(timestep/2.)
@@ -671,7 +955,19 @@ class Bridge(object):
         self._drift_time+=dt
         self.drift_codes(self._drift_time)
 
+    def _seconds_at_start_of_step(self):
+        return (time.time(), self.kick_seconds, self.drift_seconds)
+
+    def _print_seconds_of_step(self, seconds_at_start):
+        if not self.verbose:
+            return
+        t0, kick_seconds, drift_seconds = seconds_at_start
+        print "step to", self.time, "took", time.time() - t0, "seconds,",
+        print "kick:", self.kick_seconds - kick_seconds, "seconds,",
+        print "drift:", self.drift_seconds - drift_seconds, "seconds"
+
     def drift_codes(self,tend):
+        t0 = time.time()
         threads=[]
 
         for x in self.codes:
@@ -691,11 +987,83 @@ class Bridge(object):
             for x in threads:
                 x.run()
 
+        self.drift_seconds += time.time() - t0
+
     def kick_codes(self,dt):
+        t0 = time.time()
+
+        if self.use_async_kicks:
+            de = self.kick_codes_async(dt)
+        else:
+            de = quantities.zero
+            for x in self.codes:
+                if hasattr(x,"kick"):
+                    de += x.kick(dt)
+
+        self.kick_energy += de
+        self.kick_seconds += time.time() - t0
 
+    def kick_codes_async(self,dt):
+        """
+        Kicks all codes, the gravity of every field code that supports
+        asynchronous calls is requested from all field codes before the
+        results are gathered, so the field codes calculate the gravity
+        concurrently. A field code can handle one call at a time, a field
+        code used by more than one code is called again in the next round.
+        """
         de = quantities.zero
+        kicks = []
         for x in self.codes:
-            if hasattr(x,"kick"):
+            if hasattr(x,"start_kick"):
+                kick = x.start_kick(dt)
+                if kick is not None:
+                    kicks.append(kick)
+            elif hasattr(x,"kick"):
                 de += x.kick(dt)
 
-        self.kick_energy += de
+        calls = []
+        for kick in kicks:
+            for index, field_code in enumerate(kick.field_codes):
+                if(self.verbose):
+                    print kick.code_in_field.code.__class__.__name__,"receives kick from",field_code.__class__.__name__
+
+                if getattr(field_code.get_gravity_at_point, "is_async_supported", False):
+                    calls.append((kick, index, field_code))
+                else:
+                    kick.accelerations[index] = field_code.get_gravity_at_point(*kick.arguments)
+
+        while len(calls) > 0:
+            calls_in_this_round, calls = self._split_calls_on_field_code(calls)
+            requests = []
+            try:
+                for kick, index, field_code in calls_in_this_round:
+                    requests.append((kick, index, field_code.get_gravity_at_point.async(*kick.arguments)))
+            finally:
+                self._gather_gravity(requests)
+
+        for kick in kicks:
+            de += kick.finish()
+        return de
+
+    def _split_calls_on_field_code(self, calls):
+        field_codes = set()
+        calls_in_this_round = []
+        remaining_calls = []
+        for call in calls:
+            if id(call[2]) in field_codes:
+                remaining_calls.append(call)
+            else:
+                field_codes.add(id(call[2]))
+                calls_in_this_round.append(call)
+        return calls_in_this_round, remaining_calls
+
+    def _gather_gravity(self, requests):
+        error = None
+        for kick, index, request in requests:
+            try:
+                kick.accelerations[index] = request.result()
+            except Exception:
+                if error is None:
+                    error = sys.exc_info()
+        if error is not None:
+            raise error[0], error[1], error[2]
@@ -124,6 +124,14 @@ class AttributeStorage(object):
         """
         pass
     
+    def get_modification_count(self):
+        """
+        Returns a counter that changes when particles are added or
+        removed or values are set, or None if the store cannot
+        tell when its values change.
+        """
+        return None
+    
     def has_key_in_store(self, key):
         """
         Returns true if the given key can be found in the store
@@ -162,6 +170,19 @@ class AttributeStorage(object):
         """
         return self.get_values_in_store([index],[attribute])[0][0]
         
+    def can_get_values_in_store_async(self, attributes):
+        """
+        Returns true if the values of the attributes can be requested
+        without waiting for them (with get_values_in_store_async)
+        """
+        return False
+        
+    def can_set_values_in_store_async(self, attributes):
+        """
+        Returns true if the values of the attributes can be set
+        without waiting for the store (with set_values_in_store_async)
+        """
+        return False
     
     def get_defined_attribute_names(self):
         return []    
@@ -596,6 +617,130 @@ class PrivateProperties(object):
     """
     pass
 
+class RawAttributes(object):
+    """
+    Plain numpy view on the attributes of a set. Every attribute
+    is returned as a number or numpy array, in a unit that is chosen
+    once for every dimension, so values with the same dimension can
+    be combined without any unit bookkeeping. The unit of a value
+    is kept in the view and is only needed again to make a quantity
+    of the final result.
+    
+    The unit for a dimension (length, mass, time, ...) is, in order
+    of preference, the unit declared for the view, the unit of the
+    first value seen by the view that has only that dimension, or the
+    base unit of the dimension. Units of values with more dimensions
+    are composed of these. Values already in the unit of the view
+    are not copied.
+    
+    Attribute values are read from the set once, when first needed,
+    changes made to the set after that are not seen by the view.
+    
+    >>> from amuse.datamodel import Particles
+    >>> particles = Particles(2)
+    >>> particles.x = [1.0, 2.0] | units.parsec
+    >>> particles.y = [1000.0, 0.0] | units.AU
+    >>> raw = particles.raw()
+    >>> raw.x.tolist()
+    [1.0, 2.0]
+    >>> raw.unit_of('y')
+    unit<parsec>
+    >>> raw = particles.raw(units = [units.AU])
+    >>> raw.y.tolist()
+    [1000.0, 0.0]
+    >>> raw.unit_of('x')
+    unit<AU>
+    """
+    
+    def __init__(self, particles, units = None):
+        object.__setattr__(self, '_particles', particles)
+        object.__setattr__(self, '_values', {})
+        object.__setattr__(self, '_units_of_values', {})
+        if isinstance(units, RawAttributes):
+            object.__setattr__(self, '_units_of_dimensions', units._units_of_dimensions)
+            object.__setattr__(self, '_units_by_base', units._units_by_base)
+        else:
+            units_of_dimensions = {}
+            for unit in ([] if units is None else units):
+                if len(unit.base) != 1 or unit.base[0][0] != 1:
+                    raise exceptions.AmuseException(
+                        "Cannot declare unit '{0}' for a raw view, only units of one dimension can be declared".format(unit)
+                    )
+                units_of_dimensions[unit.base[0][1]] = unit
+            object.__setattr__(self, '_units_of_dimensions', units_of_dimensions)
+            object.__setattr__(self, '_units_by_base', {})
+    
+    def __getattr__(self, name_of_the_attribute):
+        if name_of_the_attribute.startswith('__'):
+            raise AttributeError(name_of_the_attribute)
+        try:
+            return self._values[name_of_the_attribute]
+        except KeyError:
+            value = getattr(self._particles, name_of_the_attribute)
+            if is_quantity(value):
+                unit = self.unit_for(value.unit)
+                self._units_of_values[name_of_the_attribute] = unit
+                value = self.number_of(value)
+            else:
+                self._units_of_values[name_of_the_attribute] = units.none
+            self._values[name_of_the_attribute] = value
+            return value
+            
+    def __setattr__(self, name_of_the_attribute, value):
+        raise exceptions.AmuseException("A raw view on the attributes of a set is read only")
+        
+    def unit_of(self, name_of_the_attribute):
+        """
+        Returns the unit of the values returned for the attribute
+        """
+        getattr(self, name_of_the_attribute)
+        return self._units_of_values[name_of_the_attribute]
+        
+    def unit_for(self, unit):
+        """
+        Returns the unit in which values of the given unit
+        are returned by the view.
+        """
+        if unit.is_zero() or unit.is_non_numeric() or not unit.base:
+            return unit
+        key = tuple(unit.base)
+        result = self._units_by_base.get(key)
+        if result is None:
+            if len(unit.base) == 1:
+                n, base = unit.base[0]
+                if not base in self._units_of_dimensions:
+                    if n == 1:
+                        self._units_of_dimensions[base] = unit
+                    elif unit.factor == 1:
+                        self._units_of_dimensions[base] = base
+                    else:
+                        self._units_of_dimensions[base] = (unit.factor ** (1.0 / n)) * base
+            result = 1
+            for n, base in unit.base:
+                dimension_unit = self._units_of_dimensions.setdefault(base, base)
+                result = result * (dimension_unit if n == 1 else dimension_unit ** n)
+            self._units_by_base[key] = result
+        return result
+        
+    def number_of(self, quantity):
+        """
+        Returns the number (or numpy array) of the quantity
+        in the unit of the view for its dimension. Use this for
+        quantities that need to be combined with attribute values,
+        for example a smoothing length or the gravitational constant.
+        """
+        if not is_quantity(quantity):
+            return quantity
+        return quantity.value_in(self.unit_for(quantity.unit))
+        
+    def for_set(self, particles):
+        """
+        Returns a raw view on another set, that uses the same units
+        for every dimension as this view.
+        """
+        return RawAttributes(particles, self)
+        
+
 class UndefinedAttribute(object):
     def __get__(self, obj, type=None):
         raise AttributeError()
@@ -742,6 +887,27 @@ class AbstractSet(object):
     def _original_set(self):
         return self
     
+    def raw(self, units = None):
+        """
+        Returns a view on the attributes of the set, that returns
+        plain numbers and numpy arrays instead of quantities. Units
+        with the same dimension are converted to the same unit (see
+        :class:`RawAttributes`), the unit bookkeeping is done once
+        when an attribute is read.
+        
+        :argument units: Optional list of units, one for every dimension, to return the values in
+        
+        >>> from amuse.datamodel import Particles
+        >>> particles = Particles(2)
+        >>> particles.x = [1.0, 2.0] | units.km
+        >>> raw = particles.raw(units = [units.m])
+        >>> raw.x.tolist()
+        [1000.0, 2000.0]
+        >>> raw.unit_of('x')
+        unit<m>
+        """
+        return RawAttributes(self, units)
+        
     def add_vector_attribute(self, name_of_the_attribute, name_of_the_components):
         self._derived_attributes[name_of_the_attribute] = VectorAttribute(name_of_the_components)
     
@@ -219,6 +219,8 @@ class ParticleGetAttributesMethod(ParticleMappingMethod):
     
 class ParticleGetGriddedAttributesMethod(ParticleGetAttributesMethod):
     
+    is_async_supported = False
+    
     def __init__(self, method, get_range_method, attribute_names = None):
         ParticleGetAttributesMethod.__init__(self, method, attribute_names)
         self.get_range_method = get_range_method
@@ -320,6 +322,13 @@ class ParticleSetAttributesMethod(ParticleMappingMethod):
         keyword_args.update(storage.extra_keyword_arguments_for_getters_and_setters)
         self.method(*list_arguments, **keyword_args)
     
+    def set_attribute_values_async(self, storage, attributes, values, *indices):
+        list_arguments = list(indices)
+        list_args, keyword_args = self.convert_attributes_and_values_to_list_and_keyword_arguments(attributes, values)
+        list_arguments.extend(list_args)
+        keyword_args.update(storage.extra_keyword_arguments_for_getters_and_setters)
+        return self.method.async(*list_arguments, **keyword_args)
+    
     def convert_attributes_and_values_to_list_and_keyword_arguments(self, attributes, values):
         not_set_marker = object()
         list_arguments = [not_set_marker] * (len(self.attribute_names))
@@ -361,6 +370,8 @@ class ParticleSetAttributesMethod(ParticleMappingMethod):
         
 class ParticleSetGriddedAttributesMethod(ParticleSetAttributesMethod):
     
+    is_async_supported = False
+    
     def __init__(self, method, get_range_method, attribute_names = None):
         ParticleSetAttributesMethod.__init__(self, method, attribute_names)
         self.get_range_method = get_range_method
@@ -453,10 +464,9 @@ class ParticleQueryMethod(object):
         indices = self.method(*args, **kwargs)
         subset_results = []
         for subset in particles._private.particle_sets:
-            keys = []
-            for index in indices:
-                if index in subset._private.attribute_storage.mapping_from_index_in_the_code_to_particle_key:
-                    keys.append(subset._private.attribute_storage.mapping_from_index_in_the_code_to_particle_key[index])
+            storage = subset._private.attribute_storage
+            indices_in_subset = numpy.asarray(indices)[storage._has_indices_in_the_code(indices)]
+            keys = storage._get_keys_for_indices_in_the_code(indices_in_subset)
             subset_results.append(subset._subset(keys))
         return ParticlesSuperset(subset_results)
     
@@ -482,7 +492,7 @@ class ParticleSpecificSelectMethod(object):
 
     def apply_on_all(self, particles):
         
-        all_indices = particles._private.attribute_storage.mapping_from_index_in_the_code_to_particle_key.keys()
+        all_indices = particles._private.attribute_storage.code_indices
         
         lists_of_indices = self.method(list(all_indices))
         
@@ -525,7 +535,7 @@ class ParticleMethod(AbstractCodeMethodWrapper):
 
     def apply_on_all(self, particles, *list_arguments, **keyword_arguments):
         storage = particles._private.attribute_storage
-        all_indices = list(storage.mapping_from_index_in_the_code_to_particle_key.keys())
+        all_indices = list(storage.code_indices)
         return self.method(all_indices, *list_arguments, **keyword_arguments)
     
     def apply_on_one(self, set,  particle, *list_arguments, **keyword_arguments):
@@ -623,6 +633,8 @@ class ParticleGetIndexMethod(object):
     """
     ATTRIBUTE_NAME = "index_in_code"
     
+    is_async_supported = False
+    
     def __init__(self):
         pass
     
@@ -719,11 +731,95 @@ class AbstractInCodeAttributeStorage(base.AttributeStorage):
         return sorted(self.writable_attributes)
 
     
+class SortedIndex(object):
+    """
+    Maps values (the keys of the particles or the indices of the
+    particles in a code) to the positions of the values in the arrays
+    of a storage. The values are kept sorted, lookups are binary 
+    searches on the sorted values and adding or removing values is 
+    done with numpy operations on whole arrays, so no python loop
+    over the particles is needed.
+    """
+    MINIMUM_LENGTH_TO_SORT = 4096
+    
+    def __init__(self):
+        self.sorted_values = numpy.zeros(0, dtype='int64')
+        self.positions = numpy.zeros(0, dtype='int64')
+    
+    def __len__(self):
+        return len(self.sorted_values)
+        
+    def as_array(self, values):
+        return numpy.asarray(values, dtype=self.sorted_values.dtype).reshape(-1)
+        
+    def find(self, values):
+        """
+        Returns the positions of the values and a boolean array 
+        that is True for every value found, the position of a 
+        value not found is undefined
+        """
+        values = self.as_array(values)
+        if len(self.sorted_values) == 0:
+            return numpy.zeros(len(values), dtype='int64'), numpy.zeros(len(values), dtype='bool')
+        if len(values) > self.MINIMUM_LENGTH_TO_SORT:
+            # searching sorted values is faster, the searches 
+            # follow each other through the sorted values
+            order = numpy.argsort(values)
+            indices = numpy.empty(len(values), dtype='int64')
+            indices[order] = numpy.searchsorted(self.sorted_values, values[order])
+        else:
+            indices = numpy.searchsorted(self.sorted_values, values)
+        indices[indices >= len(self.sorted_values)] = 0
+        return self.positions[indices], self.sorted_values[indices] == values
+    
+    def add(self, values, positions):
+        values = numpy.asarray(values)
+        if len(values) == 0:
+            return
+        if len(self.sorted_values) == 0:
+            self.sorted_values = numpy.zeros(0, dtype=values.dtype)
+        values = self.as_array(values)
+        order = numpy.argsort(values)
+        values = values[order]
+        positions = numpy.asarray(positions, dtype='int64')[order]
+        if len(self.sorted_values) == 0:
+            self.sorted_values = values
+            self.positions = positions
+        else:
+            indices = numpy.searchsorted(self.sorted_values, values)
+            self.sorted_values = numpy.insert(self.sorted_values, indices, values)
+            self.positions = numpy.insert(self.positions, indices, positions)
+        
+    def remove(self, positions, length):
+        """
+        Removes the values at the positions and moves the positions 
+        after these down, so the positions stay consistent with 
+        numpy.delete(array, positions) of the array of the storage
+        """
+        is_removed = numpy.zeros(length, dtype='bool')
+        is_removed[positions] = True
+        number_removed_before = numpy.cumsum(is_removed)
+        is_kept = numpy.logical_not(is_removed[self.positions])
+        self.sorted_values = self.sorted_values[is_kept]
+        self.positions = self.positions[is_kept]
+        self.positions -= number_removed_before[self.positions]
+
+
 class InCodeAttributeStorage(AbstractInCodeAttributeStorage):
     """
     Manages sets of particles stored in codes.
     
     Maps indices returned by the code to keys defined in AMUSE.
+    The keys and indices are kept in arrays, both are mapped to
+    the positions in these arrays with a :class:`SortedIndex`.
+    
+    If use_cache is True, the values of all attributes returned
+    by a getter are fetched for all particles when one of these
+    attributes is read, and kept until the next call to the code 
+    that is not made by the cache (evolve_model, commit_particles,
+    a setter, ...) or until particles are added or removed. The
+    calls are counted by the legacy interface of the code, for codes
+    without this count the values are not cached.
     """
     def __init__(self, 
             code_interface, 
@@ -732,7 +828,8 @@ class InCodeAttributeStorage(AbstractInCodeAttributeStorage):
             number_of_particles_method, 
             setters,
             getters,
-            name_of_the_index):
+            name_of_the_index,
+            use_cache = False):
         
         
         for x in getters:
@@ -745,8 +842,8 @@ class InCodeAttributeStorage(AbstractInCodeAttributeStorage):
         
         AbstractInCodeAttributeStorage.__init__(self, code_interface, setters, getters)
     
-        self.mapping_from_particle_key_to_index_in_the_code = {}
-        self.mapping_from_index_in_the_code_to_particle_key = {}
+        self.index_of_particle_keys = SortedIndex()
+        self.index_of_code_indices = SortedIndex()
         self.particle_keys = numpy.zeros(0)
         self.code_indices = numpy.zeros(0)
         
@@ -754,10 +851,14 @@ class InCodeAttributeStorage(AbstractInCodeAttributeStorage):
         self.delete_particle_method = delete_particle_method
         self.new_particle_method = new_particle_method
         
+        self.use_cache = use_cache
+        self.cache = {}
+        self.cached_number_of_calls = None
+        
         self.getters.append(ParticleGetIndexMethod())
 
     def __len__(self):
-        return len(self.mapping_from_particle_key_to_index_in_the_code)
+        return len(self.particle_keys)
 
     def can_extend_attributes(self):
         return False
@@ -766,72 +867,42 @@ class InCodeAttributeStorage(AbstractInCodeAttributeStorage):
         
         indices = self.new_particle_method.add_entities(attributes, values)
         
-        if len(self.particle_keys) > 0:
-            previous_length = len(self.particle_keys)
-            self.particle_keys = numpy.concatenate((self.particle_keys, numpy.array(list(keys))))
-            self.code_indices =  numpy.concatenate((self.code_indices, numpy.array(indices)))
-            result = self.code_indices[previous_length:]
-        else:
-            self.particle_keys = numpy.array(keys)
-            self.code_indices = numpy.array(indices)
-            result = self.code_indices
-            
-        index = 0
-        for key in keys:
-            self.mapping_from_particle_key_to_index_in_the_code[key] = indices[index]
-            self.mapping_from_index_in_the_code_to_particle_key[indices[index]] = key
-            index = index + 1
-        
-        return result
+        previous_length = len(self.particle_keys)
+        self._add_keys_and_indices(keys, indices)
+        return self.code_indices[previous_length:]
 
     def get_indices_of(self, keys):
-        indices_in_the_code = []
         if keys is None:
-            keys = self.particle_keys
-        
-        notfoundkeys = []
-        for particle_key in keys:
-            try:
-                indices_in_the_code.append(self.mapping_from_particle_key_to_index_in_the_code[particle_key])
-            except KeyError:
-                notfoundkeys.append(particle_key)
-          
-        if not len(notfoundkeys) == 0:
+            return self.code_indices
+        
+        keys = self.index_of_particle_keys.as_array(keys)
+        if len(keys) == len(self.particle_keys) and numpy.array_equal(keys, self.particle_keys):
+            return self.code_indices
+        
+        positions, is_found = self.index_of_particle_keys.find(keys)
+        if not is_found.all():
+            notfoundkeys = keys[numpy.logical_not(is_found)]
             if len(notfoundkeys) == 1:
                 raise Exception("Key not found in storage: {0}".format(notfoundkeys[0]))
             else:
-                notfoundkeys = numpy.asarray(notfoundkeys)
                 raise Exception("Keys not found in storage: {0}".format(notfoundkeys))
                 
-        return indices_in_the_code
+        return self.code_indices[positions]
         
    
     def get_key_indices_of(self, keys):
-        result = []
         if keys is None:
-            keys = self.particle_keys
-        
-        keys_set = set(keys)
-        for index in range(len(self.particle_keys)):
-            key = self.particle_keys[index]
-            if key in keys_set:
-                result.append(index)
-          
-        return result
-         
+            return numpy.arange(len(self.particle_keys))
+        
+        positions, is_found = self.index_of_particle_keys.find(keys)
+        return numpy.unique(positions[is_found])
         
     def get_positions_of_indices(self, indices):
-        result = []
         if indices is None:
-            indices = self.code_indices
-        
-        indices_set = set(indices)
-        for index in range(len(self.code_indices)):
-            index_in_code = self.code_indices[index]
-            if index_in_code in indices_set:
-                result.append(index)
-          
-        return result
+            return numpy.arange(len(self.code_indices))
+        
+        positions, is_found = self.index_of_code_indices.find(indices)
+        return numpy.unique(positions[is_found])
         
     def get_value_of(self, index, attribute):
         return self.get_value_in_store(index, attribute)
@@ -843,7 +914,13 @@ class InCodeAttributeStorage(AbstractInCodeAttributeStorage):
             
         if len(indices_in_the_code) == 0:
             return [[] for attribute in attributes]
-             
+        
+        if self.use_cache and not self._number_of_calls_to_the_code() is None:
+            return self._get_values_from_cache(indices_in_the_code, attributes)
+        else:
+            return self._get_values_from_code(indices_in_the_code, attributes)
+            
+    def _get_values_from_code(self, indices_in_the_code, attributes):
         mapping_from_attribute_to_result = {}
         
         for getter in self.select_getters_for(attributes):
@@ -856,60 +933,125 @@ class InCodeAttributeStorage(AbstractInCodeAttributeStorage):
         return results
         
     
-    def get_values_in_store_async(self, indices_in_the_code, attributes):
+    def _get_values_from_cache(self, indices_in_the_code, attributes):
+        if self.cached_number_of_calls != self._number_of_calls_to_the_code():
+            self.cache = {}
+        
+        missing_attributes = [x for x in attributes if not x in self.cache]
+        if missing_attributes:
+            for getter in self.select_getters_for(missing_attributes):
+                result = getter.get_attribute_values(self, getter.attribute_names, self.code_indices)
+                for attribute, values in result.iteritems():
+                    if (is_quantity(values) or isinstance(values, numpy.ndarray)) and len(values) == len(self.code_indices):
+                        self.cache[attribute] = values
+            self.cached_number_of_calls = self._number_of_calls_to_the_code()
+            if not all([x in self.cache for x in attributes]):
+                return self._get_values_from_code(indices_in_the_code, attributes)
+        
+        if indices_in_the_code is self.code_indices:
+            return [self.cache[x].copy() for x in attributes]
+            
+        positions, is_found = self.index_of_code_indices.find(indices_in_the_code)
+        if not is_found.all():
+            return self._get_values_from_code(indices_in_the_code, attributes)
+        return [self.cache[x][positions] for x in attributes]
+        
+    def _number_of_calls_to_the_code(self):
+        interface = getattr(self.code_interface, 'legacy_interface', self.code_interface)
+        return getattr(interface, 'number_of_calls', None)
+        
+    def get_modification_count(self):
+        # every change of the particles in the code is made by a call
+        return self._number_of_calls_to_the_code()
+        
+    def clear_cache(self):
+        self.cache = {}
     
+    def can_get_values_in_store_async(self, attributes):
+        try:
+            getters = self.select_getters_for(attributes)
+        except exceptions.AmuseException:
+            return False
+        return all([getattr(x, 'is_async_supported', False) for x in getters])
+        
+    def get_values_in_store_async(self, indices_in_the_code, attributes):
+        from amuse.rfi.channel import ASyncRequestSequence
+        
         if indices_in_the_code is None:
             indices_in_the_code = self.code_indices
-            
+        
         if len(indices_in_the_code) == 0:
-            return [[] for attribute in attributes]
-             
-        mapping_from_attribute_to_result = {}
+            getters = []
+        else:
+            getters = self.select_getters_for(attributes)
         
-        getters = self.select_getters_for(attributes)
-        if len(getters) > 1:
-            raise Exception("more than 1 getters needed for this set of attributes, not supported yet in async mode")
+        def new_request(getter):
+            return lambda : getter.get_attribute_values_async(self, attributes, indices_in_the_code)
         
-        for getter in getters:
-            request = getter.get_attribute_values_async(self, attributes, indices_in_the_code)
-            def result_handler(inner, mapping):
-                mapping.update(inner())
-            request.add_result_handler(result_handler, mapping_from_attribute_to_result)
-    
-        def all_handler(inner, mapping):
-            inner()
+        request = ASyncRequestSequence([new_request(x) for x in getters])
+        
+        def handle_result(inner):
+            mapping_from_attribute_to_result = {}
+            for x in inner():
+                mapping_from_attribute_to_result.update(x)
+            
+            if len(indices_in_the_code) == 0:
+                return [[] for attribute in attributes]
+            
             results = []
             for attribute in attributes:
-                results.append(mapping[attribute])
+                results.append(mapping_from_attribute_to_result[attribute])
             return results
             
-        request.add_result_handler(all_handler, mapping_from_attribute_to_result)
+        request.add_result_handler(handle_result)
         return request
         
     def set_values_in_store(self, indices_in_the_code, attributes, values):
         if len(indices_in_the_code) == 0:
             return
-            
+        
+        self.clear_cache()
         for setter in self.select_setters_for(attributes):
             setter.set_attribute_values(self, attributes, values, indices_in_the_code)
     
+    def can_set_values_in_store_async(self, attributes):
+        try:
+            setters = self.select_setters_for(attributes)
+        except exceptions.AmuseException:
+            return False
+        return all([getattr(x, 'is_async_supported', False) for x in setters])
+        
+    def set_values_in_store_async(self, indices_in_the_code, attributes, values):
+        from amuse.rfi.channel import ASyncRequestSequence
+        
+        if len(indices_in_the_code) == 0:
+            setters = []
+        else:
+            setters = self.select_setters_for(attributes)
+        
+        def new_request(setter):
+            return lambda : setter.set_attribute_values_async(self, attributes, values, indices_in_the_code)
+        
+        self.clear_cache()
+        request = ASyncRequestSequence([new_request(x) for x in setters])
+        
+        def handle_result(inner):
+            inner()
+            self.clear_cache()
+            
+        request.add_result_handler(handle_result)
+        return request
+    
     def remove_particles_from_store(self, indices_in_the_code):
         if indices_in_the_code is None:
             return
         self.delete_particle_method(indices_in_the_code)
         
-        mapping_key = self.mapping_from_particle_key_to_index_in_the_code
-        mapping_index = self.mapping_from_index_in_the_code_to_particle_key
-        for i in indices_in_the_code:
-            key = mapping_index[i]
-            del mapping_index[i]
-            del mapping_key[key]
-        
-        indices_to_delete = self.get_positions_of_indices(indices_in_the_code)
-        
-        self.particle_keys =  numpy.delete(self.particle_keys, indices_to_delete)
-        self.code_indices =  numpy.delete(self.code_indices, indices_to_delete)
-            
+        positions, is_found = self.index_of_code_indices.find(indices_in_the_code)
+        if not is_found.all():
+            notfoundindices = self.index_of_code_indices.as_array(indices_in_the_code)[numpy.logical_not(is_found)]
+            raise KeyError(notfoundindices[0])
+        self._remove_positions(positions)
         
     def get_all_keys_in_store(self):
         return self.particle_keys
@@ -918,47 +1060,55 @@ class InCodeAttributeStorage(AbstractInCodeAttributeStorage):
         return self.code_indices
         
     def has_key_in_store(self, key):
-        return key in self.mapping_from_particle_key_to_index_in_the_code
+        positions, is_found = self.index_of_particle_keys.find([key])
+        return bool(is_found[0])
+        
+    def _has_indices_in_the_code(self, indices):
+        positions, is_found = self.index_of_code_indices.find(indices)
+        return is_found
         
     def _get_keys_for_indices_in_the_code(self, indices):
-        result = []
-        for i in indices:
-            result.append(self.mapping_from_index_in_the_code_to_particle_key.get(i, 0))
-        return result
+        positions, is_found = self.index_of_code_indices.find(indices)
+        if len(self.particle_keys) == 0:
+            return numpy.zeros(len(positions), dtype='uint64')
+        keys = self.particle_keys[positions]
+        keys[numpy.logical_not(is_found)] = 0
+        return keys
         
     def _remove_indices(self, indices):
-        keys = []
-        for i in indices:
-            if i in self.mapping_from_index_in_the_code_to_particle_key:
-                key = self.mapping_from_index_in_the_code_to_particle_key[i]
-                del self.mapping_from_index_in_the_code_to_particle_key[i]
-                del self.mapping_from_particle_key_to_index_in_the_code[key]
-                keys.append(key)
-                
-        indices_to_delete = self.get_key_indices_of(keys)
-        self.particle_keys =  numpy.delete(self.particle_keys, indices_to_delete)
-        self.code_indices =  numpy.delete(self.code_indices, indices_to_delete)
-        
+        self._remove_positions(self.get_positions_of_indices(indices))
     
     def _add_indices(self, indices):
-        keys = []
-        for i in indices:
-            if i in self.mapping_from_index_in_the_code_to_particle_key:
-                raise exceptions.AmuseException("adding an index '{0}' that is already managed, bookkeeping is broken".format(i))
-            newkey = base.UniqueKeyGenerator.next()
-            self.mapping_from_index_in_the_code_to_particle_key[i] = newkey
-            self.mapping_from_particle_key_to_index_in_the_code[newkey] = i
-            
-            keys.append(newkey)
-        if len(self.particle_keys) > 0:
-            self.particle_keys = numpy.concatenate((self.particle_keys, 
-                numpy.asarray(list(keys), dtype=self.particle_keys.dtype)))
-            self.code_indices =  numpy.concatenate((self.code_indices, 
-                numpy.asarray(list(indices), dtype=self.code_indices.dtype)))
+        is_managed = self._has_indices_in_the_code(indices)
+        if is_managed.any():
+            i = numpy.asarray(indices)[is_managed][0]
+            raise exceptions.AmuseException("adding an index '{0}' that is already managed, bookkeeping is broken".format(i))
+        self._add_keys_and_indices(base.UniqueKeyGenerator.next_set_of_keys(len(indices)), indices)
+        
+    def _add_keys_and_indices(self, keys, indices):
+        keys = numpy.asarray(keys)
+        indices = numpy.asarray(indices)
+        if len(keys) == 0:
+            return
+        self.clear_cache()
+        previous_length = len(self.particle_keys)
+        positions = numpy.arange(previous_length, previous_length + len(keys))
+        if previous_length > 0:
+            self.particle_keys = numpy.concatenate((self.particle_keys, keys.astype(self.particle_keys.dtype)))
+            self.code_indices =  numpy.concatenate((self.code_indices, indices.astype(self.code_indices.dtype)))
         else:
             self.particle_keys = numpy.array(keys)
             self.code_indices = numpy.array(indices)
-                
+        self.index_of_particle_keys.add(keys, positions)
+        self.index_of_code_indices.add(indices, positions)
+        
+    def _remove_positions(self, positions):
+        self.clear_cache()
+        length = len(self.particle_keys)
+        self.index_of_particle_keys.remove(positions, length)
+        self.index_of_code_indices.remove(positions, length)
+        self.particle_keys =  numpy.delete(self.particle_keys, positions)
+        self.code_indices =  numpy.delete(self.code_indices, positions)
 
 class InCodeGridAttributeStorage(AbstractInCodeAttributeStorage):
     """
@@ -1102,7 +1252,7 @@ class ParticleSpecificSelectSubsetMethod(object):
         
         if not self.get_number_of_particles_in_set_method is None:
             number_of_particles_in_set = self.get_number_of_particles_in_set_method(from_indices)[0]
-            indices = self.method(from_indices * number_of_particles_in_set, range(number_of_particles_in_set))
+            indices = self.method(list(from_indices) * number_of_particles_in_set, range(number_of_particles_in_set))
         else:
             index = self.method()
             indices = [index]
@@ -105,6 +105,7 @@ class InMemoryAttributeStorage(AttributeStorage):
         return results
         
     def set_values_in_store(self, indices, attributes, list_of_values_to_set):
+        self.__version__ = self.__version__ + 1
         
         for attribute, values_to_set in zip(attributes, list_of_values_to_set):
     
@@ -146,6 +147,9 @@ class InMemoryAttributeStorage(AttributeStorage):
     def __len__(self):
         return len(self.particle_keys)
         
+    def get_modification_count(self):
+        return self.__version__
+        
     def copy(self):
         copy = get_in_memory_attribute_storage_factory()()
         copy.sorted_keys = self.sorted_keys.copy()
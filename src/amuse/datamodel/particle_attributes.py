@@ -1,5 +1,7 @@
 import numpy
 from collections import namedtuple
+from multiprocessing.pool import ThreadPool
+from multiprocessing import Pool
 
 from amuse.units import nbody_system
 from amuse.units import quantities
@@ -12,9 +14,11 @@ from amuse.units.quantities import new_quantity
 from amuse.units.quantities import zero
 
 from amuse.support import exceptions
-from amuse.ext.basicgraph import Graph, MinimumSpanningTreeFromEdges, MinimumSpanningTree
+from amuse.ext.basicgraph import Graph, MinimumSpanningTreeFromEdges
 
 from amuse.datamodel import base
+from amuse.datamodel.spatial_index import KDTree
+from amuse.datamodel.spatial_index import connected_component_labels
 from amuse.datamodel import rotation
 from amuse.datamodel import ParticlesWithUnitsConverted, AbstractParticleSet, Particle
 
@@ -83,6 +87,29 @@ def scale_to_standard(particles, convert_nbody = None,
     particles.velocity *= scale_factor
 
 
+def _weighted_sum_of_components(particles, raw, weights, name_of_the_vector):
+    """
+    Returns the sum of the weights times every component of the
+    vector attribute and the unit of the components. The components
+    are summed one at a time, as (weights * x).sum(), so the result
+    is rounded as in arithmetic on the quantities. The components
+    are not combined into one array, so the attributes of sets
+    stored in memory mapped files (see the memory_mapped option of
+    the amuse file format) are not copied into memory.
+    """
+    derived_attributes = particles._derived_attributes
+    if not name_of_the_vector in derived_attributes or not isinstance(derived_attributes[name_of_the_vector], base.VectorAttribute):
+        vector = getattr(raw, name_of_the_vector)
+        return (
+            numpy.asarray([(weights * vector[:,i]).sum() for i in range(vector.shape[1])]),
+            raw.unit_of(name_of_the_vector)
+        )
+    names = derived_attributes[name_of_the_vector].attribute_names
+    return (
+        numpy.asarray([(weights * getattr(raw, x)).sum() for x in names]), 
+        raw.unit_of(names[0])
+    )
+
 def center_of_mass(particles):
     """
     Returns the center of mass of the particles set.
@@ -99,17 +126,15 @@ def center_of_mass(particles):
     quantity<[0.0, 0.0, 0.0] m>
     """
 
-    masses = particles.mass
-    pos=particles.position
-
+    raw = particles.raw()
+    masses = raw.mass
     total_mass = masses.sum()
-    massx = (masses * pos[:,0]).sum()
-    massy = (masses * pos[:,1]).sum()
-    massz = (masses * pos[:,2]).sum()
-
-    return quantities.VectorQuantity.new_from_scalar_quantities(massx/total_mass,
-        massy/total_mass,
-        massz/total_mass)
+    weighted_sum, unit = _weighted_sum_of_components(particles, raw, masses, 'position')
+    
+    return new_quantity(
+        weighted_sum / total_mass,
+        unit.to_simple_form()
+    )
 
 def center_of_mass_velocity(particles):
     """
@@ -127,18 +152,15 @@ def center_of_mass_velocity(particles):
     quantity<[0.0, 0.0, 0.0] m * s**-1>
     """
 
-
-    masses = particles.mass
-    vel=particles.velocity
-
+    raw = particles.raw()
+    masses = raw.mass
     total_mass = masses.sum()
-    massx = (masses * vel[:,0]).sum()
-    massy = (masses * vel[:,1]).sum()
-    massz = (masses * vel[:,2]).sum()
-
-    return quantities.VectorQuantity.new_from_scalar_quantities(massx/total_mass,
-        massy/total_mass,
-        massz/total_mass)
+    weighted_sum, unit = _weighted_sum_of_components(particles, raw, masses, 'velocity')
+    
+    return new_quantity(
+        weighted_sum / total_mass,
+        unit.to_simple_form()
+    )
 
 def total_momentum(particles):
     """
@@ -153,15 +175,13 @@ def total_momentum(particles):
     >>> particles.total_momentum()
     quantity<[0.0, 0.0, 0.0] m * kg * s**-1>
     """
-    masses = particles.mass
-    vel=particles.velocity
-
-    momx = (masses * vel[:,0]).sum()
-    momy = (masses * vel[:,1]).sum()
-    momz = (masses * vel[:,2]).sum()
-
-    return quantities.VectorQuantity.new_from_scalar_quantities(momx,
-        momy, momz)
+    raw = particles.raw()
+    momentum, unit = _weighted_sum_of_components(particles, raw, raw.mass, 'velocity')
+    
+    return new_quantity(
+        momentum,
+        raw.unit_of('mass').simple_form_of_product(unit)
+    )
 
 def total_angular_momentum(particles):
     """
@@ -183,7 +203,16 @@ def total_angular_momentum(particles):
 #    lx=(m*(y*vz-z*vy)).sum()
 #    ly=(m*(z*vx-x*vz)).sum()
 #    lz=(m*(x*vy-y*vx)).sum()
-    return (particles.mass.reshape((-1,1)) *particles.position.cross(particles.velocity)).sum(axis=0)
+    # not on a raw view, the values are kept in the units of the
+    # attributes, so the result rounds as it did with quantities
+    mass = particles.mass
+    position = particles.position
+    velocity = particles.velocity
+    
+    return new_quantity(
+        (mass.number.reshape((-1,1)) * numpy.cross(position.number, velocity.number)).sum(axis=0),
+        mass.unit.simple_form_of_product(position.unit.simple_form_of_product(velocity.unit))
+    )
 
 
 def moment_of_inertia(particles):
@@ -191,11 +220,14 @@ def moment_of_inertia(particles):
     Returns the total moment of inertia (about the Z axis) of the particle
     set.
     """
-    m = particles.mass
-    x = particles.x
-    y = particles.y
+    raw = particles.raw()
+    x = raw.x
+    y = raw.y
 
-    return (m * (x**2 + y**2)).sum()
+    return new_quantity(
+        (raw.mass * (x**2 + y**2)).sum(),
+        (raw.unit_of('mass') * raw.unit_of('x')**2).to_simple_form()
+    )
 
 
 def kinetic_energy(particles):
@@ -216,21 +248,259 @@ def kinetic_energy(particles):
     if len(particles) < 1:
         return zero
 
-    mass = particles.mass
-    vx = particles.vx
-    vy = particles.vy
-    vz = particles.vz
+    raw = particles.raw()
+    vx = raw.vx
+    vy = raw.vy
+    vz = raw.vz
     v_squared = (vx * vx) + (vy * vy) + (vz * vz)
-    m_v_squared = mass * v_squared
-    return 0.5 * m_v_squared.sum()
+    m_v_squared = raw.mass * v_squared
+    
+    return new_quantity(
+        0.5 * m_v_squared.sum(),
+        (raw.unit_of('mass') * raw.unit_of('vx')**2).to_simple_form()
+    )
+
+
+def _map_over_blocks(function, blocks, number_of_threads):
+    if number_of_threads > 1 and len(blocks) > 1:
+        pool = ThreadPool(min(number_of_threads, len(blocks)))
+        try:
+            return pool.map(function, blocks)
+        finally:
+            pool.close()
+    else:
+        return map(function, blocks)
+
+def _squared_distances(positions, start, stop, field_positions):
+    result = None
+    delta = None
+    for component, field_component in zip(positions.T, field_positions.T):
+        if result is None:
+            result = numpy.subtract.outer(component[start:stop], field_component)
+            result *= result
+        else:
+            if delta is None:
+                delta = numpy.empty_like(result)
+            numpy.subtract.outer(component[start:stop], field_component, out=delta)
+            delta *= delta
+            result += delta
+    return result
+
+MINIMUM_ROWS_PER_BLOCK = 64
+ELEMENTS_PER_CHUNK = 1 << 20
+
+def _rows_per_block(number_of_columns, max_array_length):
+    # a block has at least MINIMUM_ROWS_PER_BLOCK rows, so the
+    # number of blocks stays much smaller than the number of
+    # particles, also for very long rows
+    return max(MINIMUM_ROWS_PER_BLOCK, max_array_length // (3 * max(1, number_of_columns)))
+
+def _column_chunks(first, last, number_of_rows):
+    # the columns of a block are handled in chunks of about
+    # ELEMENTS_PER_CHUNK elements, larger arrays no longer fit in
+    # the cache of the processor
+    columns_per_chunk = max(1, ELEMENTS_PER_CHUNK // max(1, number_of_rows))
+    return [(x, min(x + columns_per_chunk, last)) for x in range(first, last, columns_per_chunk)]
+
+def _direct_potentials(positions, field_positions, field_masses, epsilon_squared, 
+        exclude_self, max_array_length, number_of_threads):
+    """
+    Returns the sum of field_masses / distance at every position,
+    computed for blocks of positions, with at most max_array_length
+    elements in the temporary arrays of a block (or
+    MINIMUM_ROWS_PER_BLOCK rows, if the rows are longer).
+    """
+    n = len(positions)
+    rows_per_block = _rows_per_block(len(field_positions), max_array_length)
+    
+    def potentials_of_block(start):
+        stop = min(start + rows_per_block, n)
+        result = numpy.zeros(stop - start)
+        for first, last in _column_chunks(0, len(field_positions), stop - start):
+            dr_squared = _squared_distances(positions, start, stop, field_positions[first:last])
+            dr_squared += epsilon_squared
+            if exclude_self and first < stop and last > start:
+                rows = numpy.arange(max(start, first), min(stop, last))
+                dr_squared[rows - start, rows - first] = numpy.inf
+            numpy.sqrt(dr_squared, dr_squared)
+            numpy.divide(1.0, dr_squared, dr_squared)
+            result += numpy.dot(dr_squared, field_masses[first:last])
+        return result
+    
+    if n == 0:
+        return numpy.zeros(0)
+    return numpy.concatenate(_map_over_blocks(potentials_of_block, range(0, n, rows_per_block), number_of_threads))
+
+def _direct_potential_energy(positions, masses, epsilon_squared, max_array_length, number_of_threads):
+    """
+    Returns the sum of m_i * m_j / distance over all pairs i < j,
+    computed for blocks of rows of the upper triangle of pairs.
+    """
+    n = len(positions)
+    rows_per_block = _rows_per_block(n, max_array_length)
+    
+    def energy_of_block(start):
+        stop = min(start + rows_per_block, n)
+        result = 0.0
+        for first, last in _column_chunks(start, n, stop - start):
+            dr_squared = _squared_distances(positions, start, stop, positions[first:last])
+            dr_squared += epsilon_squared
+            if first < stop:
+                dr_squared[numpy.arange(first, last) <= numpy.arange(start, stop)[:, numpy.newaxis]] = numpy.inf
+            numpy.sqrt(dr_squared, dr_squared)
+            numpy.divide(1.0, dr_squared, dr_squared)
+            result += numpy.dot(masses[start:stop], numpy.dot(dr_squared, masses[first:last]))
+        return result
+    
+    return sum(_map_over_blocks(energy_of_block, range(0, n, rows_per_block), number_of_threads))
 
+class _PotentialTree(KDTree):
+    """
+    k-d tree with the mass, center of mass and radius of every
+    node, the radius is an upper bound on the distance from the
+    center to the particles of the node.
+    """
+    
+    def __init__(self, positions, masses, leaf_size = 16):
+        KDTree.__init__(self, positions, leaf_size)
+        start, stop = self.start, self.stop
+        number_of_nodes = len(start)
+        self.masses = masses[self.order]
+        self.mass = numpy.zeros(number_of_nodes)
+        self.center = numpy.zeros((number_of_nodes, self.positions.shape[1]))
+        self.radius = numpy.zeros(number_of_nodes)
+        
+        leaves = numpy.arange(self.first_leaf, number_of_nodes)
+        sizes = stop[leaves] - start[leaves]
+        self.mass[leaves] = numpy.add.reduceat(self.masses, start[leaves])
+        weighted = numpy.add.reduceat(self.masses[:, numpy.newaxis] * self.positions, start[leaves])
+        geometric = numpy.add.reduceat(self.positions, start[leaves]) / sizes[:, numpy.newaxis]
+        has_mass = self.mass[leaves] > 0
+        self.center[leaves] = geometric
+        self.center[leaves[has_mass]] = weighted[has_mass] / self.mass[leaves[has_mass], numpy.newaxis]
+        leaf_of_particle = numpy.repeat(leaves, sizes)
+        distances = numpy.sqrt(((self.positions - self.center[leaf_of_particle])**2).sum(-1))
+        self.radius[leaves] = numpy.maximum.reduceat(distances, start[leaves])
+        
+        for level in range(self.depth - 1, -1, -1):
+            nodes = self.nodes_at_level(level)
+            left, right = 2 * nodes + 1, 2 * nodes + 2
+            self.mass[nodes] = self.mass[left] + self.mass[right]
+            has_mass = self.mass[nodes] > 0
+            self.center[nodes] = 0.5 * (self.center[left] + self.center[right])
+            self.center[nodes[has_mass]] = (
+                self.mass[left[has_mass], numpy.newaxis] * self.center[left[has_mass]] +
+                self.mass[right[has_mass], numpy.newaxis] * self.center[right[has_mass]]
+            ) / self.mass[nodes[has_mass], numpy.newaxis]
+            self.radius[nodes] = numpy.maximum(
+                numpy.sqrt(((self.center[left] - self.center[nodes])**2).sum(-1)) + self.radius[left],
+                numpy.sqrt(((self.center[right] - self.center[nodes])**2).sum(-1)) + self.radius[right]
+            )
+    
+    def interaction_lists(self, source_tree, opening_angle):
+        """
+        Walks the source tree for all leaves of this tree, returns
+        the (leaf, node) pairs far enough apart to use the mass and
+        center of mass of the node, and the (leaf, leaf) pairs that
+        need a sum over all particles
+        """
+        targets = numpy.arange(self.first_leaf, len(self.mass))
+        sources = numpy.zeros(len(targets), dtype='int64')
+        far, near = [], []
+        while len(targets) > 0:
+            distances = numpy.sqrt(((self.center[targets] - source_tree.center[sources])**2).sum(-1))
+            is_far = source_tree.radius[sources] < opening_angle * (distances - self.radius[targets])
+            far.append((targets[is_far], sources[is_far]))
+            targets, sources = targets[~is_far], sources[~is_far]
+            is_leaf = sources >= source_tree.first_leaf
+            near.append((targets[is_leaf], sources[is_leaf]))
+            targets, sources = targets[~is_leaf], sources[~is_leaf]
+            targets = numpy.repeat(targets, 2)
+            sources = (2 * sources[:, numpy.newaxis] + [1, 2]).flatten()
+        far_targets, far_sources = [numpy.concatenate(x) for x in zip(*far)]
+        near_targets, near_sources = [numpy.concatenate(x) for x in zip(*near)]
+        return (far_targets, far_sources), (near_targets, near_sources)
+        
+def _indices_in_nodes(tree, nodes):
+    sizes = tree.stop[nodes] - tree.start[nodes]
+    offsets = numpy.arange(sizes.sum()) - numpy.repeat(sizes.cumsum() - sizes, sizes)
+    return numpy.repeat(tree.start[nodes], sizes) + offsets
+
+def _tree_potentials(positions, masses, field_positions, field_masses, epsilon_squared, 
+        exclude_self, max_array_length, number_of_threads, opening_angle):
+    """
+    Returns the sum of field_masses / distance at every position, with
+    the contribution of a group of field particles approximated by its
+    total mass at its center of mass, if the size (radius) of the group
+    is smaller than opening_angle times the distance to the position.
+    """
+    n = len(positions)
+    tree = _PotentialTree(positions, masses)
+    if exclude_self:
+        field_tree = tree
+    else:
+        field_tree = _PotentialTree(field_positions, field_masses)
+    (far_leaves, far_nodes), (near_leaves, near_field_leaves) = tree.interaction_lists(field_tree, opening_angle)
+    
+    leaves = numpy.arange(tree.first_leaf, len(tree.mass))
+    order = numpy.argsort(far_leaves, kind = 'mergesort')
+    far_leaves, far_nodes = far_leaves[order], far_nodes[order]
+    first_far_node = numpy.searchsorted(far_leaves, numpy.arange(tree.first_leaf, len(tree.mass) + 1))
+    order = numpy.argsort(near_leaves, kind = 'mergesort')
+    near_leaves, near_field_leaves = near_leaves[order], near_field_leaves[order]
+    first_near_leaf = numpy.searchsorted(near_leaves, numpy.arange(tree.first_leaf, len(tree.mass) + 1))
+    
+    def potentials_of_leaves(block):
+        result = []
+        for k in range(*block):
+            a, b = tree.start[leaves[k]], tree.stop[leaves[k]]
+            columns_per_block = max(1, max_array_length // (3 * (b - a)))
+            
+            nodes = far_nodes[first_far_node[k]:first_far_node[k+1]]
+            potentials = numpy.zeros(b - a)
+            for c in range(0, len(nodes), columns_per_block):
+                block_of_nodes = nodes[c:c+columns_per_block]
+                dr_squared = _squared_distances(tree.positions, a, b, field_tree.center[block_of_nodes])
+                dr_squared += epsilon_squared
+                potentials += numpy.dot(1.0 / numpy.sqrt(dr_squared), field_tree.mass[block_of_nodes])
+            
+            j = _indices_in_nodes(field_tree, near_field_leaves[first_near_leaf[k]:first_near_leaf[k+1]])
+            for c in range(0, len(j), columns_per_block):
+                block_of_j = j[c:c+columns_per_block]
+                dr_squared = _squared_distances(tree.positions, a, b, field_tree.positions[block_of_j])
+                dr_squared += epsilon_squared
+                if exclude_self:
+                    dr_squared[numpy.arange(a, b)[:, numpy.newaxis] == block_of_j] = numpy.inf
+                potentials += numpy.dot(1.0 / numpy.sqrt(dr_squared), field_tree.masses[block_of_j])
+            result.append(potentials)
+        return numpy.concatenate(result)
+    
+    leaves_per_block = max(1, len(leaves) // (4 * number_of_threads))
+    blocks = [(k, min(k + leaves_per_block, len(leaves))) for k in range(0, len(leaves), leaves_per_block)]
+    potentials = numpy.concatenate(_map_over_blocks(potentials_of_leaves, blocks, number_of_threads))
+    result = numpy.empty(n)
+    result[tree.order] = potentials
+    return result
+
+def _potentials(positions, masses, field_positions, field_masses, epsilon_squared, 
+        exclude_self, max_array_length, number_of_threads, opening_angle):
+    if opening_angle is None:
+        return _direct_potentials(positions, field_positions, field_masses, epsilon_squared,
+            exclude_self, max_array_length, number_of_threads)
+    else:
+        return _tree_potentials(positions, masses, field_positions, field_masses, epsilon_squared,
+            exclude_self, max_array_length, number_of_threads, opening_angle)
 
-def potential_energy(particles, smoothing_length_squared = zero, G = constants.G):
+def potential_energy(particles, smoothing_length_squared = zero, G = constants.G,
+        max_array_length = 10000000, number_of_threads = 1, opening_angle = None):
     """
     Returns the total potential energy of the particles in the particles set.
 
     :argument smooting_length_squared: gravitational softening, added to every distance**2.
     :argument G: gravitational constant, need to be changed for particles in different units systems
+    :argument max_array_length: the pairs are handled in blocks, with at most this number of elements in the arrays of a block (a block has at least 64 rows)
+    :argument number_of_threads: number of threads to handle the blocks with
+    :argument opening_angle: if set, approximate the potential of groups of particles farther away than their size divided by the opening angle with their center of mass (a tree code), smaller angles give more accurate results (0.5 gives relative errors of about 1e-4 in the energy)
 
     >>> from amuse.datamodel import Particles
     >>> particles = Particles(2)
@@ -245,28 +515,20 @@ def potential_energy(particles, smoothing_length_squared = zero, G = constants.G
     if len(particles) < 2:
         return zero
 
-    mass = particles.mass
-    x_vector = particles.x
-    y_vector = particles.y
-    z_vector = particles.z
-
-    sum_of_energies = zero
+    raw = particles.raw()
+    mass = raw.mass
+    position = raw.position
+    epsilon_squared = raw.number_of(smoothing_length_squared)
 
-    for i in range(len(particles) - 1):
-        x = x_vector[i]
-        y = y_vector[i]
-        z = z_vector[i]
-        dx = x - x_vector[i+1:]
-        dy = y - y_vector[i+1:]
-        dz = z - z_vector[i+1:]
-        dr_squared = (dx * dx) + (dy * dy) + (dz * dz)
-        dr = (dr_squared+smoothing_length_squared).sqrt()
-        m_m = mass[i] * mass[i+1:]
-
-        energy_of_this_particle = (m_m / dr).sum()
-        sum_of_energies -= energy_of_this_particle
+    if opening_angle is None:
+        sum_of_energies = -_direct_potential_energy(position, mass, epsilon_squared, 
+            max_array_length, number_of_threads)
+    else:
+        potentials = _tree_potentials(position, mass, position, mass, epsilon_squared,
+            True, max_array_length, number_of_threads, opening_angle)
+        sum_of_energies = -0.5 * numpy.dot(mass, potentials)
 
-    return G * sum_of_energies
+    return G * new_quantity(sum_of_energies, raw.unit_of('mass')**2 / raw.unit_of('position'))
 
 def thermal_energy(particles):
     """
@@ -280,7 +542,12 @@ def thermal_energy(particles):
     >>> particles.thermal_energy()
     quantity<1.0 m**2 * kg * s**-2>
     """
-    return (particles.mass * particles.u).sum()
+    raw = particles.raw()
+    
+    return new_quantity(
+        (raw.mass * raw.u).sum(),
+        raw.unit_of('mass').simple_form_of_product(raw.unit_of('u'))
+    )
 
 
 def particle_specific_kinetic_energy(set, particle):
@@ -313,7 +580,12 @@ def specific_kinetic_energy(particles):
     quantity<[0.5, 0.5] m**2 * s**-2>
     """
 
-    return 0.5*(particles.vx**2+particles.vy**2+particles.vz**2)
+    raw = particles.raw()
+    
+    return new_quantity(
+        0.5 * (raw.vx**2 + raw.vy**2 + raw.vz**2),
+        (raw.unit_of('vx')**2).to_simple_form()
+    )
 
 
 def particle_potential(set, particle, smoothing_length_squared = zero, G = constants.G):
@@ -341,12 +613,16 @@ def particle_potential(set, particle, smoothing_length_squared = zero, G = const
     dr = (dr_squared+smoothing_length_squared).sqrt()
     return - G * (particles.mass / dr).sum()
 
-def particleset_potential(particles, smoothing_length_squared = zero, G = constants.G):
+def particleset_potential(particles, smoothing_length_squared = zero, G = constants.G,
+        max_array_length = 10000000, number_of_threads = 1, opening_angle = None):
     """
     Returns the potential at the position of each particle in the set.
 
     :argument smooting_length_squared: gravitational softening, added to every distance**2.
     :argument G: gravitational constant, need to be changed for particles in different units systems
+    :argument max_array_length: the pairs are handled in blocks, with at most this number of elements in the arrays of a block (a block has at least 64 rows)
+    :argument number_of_threads: number of threads to handle the blocks with
+    :argument opening_angle: if set, use a tree code approximation (see :func:`potential_energy`)
 
     >>> from amuse.datamodel import Particles
     >>> particles = Particles(2)
@@ -358,27 +634,15 @@ def particleset_potential(particles, smoothing_length_squared = zero, G = consta
     quantity<[-6.67428e-11, -6.67428e-11] m**2 * s**-2>
     """
 
-    mass = particles.mass
-    x_vector = particles.x
-    y_vector = particles.y
-    z_vector = particles.z
-
-    potentials = VectorQuantity.zeros(len(mass),mass.unit/x_vector.unit) 
+    raw = particles.raw()
+    mass = raw.mass
+    position = raw.position
+    epsilon_squared = raw.number_of(smoothing_length_squared)
 
-    for i in range(len(particles) - 1):
-        x = x_vector[i]
-        y = y_vector[i]
-        z = z_vector[i]
-        dx = x - x_vector[i+1:]
-        dy = y - y_vector[i+1:]
-        dz = z - z_vector[i+1:]
-        dr_squared = (dx * dx) + (dy * dy) + (dz * dz)
-        dr = (dr_squared+smoothing_length_squared).sqrt()
+    potentials = -_potentials(position, mass, position, mass, epsilon_squared,
+        True, max_array_length, number_of_threads, opening_angle)
 
-        potentials[i]-= (mass[i+1:]/dr).sum()
-        potentials[i+1:]-= mass[i]/dr
-
-    return G * potentials
+    return G * new_quantity(potentials, raw.unit_of('mass') / raw.unit_of('position'))
 
 
 def virial_radius(particles):
@@ -398,25 +662,15 @@ def virial_radius(particles):
     """
     if len(particles) < 2:
         raise exceptions.AmuseException("Cannot calculate virial radius for a particles set with fewer than 2 particles.")
-    partial_sum = zero
 
-    mass = particles.mass
-    x_vector = particles.x
-    y_vector = particles.y
-    z_vector = particles.z
-
-    for i in range(len(particles) - 1):
-        x = x_vector[i]
-        y = y_vector[i]
-        z = z_vector[i]
-        dx = x - x_vector[i+1:]
-        dy = y - y_vector[i+1:]
-        dz = z - z_vector[i+1:]
-        dr_squared = (dx * dx) + (dy * dy) + (dz * dz)
-        dr = (dr_squared).sqrt()
-        m_m = mass[i] * mass[i+1:]
-        partial_sum += (m_m / dr).sum()
-    return (mass.sum()**2) / (2 * partial_sum)
+    raw = particles.raw()
+    mass = raw.mass
+    partial_sum = _direct_potential_energy(raw.position, mass, 0.0, 10000000, 1)
+    
+    return new_quantity(
+        (mass.sum()**2) / (2 * partial_sum), 
+        raw.unit_of('position').to_simple_form()
+    )
 
 def total_mass(particles):
     """
@@ -442,14 +696,34 @@ def total_radius(particles):
     >>> particles.total_radius()
     quantity<4.0 m>
     """
-    return (particles.position - particles.center_of_mass()).lengths_squared().amax().sqrt()
+    raw = particles.raw()
+    masses = raw.mass
+    position = raw.position
+    weighted_sum, unit = _weighted_sum_of_components(particles, raw, masses, 'position')
+    center_of_mass = weighted_sum / masses.sum()
+    
+    return new_quantity(
+        numpy.sqrt(((position - center_of_mass)**2).sum(axis=1).max()),
+        raw.unit_of('position').to_simple_form()
+    )
 
 # move_to_center??
-def get_binaries(particles,hardness=10,G = constants.G):
+BinaryPairs = namedtuple('BinaryPairs', ['i', 'j', 'binding_energy', 'hardness'])
+
+def get_binaries(particles,hardness=10,G = constants.G, as_particle_sets = True):
     """
     returns the binaries in a particleset. binaries are selected according to a hardness criterion [hardness=10]
     This function returns the binaries as a list of i,j particles. Triple detection is not done.
     
+    The candidate pairs are the pairs closer than the largest separation
+    a binary can have (found with the spatial index), the binding energies
+    of all candidates are calculated at once.
+    
+    :argument as_particle_sets: if False, a namedtuple is returned with the
+        indices (i, j) of the binaries in the set, the binding energies
+        (per unit of reduced mass) and the hardness of the binaries, instead
+        of a copy of every binary
+    
     >>> from amuse import datamodel
     >>> m = [1,1,1] | units.MSun
     >>> x = [-1,1,0] | units.AU
@@ -462,35 +736,49 @@ def get_binaries(particles,hardness=10,G = constants.G):
     >>> binaries = particles.get_binaries()
     >>> print len(binaries)
     1
+    >>> print particles.get_binaries(as_particle_sets = False).i
+    [0]
     
     """
-    n=len(particles)
-    total_Ek=(0.5*particles.mass*(particles.vx**2+particles.vy**2+particles.vz**2)).sum()
-    average_Ek=total_Ek/particles.mass.sum()
-    max_mass=particles.mass.amax()
-    limitE=hardness*average_Ek
-
-    a=numpy.argsort(particles.x.number)
-
+    raw = particles.raw()
+    mass = raw.mass
+    position = raw.position
+    velocity = raw.velocity
+    speed_unit = raw.unit_of('velocity')
+    
+    G = G.value_in(raw.unit_of('position') * speed_unit**2 / raw.unit_of('mass'))
+    average_Ek = 0.5 * (mass * (velocity**2).sum(axis=1)).sum() / mass.sum()
+    limitE = hardness * average_Ek
+    
+    if len(particles) < 2:
+        i = j = numpy.zeros(0, dtype='int64')
+    else:
+        i, j = particles.spatial_index().query_pairs(
+            new_quantity(2 * G * mass.max() / limitE, raw.unit_of('position')))
+    
+    r = numpy.sqrt(((position[j] - position[i])**2).sum(axis=1))
+    v2 = ((velocity[j] - velocity[i])**2).sum(axis=1)
+    eb = G * (mass[i] + mass[j]) / r - 0.5 * v2
+    is_binary = eb > limitE
+    i, j, eb = i[is_binary], j[is_binary], eb[is_binary]
+    
+    # order the binaries and the particles of a binary on x
+    rank = numpy.empty(len(particles), dtype='int64')
+    rank[numpy.argsort(raw.x)] = numpy.arange(len(particles))
+    is_swapped = rank[i] > rank[j]
+    i, j = numpy.where(is_swapped, j, i), numpy.where(is_swapped, i, j)
+    order = numpy.lexsort((rank[j], rank[i]))
+    i, j, eb = i[order], j[order], eb[order]
+    
+    if not as_particle_sets:
+        return BinaryPairs(i, j, new_quantity(eb, speed_unit**2), eb / average_Ek)
+    
     binaries=[]
-
-    for i in range(n-1):
-        j=i+1
-        while j<n and (particles.x[a[j]]-particles.x[a[i]])<2*G*max_mass/limitE:
-            r2=(particles.x[a[j]]-particles.x[a[i]])**2+ \
-               (particles.y[a[j]]-particles.y[a[i]])**2+ \
-               (particles.z[a[j]]-particles.z[a[i]])**2 
-            v2=(particles.vx[a[j]]-particles.vx[a[i]])**2+ \
-               (particles.vy[a[j]]-particles.vy[a[i]])**2+ \
-               (particles.vz[a[j]]-particles.vz[a[i]])**2 
-            r=r2**0.5
-            eb=G*(particles.mass[i]+particles.mass[j])/r-0.5*v2
-            if eb > limitE:
-                binary=particles[[a[i],a[j]]].copy()
-                binary.hardness=eb/average_Ek
-                binaries.append(binary)
-            j+=1  
-
+    for a, b, hardness_of_binary in zip(i, j, eb / average_Ek):
+        binary=particles[[a, b]].copy()
+        binary.hardness=hardness_of_binary
+        binaries.append(binary)
+    
     return binaries
 
 
@@ -511,10 +799,59 @@ class HopContainer(object):
                 self.code.particles.remove_particles(self.code.particles)
         
 
+def local_densities(particles, number_of_neighbours=7):
+    """
+    Returns the density around every particle, estimated from the
+    mass of the particle and its nearest neighbours in the sphere
+    reaching to the number_of_neighbours-th nearest neighbour (a
+    tophat kernel, as used by Casertano & Hut (1985, ApJ, 298, 80)
+    and by Hop with density_method=2, this gives the same densities
+    as Hop with number_of_neighbors_for_local_density set to
+    number_of_neighbours). The neighbours are found with the spatial
+    index of the set, no community code is needed.
+    
+    >>> from amuse.datamodel import Particles
+    >>> particles = Particles(3)
+    >>> particles.position = [[0, 0, 0], [1, 0, 0], [3, 0, 0]] | units.m
+    >>> particles.mass = 1 | units.kg
+    >>> density = particles.local_densities(number_of_neighbours=1)
+    >>> print density[2] * 4.0 / 3.0 * numpy.pi * (2 | units.m)**3
+    1.0 kg
+    """
+    if number_of_neighbours >= len(particles):
+        raise exceptions.AmuseException("Cannot calculate the local densities with {0} neighbours "
+            "for a particles set with {1} particles.".format(number_of_neighbours, len(particles)))
+    raw = particles.raw()
+    mass = raw.mass
+    distances, indices = particles.spatial_index().query_neighbours(number_of_neighbours)
+    mass_in_sphere = mass + mass[indices[:,:-1]].sum(axis=1)
+    return new_quantity(mass_in_sphere * 0.75 / numpy.pi, raw.unit_of('mass')) / distances[:,-1]**3
+
+def _densities(particles, unit_converter, number_of_neighbours, use_hop, reuse_hop, hop):
+    if not (use_hop or reuse_hop):
+        return local_densities(particles, number_of_neighbours)
+    
+    if isinstance(hop, HopContainer):
+        hop.initialize(unit_converter)
+        hop = hop.code
+    in_hop = hop.particles.add_particles(particles)
+    hop.parameters.density_method = 2
+    hop.parameters.number_of_neighbors_for_local_density = number_of_neighbours
+    hop.calculate_densities()
+    density = in_hop.density.copy()
+    if not reuse_hop:
+        hop.stop()
+    return density
+
 def densitycentre_coreradius_coredens(particles, unit_converter=None, number_of_neighbours=7,
-        reuse_hop=False, hop=HopContainer()):
+        reuse_hop=False, hop=HopContainer(), use_hop=False):
     """
     calculate position of the density centre, coreradius and coredensity
+    
+    The densities are calculated in process (see local_densities), with
+    use_hop or reuse_hop set Hop calculates the densities.
+    
+    :argument unit_converter: Required if the particles are in SI units and Hop is used
 
     >>> import numpy
     >>> from amuse.ic.plummer import new_plummer_sphere
@@ -522,20 +859,12 @@ def densitycentre_coreradius_coredens(particles, unit_converter=None, number_of_
     >>> particles=new_plummer_sphere(100)
     >>> pos,coreradius,coredens=particles.densitycentre_coreradius_coredens()
     >>> print coreradius
-    0.404120092331 length
+    0.404120098141 length
     """
-    if isinstance(hop, HopContainer):
-        hop.initialize(unit_converter)
-        hop = hop.code
-    hop.particles.add_particles(particles)
-    hop.parameters.density_method=2
-    hop.parameters.number_of_neighbors_for_local_density=number_of_neighbours
-    hop.calculate_densities()
-
-    density=hop.particles.density
-    x=hop.particles.x
-    y=hop.particles.y
-    z=hop.particles.z
+    density=_densities(particles, unit_converter, number_of_neighbours, use_hop, reuse_hop, hop)
+    x=particles.x
+    y=particles.y
+    z=particles.z
     rho=density.amax()
 
     total_density=numpy.sum(density)
@@ -544,37 +873,26 @@ def densitycentre_coreradius_coredens(particles, unit_converter=None, number_of_
     z_core=numpy.sum(density*z)/total_density
 
     rc = (density * ((x-x_core)**2+(y-y_core)**2+(z-z_core)**2).sqrt()).sum() / total_density
-    if not reuse_hop:
-        hop.stop()
     
     return VectorQuantity.new_from_scalar_quantities(x_core,y_core,z_core), rc, rho
 
 def new_particle_from_cluster_core(particles, unit_converter=None, density_weighting_power=2, cm=None,
-        reuse_hop=False, hop=HopContainer()):
+        reuse_hop=False, hop=HopContainer(), use_hop=False):
     """
-    Uses Hop to find the density centre (core) of a particle distribution
+    Finds the density centre (core) of a particle distribution
     and stores the properties of this core on a particle:
     position, velocity, (core) radius and (core) density.
     
     Particles are assigned weights that depend on the density (as determined by 
-    Hop) to a certain power.
+    local_densities, or by Hop if use_hop or reuse_hop is set) to a certain power.
     The default weighting power is 2, which is most commonly used. Set 
     density_weighting_power to 1 in order to get the original weighting of 
     Casertano & Hut (1985, ApJ, 298, 80).
     
-    :argument unit_converter: Required if the particles are in SI units
+    :argument unit_converter: Required if the particles are in SI units and Hop is used
     :argument density_weighting_power: Particle properties are weighted by density to this power
     """
-    if isinstance(hop, HopContainer):
-        hop.initialize(unit_converter)
-        hop = hop.code
-    in_hop = hop.particles.add_particles(particles)
-    hop.parameters.density_method = 2
-    hop.parameters.number_of_neighbors_for_local_density = 7
-    hop.calculate_densities()
-    density = in_hop.density.copy()
-    if not reuse_hop:
-        hop.stop()
+    density = _densities(particles, unit_converter, 7, use_hop, reuse_hop, hop)
     
     weights = (density**density_weighting_power).reshape((-1,1))
     # Reshape makes sure that density can be multiplied with vectors, e.g. position
@@ -592,12 +910,12 @@ def new_particle_from_cluster_core(particles, unit_converter=None, density_weigh
 
 def bound_subset(particles, tidal_radius=None, unit_converter=None, density_weighting_power=2,
         smoothing_length_squared=zero, G=constants.G, core=None,
-        reuse_hop=False, hop=HopContainer()):
+        reuse_hop=False, hop=HopContainer(), use_hop=False):
     """
     find the particles bound to the cluster. Returns a subset of bound particles.
 
     :argument tidal_radius: particles beyond this are considered not bound
-    :argument unit_converter: Required if the particles are in SI units
+    :argument unit_converter: Required if the particles are in SI units and Hop is used
     :argument density_weighting_power: Particle properties are weighted by density to this power
     :argument smooting_length_squared: the smoothing length for gravity.
     :argument G: gravitational constant, need to be changed for particles in different units systems
@@ -614,7 +932,7 @@ def bound_subset(particles, tidal_radius=None, unit_converter=None, density_weig
     99
     """
     if core is None:
-        core = particles.cluster_core(unit_converter, density_weighting_power, reuse_hop=reuse_hop, hop=hop)
+        core = particles.cluster_core(unit_converter, density_weighting_power, reuse_hop=reuse_hop, hop=hop, use_hop=use_hop)
     position=particles.position-core.position
     velocity=particles.velocity-core.velocity
     
@@ -631,11 +949,11 @@ def bound_subset(particles, tidal_radius=None, unit_converter=None, density_weig
     return particles[bs]
 
 def mass_segregation_Gini_coefficient(particles, unit_converter=None, density_weighting_power=2,
-        core=None, reuse_hop=False, hop=HopContainer()):
+        core=None, reuse_hop=False, hop=HopContainer(), use_hop=False):
     """
     Converse & Stahler 2008 Gini coefficient for cluster.
 
-    :argument unit_converter: Required if the particles are in SI units
+    :argument unit_converter: Required if the particles are in SI units and Hop is used
     :argument density_weighting_power: Particle properties are weighted by density to this power
     :argument core: (optional) core of the cluster
     
@@ -650,7 +968,7 @@ def mass_segregation_Gini_coefficient(particles, unit_converter=None, density_we
     1.0
     """                   
     if core is None:
-      core = particles.cluster_core(unit_converter, density_weighting_power, reuse_hop=reuse_hop, hop=hop)
+      core = particles.cluster_core(unit_converter, density_weighting_power, reuse_hop=reuse_hop, hop=hop, use_hop=use_hop)
 
     position=particles.position-core.position
 
@@ -667,7 +985,7 @@ def mass_segregation_Gini_coefficient(particles, unit_converter=None, density_we
     return (mfmnf[1:]+mfmnf[:-1]).sum()/2/(len(mf)-1.)
 
 def LagrangianRadii(stars, unit_converter=None, mf=[0.01,0.02,0.05,0.1,0.2,0.5,0.75,0.9,1],
-        cm=None, number_of_neighbours=7, reuse_hop=False, hop=HopContainer()):
+        cm=None, number_of_neighbours=7, reuse_hop=False, hop=HopContainer(), use_hop=False):
     """
     Calculate lagrangian radii. Output is radii, mass fraction 
 
@@ -677,14 +995,14 @@ def LagrangianRadii(stars, unit_converter=None, mf=[0.01,0.02,0.05,0.1,0.2,0.5,0
     >>> parts=new_plummer_sphere(100)
     >>> lr,mf=parts.LagrangianRadii()
     >>> print lr[5]
-    0.856966667972 length
+    0.856966668424 length
     """
     import bisect
     if cm is None:
         cm,rcore,rhocore = stars.densitycentre_coreradius_coredens(
             unit_converter=unit_converter,
             number_of_neighbours=number_of_neighbours,
-            reuse_hop=reuse_hop, hop=hop
+            reuse_hop=reuse_hop, hop=hop, use_hop=use_hop
         )
     cmx,cmy,cmz=cm
     r2=(stars.x-cmx)**2+(stars.y-cmy)**2+(stars.z-cmz)**2
@@ -713,10 +1031,11 @@ def find_closest_particle_to(particles,x,y,z):
     >>> print particles.find_closest_particle_to( -1 | units.m,0.| units.m,0.| units.m).x
     0.0 m
     """
-    d2=(particles.x-x)**2+(particles.y-y)**2+(particles.z-z)**2
-    return particles[d2.number.argmin()]
+    distances, indices = particles.spatial_index().query(VectorQuantity.new_from_scalar_quantities(x, y, z))
+    return particles[indices[0, 0]]
 
-def potential_energy_in_field(particles, field_particles, smoothing_length_squared = zero, G = constants.G):
+def potential_energy_in_field(particles, field_particles, smoothing_length_squared = zero, G = constants.G,
+        max_array_length = 10000000, number_of_threads = 1, opening_angle = None):
     """
     Returns the total potential energy of the particles associated with an external 
     gravitational field, which is represented by the field_particles.
@@ -724,6 +1043,9 @@ def potential_energy_in_field(particles, field_particles, smoothing_length_squar
     :argument field_particles: the external field consists of these (i.e. potential energy is calculated relative to the field particles) 
     :argument smooting_length_squared: gravitational softening, added to every distance**2.
     :argument G: gravitational constant, need to be changed for particles in different units systems
+    :argument max_array_length: the pairs are handled in blocks, with at most this number of elements in the arrays of a block (a block has at least 64 rows)
+    :argument number_of_threads: number of threads to handle the blocks with
+    :argument opening_angle: if set, use a tree code approximation (see :func:`potential_energy`)
 
     >>> from amuse.datamodel import Particles
     >>> field_particles = Particles(2)
@@ -742,14 +1064,12 @@ def potential_energy_in_field(particles, field_particles, smoothing_length_squar
     if len(field_particles) == 0:
         return zero * G
         
-    n = len(particles)
-    dimensions = particles.position.shape[-1]
-    transposed_positions = particles.position.reshape([n,1,dimensions]) 
-    dxdydz = transposed_positions - field_particles.position
-    dr_squared = (dxdydz**2).sum(-1)
-    dr = (dr_squared+smoothing_length_squared).sqrt()
-    m_m = particles.mass.reshape([n,1]) * field_particles.mass
-    return -G * (m_m / dr).sum()
+    raw = particles.raw()
+    field = raw.for_set(field_particles)
+    
+    potentials = _potentials(raw.position, raw.mass, field.position, field.mass, 
+        raw.number_of(smoothing_length_squared), False, max_array_length, number_of_threads, opening_angle)
+    return -G * new_quantity(numpy.dot(raw.mass, potentials), raw.unit_of('mass')**2 / raw.unit_of('position'))
     
 def distances_squared(particles, other_particles):
     """
@@ -769,9 +1089,10 @@ def distances_squared(particles, other_particles):
     >>> particles.distances_squared(field_particles)
     quantity<[[1.0, 1.0], [9.0, 1.0], [16.0, 4.0]] m**2>
     """
-    transposed_positions = particles.position.reshape((len(particles), 1, -1))
-    dxdydz = transposed_positions - other_particles.position
-    return (dxdydz**2).sum(-1)
+    raw = particles.raw()
+    transposed_positions = raw.position.reshape((len(particles), 1, -1))
+    dxdydz = transposed_positions - raw.for_set(other_particles).position
+    return new_quantity((dxdydz**2).sum(-1), raw.unit_of('position')**2)
     
 def nearest_neighbour(particles, neighbours=None, max_array_length=10000000):
     """
@@ -797,30 +1118,11 @@ def nearest_neighbour(particles, neighbours=None, max_array_length=10000000):
     quantity<[0.0, 2.5, 2.5] m>
     """
     if neighbours is None:
-        other_particles = particles
-    else:
-        other_particles = neighbours
-    
-    if len(particles) * len(other_particles) * 3 > max_array_length:
-        neighbour_indices = []
-        particles_per_batch = max(1, max_array_length // (3 * len(other_particles)))
-        number_of_batches = (len(particles) - 1) // particles_per_batch + 1
-        indices_in_each_batch = [numpy.arange(particles_per_batch) + i*particles_per_batch for i in range(number_of_batches-1)]
-        indices_in_each_batch.append(numpy.arange(indices_in_each_batch[-1][-1]+1, len(particles)))
-        for indices in indices_in_each_batch:
-            distances_squared = particles[indices].distances_squared(other_particles)
-            if neighbours is None:
-                diagonal_indices = [numpy.arange(len(indices)), indices]
-                distances_squared.number[diagonal_indices] = numpy.inf # can't be your own neighbour
-            neighbour_indices.append(distances_squared.argmin(axis=1))
-        return other_particles[numpy.concatenate(neighbour_indices)]
-    
-    distances_squared = particles.distances_squared(other_particles)
-    if neighbours is None:
-        diagonal_indices = [numpy.arange(len(particles))]*2
-        distances_squared.number[diagonal_indices] = numpy.inf # can't be your own neighbour
-    return other_particles[distances_squared.argmin(axis=1)]
+        distances, indices = particles.spatial_index().query_neighbours(max_array_length = max_array_length)
+        return particles[indices[:, 0]]
     
+    distances, indices = neighbours.spatial_index().query(particles.position, max_array_length = max_array_length)
+    return neighbours[indices[:, 0]]
 
 def velocity_diff_squared(particles,field_particles):
     """
@@ -841,24 +1143,43 @@ def velocity_diff_squared(particles,field_particles):
     quantity<[[1.0, 1.0], [9.0, 1.0], [16.0, 4.0]] m**2>
     """
 
+    raw = particles.raw()
     n = len(particles)
-    dimensions = particles.velocity.shape[-1]
-    transposed_positions = particles.velocity.reshape([n,1,dimensions]) 
-    dxdydz = transposed_positions - field_particles.velocity
-    return (dxdydz**2).sum(-1)
-
-def Qparameter(parts, distfunc=None):
+    dimensions = raw.velocity.shape[-1]
+    transposed_positions = raw.velocity.reshape([n,1,dimensions]) 
+    dxdydz = transposed_positions - raw.for_set(field_particles).velocity
+    return new_quantity((dxdydz**2).sum(-1), raw.unit_of('velocity')**2)
+
+def _mean_separation(positions, max_array_length):
+    n = len(positions)
+    rows_per_block = _rows_per_block(n, max_array_length)
+    total = 0.0
+    for start in range(0, n, rows_per_block):
+        stop = min(start + rows_per_block, n)
+        for first, last in _column_chunks(0, n, stop - start):
+            total += numpy.sqrt(_squared_distances(positions, start, stop, positions[first:last])).sum()
+    return total / (n * (n - 1))
+
+def Qparameter(parts, distfunc=None, max_array_length=10000000):
     """
     Calculates the minimum spanning tree Q parameter (Cartwright & Whitworth 2004)
     for a projection of the particle set.
     
     :argument distfunc:  distfunc is the distance function which can be used to select
-    the projection plane.
+    the projection plane. By default the projection on the x-y plane is used, and
+    the minimum spanning tree is found with the spatial index (k-d tree) of the
+    positions. For other distance functions the complete graph of the particles
+    is made.
 
     """
     if distfunc is None:
-      def distfunc(p,q):
-        return (((p.x-q.x)**2+(p.y-q.y)**2)**0.5).value_in(p.x.unit)
+      raw = parts.raw()
+      positions = numpy.column_stack([raw.x, raw.y])
+      N = len(positions)
+      ml = _mean_separation(positions, max_array_length)
+      mlmst = KDTree(positions).minimum_spanning_tree()[2].sum() / (N*numpy.pi)**0.5
+      return mlmst/ml
+    
     N=len(parts)
   
     graph=Graph()
@@ -896,8 +1217,15 @@ def connected_components(parts, threshold=None, distfunc=None, verbose=False):
       threshold=1. | parts.x.unit
     
     if distfunc is None:
-      def distfunc(p,q):
-        return (((p.x-q.x)**2+(p.y-q.y)**2+(p.z-q.z)**2)**0.5)
+      if verbose: print "making CC"
+      i, j = parts.spatial_index().query_pairs(threshold)
+      labels = connected_component_labels(len(parts), i, j)
+      indices = numpy.lexsort((numpy.arange(len(parts)), labels))
+      first = numpy.flatnonzero(numpy.diff(labels[indices])) + 1
+      cc = [parts[x] for x in sorted(numpy.split(indices, first), key = lambda x : -x[-1])]
+      if verbose: print "done"
+      if verbose: print "number of CC:",len(cc)
+      return cc
   
     if verbose: print "making CC"
     tocheck=range(len(parts))
@@ -922,22 +1250,26 @@ def connected_components(parts, threshold=None, distfunc=None, verbose=False):
 
 def minimum_spanning_tree_length(particles):
     """
-    Calculates the length of the minimum spanning tree (MST) of a set of particles 
-    using David Eppstein's Python implemention of Kruskal's algorithm.
+    Calculates the length of the minimum spanning tree (MST) of a set of particles,
+    the Euclidean minimum spanning tree is found with Boruvka's algorithm on the
+    spatial index (k-d tree) of the particles.
+    
+    >>> from amuse.datamodel import Particles
+    >>> particles = Particles(3)
+    >>> particles.position = [[0, 0, 0], [3, 0, 0], [0, 4, 0]] | units.m
+    >>> print particles.minimum_spanning_tree_length()
+    7.0 m
     """
-    graph = Graph()
-    for particle in particles:
-        others = particles - particle
-        distances = (particle.position - others.position).lengths()
-        for other, distance in zip(others, distances):
-            graph.add_edge(particle, other, distance)
-    return sum([edge[0] for edge in MinimumSpanningTree(graph)], zero)
+    return particles.spatial_index().minimum_spanning_tree()[2].sum()
+
+def _minimum_spanning_tree_length(positions):
+    return KDTree(positions).minimum_spanning_tree()[2].sum()
 
 MassSegregationRatioResults = namedtuple('MassSegregationRatioResults', 
     ['mass_segregation_ratio', 'uncertainty'])
 
 def mass_segregation_ratio(particles, number_of_particles=20, number_of_random_sets=50, 
-        also_compute_uncertainty=False):
+        also_compute_uncertainty=False, number_of_processes=1):
     """
     Calculates the mass segregation ratio (Allison et al. 2009, MNRAS 395 1449).
     
@@ -952,12 +1284,24 @@ def mass_segregation_ratio(particles, number_of_particles=20, number_of_random_s
     :argument number_of_random_sets:  the number of randomly selected subsets for 
         which the MST is calculated to determine l_norm
     :argument also_compute_uncertainty: if True, a namedtuple is returned with (MSR, sigma) 
+    :argument number_of_processes: if larger than 1, the MSTs of the random sets are
+        calculated in a pool of this number of processes
     """
     most_massive = particles.sorted_by_attribute("mass")[-number_of_particles:]
     l_massive = most_massive.minimum_spanning_tree_length()
-    l_norms = [] | particles.position.unit
-    for i in range(number_of_random_sets):
-        l_norms.append(particles.random_sample(number_of_particles).minimum_spanning_tree_length())
+    unit = particles.position.unit
+    random_sets = [particles.random_sample(number_of_particles).position.value_in(unit) 
+        for i in range(number_of_random_sets)]
+    if number_of_processes > 1:
+        pool = Pool(number_of_processes)
+        try:
+            lengths = pool.map(_minimum_spanning_tree_length, random_sets)
+        finally:
+            pool.close()
+            pool.join()
+    else:
+        lengths = map(_minimum_spanning_tree_length, random_sets)
+    l_norms = new_quantity(numpy.array(lengths), unit)
     msr = l_norms.mean() / l_massive
     if also_compute_uncertainty:
         sigma = l_norms.std() / l_massive
@@ -1112,6 +1456,7 @@ AbstractParticleSet.add_global_function_attribute("add_spin", rotation.add_spin)
 AbstractParticleSet.add_global_function_attribute("binaries", get_binaries)
 AbstractParticleSet.add_global_function_attribute("get_binaries", get_binaries)
 
+AbstractParticleSet.add_global_function_attribute("local_densities", local_densities)
 AbstractParticleSet.add_global_function_attribute("densitycentre_coreradius_coredens", densitycentre_coreradius_coredens)
 AbstractParticleSet.add_global_function_attribute("new_particle_from_cluster_core", new_particle_from_cluster_core)
 
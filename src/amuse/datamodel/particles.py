@@ -5,6 +5,7 @@ from amuse.datamodel.base import *
 from amuse.datamodel import base
 from amuse.datamodel.memory_storage import *
 from amuse.datamodel import trees
+from amuse.datamodel.spatial_index import ParticlesSpatialIndex
 from amuse.units import constants
 from amuse.units import units
 from amuse.units import quantities
@@ -341,6 +342,12 @@ class AbstractParticleSet(AbstractSet):
     def can_extend_attributes(self):
         return self._original_set().can_extend_attributes()
 
+    def can_get_values_in_store_async(self, attributes):
+        return False
+
+    def can_set_values_in_store_async(self, attributes):
+        return False
+
     def add_attribute_domain(self, namespace):
         self._derived_attributes[namespace] = DomainAttribute(namespace)
 
@@ -443,6 +450,31 @@ class AbstractParticleSet(AbstractSet):
         result.add_particles_to_store(keys, [],[])
         return result
 
+    def _get_modification_count(self):
+        return None
+
+    def spatial_index(self):
+        """
+        Returns a spatial index (k-d tree) on the positions of the
+        particles, see :class:`~amuse.datamodel.spatial_index.ParticlesSpatialIndex`.
+        The index is made when first needed and kept by the set,
+        until particles are added or removed or values of the
+        particles are set.
+
+        >>> particles = Particles(3)
+        >>> particles.position = [[0, 0, 0], [1, 0, 0], [3, 0, 0]] | units.m
+        >>> distances, indices = particles.spatial_index().query_neighbours()
+        >>> print distances[...,0]
+        [1.0, 1.0, 2.0] m
+        >>> print indices[...,0]
+        [1 0 1]
+        """
+        index = getattr(self._private, 'spatial_index', None)
+        if index is None or not index.is_valid_for(self):
+            index = ParticlesSpatialIndex(self)
+            self._private.spatial_index = index
+        return index
+
     def copy_values_of_attribute_to(self, attribute_name, particles):
         """
         Copy values of one attribute from this set to the
@@ -1094,6 +1126,9 @@ class Particles(AbstractParticleSet):
     def _get_version(self):
         return self._private.version
 
+    def _get_modification_count(self):
+        return self._private.attribute_storage.get_modification_count()
+
     def __iter__(self):
         keys =  self.get_all_keys_in_store()
         indices = self.get_all_indices_in_store()
@@ -1229,12 +1264,27 @@ class Particles(AbstractParticleSet):
         subset = self[indices]
         return [defined_values[attribute] if attribute in defined_values else subset._get_derived_attribute_value(attribute) for attribute in attributes]
 
+    def get_values_in_store_async(self, indices, attributes):
+        return self._private.attribute_storage.get_values_in_store_async(indices, attributes)
+
     def get_indices_of_keys(self, keys):
         return self._private.attribute_storage.get_indices_of(keys)
 
     def set_values_in_store(self, indices, attributes, values):
         self._private.attribute_storage.set_values_in_store(indices, attributes, values)
 
+    def set_values_in_store_async(self, indices, attributes, values):
+        return self._private.attribute_storage.set_values_in_store_async(indices, attributes, values)
+
+    def can_get_values_in_store_async(self, attributes):
+        missing_attributes = set(attributes) - set(self.get_attribute_names_defined_in_store())
+        if len(missing_attributes) > 0:
+            return False
+        return self._private.attribute_storage.can_get_values_in_store_async(attributes)
+
+    def can_set_values_in_store_async(self, attributes):
+        return self._private.attribute_storage.can_set_values_in_store_async(attributes)
+
     def get_attribute_names_defined_in_store(self):
         return self._private.attribute_storage.get_defined_attribute_names()
 
@@ -1447,6 +1497,12 @@ class ParticlesSuperset(AbstractParticleSet):
 
         return self._private.version
 
+    def _get_modification_count(self):
+        counts = tuple([x._get_modification_count() for x in self._private.particle_sets])
+        if None in counts:
+            return None
+        return counts
+
 
     def __getitem__(self, index):
         self._ensure_updated_set_properties()
@@ -1778,6 +1834,9 @@ class ParticlesSubset(AbstractParticleSet):
     def _get_version(self):
         return self._private.particles._get_version()
 
+    def _get_modification_count(self):
+        return self._private.particles._get_modification_count()
+
     def compressed(self):
         keys = self._private.keys
         return self._subset(keys[numpy.logical_and(keys > 0 ,  keys < 18446744073709551615L)])
@@ -1969,6 +2028,9 @@ class ParticlesMaskedSubset(ParticlesSubset):
     def _get_version(self):
         return self._private.particles._get_version()
 
+    def _get_modification_count(self):
+        return self._private.particles._get_modification_count()
+
     def unconverted_set(self):
         return ParticlesMaskedSubset(self._private.particles.unconverted_set(), self._private.keys)
 
@@ -2868,17 +2930,58 @@ class ParticleInformationChannel(object):
         if target_names is None:
             target_names = attributes
 
+        if self.can_copy_attributes_async(attributes, target_names):
+            self.copy_attributes_async(attributes, target_names).result()
+            return
+
         self._reindex()
 
         values = self.from_particles.get_values_in_store(self.from_indices, attributes)
+        self.to_particles.set_values_in_store(self.to_indices, target_names, self._converted_values(values))
+
+    def can_copy_attributes_async(self, attributes, target_names = None):
+        if target_names is None:
+            target_names = attributes
+
+        return (
+            self.from_particles.can_get_values_in_store_async(attributes) or
+            self.to_particles.can_set_values_in_store_async(target_names)
+        )
+
+    def copy_attributes_async(self, attributes, target_names = None):
+        """ Copy the values of the attributes like copy_attributes, but
+        returns a request instead of waiting for the copy to finish.
+        All calls for the attributes in the code are made one after the
+        other without waiting for the caller, the copy is finished when
+        the result of the request is asked. Requests of channels of
+        different codes can be joined and waited on together.
+        """
+        if target_names is None:
+            target_names = attributes
+
+        self._reindex()
+
+        if self.from_particles.can_get_values_in_store_async(attributes):
+            request = self.from_particles.get_values_in_store_async(self.from_indices, attributes)
+            def handle_result(inner):
+                values = self._converted_values(inner())
+                self.to_particles.set_values_in_store(self.to_indices, target_names, values)
+            request.add_result_handler(handle_result)
+            return request
+        elif self.to_particles.can_set_values_in_store_async(target_names):
+            values = self.from_particles.get_values_in_store(self.from_indices, attributes)
+            return self.to_particles.set_values_in_store_async(self.to_indices, target_names, self._converted_values(values))
+        else:
+            raise exceptions.AmuseException("the attributes cannot be copied asynchronously, use copy_attributes")
+
+    def _converted_values(self, values):
         converted = []
         for x in values:
             if isinstance(x, LinkedArray):
                 converted.append(x.copy_with_link_transfer(self.from_particles, self.to_particles))
             else:
                 converted.append(x)
-
-        self.to_particles.set_values_in_store(self.to_indices, target_names, converted)
+        return converted
 
     def copy(self):
         if not self.attributes is None:
@@ -0,0 +1,492 @@
+"""
+Spatial index (a k-d tree) on the positions of particles, for
+nearest neighbour searches, for finding all particles, or all
+pairs of particles, closer than a given distance and for the
+Euclidean minimum spanning tree of the particles.
+
+The index of a particle set is made with
+:meth:`~amuse.datamodel.particles.AbstractParticleSet.spatial_index`,
+the set keeps the index until particles are added or removed or
+values of the particles are set.
+"""
+
+import numpy
+
+from amuse.units.quantities import is_quantity
+from amuse.units.quantities import new_quantity
+
+class KDTree(object):
+    """
+    Balanced k-d tree on an array of positions (N x dimensions).
+    The positions are split in two halves along the longest side of
+    their bounding box, down to leaves of at most leaf_size positions.
+    The nodes are numbered as in a heap, the children of node k are
+    2k+1 and 2k+2, all leaves are at the same depth. The positions
+    of a node are stored contiguously in :attr:`positions`,
+    :attr:`order` maps these back to the original indices.
+
+    The queries handle many points at once, the tree is walked for
+    all points together, one level at a time.
+
+    >>> tree = KDTree(numpy.array([[0.0, 0.0], [1.0, 0.0], [3.0, 0.0]]))
+    >>> distances, indices = tree.query(numpy.array([[2.5, 0.0]]), k = 2)
+    >>> distances.tolist(), indices.tolist()
+    ([[0.5, 1.5]], [[2, 1]])
+    >>> [x.tolist() for x in tree.query_pairs(1.5)]
+    [[0], [1]]
+    """
+
+    def __init__(self, positions, leaf_size = 16):
+        positions = numpy.asarray(positions, dtype='float64')
+        n = len(positions)
+        self.leaf_size = leaf_size
+        self.depth = int(numpy.ceil(numpy.log2(n * 1.0 / leaf_size))) if n > leaf_size else 0
+        self.first_leaf = 2**self.depth - 1
+        number_of_nodes = 2**(self.depth + 1) - 1
+
+        start = numpy.zeros(number_of_nodes, dtype='int64')
+        stop = numpy.zeros(number_of_nodes, dtype='int64')
+        self.split_axis = numpy.zeros(self.first_leaf, dtype='int64')
+        self.split_value = numpy.zeros(self.first_leaf)
+        stop[0] = n
+        order = numpy.arange(n)
+        for node in range(self.first_leaf):
+            a, b = start[node], stop[node]
+            middle = (a + b) // 2
+            indices = order[a:b]
+            box = positions[indices]
+            axis = (box.max(axis=0) - box.min(axis=0)).argmax()
+            partition = numpy.argpartition(box[:, axis], middle - a)
+            order[a:b] = indices[partition]
+            self.split_axis[node] = axis
+            self.split_value[node] = box[partition[middle - a], axis]
+            start[2*node+1], stop[2*node+1] = a, middle
+            start[2*node+2], stop[2*node+2] = middle, b
+
+        self.order = order
+        self.positions = positions[order]
+        self.start = start
+        self.stop = stop
+
+        dimensions = positions.shape[1] if positions.ndim == 2 else 0
+        self.lower = numpy.zeros((number_of_nodes, dimensions))
+        self.upper = numpy.zeros((number_of_nodes, dimensions))
+        if n > 0:
+            leaves = numpy.arange(self.first_leaf, number_of_nodes)
+            self.lower[leaves] = numpy.minimum.reduceat(self.positions, start[leaves])
+            self.upper[leaves] = numpy.maximum.reduceat(self.positions, start[leaves])
+            for level in range(self.depth - 1, -1, -1):
+                nodes = self.nodes_at_level(level)
+                self.lower[nodes] = numpy.minimum(self.lower[2*nodes+1], self.lower[2*nodes+2])
+                self.upper[nodes] = numpy.maximum(self.upper[2*nodes+1], self.upper[2*nodes+2])
+
+    def __len__(self):
+        return len(self.positions)
+
+    def nodes_at_level(self, level):
+        return numpy.arange(2**level - 1, 2**(level + 1) - 1)
+
+    def query(self, points, k = 1, exclude = None, max_array_length = 10000000):
+        """
+        Returns the distances to, and the indices of, the k nearest
+        positions of every point. Both arrays have k columns, sorted
+        on distance, for missing neighbours the distance is infinite
+        and the index is -1.
+
+        :argument exclude: optional array with, for every point, the index of a position to skip (for example the point itself)
+        """
+        points = self._as_points(points)
+        number_of_points = len(points)
+        distances = numpy.empty((number_of_points, k))
+        indices = numpy.empty((number_of_points, k), dtype='int64')
+        if exclude is not None:
+            exclude = numpy.asarray(exclude)
+
+        number_needed = k if exclude is None else k + 1
+        level = 0
+        for l in range(self.depth + 1):
+            if (self.stop - self.start)[self.nodes_at_level(l)].min() >= number_needed:
+                level = l
+
+        for first, last in self._blocks_of_points(number_of_points, max_array_length):
+            block = points[first:last]
+            excluded = None if exclude is None else exclude[first:last]
+
+            nodes = self._descend(block, level)
+            point, j = self._expand(numpy.arange(len(block)), nodes)
+            squared_distances = self._squared_distances(block, point, j, excluded)
+            bound, unused = self._k_smallest(len(block), point, squared_distances, j, k)
+
+            point, leaves = self._leaves_within(block, bound[:, -1])
+            point, j = self._expand(point, leaves)
+            squared_distances = self._squared_distances(block, point, j, excluded)
+            is_within = squared_distances <= bound[point, -1]
+            point, j, squared_distances = point[is_within], j[is_within], squared_distances[is_within]
+            distances[first:last], indices[first:last] = self._k_smallest(len(block), point, squared_distances, j, k)
+
+        indices[distances == numpy.inf] = -1
+        return numpy.sqrt(distances), indices
+
+    def query_radius(self, points, radius, max_array_length = 10000000):
+        """
+        Returns the indices of the points and the indices of the positions,
+        for all positions closer than the radius to a point, sorted on
+        the index of the point.
+        """
+        points = self._as_points(points)
+        radius_squared = numpy.ones(len(points)) * radius**2
+        result_points, result_indices = [numpy.zeros(0, dtype='int64')], [numpy.zeros(0, dtype='int64')]
+        for first, last in self._blocks_of_points(len(points), max_array_length):
+            block = points[first:last]
+            point, leaves = self._leaves_within(block, radius_squared[first:last])
+            point, j = self._expand(point, leaves)
+            is_within = self._squared_distances(block, point, j) < radius_squared[first:last][point]
+            result_points.append(point[is_within] + first)
+            result_indices.append(self.order[j[is_within]])
+        return numpy.concatenate(result_points), numpy.concatenate(result_indices)
+
+    def query_pairs(self, radius, max_array_length = 10000000):
+        """
+        Returns the indices (i, j) of all pairs of positions closer
+        than the radius to each other, every pair is returned once.
+        """
+        radius_squared = radius**2
+        a = numpy.zeros(1, dtype='int64')
+        b = numpy.zeros(1, dtype='int64')
+        for level in range(self.depth + 1):
+            delta = (numpy.maximum(self.lower[b] - self.upper[a], 0) +
+                numpy.maximum(self.lower[a] - self.upper[b], 0))
+            is_near = (delta**2).sum(-1) < radius_squared
+            a, b = a[is_near], b[is_near]
+            if level < self.depth:
+                is_same = a == b
+                same = a[is_same]
+                left_a, right_a = 2 * a[~is_same] + 1, 2 * a[~is_same] + 2
+                left_b, right_b = 2 * b[~is_same] + 1, 2 * b[~is_same] + 2
+                a = numpy.concatenate([2*same+1, 2*same+1, 2*same+2, left_a, left_a, right_a, right_a])
+                b = numpy.concatenate([2*same+1, 2*same+2, 2*same+2, left_b, right_b, left_b, right_b])
+
+        rows = self.stop[a] - self.start[a]
+        columns = self.stop[b] - self.start[b]
+        result_i, result_j = [numpy.zeros(0, dtype='int64')], [numpy.zeros(0, dtype='int64')]
+        for first, last in _chunks(rows * columns, max(1, max_array_length // 3)):
+            pair, row, column = _expand_pairs(rows[first:last], columns[first:last])
+            i = self.start[a[first:last]][pair] + row
+            j = self.start[b[first:last]][pair] + column
+            is_within = ((self.positions[i] - self.positions[j])**2).sum(-1) < radius_squared
+            is_within &= (a[first:last][pair] != b[first:last][pair]) | (i < j)
+            result_i.append(self.order[i[is_within]])
+            result_j.append(self.order[j[is_within]])
+        return numpy.concatenate(result_i), numpy.concatenate(result_j)
+
+    def minimum_spanning_tree(self, number_of_neighbours = 8, max_array_length = 10000000):
+        """
+        Returns the edges (i, j) and the lengths of the Euclidean
+        minimum spanning tree of the positions, sorted on length.
+        The tree is made with Boruvka's algorithm, every round joins
+        all components to their nearest other component.
+
+        The nearest neighbours of all positions are found once, the
+        first of these in another component is the nearest position
+        in another component. Only the positions with all neighbours in
+        their own component are searched for in the tree, parts of the
+        tree inside that component are skipped.
+        """
+        n = len(self)
+        labels = numpy.arange(n)
+        edges_i, edges_j, lengths = [numpy.zeros(0, dtype='int64')], [numpy.zeros(0, dtype='int64')], [numpy.zeros(0)]
+        if n > 1:
+            positions = numpy.empty_like(self.positions)
+            positions[self.order] = self.positions
+            neighbour_distances, neighbours = self.query(positions, min(number_of_neighbours, n - 1),
+                exclude = numpy.arange(n), max_array_length = max_array_length)
+        # the label of a position is the lowest index in its component
+        while n > 0 and labels.any():
+            is_other = labels[neighbours] != labels[:, numpy.newaxis]
+            has_other = is_other.any(axis=1)
+            first_other = is_other.argmax(axis=1)
+            distances = numpy.where(has_other, neighbour_distances[numpy.arange(n), first_other], numpy.inf)
+            j = neighbours[numpy.arange(n), first_other]
+
+            component_bound = numpy.empty(n)
+            component_bound.fill(numpy.inf)
+            numpy.minimum.at(component_bound, labels, distances**2)
+            search = numpy.flatnonzero(~has_other & (neighbour_distances[:, -1]**2 <= component_bound[labels]))
+            if len(search) > 0:
+                distances[search], j[search] = self._nearest_with_other_label(labels, search, component_bound, max_array_length)
+
+            i = numpy.arange(n)
+            low, high = numpy.minimum(i, j), numpy.maximum(i, j)
+            # the shortest edge of every component, equal lengths
+            # are ordered on the indices, so no cycles are made
+            shortest = numpy.lexsort((high, low, distances, labels))
+            is_first = numpy.ones(n, dtype=bool)
+            is_first[1:] = labels[shortest][1:] != labels[shortest][:-1]
+            shortest = shortest[is_first]
+            # two components can select the same edge
+            unused, first = numpy.unique(low[shortest] * n + high[shortest], return_index = True)
+            shortest = shortest[first]
+
+            edges_i.append(low[shortest])
+            edges_j.append(high[shortest])
+            lengths.append(distances[shortest])
+            labels = connected_component_labels(n, labels[low[shortest]], labels[high[shortest]])[labels]
+
+        lengths = numpy.concatenate(lengths)
+        sorted = numpy.argsort(lengths, kind = 'mergesort')
+        return numpy.concatenate(edges_i)[sorted], numpy.concatenate(edges_j)[sorted], lengths[sorted]
+
+    def _nearest_with_other_label(self, labels, points, component_bound, max_array_length):
+        """
+        Returns, for the positions with the given indices, the distance
+        to and the index of the nearest position with a different label.
+        The search for a position stops at the squared distance in
+        component_bound for its label (this bound is updated), beyond
+        it the distance is infinite.
+        """
+        sorted_labels = labels[self.order]
+
+        # label of the node if all its positions have the same label, -1 otherwise
+        node_label = -numpy.ones(len(self.start), dtype='int64')
+        leaves = numpy.arange(self.first_leaf, len(self.start))
+        lowest = numpy.minimum.reduceat(sorted_labels, self.start[leaves])
+        highest = numpy.maximum.reduceat(sorted_labels, self.start[leaves])
+        node_label[leaves] = numpy.where(lowest == highest, lowest, -1)
+        for level in range(self.depth - 1, -1, -1):
+            nodes = self.nodes_at_level(level)
+            left, right = node_label[2*nodes+1], node_label[2*nodes+2]
+            node_label[nodes] = numpy.where(left == right, left, -1)
+
+        positions = numpy.empty_like(self.positions)
+        positions[self.order] = self.positions
+        distances = numpy.empty(len(points))
+        indices = numpy.empty(len(points), dtype='int64')
+        for first, last in self._blocks_of_points(len(points), max_array_length):
+            block = positions[points[first:last]]
+            block_labels = labels[points[first:last]]
+            bound = component_bound[block_labels]
+            point = numpy.arange(len(block))
+            nodes = numpy.zeros(len(block), dtype='int64')
+            for level in range(self.depth + 1):
+                lower, upper, block_positions = self.lower[nodes], self.upper[nodes], block[point]
+                near = numpy.maximum(lower - block_positions, 0) + numpy.maximum(block_positions - upper, 0)
+                far = numpy.maximum(numpy.abs(block_positions - lower), numpy.abs(upper - block_positions))
+                min_squared, max_squared = (near**2).sum(-1), (far**2).sum(-1)
+
+                # a node that is not all in the component of the point
+                # has a position of another component, at most the
+                # distance to the farthest corner of the node away
+                is_other = node_label[nodes] != block_labels[point]
+                other = point[is_other]
+                if len(other) > 0:
+                    starts = numpy.flatnonzero(numpy.concatenate([[True], other[1:] != other[:-1]]))
+                    bound[other[starts]] = numpy.minimum(bound[other[starts]],
+                        numpy.minimum.reduceat(max_squared[is_other], starts))
+                numpy.minimum.at(component_bound, block_labels, bound)
+                bound = component_bound[block_labels]
+
+                is_kept = is_other & (min_squared <= bound[point])
+                point, nodes = point[is_kept], nodes[is_kept]
+                if level < self.depth:
+                    point = numpy.repeat(point, 2)
+                    nodes = (2 * nodes[:, numpy.newaxis] + [1, 2]).flatten()
+
+            point, j = self._expand(point, nodes)
+            squared_distances = ((block[point] - self.positions[j])**2).sum(-1)
+            squared_distances[sorted_labels[j] == block_labels[point]] = numpy.inf
+            block_distances, block_indices = self._k_smallest(len(block), point, squared_distances, j, 1)
+            distances[first:last] = block_distances[:, 0]
+            indices[first:last] = block_indices[:, 0]
+            numpy.minimum.at(component_bound, block_labels, block_distances[:, 0])
+
+        return numpy.sqrt(distances), indices
+
+    def _as_points(self, points):
+        points = numpy.asarray(points, dtype='float64')
+        if points.ndim == 1:
+            points = points.reshape((1, -1))
+        return points
+
+    def _blocks_of_points(self, number_of_points, max_array_length):
+        # every point is compared with the positions in a few tens of leaves
+        points_per_block = max(1, max_array_length // (3 * 32 * self.leaf_size))
+        return [(first, min(first + points_per_block, number_of_points)) for first in range(0, number_of_points, points_per_block)]
+
+    def _descend(self, points, level):
+        nodes = numpy.zeros(len(points), dtype='int64')
+        rows = numpy.arange(len(points))
+        for l in range(level):
+            is_right = points[rows, self.split_axis[nodes]] >= self.split_value[nodes]
+            nodes = 2 * nodes + 1 + is_right
+        return nodes
+
+    def _leaves_within(self, points, radius_squared):
+        point = numpy.arange(len(points))
+        nodes = numpy.zeros(len(points), dtype='int64')
+        for level in range(self.depth + 1):
+            delta = (numpy.maximum(self.lower[nodes] - points[point], 0) +
+                numpy.maximum(points[point] - self.upper[nodes], 0))
+            is_near = (delta**2).sum(-1) <= radius_squared[point]
+            point, nodes = point[is_near], nodes[is_near]
+            if level < self.depth:
+                point = numpy.repeat(point, 2)
+                nodes = (2 * nodes[:, numpy.newaxis] + [1, 2]).flatten()
+        return point, nodes
+
+    def _expand(self, point, nodes):
+        sizes = self.stop[nodes] - self.start[nodes]
+        offsets = numpy.arange(sizes.sum()) - numpy.repeat(sizes.cumsum() - sizes, sizes)
+        return numpy.repeat(point, sizes), numpy.repeat(self.start[nodes], sizes) + offsets
+
+    def _squared_distances(self, points, point, j, excluded = None):
+        result = ((points[point] - self.positions[j])**2).sum(-1)
+        if excluded is not None:
+            result[self.order[j] == excluded[point]] = numpy.inf
+        return result
+
+    def _k_smallest(self, number_of_points, point, squared_distances, j, k):
+        # the entries are grouped on point, the k smallest are selected
+        # one at a time, ties go to the lowest original index
+        distances = numpy.empty((number_of_points, k))
+        distances.fill(numpy.inf)
+        indices = numpy.zeros((number_of_points, k), dtype='int64')
+        if len(point) == 0:
+            return distances, indices
+        is_first = numpy.ones(len(point), dtype=bool)
+        is_first[1:] = point[1:] != point[:-1]
+        starts = numpy.flatnonzero(is_first)
+        group = is_first.cumsum() - 1
+        owners = point[starts]
+        squared_distances = squared_distances.copy()
+        original = self.order[j]
+        for rank in range(k):
+            smallest = numpy.minimum.reduceat(squared_distances, starts)
+            is_smallest = squared_distances == smallest[group]
+            chosen = numpy.minimum.reduceat(numpy.where(is_smallest, original, len(self.order)), starts)
+            distances[owners, rank] = smallest
+            indices[owners, rank] = chosen
+            if rank < k - 1:
+                squared_distances[is_smallest & (original == chosen[group])] = numpy.inf
+        return distances, indices
+
+def _expand_pairs(number_of_rows, number_of_columns):
+    """
+    For pairs with the given number of rows and columns, returns the index
+    of the pair, the row and the column of all the elements of the pairs
+    """
+    counts = number_of_rows * number_of_columns
+    pair = numpy.repeat(numpy.arange(len(counts)), counts)
+    offset = numpy.arange(counts.sum()) - numpy.repeat(counts.cumsum() - counts, counts)
+    return pair, offset // number_of_columns[pair], offset % number_of_columns[pair]
+
+def _chunks(counts, max_array_length):
+    """
+    Returns (first, last) ranges, the sum of the counts in a range
+    is at most max_array_length (unless a single count is larger)
+    """
+    cumulative = counts.cumsum()
+    boundaries = [0]
+    while boundaries[-1] < len(counts):
+        first = boundaries[-1]
+        offset = cumulative[first - 1] if first > 0 else 0
+        last = numpy.searchsorted(cumulative, offset + max_array_length, side = 'right')
+        boundaries.append(max(last, first + 1))
+    return zip(boundaries[:-1], boundaries[1:])
+
+def connected_component_labels(number_of_vertices, i, j):
+    """
+    Returns, for every vertex of the graph with edges (i, j), the
+    smallest vertex of the connected component it belongs to. The
+    components are found by repeatedly hooking the root of every edge
+    on the smallest root of the edge and then compressing the paths
+    to the roots.
+
+    >>> connected_component_labels(5, numpy.array([4, 1]), numpy.array([3, 2])).tolist()
+    [0, 1, 1, 3, 3]
+    """
+    parent = numpy.arange(number_of_vertices)
+    while True:
+        root_i, root_j = parent[i], parent[j]
+        is_different = root_i != root_j
+        if not is_different.any():
+            return parent
+        low = numpy.minimum(root_i, root_j)[is_different]
+        high = numpy.maximum(root_i, root_j)[is_different]
+        numpy.minimum.at(parent, high, low)
+        while True:
+            grandparent = parent[parent]
+            if numpy.array_equal(grandparent, parent):
+                break
+            parent = grandparent
+
+class ParticlesSpatialIndex(object):
+    """
+    Spatial index on the positions of a particle set, handles the
+    units of the positions and distances for a :class:`KDTree`.
+    Indices returned by the queries are indices in the set.
+    """
+
+    def __init__(self, particles):
+        raw = particles.raw()
+        self.unit = raw.unit_of('position')
+        self.positions = raw.position
+        self.version = particles._get_version()
+        self.modification_count = particles._get_modification_count()
+        self.tree = KDTree(self.positions)
+
+    def is_valid_for(self, particles):
+        """
+        Returns True if no particles have been added to or removed
+        from the set, and no values have been set, since the index
+        was made. For sets that do not count their modifications
+        the positions are compared instead.
+        """
+        if particles._get_version() != self.version or len(particles) != len(self.positions):
+            return False
+        if self.modification_count is not None:
+            return particles._get_modification_count() == self.modification_count
+        return numpy.array_equal(particles.position.value_in(self.unit), self.positions)
+
+    def query(self, positions, k = 1, max_array_length = 10000000):
+        """
+        Returns the distances to, and the indices of, the k nearest
+        particles of every position (as arrays with k columns).
+        """
+        distances, indices = self.tree.query(self.number_of(positions), k, max_array_length = max_array_length)
+        return new_quantity(distances, self.unit), indices
+
+    def query_neighbours(self, k = 1, max_array_length = 10000000):
+        """
+        Returns the distances to, and the indices of, the k nearest
+        other particles of every particle in the set.
+        """
+        distances, indices = self.tree.query(self.positions, k,
+            exclude = numpy.arange(len(self.positions)), max_array_length = max_array_length)
+        return new_quantity(distances, self.unit), indices
+
+    def query_radius(self, positions, radius, max_array_length = 10000000):
+        """
+        Returns the indices of the positions and of the particles,
+        for all particles closer than the radius to a position.
+        """
+        return self.tree.query_radius(self.number_of(positions), self.number_of(radius), max_array_length)
+
+    def query_pairs(self, radius, max_array_length = 10000000):
+        """
+        Returns the indices (i, j) of all pairs of particles closer
+        than the radius to each other.
+        """
+        return self.tree.query_pairs(self.number_of(radius), max_array_length)
+
+    def minimum_spanning_tree(self):
+        """
+        Returns the edges (i, j) and the lengths of the Euclidean
+        minimum spanning tree of the particles, sorted on length.
+        """
+        i, j, lengths = self.tree.minimum_spanning_tree()
+        return i, j, new_quantity(lengths, self.unit)
+
+    def number_of(self, quantity):
+        if is_quantity(quantity):
+            return quantity.value_in(self.unit)
+        return quantity
@@ -7,9 +7,10 @@ to model accretion, for example unto protostars or compact objects.
 
 import numpy
 from amuse.units import units, quantities
-from amuse.units.quantities import zero, AdaptingVectorQuantity
+from amuse.units.quantities import zero
 from amuse.datamodel import Particle, ParticlesOverlay, ParticlesSubset
 from amuse.datamodel import Particles, ParticlesSuperset
+from amuse.datamodel.spatial_index import KDTree
 
 from amuse.support.exceptions import AmuseException
 
@@ -95,102 +96,146 @@ class SinkParticles(ParticlesOverlay):
     def add_sink(self, particle):
         self.add_sinks(particle.as_set())
 
+    def select_candidates(self, others, position):
+        """
+        Returns the indices of the sinks and of the other particles
+        (with the given positions), for all particles within the
+        sink radius of a sink.
+        """
+        unit = position.unit
+        sink_radius = self.sink_radius.value_in(unit) * numpy.ones(len(self))
+        sink_position = self.position.value_in(unit)
+        j, i = KDTree(sink_position).query_radius(position.number, sink_radius.max())
+        is_within = ((position.number[j] - sink_position[i])**2).sum(axis=1) < sink_radius[i]**2
+        return i[is_within], j[is_within]
+
     def select_too_close(self, others):
-        too_close = []
-        for pos, r_squared in zip(self.position, self.sink_radius**2):
-            subset = others[(others.position-pos).lengths_squared() < r_squared]
-            too_close.append(subset)
-        return too_close
+        i, j = self.select_candidates(others, others.position)
+        return [others[j[i == index]] for index in range(len(self))]
 
     def accrete_looping_over_sinks(self, orgparticles):
-        particles=orgparticles.copy()
-        others = (particles - self.get_intersecting_subset_in(particles))
-        too_close = self.select_too_close(others)
-        try:
-            all_too_close = sum(too_close, particles[0:0])
-        except AmuseException as ex:
-            too_close = self.resolve_duplicates(too_close, particles)
-            all_too_close = sum(too_close, particles[0:0])
-        if len(all_too_close):
-            self.aggregate_mass(too_close)
-            orgparticles.remove_particles(all_too_close)
-        return all_too_close
+        return self.accrete_candidates(orgparticles, order_on_sinks = True)
 
     def resolve_duplicates(self, too_close, particles):
-        # Find the particles that are within more than one sink's radius
-        duplicates = particles[0:0]
-        keys = set()
-        for subset in too_close:
-            for particle in subset:
-                if (particle.key in keys) and (particle.key not in duplicates.key):
-                    duplicates += particle
-                else:
-                    keys.add(particle.key)
-
-        # Determine which sink's attraction is strongest
-        strongest_sinks = []
-        for duplicate in duplicates:
-            candidate_sinks = []
-            for index, subset in enumerate(too_close):
-                if duplicate in subset:
-                    candidate_sinks.append(index)
-            attraction = self[candidate_sinks].mass/(self[candidate_sinks].position-duplicate.position).lengths_squared()
-            strongest_sinks.append(candidate_sinks[numpy.where(attraction==attraction.amax())[0][0]])
-        # Define a new list with particles to be accreted, without the duplicates
-        result = []
-        for index, subset in enumerate(too_close):
-            for duplicate, strongest_sink in zip(duplicates, strongest_sinks):
-                if duplicate in subset and not index == strongest_sink:
-                    subset -= duplicate
-            result.append(subset)
-        return result
+        """
+        Returns the subsets in too_close (one for every sink), with a
+        particle that is in more than one subset only kept in the
+        subset of the sink with the strongest attraction (mass over
+        distance squared).
+        """
+        i = numpy.concatenate([[index] * len(subset) for index, subset in enumerate(too_close)] + [[]]).astype('int64')
+        if len(i) == 0:
+            return too_close
+        candidates = [subset for subset in too_close if len(subset)]
+        unit = candidates[0].position.unit
+        position = numpy.concatenate([subset.position.value_in(unit) for subset in candidates]) | unit
+        keys, j = numpy.unique(numpy.concatenate([subset.key for subset in candidates]), return_inverse = True)
+        d2 = (position - self.position[i]).lengths_squared()
+        with numpy.errstate(divide = 'ignore', invalid = 'ignore'):
+            i, j = self.select_strongest(i, j, -(self.mass[i] / d2).number)
+        return [subset[numpy.in1d(subset.key, keys[j[i == index]])] for index, subset in enumerate(too_close)]
+
+    def select_strongest(self, i, j, rank):
+        """
+        Returns the candidate (sink, particle) pairs, with for every
+        particle only the pair of the lowest rank (the first sink
+        on ties), ordered on the particles.
+        """
+        order = numpy.lexsort((i, rank, j))
+        i, j = i[order], j[order]
+        is_first = numpy.ones(len(j), dtype=bool)
+        is_first[1:] = j[1:] != j[:-1]
+        return i[is_first], j[is_first]
 
     def accrete_looping_over_sources(self, orgparticles):
         if len(self) == 0:
             return
-        particles=orgparticles.copy()
-        others = (particles - self.get_intersecting_subset_in(particles))
-        too_close = [particles[0:0] for p in self]
-        all_too_close=particles[0:0]
-        positions=self.position
-        masses=self.mass
-        sink_radii2=self.sink_radius**2
-        for p in others:
-            d2=(positions-p.position).lengths_squared()
-            a=numpy.where(d2<sink_radii2)[0]
-            if len(a) > 0:
-                amin=(d2[a]/masses[a]).argmin()
-                too_close[a[amin]]+=p
-                all_too_close+=p
-        if len(all_too_close):
-            self.aggregate_mass(too_close)
-            orgparticles.remove_particles(all_too_close)
-        return all_too_close
-
-    def aggregate_mass(self,too_close):
-        corrected_masses = AdaptingVectorQuantity()
-        corrected_positions = AdaptingVectorQuantity()
-        corrected_velocities = AdaptingVectorQuantity()
-        corrected_angular_momenta = AdaptingVectorQuantity()
-        for subset, m, pos, vel, Lin in zip(too_close, self.mass, self.position, self.velocity, self.angular_momentum):
-            if len(subset):
-                total_mass = subset.total_mass() + m
-                cmpos=(m*pos + subset.total_mass()*subset.center_of_mass())/total_mass
-                cmvel=(m*vel + subset.total_mass()*subset.center_of_mass_velocity())/total_mass
-                L=Lin+angular_momentum(m,pos-cmpos,vel-cmvel)+angular_momentum(subset.mass,subset.position-cmpos,subset.velocity-cmvel).sum(axis=0)
-                corrected_masses.append(total_mass)
-                corrected_positions.append(cmpos)
-                corrected_velocities.append(cmvel)
-                corrected_angular_momenta.append(L)
+        return self.accrete_candidates(orgparticles, order_on_sinks = False)
+
+    def accrete_candidates(self, orgparticles, order_on_sinks = True):
+        """
+        Accretes the particles within the radius of a sink, a particle
+        within the radius of more than one sink is accreted by the sink
+        with the strongest attraction (mass over distance squared).
+        Returns a copy of the accreted particles, ordered on the sinks
+        (order_on_sinks) or in the order of the particles.
+        """
+        is_other = ~numpy.in1d(orgparticles.key, self.key)
+        others = orgparticles[is_other]
+        if len(self) == 0 or len(others) == 0:
+            return others[0:0].copy()
+        position = others.position
+        i, j = self.select_candidates(others, position)
+
+        d2 = (position[j] - self.position[i]).lengths_squared()
+        masses = self.mass[i]
+        with numpy.errstate(divide = 'ignore', invalid = 'ignore'):
+            if order_on_sinks:
+                strength = -(masses / d2).number
             else:
-                corrected_masses.append(m)
-                corrected_positions.append(pos)
-                corrected_velocities.append(vel)
-                corrected_angular_momenta.append(Lin)
-        self.mass = corrected_masses
-        self.position = corrected_positions
-        self.velocity = corrected_velocities
-        self.angular_momentum = corrected_angular_momenta
+                strength = (d2 / masses).number
+        i, j = self.select_strongest(i, j, strength)
+        if order_on_sinks:
+            order = numpy.lexsort((j, i))
+            i, j = i[order], j[order]
+
+        accreted = others[j].copy()
+        if len(accreted):
+            self.aggregate_accreted(i, accreted.mass, accreted.position, accreted.velocity)
+            orgparticles.remove_particles(accreted)
+        return accreted
+
+    def aggregate_mass(self, too_close):
+        sinks = numpy.concatenate([[index] * len(subset) for index, subset in enumerate(too_close)] + [[]]).astype('int64')
+        if len(sinks) == 0:
+            return
+        accreted = [subset for subset in too_close if len(subset)]
+        def concatenate(values):
+            unit = values[0].unit
+            return numpy.concatenate([x.value_in(unit) for x in values]) | unit
+        self.aggregate_accreted(
+            sinks,
+            concatenate([subset.mass for subset in accreted]),
+            concatenate([subset.position for subset in accreted]),
+            concatenate([subset.velocity for subset in accreted])
+        )
+
+    def aggregate_accreted(self, sinks, mass, position, velocity):
+        """
+        Adds the mass, momentum and angular momentum of the accreted
+        particles to the sinks, sinks[k] is the index of the sink that
+        accreted the k-th particle. The sinks move to the center of
+        mass of the sink and its accreted particles.
+        """
+        indices = numpy.unique(sinks)
+        sinks = numpy.searchsorted(indices, sinks)
+        m = self.mass[indices]
+        pos = self.position[indices]
+        vel = self.velocity[indices]
+        Lin = self.angular_momentum[indices]
+
+        mass = mass.as_quantity_in(m.unit)
+        position = position.as_quantity_in(pos.unit)
+        velocity = velocity.as_quantity_in(vel.unit)
+        accreted_mass = numpy.bincount(sinks, mass.number, len(indices)) | m.unit
+        accreted_mass_position = numpy.zeros(pos.shape)
+        accreted_mass_velocity = numpy.zeros(vel.shape)
+        numpy.add.at(accreted_mass_position, sinks, mass.number.reshape((-1,1)) * position.number)
+        numpy.add.at(accreted_mass_velocity, sinks, mass.number.reshape((-1,1)) * velocity.number)
+
+        total_mass = accreted_mass + m
+        cmpos = (m.reshape((-1,1))*pos + (accreted_mass_position | m.unit * pos.unit)) / total_mass.reshape((-1,1))
+        cmvel = (m.reshape((-1,1))*vel + (accreted_mass_velocity | m.unit * vel.unit)) / total_mass.reshape((-1,1))
+
+        accreted_L = angular_momentum(mass, position-cmpos[sinks], velocity-cmvel[sinks]).as_quantity_in(Lin.unit)
+        L = numpy.zeros(Lin.shape)
+        numpy.add.at(L, sinks, accreted_L.number)
+        L = Lin + angular_momentum(m, pos-cmpos, vel-cmvel) + (L | Lin.unit)
+
+        self[indices].mass = total_mass
+        self[indices].position = cmpos
+        self[indices].velocity = cmvel
+        self[indices].angular_momentum = L
 
 
 class AbstractShape(object):
@@ -257,12 +302,13 @@ class NonSphericalSinkParticles(SinkParticles):
 
         self.shapes = shapes
 
-    def select_too_close(self, sources):
-        too_close = []
-        for pos, shape in zip(self.position, self.shapes):
-            subset = shape.within_shape(pos, sources)
-            too_close.append(subset)
-        return too_close
+    def select_candidates(self, others, position):
+        i, j = [numpy.zeros(0, dtype='int64')], [numpy.zeros(0, dtype='int64')]
+        for index, (pos, shape) in enumerate(zip(self.position, self.shapes)):
+            selected = numpy.flatnonzero(shape.select(pos, others))
+            i.append(numpy.repeat(index, len(selected)))
+            j.append(selected)
+        return numpy.concatenate(i), numpy.concatenate(j)
 
     def accrete_looping_over_sources(self, orgparticles):
         raise AmuseException("Looping over sources not supported for non spherical sink particles")
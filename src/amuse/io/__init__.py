@@ -26,4 +26,4 @@ GadgetFileFormatProcessor.register()
 VtkStructuredGrid.register()
 VtkUnstructuredGrid.register()
 
-__all__ = ["read_set_from_file", "write_set_to_file", "get_options_for_format"]
+__all__ = ["read_set_from_file", "write_set_to_file", "get_options_for_format", "BackgroundWriter"]
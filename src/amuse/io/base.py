@@ -2,6 +2,8 @@ import textwrap
 import struct
 import numpy
 import os.path
+import threading
+import Queue
 
 from amuse.support.core import late
 from amuse.support import exceptions
@@ -99,6 +101,150 @@ def read_set_from_file(
     return processor.load()
 
 
+class WriteRequest(object):
+    """
+    The pending write of a set by a :class:`BackgroundWriter`, the
+    request is finished when the set is written (or writing failed).
+    """
+    
+    def __init__(self, filename, number_of_bytes):
+        self.filename = filename
+        self.number_of_bytes = number_of_bytes
+        self.is_finished = False
+        self.exception = None
+        self.finished_event = threading.Event()
+    
+    def wait(self):
+        self.finished_event.wait()
+    
+    def is_result_available(self):
+        return self.is_finished
+    
+    def result(self):
+        """
+        Waits for the write to finish, raises the exception
+        of the write if it failed
+        """
+        self.wait()
+        if self.exception is not None:
+            raise self.exception
+    
+    def _set_finished(self, exception = None):
+        self.exception = exception
+        self.is_finished = True
+        self.finished_event.set()
+
+class BackgroundWriter(object):
+    """
+    Writes sets to files in a background thread, so the simulation
+    can continue while the file is written. A copy of the set is made
+    when the write is requested, changes to the set made after the
+    request are not written. At most maximum_number_of_pending_writes
+    copies are kept, a request for another write waits until a
+    pending write is finished. The writes are done in the order
+    of the requests.
+    
+    >>> from amuse.datamodel import Particles
+    >>> writer = BackgroundWriter(maximum_number_of_pending_writes = 2)
+    >>> particles = Particles(2)
+    >>> request = writer.write_set_to_file(particles, "snapshots.h5", "hdf5") # doctest: +SKIP
+    >>> writer.number_of_pending_writes, writer.number_of_pending_bytes # doctest: +SKIP
+    (1, 16)
+    >>> writer.close()
+    """
+    
+    def __init__(self, maximum_number_of_pending_writes = 2):
+        self.maximum_number_of_pending_writes = maximum_number_of_pending_writes
+        self.number_of_pending_writes = 0
+        self.number_of_pending_bytes = 0
+        self.is_closed = False
+        self.failed_requests = []
+        self.lock = threading.Lock()
+        self.slots = threading.Semaphore(maximum_number_of_pending_writes)
+        self.queue = Queue.Queue()
+        self.thread = threading.Thread(target = self._write_requests)
+        self.thread.daemon = True
+        self.thread.start()
+    
+    def write_set_to_file(self, set, filename, format = 'csv', **format_specific_keyword_arguments):
+        """
+        Requests a write of a copy of the set to the file, see
+        :func:`write_set_to_file` for the arguments. Returns a
+        :class:`WriteRequest`.
+        """
+        if self.is_closed:
+            raise IoException("cannot write '{0}', the background writer is closed".format(filename))
+        
+        self.slots.acquire()
+        try:
+            copy = set.copy()
+            request = WriteRequest(filename, self._number_of_bytes_in(copy))
+        except:
+            self.slots.release()
+            raise
+        
+        with self.lock:
+            self.number_of_pending_writes += 1
+            self.number_of_pending_bytes += request.number_of_bytes
+        self.queue.put((request, copy, filename, format, format_specific_keyword_arguments))
+        return request
+    
+    def flush(self):
+        """
+        Waits until all pending writes are finished, raises the
+        exception of the first failed write since the last flush
+        """
+        self.queue.join()
+        with self.lock:
+            failed_requests = self.failed_requests
+            self.failed_requests = []
+        if failed_requests:
+            raise failed_requests[0].exception
+    
+    def close(self):
+        if self.is_closed:
+            return
+        self.is_closed = True
+        try:
+            self.flush()
+        finally:
+            self.queue.put(None)
+            self.thread.join()
+    
+    def _write_requests(self):
+        while True:
+            item = self.queue.get()
+            if item is None:
+                self.queue.task_done()
+                return
+            
+            request, set, filename, format, format_specific_keyword_arguments = item
+            try:
+                write_set_to_file(set, filename, format, **format_specific_keyword_arguments)
+                exception = None
+            except Exception as ex:
+                exception = ex
+            
+            with self.lock:
+                self.number_of_pending_writes -= 1
+                self.number_of_pending_bytes -= request.number_of_bytes
+                if exception is not None:
+                    self.failed_requests.append(request)
+            request._set_finished(exception)
+            self.slots.release()
+            self.queue.task_done()
+    
+    def _number_of_bytes_in(self, set):
+        result = 0
+        for values in set.get_values_in_store(None, set.get_attribute_names_defined_in_store()):
+            if hasattr(values, 'number'):
+                values = values.number
+            result += numpy.asanyarray(values).nbytes
+        keys = set.get_all_keys_in_store()
+        if keys is not None:
+            result += numpy.asanyarray(keys).nbytes
+        return result
+
 class ReportTable(object):
     """
     Report quantities and values to a file.
@@ -43,15 +43,20 @@ class HDF5FileFormatProcessor(base.FileFormatProcessor):
                     False, 
                     open_for_writing = False, 
                     copy_history = self.copy_history,
-                    return_working_copy = self.return_working_copy
+                    return_working_copy = self.return_working_copy,
+                    memory_mapped = self.memory_mapped
                 )
+            elif self.memory_mapped:
+                processor.close()
+                raise exceptions.AmuseException("memory mapped reading is only available for version 2.0 files")
         else:
                 processor = store_v2.StoreHDF(
                     self.filename, 
                     False, 
                     open_for_writing = False, 
                     copy_history = self.copy_history,
-                    return_working_copy = self.return_working_copy
+                    return_working_copy = self.return_working_copy,
+                    memory_mapped = self.memory_mapped
                 )
 	    
         if len(self.names) > 0:
@@ -75,6 +80,9 @@ class HDF5FileFormatProcessor(base.FileFormatProcessor):
     def store(self):
         
         if self.version == '1.0':
+            names = self.options_only_available_for_version_2()
+            if len(names) > 0:
+                raise exceptions.AmuseException("these options are only available for version 2.0: {0}".format(", ".join(names)))
             processor = store_v1.StoreHDF(
                 self.filename, 
                 self.append_to_file, 
@@ -87,7 +95,14 @@ class HDF5FileFormatProcessor(base.FileFormatProcessor):
             processor = store_v2.StoreHDF(
                 self.filename, 
                 self.append_to_file, 
-                open_for_writing = True
+                open_for_writing = True,
+                incremental = self.incremental,
+                chunks = self.chunks,
+                compression = self.compression,
+                compression_opts = self.compression_opts,
+                shuffle = self.shuffle,
+                resizable = self.resizable,
+                append_to_time_axis = self.append_to_time_axis
             )
         
             if not processor.is_correct_version():
@@ -100,6 +115,11 @@ class HDF5FileFormatProcessor(base.FileFormatProcessor):
         finally:
             processor.close()
     
+    def options_only_available_for_version_2(self):
+        names = ['incremental', 'append_to_time_axis', 'chunks', 'compression', 
+            'compression_opts', 'shuffle', 'resizable', 'memory_mapped']
+        return [x for x in names if getattr(self, x) is not None and getattr(self, x) is not False]
+    
     @base.format_option
     def append_to_file(self):
         """If set to True, new data is appended to HDF5 files. 
@@ -136,6 +156,69 @@ class HDF5FileFormatProcessor(base.FileFormatProcessor):
         to store links between particles and grids (default: '2.0')"""
         return '1.0'
 
+    @base.format_option
+    def incremental(self):
+        """If set to True, the values of an attribute (and the keys) are
+        only stored if these differ from the values of the previous version
+        of the same set in the file, unchanged values are stored as links
+        to the previous version. Only available for version 2.0. (default: False)"""
+        return False
+
+    @base.format_option
+    def chunks(self):
+        """Chunk shape of the datasets, True to let h5py choose the
+        chunk shape or None to store the datasets contiguous (unless
+        needed for compression or resizing). Only available for
+        version 2.0. (default: None)"""
+        return None
+
+    @base.format_option
+    def compression(self):
+        """Compression filter for the datasets, for example "gzip" or
+        "lzf". Only available for version 2.0. (default: None)"""
+        return None
+
+    @base.format_option
+    def compression_opts(self):
+        """Options of the compression filter, for "gzip" the compression
+        level (0-9). (default: None)"""
+        return None
+
+    @base.format_option
+    def shuffle(self):
+        """If set to True, the bytes of the values are shuffled before
+        compression, this often improves compression. (default: False)"""
+        return False
+
+    @base.format_option
+    def resizable(self):
+        """If set to True, the first dimension of the datasets can grow,
+        particles added to a set loaded from the file are added without
+        copying the datasets. Only available for version 2.0. (default: False)"""
+        return False
+
+    @base.format_option
+    def append_to_time_axis(self):
+        """If set to True, every attribute of a set is stored in one
+        dataset with a row per snapshot. A snapshot is appended as a new
+        row if the previous snapshot in the file has the same particles
+        and attributes. Sets with links are stored as separate versions.
+        Unless chunks is set, a chunk holds at most 4096 values of one
+        row. Only available for version 2.0. (default: False)"""
+        return False
+
+    @base.format_option
+    def memory_mapped(self):
+        """If set to True, the attributes of the particles are returned
+        as read only memory maps of the data in the file, so a set that 
+        does not fit in memory can be analysed. For a subset only the
+        values of the selected particles are read. Datasets written with chunks,
+        compression or resizable set, cannot be mapped and are read
+        in blocks. Only available for version 2.0 files, and only useful
+        when the file is kept open (close_file is False).
+        (default: False)"""
+        return False
+    
     @base.format_option
     def return_working_copy(self):
         """If set to True, return a working copy in memory you can manipulate,
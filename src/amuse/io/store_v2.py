@@ -41,6 +41,60 @@ else:
     def unpickle_from_string(value):
         return pickle.loads(value)
     
+def is_selection_of_items(indices):
+    """
+    Returns True if the indices select items of the first 
+    dimension, with an array of indices or a boolean mask
+    """
+    return isinstance(indices, numpy.ndarray) and indices.ndim == 1 and indices.dtype.kind in 'iub'
+    
+def read_selection(dataset, indices, block_length):
+    """
+    Reads the items at the indices from the dataset. Only the
+    blocks of the dataset with selected items are read, a block 
+    has at most block_length items, so a small selection of a large 
+    dataset is read without reading the whole dataset into memory.
+    """
+    if indices.dtype.kind == 'b':
+        indices = indices.nonzero()[0]
+    result = numpy.empty((len(indices),) + dataset.shape[1:], dtype = dataset.dtype)
+    if len(indices) == 0:
+        return result
+    order = numpy.argsort(indices, kind = 'mergesort')
+    sorted_indices = indices[order]
+    start = 0
+    while start < len(sorted_indices):
+        begin = sorted_indices[start]
+        end = numpy.searchsorted(sorted_indices, begin + block_length)
+        block = dataset[begin:sorted_indices[end - 1] + 1]
+        result[order[start:end]] = block[sorted_indices[start:end] - begin]
+        start = end
+    return result
+    
+def memory_mapped_array(dataset):
+    """
+    Returns a read only memory map of the values in the dataset, 
+    or None if the values of the dataset cannot be mapped. Only 
+    contiguous datasets without compression can be mapped, the 
+    datasets of a file written with the chunks, compression or 
+    resizable options are read in blocks instead.
+    """
+    if dataset.chunks is not None or dataset.dtype.hasobject or dataset.size == 0:
+        return None
+    try:
+        offset = dataset.id.get_offset()
+    except Exception:
+        return None
+    if offset is None:
+        return None
+    return numpy.memmap(
+        dataset.file.filename, 
+        mode = 'r', 
+        dtype = dataset.dtype, 
+        offset = offset, 
+        shape = dataset.shape
+    )
+    
 class HDF5Attribute(object):
     
     def __init__(self, name):
@@ -83,34 +137,43 @@ class HDF5Attribute(object):
     def load_attribute(cls, name, dataset, loader):
         units_string = dataset.attrs["units"]
         if units_string == "none":
-            return HDF5UnitlessAttribute(name, dataset)
+            return HDF5UnitlessAttribute(name, dataset, loader.memory_mapped, loader.block_length)
         elif units_string == "link":
             return HDF5LinkedAttribute(name, dataset, loader)
         else:
             unit = eval(units_string, core.__dict__)
-            return HDF5VectorQuantityAttribute(name, dataset, unit) 
+            return HDF5VectorQuantityAttribute(name, dataset, unit, loader.memory_mapped, loader.block_length) 
 
     def get_value(self, index):
         pass
 
     def remove_indices(self, indices):
         pass
+        
+    def read_values(self, indices):
+        if self.memory_mapped:
+            values = memory_mapped_array(self.dataset)
+            if values is not None:
+                return values if indices is None else values[indices]
+        if indices is None:
+            return self.dataset[:]
+        elif is_selection_of_items(indices):
+            return read_selection(self.dataset, indices, self.block_length)
+        else:
+            return self.dataset[:][indices]
 
 class HDF5VectorQuantityAttribute(HDF5Attribute):
     
-    def __init__(self, name, dataset, unit):
+    def __init__(self, name, dataset, unit, memory_mapped = False, block_length = 1 << 20):
         HDF5Attribute.__init__(self, name)
     
         self.dataset = dataset
         self.unit = unit
+        self.memory_mapped = memory_mapped
+        self.block_length = block_length
         
     def get_values(self, indices):
-        if indices is None:
-            return self.unit.new_quantity(self.dataset[:])
-        elif len(self.get_shape()) > 1:
-            return self.unit.new_quantity(self.dataset[:][indices])
-        else:
-            return self.unit.new_quantity(self.dataset[:][indices])
+        return self.unit.new_quantity(self.read_values(indices))
             
     
     def set_values(self, indices, values):
@@ -131,6 +194,9 @@ class HDF5VectorQuantityAttribute(HDF5Attribute):
         delta = newlength - len(self.dataset)
         if delta == 0: 
            return
+        if self.dataset.maxshape[0] is None:
+            self.dataset.resize(newlength, axis = 0)
+            return
         newshape = list(self.dataset.shape)
         newshape[0] = newlength
         
@@ -173,18 +239,15 @@ class HDF5VectorQuantityAttribute(HDF5Attribute):
 
 class HDF5UnitlessAttribute(HDF5Attribute):
     
-    def __init__(self, name, dataset):
+    def __init__(self, name, dataset, memory_mapped = False, block_length = 1 << 20):
         HDF5Attribute.__init__(self, name)
         
         self.dataset = dataset
+        self.memory_mapped = memory_mapped
+        self.block_length = block_length
         
     def get_values(self, indices):
-        if indices is None:
-            return self.dataset[:]
-        elif len(self.get_shape()) > 1:
-            return self.dataset[:][indices]
-        else:
-            return self.dataset[:][indices]
+        return self.read_values(indices)
         
     
     def set_values(self, indices, values):
@@ -198,6 +261,9 @@ class HDF5UnitlessAttribute(HDF5Attribute):
         delta = newlength - len(self.dataset)
         if delta == 0: 
            return
+        if self.dataset.maxshape[0] is None:
+            self.dataset.resize(newlength, axis = 0)
+            return
         newshape = list(self.dataset.shape)
         newshape[0] = newlength
         
@@ -253,6 +319,8 @@ class HDF5LinkedAttribute(HDF5Attribute):
         self.loader = loader
 
     def get_values(self, indices):
+        if indices is None:
+            indices = slice(None)
         kinds = self.kind_dataset[:][indices]
         references = self.ref_dataset[:][indices]
         keys = self.keys_dataset[:][indices]
@@ -402,7 +470,8 @@ class HDF5AttributeStorage(AttributeStorage):
         self.number_of_particles = self.hdfgroup.attrs["number_of_particles"]
         self.particle_keys = keys
         self.loader = loader
-        self.mapping_from_particle_to_index = self.new_index()
+        self.sorted_indices, self.sorted_keys = self.new_index()
+        self.all_indices = numpy.arange(len(keys))
         
     def can_extend_attributes(self):
         return True
@@ -411,25 +480,33 @@ class HDF5AttributeStorage(AttributeStorage):
         return len(self.particle_keys)
         
     def new_index(self):
-        result = {}
-        index = 0
-        for particle_key in self.particle_keys:
-            result[particle_key] = index
-            index += 1
-        return result
+        """
+        Returns the indices that sort the keys and the sorted keys,
+        the index of a key is found with a binary search. Unlike
+        a dictionary from key to index, this index needs only two
+        numbers per particle, so large sets can be loaded.
+        """
+        sorted_indices = numpy.argsort(self.particle_keys, kind = 'mergesort')
+        return sorted_indices, self.particle_keys[sorted_indices]
+        
+    def positions_of(self, keys):
+        positions = numpy.searchsorted(self.sorted_keys, keys)
+        positions[positions == len(self.sorted_keys)] = 0
+        return positions, self.sorted_keys[positions] == keys
         
     def get_indices_of(self, keys):
         if keys is None:
             return numpy.arange(0,len(self.particle_keys))
-            
-        mapping_from_particle_to_index = self.mapping_from_particle_to_index 
-        result = numpy.zeros(len(keys),dtype='int32')
         
-        index = 0
-        for index, particle_key in enumerate(keys):
-            result[index] = mapping_from_particle_to_index[particle_key]
-            index += 1
-        return result
+        keys = numpy.asarray(keys, dtype = self.sorted_keys.dtype).reshape(-1)
+        if len(keys) == 0 or len(self.sorted_keys) == 0:
+            if len(keys) > 0:
+                raise KeyError(keys[0])
+            return numpy.zeros(0, dtype='int32')
+        positions, is_found = self.positions_of(keys)
+        if not is_found.all():
+            raise KeyError(keys[numpy.logical_not(is_found)][0])
+        return self.sorted_indices[positions]
         
     def get_defined_attribute_names(self):
         return self.attributesgroup.keys()
@@ -438,6 +515,8 @@ class HDF5AttributeStorage(AttributeStorage):
         return self.get_defined_attribute_names()
     
     def get_values_in_store(self, indices, attributes):
+        if indices is self.all_indices:
+            indices = None
         results = []
         for attribute in attributes:
             dataset = HDF5Attribute.load_attribute(
@@ -451,7 +530,10 @@ class HDF5AttributeStorage(AttributeStorage):
         return results
         
     def has_key_in_store(self, key):
-        return key in self.mapping_from_particle_to_index
+        if len(self.sorted_keys) == 0:
+            return False
+        positions, is_found = self.positions_of(numpy.asarray([key], dtype = self.sorted_keys.dtype))
+        return bool(is_found[0])
     
     def get_all_keys_in_store(self):
         return self.particle_keys
@@ -478,7 +560,43 @@ class HDF5AttributeStorage(AttributeStorage):
             dataset.set_values(bools, quantity)
 
     def get_all_indices_in_store(self):
-        return numpy.arange(len(self.particle_keys))
+        return self.all_indices
+
+class HDF5TimeAxisAttributeStorage(HDF5AttributeStorage):
+    """
+    Storage of one version of a set stored along the time axis, the
+    datasets have one row per version and the values of this
+    version are in the row at the version_index.
+    """
+
+    def __init__(self, keys, hdfgroup, loader, version_index):
+        HDF5AttributeStorage.__init__(self, keys, hdfgroup, loader)
+        self.version_index = version_index
+    
+    def get_values_in_store(self, indices, attributes):
+        results = []
+        for attribute in attributes:
+            dataset = self.attributesgroup[attribute]
+            values = dataset[self.version_index]
+            if indices is not None:
+                values = values[indices]
+            units_string = dataset.attrs["units"]
+            if units_string != "none":
+                values = eval(units_string, core.__dict__).new_quantity(values)
+            results.append(values)
+        return results
+        
+    def set_values_in_store(self, indices, attributes, quantities):
+        for attribute, quantity in zip(attributes, quantities):
+            if not attribute in self.attributesgroup:
+                raise exceptions.AmuseException("cannot add attribute '{0}' to a set stored along the time axis".format(attribute))
+            dataset = self.attributesgroup[attribute]
+            units_string = dataset.attrs["units"]
+            if units_string != "none":
+                quantity = quantity.value_in(eval(units_string, core.__dict__))
+            values = dataset[self.version_index]
+            values[indices] = quantity
+            dataset[self.version_index] = values
 
 class HDF5GridAttributeStorage(AttributeStorage):
 
@@ -586,11 +704,28 @@ class UneresolvedAttributeLink(object):
     def is_resolved(self):
         return self.resolved
         
+def chunk_shape(chunks, shape, maxshape):
+    """
+    Returns the chunk shape for a dataset, a chunk shape with fewer
+    dimensions than the dataset is extended with the size of the
+    remaining dimensions and every chunk dimension is limited to the
+    maximum size of the dimension
+    """
+    if chunks is None or chunks is True:
+        return chunks
+    chunks = tuple(chunks)[:len(shape)] + tuple(shape[len(chunks):])
+    return tuple([max(1, x if y is None else min(x, y)) for x, y in zip(chunks, maxshape)])
+    
 class StoreHDF(object):
     INFO_GROUP_NAME = 'AMUSE_INF'
     DATA_GROUP_NAME = 'data'
+    TIME_AXIS_TYPE = 'particles_on_time_axis'
+    TIME_AXIS_CHUNK_LENGTH = 4096
+    READ_BLOCK_LENGTH = 1 << 20
     
-    def __init__(self, filename, append_to_file=True, open_for_writing = True, copy_history = False, return_working_copy = False):
+    def __init__(self, filename, append_to_file=True, open_for_writing = True, copy_history = False, return_working_copy = False, incremental = False,
+            chunks = None, compression = None, compression_opts = None, shuffle = False, resizable = False, append_to_time_axis = False,
+            memory_mapped = False):
         if h5py is None:
             raise AmuseException("h5py module not available, cannot use hdf5 files")
             
@@ -613,6 +748,15 @@ class StoreHDF(object):
         
         self.copy_history = copy_history
         self.return_working_copy = return_working_copy
+        self.incremental = incremental
+        self.chunks = chunks
+        self.compression = compression
+        self.compression_opts = compression_opts
+        self.shuffle = shuffle
+        self.resizable = resizable
+        self.append_to_time_axis = append_to_time_axis
+        self.memory_mapped = memory_mapped
+        self.block_length = self.READ_BLOCK_LENGTH
         self.mapping_from_groupid_to_set = {}
         
         warnings.warn("amuse hdf storage version 2.0 is still in development, do not use it for production scripts")
@@ -695,7 +839,11 @@ class StoreHDF(object):
     def store_particles(self, particles, extra_attributes = {}, parent=None, mapping_from_setid_to_group = {}, links = []):
         if parent is None:
             parent = self.data_group()
+        
+        if self.append_to_time_axis and self.store_particles_on_time_axis(particles, extra_attributes, parent, mapping_from_setid_to_group):
+            return
             
+        previous_group = self.previous_version(parent, 'particles')
         group = self.new_version(parent)
         group.attrs["type"] = 'particles'
         self.mapping_from_groupid_to_set[group.id] = particles._original_set()
@@ -705,10 +853,12 @@ class StoreHDF(object):
         group.attrs["class_of_the_particles"] = pickle_to_string(particles._factory_for_new_collection())
             
         keys = particles.get_all_keys_in_store()
-        dataset = group.create_dataset("keys", data=keys)
-        self.hdf5file.flush()
+        if previous_group is not None and self.is_unchanged(previous_group, "keys", keys):
+            group["keys"] = previous_group["keys"]
+        else:
+            dataset = group.create_dataset("keys", data=keys, **self.dataset_options(keys.shape))
         self.store_collection_attributes(particles, group, extra_attributes, links)
-        self.store_values(particles, group, links)
+        self.store_values(particles, group, links, previous_group)
             
         mapping_from_setid_to_group[id(particles._original_set())] = group
         
@@ -719,6 +869,7 @@ class StoreHDF(object):
         if parent is None:
             parent = self.data_group()
             
+        previous_group = self.previous_version(parent, 'grid')
         group = self.new_version(parent)
         
         group.attrs["type"] = 'grid'
@@ -726,7 +877,7 @@ class StoreHDF(object):
         group.create_dataset("shape", data=numpy.asarray(grid.shape))
     
         self.store_collection_attributes(grid, group, extra_attributes, links)
-        self.store_values(grid, group, links)
+        self.store_values(grid, group, links, previous_group)
         
         mapping_from_setid_to_group[id(grid._original_set())] = group
         
@@ -746,20 +897,177 @@ class StoreHDF(object):
                 links_to_resolve.append(unresolved_link)
         return sets_to_store, links_to_resolve
         
-    def store_values(self, container, group, links = []):
+    def store_values(self, container, group, links = [], previous_group = None):
         attributes_group = group.create_group("attributes")
+        if previous_group is None:
+            previous_attributes_group = None
+        else:
+            previous_attributes_group = previous_group["attributes"]
         
         all_values = container.get_values_in_store(None, container.get_attribute_names_defined_in_store())
         for attribute, quantity in zip(container.get_attribute_names_defined_in_store(), all_values):
             if is_quantity(quantity):
                 value = quantity.value_in(quantity.unit)
-                dataset = attributes_group.create_dataset(attribute, data=value)
-                dataset.attrs["units"] = quantity.unit.to_simple_form().reference_string()
+                units_string = quantity.unit.to_simple_form().reference_string()
+                if self.is_unchanged(previous_attributes_group, attribute, value, units_string):
+                    attributes_group[attribute] = previous_attributes_group[attribute]
+                    continue
+                dataset = attributes_group.create_dataset(attribute, data=value, **self.dataset_options(value.shape))
+                dataset.attrs["units"] = units_string
             elif isinstance(quantity, LinkedArray):
                 self.store_linked_array(attribute, attributes_group, quantity, group, links)
             else:
-                dataset = attributes_group.create_dataset(attribute, data=quantity)
+                if self.is_unchanged(previous_attributes_group, attribute, quantity, "none"):
+                    attributes_group[attribute] = previous_attributes_group[attribute]
+                    continue
+                dataset = attributes_group.create_dataset(attribute, data=quantity, **self.dataset_options(numpy.shape(quantity)))
                 dataset.attrs["units"] = "none"
+    
+    def dataset_options(self, shape, maxshape = None):
+        """
+        Returns the keyword arguments for create_dataset to set
+        the chunk shape, compression and maximum shape
+        """
+        if len(shape) == 0 or (maxshape is None and 0 in shape):
+            return {}
+        
+        result = {}
+        if maxshape is None and self.resizable:
+            maxshape = (None,) + tuple(shape[1:])
+        if maxshape is not None:
+            result['maxshape'] = maxshape
+        else:
+            maxshape = shape
+        if self.chunks is not None:
+            result['chunks'] = chunk_shape(self.chunks, shape, maxshape)
+        if self.compression is not None:
+            result['compression'] = self.compression
+            if self.compression_opts is not None:
+                result['compression_opts'] = self.compression_opts
+        if self.shuffle:
+            result['shuffle'] = True
+        return result
+        
+    def collection_attributes_to_store(self, container, extra_attributes):
+        result = {}
+        result.update(container.collection_attributes.__getstate__())
+        result.update(extra_attributes)
+        return dict([(name, quantity) for name, quantity in result.iteritems() if quantity is not None])
+    
+    def store_particles_on_time_axis(self, particles, extra_attributes, parent, mapping_from_setid_to_group):
+        """
+        Stores the particles as a new row in the datasets of the last
+        version, if the last version was stored along the time axis with
+        the same particles and attributes. Otherwise a new version is
+        created, with a dataset for every attribute with a first
+        dimension that grows with every row. Returns False, without
+        storing, for an empty set and for sets with links or collection
+        attributes that are not scalars.
+        """
+        if len(particles) == 0:
+            return False
+        collection_attributes = self.collection_attributes_to_store(particles, extra_attributes)
+        for quantity in collection_attributes.values():
+            if is_quantity(quantity):
+                if not quantity.is_scalar():
+                    return False
+            elif not numpy.isscalar(quantity):
+                return False
+        
+        names = particles.get_attribute_names_defined_in_store()
+        all_values = particles.get_values_in_store(None, names)
+        for quantity in all_values:
+            if isinstance(quantity, LinkedArray):
+                return False
+            if not is_quantity(quantity) and numpy.asanyarray(quantity).dtype.kind == 'O':
+                return False
+                
+        keys = particles.get_all_keys_in_store()
+        values = [self.number_and_units_string(x) for x in all_values]
+        collection_values = [self.number_and_units_string(x) for x in collection_attributes.values()]
+        
+        group = self.last_version(parent)
+        if group is None or not self.can_append_to_time_axis(
+                group, keys, 
+                zip(names, values), 
+                zip(collection_attributes.keys(), collection_values)):
+            group = self.new_version(parent)
+            group.attrs["type"] = self.TIME_AXIS_TYPE
+            group.attrs["number_of_particles"] = len(particles)
+            group.attrs["class_of_the_particles"] = pickle_to_string(particles._factory_for_new_collection())
+            group.attrs["number_of_versions"] = 0
+            group.create_dataset("keys", data=keys, **self.dataset_options(keys.shape))
+            for group_name, names_and_values in (
+                    ("attributes", zip(names, values)), 
+                    ("collection_attributes", zip(collection_attributes.keys(), collection_values))):
+                subgroup = group.create_group(group_name)
+                for name, (number, units_string) in names_and_values:
+                    shape = (0,) + number.shape
+                    maxshape = (None,) + number.shape
+                    options = self.dataset_options(shape, maxshape)
+                    if not 'chunks' in options:
+                        options['chunks'] = (1,) + tuple([min(x, self.TIME_AXIS_CHUNK_LENGTH) for x in number.shape])
+                    dataset = subgroup.create_dataset(name, shape=shape, dtype=number.dtype, **options)
+                    dataset.attrs["units"] = units_string
+        
+        index = group.attrs["number_of_versions"]
+        for group_name, names_and_values in (
+                ("attributes", zip(names, values)),
+                ("collection_attributes", zip(collection_attributes.keys(), collection_values))):
+            subgroup = group[group_name]
+            for name, (number, units_string) in names_and_values:
+                dataset = subgroup[name]
+                dataset.resize(index + 1, axis = 0)
+                dataset[index] = number
+        group.attrs["number_of_versions"] = index + 1
+        
+        self.mapping_from_groupid_to_set[group.id] = particles._original_set()
+        mapping_from_setid_to_group[id(particles._original_set())] = group
+        self.hdf5file.flush()
+        return True
+    
+    def can_append_to_time_axis(self, group, keys, names_and_values, collection_names_and_values):
+        if group.attrs.get("type", None) != self.TIME_AXIS_TYPE:
+            return False
+        if not numpy.array_equal(group["keys"][...], keys):
+            return False
+        for group_name, names_and_values in (
+                ("attributes", names_and_values),
+                ("collection_attributes", collection_names_and_values)):
+            subgroup = group[group_name]
+            if set(subgroup.keys()) != set([name for name, x in names_and_values]):
+                return False
+            for name, (number, units_string) in names_and_values:
+                dataset = subgroup[name]
+                if dataset.attrs["units"] != units_string:
+                    return False
+                if dataset.dtype != number.dtype or dataset.shape[1:] != number.shape:
+                    return False
+        return True
+        
+    def number_and_units_string(self, quantity):
+        if is_quantity(quantity):
+            return numpy.asarray(quantity.value_in(quantity.unit)), quantity.unit.to_simple_form().reference_string()
+        else:
+            return numpy.asarray(quantity), "none"
+    
+    def is_unchanged(self, previous_group, name, value, units_string = None):
+        """
+        Returns True if the dataset with the name in the group of the previous
+        version has the same values (and units) as the given value, the
+        dataset can then be linked to instead of stored again
+        """
+        if previous_group is None or not name in previous_group:
+            return False
+        dataset = previous_group[name]
+        if not isinstance(dataset, h5py.Dataset):
+            return False
+        if units_string is not None and dataset.attrs.get("units", None) != units_string:
+            return False
+        value = numpy.asanyarray(value)
+        if dataset.shape != value.shape or dataset.dtype != value.dtype:
+            return False
+        return numpy.array_equal(dataset[...], value)
                 
     
     def store_linked_array(self, attribute, attributes_group, quantity, group, links):
@@ -942,6 +1250,33 @@ class StoreHDF(object):
         return particles
         
         
+    def load_particles_on_time_axis_from_group(self, group):
+        """
+        Returns a particle set for every version stored
+        along the time axis in the group
+        """
+        try:
+            class_of_the_container = unpickle_from_string(group.attrs["class_of_the_particles"])
+        except:
+            class_of_the_container = Particles
+            
+        keys = group["keys"][...]
+        collection_attributes_group = group["collection_attributes"]
+        result = []
+        for index in range(group.attrs["number_of_versions"]):
+            particles = class_of_the_container(is_working_copy = False)
+            particles._private.attribute_storage = HDF5TimeAxisAttributeStorage(keys, group, self, index)
+            for name in collection_attributes_group.keys():
+                dataset = collection_attributes_group[name]
+                quantity = dataset[index]
+                if dataset.attrs["units"] != "none":
+                    quantity = eval(dataset.attrs["units"], core.__dict__).new_quantity(quantity)
+                setattr(particles.collection_attributes, name, quantity)
+            result.append(particles)
+        
+        self.mapping_from_groupid_to_set[group.id] = result[-1]
+        return result
+        
     def load_grid_from_group(self, group):
         try:
             class_of_the_container = unpickle_from_string(group.attrs["class_of_the_container"])
@@ -964,6 +1299,8 @@ class StoreHDF(object):
             return self.load_particles_from_group(group)
         elif container_type == 'grid':
             return self.load_grid_from_group(group)
+        elif container_type == self.TIME_AXIS_TYPE:
+            return self.load_particles_on_time_axis_from_group(group)[-1]
         else:
             raise Exception('unknown container type in file {0}'.format(container_type))
         
@@ -982,14 +1319,17 @@ class StoreHDF(object):
         return self.load_container(container_group)
         
     def load_container(self, container_group):
-        number_of_saved_containers= len(container_group)
-        all_containers = [None] * number_of_saved_containers
-        for group_index in container_group.keys():
+        all_containers = []
+        for group_index in sorted(container_group.keys(), key = int):
             group = container_group[group_index]
-            container = self.load_from_group(group)
-            if self.copy_history:
-                container = container.copy()
-            all_containers[int(group_index) - 1] = container
+            if group.attrs['type'] == self.TIME_AXIS_TYPE:
+                containers = self.load_particles_on_time_axis_from_group(group)
+            else:
+                containers = [self.load_from_group(group)]
+            for container in containers:
+                if self.copy_history:
+                    container = container.copy()
+                all_containers.append(container)
             
         previous = None
         for x in all_containers:
@@ -1013,6 +1353,25 @@ class StoreHDF(object):
     def derefence(self, reference):
         return self.hdf5file[reference]
         
+    def last_version(self, master_group):
+        if len(master_group) == 0:
+            return None
+        return master_group.get(format(len(master_group),"010d"), None)
+        
+    def previous_version(self, master_group, container_type):
+        """
+        In incremental mode, returns the group of the last version stored
+        in the master group, if it is of the same type. The datasets of the
+        new version that are equal to the datasets of this version will be
+        hard links to these datasets. Returns None otherwise.
+        """
+        if not self.incremental:
+            return None
+        group = self.last_version(master_group)
+        if group is None or group.attrs.get("type", None) != container_type or not "attributes" in group:
+            return None
+        return group
+        
     def new_version(self, master_group):
         index = len(master_group)
         name = format(index + 1,"010d")
@@ -7,12 +7,15 @@ import cPickle as pickle
 import sys
 import struct
 import threading
+import Queue
 import select
 import atexit
 import time
 
 import socket
 import array
+import mmap
+import tempfile
 import logging
 
 logger = logging.getLogger(__name__)
@@ -36,6 +39,15 @@ from amuse.support.core import late
 from amuse.support import exceptions
 from amuse.rfi import run_command_redirected
 
+class CallingChain(object):
+    def __init__(self, outer, args,  inner):
+        self.outer = outer
+        self.inner = inner
+        self.args = args
+        
+    def __call__(self):
+        return self.outer(self.inner, *self.args)
+        
 class ASyncRequest(object):
         
     def __init__(self, request, message, comm, header):
@@ -69,15 +81,6 @@ class ASyncRequest(object):
         return self.message
         
     def _set_result(self):
-        class CallingChain(object):
-            def __init__(self, outer, args,  inner):
-                self.outer = outer
-                self.inner = inner
-                self.args = args
-                
-            def __call__(self):
-                return self.outer(self.inner)
-                
         self.message.receive_content(self.comm, self.header)
         
         current = self.get_message
@@ -144,26 +147,18 @@ class ASyncSocketRequest(object):
         self.is_finished = len(readables) == 1
         return self.is_finished
         
-    def add_result_handler(self, function):
-        self.result_handlers.append(function)
+    def add_result_handler(self, function, args = ()):
+        self.result_handlers.append([function,args])
     
     def get_message(self):
         return self.message
         
     def _set_result(self):
-        class CallingChain(object):
-            def __init__(self, outer, inner):
-                self.outer = outer
-                self.inner = inner
-                
-            def __call__(self):
-                return self.outer(self.inner)
-                
         self.message.receive(self.socket)
         
         current = self.get_message
-        for x in self.result_handlers:
-            current = CallingChain(x, current)
+        for x, args in self.result_handlers:
+            current = CallingChain(x, args, current)
         
         self._result = current()
         
@@ -184,7 +179,134 @@ class ASyncSocketRequest(object):
     def is_pool(self):
         return False
 
+class ASyncFinishedRequest(object):
+    """
+    A request for a call of which the result was already received
+    when the request was made, a call that is split into blocks is
+    send and received completely in send_message.
+    """
+    
+    def __init__(self, value):
+        self.value = value
+        
+        self.is_finished = True
+        self.is_set = False
+        self._result = None
+        self.result_handlers = []
+        
+    def wait(self):
+        pass
+    
+    def is_result_available(self):
+        return True
+        
+    def add_result_handler(self, function, args = ()):
+        self.result_handlers.append([function,args])
+    
+    def get_value(self):
+        return self.value
+        
+    def result(self):
+        if not self.is_set:
+            current = self.get_value
+            for x, args in self.result_handlers:
+                current = CallingChain(x, args, current)
+            self._result = current()
+            self.is_set = True
+        
+        return self._result
+    
+    def is_mpi_request(self):
+        return False
+        
+    def is_pool(self):
+        return False
+        
+class ASyncRequestSequence(object):
+    """
+    A request for a number of calls to the same code. A channel
+    handles one message at a time, so the next call is sent as soon
+    as the result of the previous call is received, without waiting
+    for the caller. The calls are given as functions returning the
+    request of the call, the result of the sequence is the list of
+    the results of the calls.
+    """
+    
+    def __init__(self, create_requests):
+        self.create_requests = list(create_requests)
+        self.results = []
+        self.current_async_request = None
+        self.is_finished = False
+        self.is_set = False
+        self._result = None
+        self.result_handlers = []
+        
+        self._start_next_request()
+    
+    def _start_next_request(self):
+        while True:
+            if not self.current_async_request is None:
+                self.results.append(self.current_async_request.result())
+            
+            if len(self.results) < len(self.create_requests):
+                self.current_async_request = self.create_requests[len(self.results)]()
+                # a request can be finished when it is made, for
+                # example a call that was split into blocks
+                if not self.current_async_request.is_finished:
+                    break
+            else:
+                self.is_finished = True
+                break
+    
+    def wait(self):
+        while not self.is_finished:
+            self.current_async_request.wait()
+            self._start_next_request()
+    
+    def is_result_available(self):
+        while not self.is_finished and self.current_async_request.is_result_available():
+            self._start_next_request()
+        return self.is_finished
+        
+    def add_result_handler(self, function, args = ()):
+        self.result_handlers.append([function,args])
+    
+    def get_results(self):
+        return self.results
+        
+    def result(self):
+        self.wait()
+        
+        if not self.is_set:
+            current = self.get_results
+            for x, args in self.result_handlers:
+                current = CallingChain(x, args, current)
+            self._result = current()
+            self.is_set = True
+        
+        return self._result
+    
+    @property
+    def request(self):
+        return self.current_async_request.request
         
+    @property
+    def socket(self):
+        return self.current_async_request.socket
+        
+    def is_mpi_request(self):
+        if self.current_async_request is None:
+            return False
+        return self.current_async_request.is_mpi_request()
+        
+    def is_pool(self):
+        return False
+        
+    def join(self, other):
+        pool = AsyncRequestsPool()
+        pool.add_request(self, lambda x: x.result())
+        pool.add_request(other, lambda x: x.result())
+        return pool
         
 class AsyncRequestWithHandler(object):
     
@@ -200,10 +322,11 @@ class AsyncRequestWithHandler(object):
         
 class AsyncRequestsPool(object):
     
-    def __init__(self):
+    def __init__(self, polling_interval = 0.001):
         self.requests_and_handlers = []
         self.registered_requests = set([])
         self.result_handlers = []
+        self.polling_interval = polling_interval
         
     def add_request(self, async_request, result_handler, args=(), kwargs={}):
         if async_request in self.registered_requests:
@@ -222,55 +345,145 @@ class AsyncRequestsPool(object):
         )
     
         
-    def wait(self):
+    def poll(self):
+        """
+        Calls the handlers of the requests that are finished, without
+        waiting for the others. Returns the number of handled requests,
+        use this to drive the pool from another event loop.
+        """
+        return self._run_handlers(self._finished_requests(0))
         
-        # TODO need to cleanup this code
-        #
-        requests = [x.async_request.request for x in self.requests_and_handlers if x.async_request.is_mpi_request()]
-        indices = [i for i, x in enumerate(self.requests_and_handlers) if x.async_request.is_mpi_request()]
+    def wait(self, timeout = None):
+        """
+        Waits until at least one request is finished and calls the
+        handlers of all finished requests. MPI and socket requests are
+        checked in turn, so a finished request on one kind of channel
+        does not wait for a request on the other kind. Returns the
+        number of handled requests, this is 0 if no request finished
+        within the timeout (in seconds, None waits as long as needed).
+        """
+        if not timeout is None:
+            end_time = time.time() + timeout
         
-        if len(requests) > 0:
-            index = MPI.Request.Waitany(requests)
-              
-            index = indices[index]
-            
-            request_and_handler = self.requests_and_handlers[index]
+        while len(self.requests_and_handlers) > 0:
+            if timeout is None:
+                remaining = None
+            else:
+                remaining = max(0, end_time - time.time())
             
-            request_and_handler.async_request.wait()  # will set the finished flag
+            finished_requests = self._finished_requests(remaining)
+            if len(finished_requests) > 0:
+                return self._run_handlers(finished_requests)
             
-            if request_and_handler.async_request.is_result_available():
-                self.registered_requests.remove(request_and_handler.async_request)
-                
-                del self.requests_and_handlers[index]
-                
-                request_and_handler.run()
+            if remaining == 0:
+                break
+        return 0
+        
+    def wait_all(self, timeout = None):
+        """
+        Waits until all requests are finished, or until the timeout
+        (in seconds) has passed. Returns True if all requests are
+        finished.
+        """
+        if not timeout is None:
+            end_time = time.time() + timeout
             
+        while len(self.requests_and_handlers) > 0:
+            if timeout is None:
+                self.wait()
+            else:
+                remaining = end_time - time.time()
+                if remaining <= 0:
+                    break
+                self.wait(remaining)
         
-        sockets = [x.async_request.socket for x in self.requests_and_handlers if not x.async_request.is_mpi_request()]
-        indices = [i for i, x in enumerate(self.requests_and_handlers) if not x.async_request.is_mpi_request()]
-        if len(sockets) > 0:
-            readable, _, _ = select.select(sockets, [], [])
-            indices_to_delete = []
-            for read_socket in readable:
-                
-                index = sockets.index(read_socket)
-                
-                index = indices[index]
-                
-                request_and_handler = self.requests_and_handlers[index]
-                
-                self.registered_requests.remove(request_and_handler.async_request)
-                
-                indices_to_delete.append(index)
-                
-                request_and_handler.async_request.wait()  # will set the finished flag
-                
-                request_and_handler.run()
+        return len(self.requests_and_handlers) == 0
+        
+    def as_completed(self, timeout = None):
+        """
+        Yields the requests in the order in which they finish, the
+        handler of a request is called before it is yielded. Stops
+        when all requests are finished or when no request finished
+        within the timeout (in seconds).
+        """
+        while len(self.requests_and_handlers) > 0:
+            finished_requests = []
+            
+            if not timeout is None:
+                end_time = time.time() + timeout
+            while len(finished_requests) == 0:
+                if timeout is None:
+                    remaining = None
+                else:
+                    remaining = max(0, end_time - time.time())
+                finished_requests = self._finished_requests(remaining)
+                if remaining == 0:
+                    break
             
-            for x in reversed(list(sorted(indices_to_delete))):
-                
-                del self.requests_and_handlers[x]
+            if len(finished_requests) == 0:
+                return
             
+            self._run_handlers(finished_requests)
+            for x in finished_requests:
+                yield x.async_request
+                
+    def _finished_requests(self, timeout):
+        # MPI requests are tested without blocking, the socket requests
+        # are selected, if there are MPI requests the select returns
+        # after the polling interval to test these again
+        result = []
+        sockets = []
+        requests_on_sockets = []
+        requests_on_mpi = []
+        for x in self.requests_and_handlers:
+            async_request = x.async_request
+            if getattr(async_request, 'is_finished', False):
+                result.append(x)
+            elif async_request.is_mpi_request():
+                requests_on_mpi.append(x)
+                if async_request.is_result_available():
+                    result.append(x)
+            else:
+                sockets.append(async_request.socket)
+                requests_on_sockets.append(x)
+        
+        has_mpi_requests = len(requests_on_mpi) > 0
+        if len(result) == 0 and len(sockets) == 0 and has_mpi_requests and timeout is None:
+            # only MPI requests, no need to poll
+            MPI.Request.Waitany([x.async_request.request for x in requests_on_mpi])
+            return [x for x in requests_on_mpi if x.async_request.is_result_available()]
+        
+        if len(result) > 0:
+            timeout = 0
+        elif has_mpi_requests:
+            if timeout is None:
+                timeout = self.polling_interval
+            else:
+                timeout = min(timeout, self.polling_interval)
+        
+        if len(sockets) > 0:
+            if timeout is None:
+                readable, _, _ = select.select(sockets, [], [])
+            else:
+                readable, _, _ = select.select(sockets, [], [], timeout)
+            for socket, x in zip(sockets, requests_on_sockets):
+                if socket in readable and x.async_request.is_result_available():
+                    result.append(x)
+        elif len(result) == 0 and timeout > 0:
+            time.sleep(timeout)
+        
+        return result
+        
+    def _run_handlers(self, finished_requests):
+        for x in finished_requests:
+            self.requests_and_handlers.remove(x)
+            self.registered_requests.remove(x.async_request)
+        
+        for x in finished_requests:
+            x.run()
+        
+        return len(finished_requests)
+        
     def __len__(self):
         return len(self.requests_and_handlers)
         
@@ -749,6 +962,33 @@ class AbstractMessageChannel(OptionalAttributes):
     def is_multithreading_supported(cls):
         return True
             
+    @option(type="int", sections=("channel",))
+    def max_message_length(self):
+        """
+        For calls to functions that can handle arrays, messages may get too long for large N.
+        The MPI and socket channels will split long messages into blocks of size max_message_length.
+        """ 
+        return 1000000
+    
+    @option(type="int", sections=("channel",))
+    def split_message_window(self):
+        """
+        Number of blocks of a split message that are send before the
+        reply to the first block is received. With 1 every block waits
+        for the reply to the previous block, with more the code handles
+        a block while the next blocks are transferred (for MPI this
+        needs an MPI library with multithreading support).
+        """ 
+        return 1
+    
+    @option(type="float", sections=("channel",))
+    def split_message_join_timeout(self):
+        """
+        Number of seconds to wait for the thread sending the blocks of
+        a split message to stop, after an error in receiving the replies.
+        """ 
+        return 1.0
+    
     @option(type='string', sections=("channel",))
     def worker_code_suffix(self):
         return ''
@@ -882,6 +1122,119 @@ Please do a 'make clean; make' in the root directory.
     
     def nonblocking_recv_message(self, call_id=0, function_id=-1, handle_as_array=False):
         pass
+    
+    def send_block(self, call_id, function_id, dtype_to_arguments):
+        raise NotImplementedError
+        
+    def receive_block(self, call_id, function_id):
+        raise NotImplementedError
+    
+    def is_pipelining_supported(self):
+        return False
+        
+    def split_message(self, call_id, function_id, call_count, dtype_to_arguments):
+        """
+        Sends a call that is longer than max_message_length in blocks
+        of max_message_length. When pipelining is supported, up to
+        split_message_window blocks are send before the reply to the
+        first block is received (the blocks are send from a thread),
+        so the code handles a block while the next blocks are
+        transferred. The replies are copied into result arrays of the
+        length of the whole call, recv_message returns these.
+        """
+        number_of_blocks = 1 + (call_count - 1) / self.max_message_length
+        
+        def block_of_arguments(i):
+            start = i * self.max_message_length
+            end = min(start + self.max_message_length, call_count)
+            result = {}
+            for key, value in dtype_to_arguments.iteritems():
+                result[key] = [x[start:end] if hasattr(x, '__iter__') else x for x in value]
+            return result
+        
+        dtype_to_result = {}
+        
+        def add_block_of_results(i, partial_dtype_to_result):
+            start = i * self.max_message_length
+            end = min(start + self.max_message_length, call_count)
+            for datatype, value in partial_dtype_to_result.iteritems():
+                if not datatype in dtype_to_result:
+                    if datatype == 'string':
+                        dtype_to_result[datatype] = [[None] * call_count for element in value]
+                    else:
+                        dtype_to_result[datatype] = [numpy.zeros((call_count,), dtype=datatype) for element in value]
+                
+                for j, element in enumerate(value):
+                    dtype_to_result[datatype][j][start:end] = element
+        
+        if self.is_pipelining_supported():
+            window = max(1, self.split_message_window)
+        else:
+            window = 1
+        
+        if window == 1 or number_of_blocks == 1:
+            for i in range(number_of_blocks):
+                self.send_block(call_id, function_id, block_of_arguments(i))
+                add_block_of_results(i, self.receive_block(call_id, function_id).to_result(True))
+        else:
+            self._send_and_receive_blocks(call_id, function_id, number_of_blocks, window, block_of_arguments, add_block_of_results)
+        
+        self._communicated_splitted_message = True
+        self._merged_results_splitted_message = dtype_to_result
+        
+    def _send_and_receive_blocks(self, call_id, function_id, number_of_blocks, window, block_of_arguments, add_block_of_results):
+        sent_blocks = Queue.Queue()
+        free_slots = threading.Semaphore(window)
+        must_stop = threading.Event()
+        
+        def send_blocks():
+            try:
+                for i in range(number_of_blocks):
+                    free_slots.acquire()
+                    if must_stop.is_set():
+                        break
+                    self.send_block(call_id, function_id, block_of_arguments(i))
+                    sent_blocks.put(i)
+            except Exception as ex:
+                sent_blocks.put(ex)
+                return
+            sent_blocks.put(None)
+        
+        thread = threading.Thread(target = send_blocks)
+        thread.daemon = True
+        thread.start()
+        
+        error = None
+        try:
+            while True:
+                i = sent_blocks.get()
+                if i is None:
+                    break
+                if isinstance(i, Exception):
+                    error = error or i
+                    break
+                try:
+                    message = self.receive_block(call_id, function_id)
+                    if error is None:
+                        add_block_of_results(i, message.to_result(True))
+                except exceptions.CodeException as ex:
+                    # the blocks already send will still be handled by the code,
+                    # receive their replies before raising
+                    error = error or ex
+                    must_stop.set()
+                free_slots.release()
+        finally:
+            # on any other error the sender may be waiting for a slot,
+            # wake it up so it can see it must stop
+            must_stop.set()
+            for i in range(window):
+                free_slots.release()
+            # or it may be blocked in a send that the code will never
+            # receive, the thread is a daemon so do not wait forever
+            thread.join(self.split_message_join_timeout)
+        
+        if not error is None:
+            raise error
         
     def start(self):
         pass
@@ -1063,14 +1416,6 @@ class MpiChannel(AbstractMessageChannel):
         return "none"
         
     
-    @option(type="int", sections=("channel",))
-    def max_message_length(self):
-        """
-        For calls to functions that can handle arrays, MPI messages may get too long for large N.
-        The MPI channel will split long messages into blocks of size max_message_length.
-        """ 
-        return 1000000
-    
 
     @late
     def redirect_stdout_file(self):
@@ -1178,63 +1523,16 @@ class MpiChannel(AbstractMessageChannel):
             self.split_message(call_id, function_id, call_count, dtype_to_arguments)
             return
         
+        self.send_block(call_id, function_id, dtype_to_arguments)
+        
+        self._is_inuse = True
+        
+    def send_block(self, call_id, function_id, dtype_to_arguments):
         message = ServerSideMPIMessage(
             call_id, function_id,
-            call_count, dtype_to_arguments
+            self.determine_length_from_data(dtype_to_arguments), dtype_to_arguments
         )
         message.send(self.intercomm)
-        
-        self._is_inuse = True
-        
-    def split_message(self, call_id, function_id, call_count, dtype_to_arguments):
-        
-        def split_input_array(i, arr_in):
-            if call_count == 1:
-                return [tmp[i * self.max_message_length] for tmp in arr_in]
-            else:
-                result = []
-                for x in arr_in:
-                    if hasattr(x, '__iter__'):
-                        result.append(x[i * self.max_message_length:(i + 1) * self.max_message_length])
-                    else:
-                        result.append(x)
-                return result
-        
-        dtype_to_result = {}
-        
-        for i in range(1 + (call_count - 1) / self.max_message_length):
-            split_dtype_to_argument = {}
-            for key, value in dtype_to_arguments.iteritems():
-                split_dtype_to_argument[key] = split_input_array(i, value)
-                
-            self.send_message(
-                call_id,
-                function_id,
-                # min(call_count,self.max_message_length),
-                split_dtype_to_argument
-            )
-            
-            partial_dtype_to_result = self.recv_message(call_id, function_id, True)
-            for datatype, value in partial_dtype_to_result.iteritems():
-                if not datatype in dtype_to_result:
-                    dtype_to_result[datatype] = [] 
-                    for j, element in enumerate(value):
-                        if datatype == 'string':
-                            dtype_to_result[datatype].append([])
-                        else:
-                            dtype_to_result[datatype].append(numpy.zeros((call_count,), dtype=datatype))
-                            
-                for j, element in enumerate(value):
-                    if datatype == 'string':
-                        dtype_to_result[datatype][j].extend(element)
-                    else:
-                        dtype_to_result[datatype][j][i * self.max_message_length:(i + 1) * self.max_message_length] = element
-                
-            # print partial_dtype_to_result
-            call_count -= self.max_message_length
-        
-        self._communicated_splitted_message = True
-        self._merged_results_splitted_message = dtype_to_result
     
     def recv_message(self, call_id, function_id, handle_as_array):
         
@@ -1246,6 +1544,9 @@ class MpiChannel(AbstractMessageChannel):
             del self._merged_results_splitted_message
             return x
         
+        return self.receive_block(call_id, function_id).to_result(handle_as_array)
+        
+    def receive_block(self, call_id, function_id):
         message = ServerSideMPIMessage(
             polling_interval=self.polling_interval_in_milliseconds * 1000
         )
@@ -1271,9 +1572,15 @@ class MpiChannel(AbstractMessageChannel):
 #            self.stop()
 #            raise exceptions.CodeException("Fatal error in code, code has exited")
         
-        return message.to_result(handle_as_array)
+        return message
         
     def nonblocking_recv_message(self, call_id, function_id, handle_as_array):
+        if self._communicated_splitted_message:
+            x = self._merged_results_splitted_message
+            self._communicated_splitted_message = False
+            del self._merged_results_splitted_message
+            return ASyncFinishedRequest(x)
+        
         request = ServerSideMPIMessage().nonblocking_receive(self.intercomm)
         def handle_result(function):
             self._is_inuse = False
@@ -1306,6 +1613,9 @@ class MpiChannel(AbstractMessageChannel):
     def is_polling_supported(self):
         return True
         
+    def is_pipelining_supported(self):
+        return self.is_multithreading_supported()
+        
 
 
 class MultiprocessingMPIChannel(AbstractMessageChannel):
@@ -1501,33 +1811,48 @@ m.run_mpi_channel('{2}')"""
         return True
 
 class SocketMessage(AbstractMessage):
-      
-    def _receive_all(self, nbytes, thesocket):
-
-        # logger.debug("receiving %d bytes", nbytes)
-        
-        result = []
-        
-        while nbytes > 0:
-            chunk = min(nbytes, 10240)
-            data_bytes = thesocket.recv(chunk)
+    """
+    Message send over a stream socket.
+    
+    The typed sections of the message are received directly into
+    preallocated numpy arrays (using recv_into) and send from the
+    memory of the numpy arrays. When the socket supports vectored
+    writes (sendmsg) the header and all sections are written in
+    one call, otherwise small messages are joined and
+    large sections are written one after the other, without making
+    intermediate string copies.
+    """
+    
+    # messages smaller than this are joined in one buffer before
+    # sending, so these go out in one packet
+    join_limit = 65536
+    
+    def _receive_into(self, data_buffer, thesocket):
+        view = memoryview(data_buffer)
+        nbytes = len(view)
+        offset = 0
+        while offset < nbytes:
+            count = thesocket.recv_into(view[offset:], nbytes - offset)
             
-            if len(data_bytes) == 0:
+            if count == 0:
                 raise exceptions.CodeException("lost connection to code")
             
-            result.append(data_bytes)
-            nbytes -= len(data_bytes)
-            # logger.debug("got %d bytes, result length = %d", len(data_bytes), len(result))
-            
-        return "".join(result)
-     
-    def receive(self, socket):
+            offset += count
         
-        # logger.debug("receiving message")
+        return data_buffer
         
-        header_bytes = self._receive_all(40, socket)
-
-        flags = numpy.frombuffer(header_bytes, dtype="b", count=4, offset=0)
+    def _receive_all(self, nbytes, thesocket):
+        return bytes(self._receive_into(bytearray(nbytes), thesocket))
+        
+    def _receive_array(self, thesocket, count, dtype):
+        result = numpy.empty(count, dtype=dtype)
+        self._receive_into(result.view(dtype='b'), thesocket)
+        return result
+        
+    def receive_header(self, socket):
+        header = self._receive_array(socket, 10, 'i')
+        
+        flags = header[:1].view(dtype='b')
         
         if flags[0] != self.big_endian:
             raise exceptions.CodeException("endianness in message does not match native endianness")
@@ -1537,9 +1862,15 @@ class SocketMessage(AbstractMessage):
         else:
             self.error = False
         
-        header = numpy.copy(numpy.frombuffer(header_bytes, dtype="i", offset=0))
-        
         # logger.debug("receiving message with flags %s and header %s", flags, header)
+        
+        return header
+        
+    def receive(self, socket):
+        
+        # logger.debug("receiving message")
+        
+        header = self.receive_header(socket)
 
         # id of this call
         self.call_id = header[1]
@@ -1569,77 +1900,45 @@ class SocketMessage(AbstractMessage):
         
     def receive_ints(self, socket, count):
         if count > 0:
-            nbytes = count * 4  # size of int
-            
-            data_bytes = self._receive_all(nbytes, socket)
-            
-            result = numpy.copy(numpy.frombuffer(data_bytes, dtype='int32'))
-            
-            return result
+            return self._receive_array(socket, count, 'int32')
         else:
             return []        
             
     def receive_longs(self, socket, count):
         if count > 0:
-            nbytes = count * 8  # size of long
-            
-            data_bytes = self._receive_all(nbytes, socket)
-            
-            result = numpy.copy(numpy.frombuffer(data_bytes, dtype='int64'))
-            
-            return result
+            return self._receive_array(socket, count, 'int64')
         else:
             return []
- 
         
     def receive_floats(self, socket, count):
         if count > 0:
-            nbytes = count * 4  # size of float
-            
-            data_bytes = self._receive_all(nbytes, socket)
-            
-            result = numpy.copy(numpy.frombuffer(data_bytes, dtype='f4'))
-            
-            return result
+            return self._receive_array(socket, count, 'f4')
         else:
             return []
-    
           
     def receive_doubles(self, socket, count):
         if count > 0:
-            nbytes = count * 8  # size of double
-            
-            data_bytes = self._receive_all(nbytes, socket)
-            
-            result = numpy.copy(numpy.frombuffer(data_bytes, dtype='f8'))
-            
-            return result
+            return self._receive_array(socket, count, 'f8')
         else:
             return []
-        
 
     def receive_booleans(self, socket, count):
         if count > 0:
-            nbytes = count * 1  # size of boolean/byte
-            
-            data_bytes = self._receive_all(nbytes, socket)
-            
-            result = numpy.copy(numpy.frombuffer(data_bytes, dtype='b'))
-            
-            return result
+            return self._receive_array(socket, count, 'b')
         else:
             return []
-    
             
     def receive_strings(self, socket, count):
         if count > 0:
             lengths = self.receive_ints(socket, count)
             
-            strings = []
+            data_bytes = self._receive_all(int(lengths.sum()), socket)
             
+            strings = []
+            offset = 0
             for i in range(count):
-                data_bytes = self._receive_all(lengths[i], socket)
-                strings.append(str(data_bytes.decode('utf-8')))
+                strings.append(str(data_bytes[offset:offset + lengths[i]].decode('utf-8')))
+                offset += lengths[i]
             
             return strings
         else:
@@ -1648,12 +1947,16 @@ class SocketMessage(AbstractMessage):
     def nonblocking_receive(self, socket):
         return ASyncSocketRequest(self, socket)
     
-    
-    def send(self, socket):
+    def header_array(self):
+        header = numpy.empty(10, dtype='i')
         
-        flags = numpy.array([self.big_endian, False, False, False], dtype="b")
+        flags = header[:1].view(dtype='b')
+        flags[0] = self.big_endian
+        flags[1] = self.error
+        flags[2] = False
+        flags[3] = False
         
-        header = numpy.array([
+        header[1:] = [
             self.call_id,
             self.function_id,
             self.call_count,
@@ -1663,65 +1966,69 @@ class SocketMessage(AbstractMessage):
             len(self.doubles),
             len(self.booleans),
             len(self.strings),
-        ], dtype='i')
+        ]
+        return header
         
-        # logger.debug("sending message with flags %s and header %s", flags, header)
+    def buffers_to_send(self):
+        buffers = [self.header_array()]
         
-        socket.sendall(flags.tostring())
+        for dtype, array in (
+                ('int32', self.ints),
+                ('int64', self.longs),
+                ('f4', self.floats),
+                ('f8', self.doubles),
+                ('b', self.booleans),
+            ):
+            if len(array) > 0:
+                buffers.append(numpy.ascontiguousarray(array, dtype=dtype))
         
-        socket.sendall(header.tostring())
-
-        self.send_ints(socket, self.ints)
-        self.send_longs(socket, self.longs)
-        self.send_floats(socket, self.floats)
-        self.send_doubles(socket, self.doubles)
-        self.send_booleans(socket, self.booleans)
-        self.send_strings(socket, self.strings)
+        if len(self.strings) > 0:
+            encoded = [x.encode('utf-8') for x in self.strings]
+            buffers.append(numpy.asarray([len(x) for x in encoded], dtype='int32'))
+            buffers.append(''.join(encoded))
         
-        # logger.debug("message send")
-    
-    def send_doubles(self, socket, array):
-        if len(array) > 0:
-            data_buffer = numpy.array(array, dtype='f8')
-            socket.sendall(data_buffer.tostring())
-            
-    def send_ints(self, socket, array):
-        if len(array) > 0:
-            data_buffer = numpy.array(array, dtype='int32')
-            socket.sendall(data_buffer.tostring())
-            
-    def send_floats(self, socket, array):
-        if len(array) > 0:
-            data_buffer = numpy.array(array, dtype='f4')
-            socket.sendall(data_buffer.tostring())
-            
-    def send_strings(self, socket, array):
-        header = []
-        data_bytes = []
+        return buffers
         
-        for i in range(len(array)):
-            
-            #logger.debug("sending string %s", array[i])
-            
-            utf8_string = array[i].encode('utf-8')
-            header.append(len(utf8_string))
-            data_bytes.append(utf8_string)
-  
-        self.send_ints(socket, header);
+    def set_error(self, message):
+        self.strings = [message]
+        self.error = True
         
-        for i in range(len(data_bytes)):
-            socket.sendall(data_bytes[i])
+    def send(self, socket):
+        self.send_buffers(socket, self.buffers_to_send())
+        
+    def send_buffers(self, socket, buffers_to_send):
+        buffers = []
+        total_number_of_bytes = 0
+        for x in buffers_to_send:
+            if isinstance(x, numpy.ndarray):
+                x = x.view(dtype='b')
+            view = memoryview(x)
+            buffers.append(view)
+            total_number_of_bytes += len(view)
+        
+        # logger.debug("sending message with %d bytes in %d buffers", total_number_of_bytes, len(buffers))
+        
+        if hasattr(socket, 'sendmsg'):
+            self._send_vectored(socket, buffers)
+        elif total_number_of_bytes <= self.join_limit:
+            socket.sendall(b''.join([x.tobytes() for x in buffers]))
+        else:
+            for x in buffers:
+                socket.sendall(x)
         
-    def send_booleans(self, socket, array):
-        if len(array) > 0:
-            data_buffer = numpy.array(array, dtype='b')
-            socket.sendall(data_buffer.tostring())
+        # logger.debug("message send")
+    
+    def _send_vectored(self, socket, buffers):
+        while len(buffers) > 0:
+            count = socket.sendmsg(buffers)
+            while count > 0:
+                if count >= len(buffers[0]):
+                    count -= len(buffers[0])
+                    del buffers[0]
+                else:
+                    buffers[0] = buffers[0][count:]
+                    count = 0
 
-    def send_longs(self, socket, array):
-        if len(array) > 0:
-            data_buffer = numpy.array(array, dtype='int64')
-            socket.sendall(data_buffer.tostring())
-        
 class SocketChannel(AbstractMessageChannel):
     
     def __init__(self, name_of_the_worker, legacy_interface_type=None, interpreter_executable=None, **options):
@@ -1749,6 +2056,7 @@ class SocketChannel(AbstractMessageChannel):
         logger.debug("full name of worker is %s", self.full_name_of_the_worker)
         
         self._is_inuse = False
+        self._communicated_splitted_message = False
         self.socket = None
     
 
@@ -1835,7 +2143,7 @@ class SocketChannel(AbstractMessageChannel):
             arguments.append('false')
 
         logger.debug("starting process with command `%s`, arguments `%s` and environment '%s'", command, arguments, os.environ)
-        self.process = Popen(arguments, executable=command, stdin=PIPE, stdout=None, stderr=None, close_fds=False)
+        self.process = Popen(arguments, executable=command, stdin=PIPE, stdout=None, stderr=None, close_fds=False, env=self.worker_environment())
         logger.debug("waiting for connection from worker")
 
         self.socket, address = self.accept_worker_connection(server_socket, self.process)
@@ -1890,6 +2198,15 @@ class SocketChannel(AbstractMessageChannel):
     def is_inuse(self):
         return self._is_inuse
     
+    def worker_environment(self):
+        return None
+        
+    def new_message_to_send(self, call_id, function_id, call_count, dtype_to_arguments):
+        return SocketMessage(call_id, function_id, call_count, dtype_to_arguments)
+        
+    def new_message_to_receive(self):
+        return SocketMessage()
+        
     def determine_length_from_data(self, dtype_to_arguments):
         def get_length(x):
             if x:
@@ -1918,16 +2235,33 @@ class SocketChannel(AbstractMessageChannel):
         if self.socket is None:
             raise exceptions.CodeException("You've tried to send a message to a code that is not running")
         
-        message = SocketMessage(call_id, function_id, call_count, dtype_to_arguments)
-        message.send(self.socket)
+        if call_count > self.max_message_length:
+            self.split_message(call_id, function_id, call_count, dtype_to_arguments)
+            return
+        
+        self.send_block(call_id, function_id, dtype_to_arguments)
         
         self._is_inuse = True
         
+    def send_block(self, call_id, function_id, dtype_to_arguments):
+        call_count = self.determine_length_from_data(dtype_to_arguments)
+        message = self.new_message_to_send(call_id, function_id, call_count, dtype_to_arguments)
+        message.send(self.socket)
+        
     def recv_message(self, call_id, function_id, handle_as_array):
            
         self._is_inuse = False
         
-        message = SocketMessage()
+        if self._communicated_splitted_message:
+            x = self._merged_results_splitted_message
+            self._communicated_splitted_message = False
+            del self._merged_results_splitted_message
+            return x
+        
+        return self.receive_block(call_id, function_id).to_result(handle_as_array)
+        
+    def receive_block(self, call_id, function_id):
+        message = self.new_message_to_receive()
         
         message.receive(self.socket)
 
@@ -1942,10 +2276,19 @@ class SocketChannel(AbstractMessageChannel):
             logger.info("error message!")
             raise exceptions.CodeException("Error in code: " + message.strings[0])
 
-        return message.to_result(handle_as_array)
+        return message
+        
+    def is_pipelining_supported(self):
+        return True
         
     def nonblocking_recv_message(self, call_id, function_id, handle_as_array):
-        request = SocketMessage().nonblocking_receive(self.socket)
+        if self._communicated_splitted_message:
+            x = self._merged_results_splitted_message
+            self._communicated_splitted_message = False
+            del self._merged_results_splitted_message
+            return ASyncFinishedRequest(x)
+        
+        request = self.new_message_to_receive().nonblocking_receive(self.socket)
     
         def handle_result(function):
             self._is_inuse = False
@@ -1969,6 +2312,220 @@ class SocketChannel(AbstractMessageChannel):
     
         return request
 
+class SharedMemoryBuffer(object):
+    """
+    Memory mapped file in the shared memory filesystem (``/dev/shm``
+    on linux), used to move the typed data of messages between
+    processes on the same host.
+    
+    The buffer is split in two slots, one for the messages send to
+    the worker and one for the messages send back by the worker.
+    Every message is written at the start of its slot, as a channel
+    only has one message in flight in each direction.
+    """
+    ENVIRONMENT_VARIABLE = 'AMUSE_SHARED_MEMORY_BUFFER'
+    
+    TO_WORKER = 0
+    FROM_WORKER = 1
+    
+    def __init__(self, filename, size = None):
+        self.filename = filename
+        self.is_owner = not size is None
+        
+        if self.is_owner:
+            fileno = os.open(filename, os.O_RDWR | os.O_CREAT, 0600)
+            os.ftruncate(fileno, size)
+        else:
+            fileno = os.open(filename, os.O_RDWR)
+            size = os.fstat(fileno).st_size
+        
+        try:
+            self.mapping = mmap.mmap(fileno, size)
+        finally:
+            os.close(fileno)
+        
+        self.memory = numpy.frombuffer(self.mapping, dtype='b')
+        self.slot_size = (size // 2) - ((size // 2) % 8)
+        
+        # the creator of the buffer cannot assume the other side
+        # supports shared memory, it will know after the first
+        # message received through the buffer
+        self.is_used_by_peer = not self.is_owner
+    
+    @classmethod
+    def new(cls, size_of_a_slot):
+        if os.path.isdir('/dev/shm'):
+            directory = '/dev/shm'
+        else:
+            directory = tempfile.gettempdir()
+        
+        fileno, filename = tempfile.mkstemp(prefix = 'amuse_', dir = directory)
+        os.close(fileno)
+        
+        return cls(filename, 2 * size_of_a_slot)
+        
+    @classmethod
+    def from_environment(cls):
+        """
+        Opens the buffer named in the environment of a worker process, 
+        returns None when the worker was not started with a buffer.
+        The variable is removed, so the buffer is not passed on
+        to workers started by this worker.
+        """
+        filename = os.environ.pop(cls.ENVIRONMENT_VARIABLE, None)
+        if filename is None:
+            return None
+        return cls(filename)
+        
+    def slot(self, index):
+        return self.memory[index * self.slot_size:(index + 1) * self.slot_size]
+        
+    def close(self):
+        if self.mapping is None:
+            return
+        
+        self.memory = None
+        self.mapping.close()
+        self.mapping = None
+        
+        if self.is_owner and os.path.exists(self.filename):
+            os.remove(self.filename)
+            
+class SharedMemoryMessage(SocketMessage):
+    """
+    Socket message that puts the typed data in a slot of a
+    shared memory buffer. Only the header and the characters of
+    the strings are send over the socket. The third flag of the
+    header is set when the data is in the buffer, messages that
+    do not fit in the slot are send over the socket completely.
+    """
+    
+    def __init__(self, call_id=0, function_id=-1, call_count=1, dtype_to_arguments={}, shared_memory=None, slot=0, **options):
+        SocketMessage.__init__(self, call_id, function_id, call_count, dtype_to_arguments, **options)
+        
+        self.shared_memory = shared_memory
+        self.slot = slot
+        self.payload_in_shared_memory = False
+        self.payload_offset = None
+    
+    def _aligned(self, offset):
+        return offset + (-offset % 8)
+        
+    def _receive_array(self, thesocket, count, dtype):
+        if self.payload_offset is None:
+            return SocketMessage._receive_array(self, thesocket, count, dtype)
+            
+        result = numpy.empty(count, dtype=dtype)
+        nbytes = result.nbytes
+        memory = self.shared_memory.slot(self.slot)
+        result.view(dtype='b')[:] = memory[self.payload_offset:self.payload_offset + nbytes]
+        self.payload_offset = self._aligned(self.payload_offset + nbytes)
+        return result
+        
+    def receive_header(self, socket):
+        self.payload_offset = None
+        
+        header = SocketMessage.receive_header(self, socket)
+        
+        flags = header[:1].view(dtype='b')
+        self.payload_in_shared_memory = bool(flags[2])
+        if self.payload_in_shared_memory:
+            if self.shared_memory is None:
+                raise exceptions.CodeException("received a message with data in shared memory, but no shared memory buffer is available")
+            self.shared_memory.is_used_by_peer = True
+            self.payload_offset = 0
+            
+        return header
+        
+    def header_array(self):
+        header = SocketMessage.header_array(self)
+        header[:1].view(dtype='b')[2] = self.payload_in_shared_memory
+        return header
+    
+    def send(self, socket):
+        buffers = self.buffers_to_send()
+        
+        if self.shared_memory is None or not self.shared_memory.is_used_by_peer:
+            self.send_buffers(socket, buffers)
+            return
+            
+        arrays = [x for x in buffers[1:] if isinstance(x, numpy.ndarray)]
+        total_number_of_bytes = sum([self._aligned(x.nbytes) for x in arrays])
+        if total_number_of_bytes > self.shared_memory.slot_size:
+            self.send_buffers(socket, buffers)
+            return
+        
+        memory = self.shared_memory.slot(self.slot)
+        offset = 0
+        for x in arrays:
+            memory[offset:offset + x.nbytes] = x.view(dtype='b')
+            offset = self._aligned(offset + x.nbytes)
+        
+        self.payload_in_shared_memory = True
+        buffers = [self.header_array()] + [x for x in buffers[1:] if not isinstance(x, numpy.ndarray)]
+        self.send_buffers(socket, buffers)
+        
+class SharedMemoryChannel(SocketChannel):
+    """
+    Channel to a worker on the same host. The worker is connected
+    with a socket, as in the socket channel, but the typed data of
+    the messages is copied through a shared memory buffer.
+    
+    The name of the buffer is passed to the worker in the
+    environment. Workers that do not support shared memory
+    ignore it, the channel will only put data in the buffer after
+    the worker has replied through it.
+    """
+    
+    def __init__(self, name_of_the_worker, legacy_interface_type=None, interpreter_executable=None, **options):
+        SocketChannel.__init__(self, name_of_the_worker, legacy_interface_type, interpreter_executable, **options)
+        
+        self.shared_memory = None
+    
+    @option(type="int", sections=("channel",))
+    def shared_memory_size(self):
+        """Size of the shared memory buffer in bytes, for each direction"""
+        return 64 * 1024 * 1024
+        
+    def start(self):
+        self.shared_memory = SharedMemoryBuffer.new(self.shared_memory_size)
+        try:
+            SocketChannel.start(self)
+        except:
+            self.shared_memory.close()
+            self.shared_memory = None
+            raise
+        
+    def stop(self):
+        SocketChannel.stop(self)
+        
+        if not self.shared_memory is None:
+            self.shared_memory.close()
+            self.shared_memory = None
+            
+    def is_pipelining_supported(self):
+        # a block is send through the same shared memory buffer as the
+        # previous block, so it can only be send after the reply
+        return False
+        
+    def worker_environment(self):
+        result = dict(os.environ)
+        result[SharedMemoryBuffer.ENVIRONMENT_VARIABLE] = self.shared_memory.filename
+        return result
+        
+    def new_message_to_send(self, call_id, function_id, call_count, dtype_to_arguments):
+        return SharedMemoryMessage(
+            call_id, function_id, call_count, dtype_to_arguments,
+            shared_memory = self.shared_memory,
+            slot = SharedMemoryBuffer.TO_WORKER
+        )
+        
+    def new_message_to_receive(self):
+        return SharedMemoryMessage(
+            shared_memory = self.shared_memory,
+            slot = SharedMemoryBuffer.FROM_WORKER
+        )
+        
 class OutputHandler(threading.Thread):
     
     def __init__(self, stream, port):
@@ -7,6 +7,8 @@ import pydoc
 import traceback
 import random
 import sys
+import time
+import numpy
 
 
 from subprocess import Popen, PIPE
@@ -16,11 +18,13 @@ from amuse.support.core import late
 from amuse.support.core import print_out
 from amuse.support.core import OrderedDictionary
 from amuse.support.options import OptionalAttributes, option
+from amuse.support.thirdparty import texttable
 from amuse.rfi.tools.create_definition import CodeDocStringProperty
 from amuse.rfi.channel import MpiChannel
 from amuse.rfi.channel import MultiprocessingMPIChannel
 from amuse.rfi.channel import DistributedChannel
 from amuse.rfi.channel import SocketChannel
+from amuse.rfi.channel import SharedMemoryChannel
 from amuse.rfi.channel import is_mpd_running
 
 try:
@@ -70,6 +74,114 @@ def _typecode_to_datatype(typecode):
 
 
     
+class CallProfile(object):
+    """
+    Records, for every code and legacy function, the number of calls,
+    the number of elements (the length of the arrays) per call, the
+    bytes of the arguments sent to and the results received from the
+    worker and the time spent converting and sending the arguments
+    (serialise), waiting for the worker to reply (wait) and
+    converting the results (convert). The bytes are the bytes
+    of the values, the message headers are not counted.
+    
+    Profiling is off by default, the module has one profile
+    (:data:`call_profile`) for all codes and channels.
+    
+    >>> call_profile.start() # doctest: +SKIP
+    >>> code = BHTree() # doctest: +SKIP
+    >>> print call_profile.as_table() # doctest: +SKIP
+    >>> call_profile.write_at_exit("calls.txt") # doctest: +SKIP
+    """
+    CALLS, ELEMENTS, BYTES_SENT, BYTES_RECEIVED, SERIALISE, WAIT, CONVERT = range(7)
+    
+    def __init__(self):
+        self.is_enabled = False
+        self.filenames_to_write_at_exit = []
+        self.reset()
+    
+    def start(self):
+        self.is_enabled = True
+    
+    def stop(self):
+        self.is_enabled = False
+    
+    def reset(self):
+        self.entries = {}
+    
+    def record(self, interface, specification, dtype_to_arguments, dtype_to_result, serialise, wait, convert):
+        key = (type(interface).__name__, specification.name, specification.id)
+        if not key in self.entries:
+            self.entries[key] = [0, 0, 0, 0, 0.0, 0.0, 0.0]
+        entry = self.entries[key]
+        entry[self.CALLS] += 1
+        entry[self.ELEMENTS] += self._number_of_elements(dtype_to_arguments)
+        entry[self.BYTES_SENT] += self._number_of_bytes(dtype_to_arguments)
+        entry[self.BYTES_RECEIVED] += self._number_of_bytes(dtype_to_result)
+        entry[self.SERIALISE] += serialise
+        entry[self.WAIT] += wait
+        entry[self.CONVERT] += convert
+    
+    def rows(self):
+        """
+        Returns a row for every code and function, sorted on the
+        total time spent in the function. The columns are: code, function,
+        function id, calls, elements per call, bytes sent, bytes received,
+        serialise, wait and convert times (in seconds).
+        """
+        result = []
+        for (code, name, function_id), entry in self.entries.iteritems():
+            result.append((
+                code, 
+                name, 
+                function_id, 
+                entry[self.CALLS], 
+                entry[self.ELEMENTS] * 1.0 / entry[self.CALLS],
+            ) + tuple(entry[self.BYTES_SENT:]))
+        return sorted(result, key = lambda x : -sum(x[-3:]))
+    
+    def as_table(self):
+        table = texttable.Texttable(max_width = 0)
+        table.set_cols_dtype(['t', 't', 'i', 'i', 'f', 'i', 'i', 'f', 'f', 'f'])
+        table.set_cols_align(["l", "l", "r", "r", "r", "r", "r", "r", "r", "r"])
+        table.add_rows([('code', 'function', 'id', 'calls', 'elements/call', 'bytes sent', 
+            'bytes received', 'serialise (s)', 'wait (s)', 'convert (s)')] + self.rows())
+        return table.draw()
+    
+    def write_to_file(self, filename):
+        with open(filename, "w") as stream:
+            stream.write(self.as_table())
+            stream.write("\n")
+    
+    def write_at_exit(self, filename):
+        """
+        Writes the table to the file when python exits
+        """
+        if not self.filenames_to_write_at_exit:
+            atexit.register(self._write_files_at_exit)
+        self.filenames_to_write_at_exit.append(filename)
+    
+    def _write_files_at_exit(self):
+        for filename in self.filenames_to_write_at_exit:
+            self.write_to_file(filename)
+    
+    def _number_of_elements(self, dtype_to_values):
+        for values in dtype_to_values.values():
+            if values and hasattr(values[0], '__len__') and not isinstance(values[0], basestring):
+                return len(values[0])
+        return 1
+    
+    def _number_of_bytes(self, dtype_to_values):
+        result = 0
+        for dtype, values in dtype_to_values.iteritems():
+            if dtype == 'string':
+                for x in values:
+                    result += len(x) if isinstance(x, basestring) else sum(map(len, x))
+            else:
+                result += sum(map(numpy.size, values)) * numpy.dtype(dtype).itemsize
+        return result
+
+call_profile = CallProfile()
+
 class CodeFunction(object):
     
     __doc__ = CodeDocStringProperty()
@@ -88,6 +200,10 @@ class CodeFunction(object):
         self.specification = specification
     
     def __call__(self, *arguments_list, **keyword_arguments):
+        is_profiled = call_profile.is_enabled
+        if is_profiled:
+            t0 = time.time()
+        
         dtype_to_values = self.converted_keyword_and_list_arguments( arguments_list, keyword_arguments)
         
         handle_as_array = self.must_handle_as_array(dtype_to_values)
@@ -99,20 +215,36 @@ class CodeFunction(object):
         
         try:
             self.interface.channel.send_message(call_id, self.specification.id, dtype_to_arguments = dtype_to_values)
+            self.interface.number_of_calls += 1
+            if is_profiled:
+                t1 = time.time()
             
             dtype_to_result = self.interface.channel.recv_message(call_id, self.specification.id, handle_as_array)
+            if is_profiled:
+                t2 = time.time()
         except Exception, ex:
             CODE_LOG.info("Exception when calling function '{0}', of code '{1}', exception was '{2}'".format(self.specification.name, type(self.interface).__name__, ex))
             raise exceptions.CodeException("Exception when calling function '{0}', of code '{1}', exception was '{2}'".format(self.specification.name, type(self.interface).__name__, ex))
         
         result = self.converted_results(dtype_to_result, handle_as_array)
         
+        if is_profiled:
+            call_profile.record(self.interface, self.specification, dtype_to_values, dtype_to_result, 
+                t1 - t0, t2 - t1, time.time() - t2)
+        
+        if self.specification.name in ('initialize_code', 'cleanup_code'):
+            self.interface._is_code_initialized = self.specification.name == 'initialize_code'
+        
         if not self.owner is None:
             logging.getLogger("code").info("end call '%s.%s'",self.owner.__name__, self.specification.name)
         
         return result
     
     def async(self, *arguments_list, **keyword_arguments):
+        is_profiled = call_profile.is_enabled
+        if is_profiled:
+            t0 = time.time()
+        
         dtype_to_values = self.converted_keyword_and_list_arguments( arguments_list, keyword_arguments)
         
         handle_as_array = self.must_handle_as_array(dtype_to_values)
@@ -120,6 +252,9 @@ class CodeFunction(object):
         call_id = random.randint(0, 1000)
               
         self.interface.channel.send_message(call_id, self.specification.id, dtype_to_arguments = dtype_to_values)
+        self.interface.number_of_calls += 1
+        if is_profiled:
+            t1 = time.time()
         
         request = self.interface.channel.nonblocking_recv_message(call_id, self.specification.id, handle_as_array)
         
@@ -128,7 +263,17 @@ class CodeFunction(object):
                 dtype_to_result = function()
             except Exception, ex:
                 raise exceptions.CodeException("Exception when calling legacy code '{0}', exception was '{1}'".format(self.specification.name, ex))
-            return self.converted_results(dtype_to_result, handle_as_array)
+            if self.specification.name in ('initialize_code', 'cleanup_code'):
+                self.interface._is_code_initialized = self.specification.name == 'initialize_code'
+            if not is_profiled:
+                return self.converted_results(dtype_to_result, handle_as_array)
+            
+            # for asynchronous calls, the wait time is the time until the result is handled
+            t2 = time.time()
+            result = self.converted_results(dtype_to_result, handle_as_array)
+            call_profile.record(self.interface, self.specification, dtype_to_values, dtype_to_result, 
+                t1 - t0, t2 - t1, time.time() - t2)
+            return result
             
         request.add_result_handler(handle_result)
         return request
@@ -525,6 +670,124 @@ def stop_interfaces(exceptions = []):
                 x._stop()
             except:
                 pass
+    for reference in WorkerPool.pools:
+        x = reference()
+        if not x is None:
+            x.stop()
+
+class WorkerPool(object):
+    """
+    Keeps the workers of stopped interface instances running, to
+    hand these to new instances of the same interface class (started
+    with the same worker and options). Starting a worker (a new
+    process and an MPI spawn or a socket handshake) can take longer than
+    a short calculation, parameter sweeps that create and stop many
+    instances save this time.
+    
+    A worker is returned to the pool in the state after cleanup_code,
+    cleanup_code is called on it if the code was initialized when the
+    instance was stopped. The new instance runs initialize_code (the
+    high level codes do this in their state transitions). Only use
+    the pool for codes that are reset by these functions.
+    
+    :argument maximum_number_of_workers: Number of idle workers to keep, the least recently used idle worker is stopped when the pool is full
+    :argument idle_timeout: Idle workers are stopped after this number of seconds, checked when workers are taken or returned
+    
+    >>> pool = WorkerPool(maximum_number_of_workers = 4, idle_timeout = 60)
+    >>> for x in range(100): # doctest: +SKIP
+    ...     code = BHTree(worker_pool = pool)
+    ...     code.stop()
+    >>> print pool.number_of_reused_workers # doctest: +SKIP
+    99
+    """
+    pools = []
+    
+    def __init__(self, maximum_number_of_workers = 4, idle_timeout = 60.0):
+        self.maximum_number_of_workers = maximum_number_of_workers
+        self.idle_timeout = idle_timeout
+        self.idle_workers = []
+        self.number_of_started_workers = 0
+        self.number_of_reused_workers = 0
+    
+    def __len__(self):
+        return len(self.idle_workers)
+    
+    def take_worker(self, key):
+        """
+        Returns the channel of an idle worker started for the key
+        or None if the pool has no such worker
+        """
+        self.stop_idle_workers()
+        for index, (worker_key, channel, time_released) in enumerate(self.idle_workers):
+            if worker_key == key:
+                del self.idle_workers[index]
+                self.number_of_reused_workers += 1
+                return channel
+        return None
+    
+    def release_worker(self, key, interface):
+        """
+        Adds the worker of the interface to the pool, returns False
+        if the worker could not be cleaned up (the worker must
+        then be stopped)
+        """
+        if getattr(interface, '_is_code_initialized', False):
+            try:
+                if interface.cleanup_code() < 0:
+                    return False
+            except exceptions.CodeException:
+                return False
+        
+        self.stop_idle_workers()
+        while self.idle_workers and len(self.idle_workers) >= self.maximum_number_of_workers:
+            self.stop_worker(self.idle_workers.pop(0)[1])
+        if self.maximum_number_of_workers <= 0:
+            return False
+        if not self.is_registered():
+            self.pools.append(weakref.ref(self))
+        self.idle_workers.append((key, interface.channel, time.time()))
+        return True
+    
+    def is_registered(self):
+        """
+        Returns True if the pool is in the list of pools with idle
+        workers, that are stopped by stop_interfaces
+        """
+        return any([x() is self for x in self.pools])
+    
+    def stop_idle_workers(self):
+        """
+        Stops the workers that have been idle for longer than the idle timeout
+        """
+        now = time.time()
+        is_expired = lambda x : now - x[2] > self.idle_timeout
+        expired = [x for x in self.idle_workers if is_expired(x)]
+        self.idle_workers = [x for x in self.idle_workers if not is_expired(x)]
+        for key, channel, time_released in expired:
+            self.stop_worker(channel)
+    
+    def stop_worker(self, channel):
+        if not channel.is_active():
+            return
+        try:
+            call_id = random.randint(0, 1000)
+            channel.send_message(call_id, CodeInterface._stop_worker.specification.id)
+            channel.recv_message(call_id, CodeInterface._stop_worker.specification.id, False)
+        finally:
+            channel.stop()
+    
+    def stop(self):
+        """
+        Stops all idle workers and removes the pool from the list of
+        pools, it is added again when a worker is released to it
+        """
+        self.pools[:] = [x for x in self.pools if not x() is None and not x() is self]
+        idle_workers, self.idle_workers = self.idle_workers, []
+        for key, channel, time_released in idle_workers:
+            try:
+                self.stop_worker(channel)
+            except:
+                pass
 
 class CodeInterface(OptionalAttributes):
     """
@@ -537,6 +800,11 @@ class CodeInterface(OptionalAttributes):
     """
     instances = []
     is_stop_interfaces_registered = False
+    worker_pool = None
+    
+    # counts the calls to the worker, a change in this count
+    # tells a cache that the state of the code may have changed
+    number_of_calls = 0
     
     def __init__(self, name_of_the_worker = 'worker_code', **options):
         """
@@ -554,6 +822,7 @@ class CodeInterface(OptionalAttributes):
         :argument number_of_workers: Number of applications to start. The application must have parallel MPI support if this is more than 1.
         :argument debug_with_gdb: Start the worker(s) in a gdb session in a separate xterm
         :argument hostname: Start the worker on the node with this name
+        :argument worker_pool: Take the worker from this :class:`WorkerPool`, and return it to the pool when stopped
         """
         OptionalAttributes.__init__(self, **options)
            
@@ -579,6 +848,13 @@ class CodeInterface(OptionalAttributes):
         
     
     def _start(self, name_of_the_worker = 'worker_code', interpreter_executable = None, **options):
+        if not self.worker_pool is None:
+            self._worker_pool_key = self._get_worker_pool_key(name_of_the_worker, interpreter_executable, options)
+            self.channel = self.worker_pool.take_worker(self._worker_pool_key)
+            if not self.channel is None:
+                return
+            self.worker_pool.number_of_started_workers += 1
+        
         self.channel = self.channel_factory(name_of_the_worker, type(self), interpreter_executable = interpreter_executable, **options)
         
         self._check_if_worker_is_up_to_date()
@@ -609,11 +885,24 @@ class CodeInterface(OptionalAttributes):
             atexit.register(stop_interfaces)
             cls.is_stop_interfaces_registered = True
         
+    def _get_worker_pool_key(self, name_of_the_worker, interpreter_executable, options):
+        options = [(key, repr(value)) for key, value in options.iteritems() if key != 'worker_pool']
+        return (
+            type(self), 
+            name_of_the_worker, 
+            interpreter_executable, 
+            self.channel_factory, 
+            self.redirection_filenames, 
+            self.polling_interval_in_milliseconds, 
+            tuple(sorted(options))
+        )
+        
     def _stop(self):
         if hasattr(self, 'channel'):
             if not self.channel is None and self.channel.is_active():
-                self._stop_worker()
-                self.channel.stop()
+                if self.worker_pool is None or not self.worker_pool.release_worker(self._worker_pool_key, self):
+                    self._stop_worker()
+                    self.channel.stop()
                 self.channel = None
             del self.channel
         
@@ -648,7 +937,7 @@ class CodeInterface(OptionalAttributes):
     def stop(self):
         self._stop()
     
-    @option(choices=['mpi','remote','distributed', 'sockets'], sections=("channel",))
+    @option(choices=['mpi','remote','distributed', 'sockets', 'shared_memory'], sections=("channel",))
     def channel_type(self):
         return 'mpi'
     
@@ -701,6 +990,8 @@ class CodeInterface(OptionalAttributes):
             return DistributedChannel
         elif self.channel_type == 'sockets':
             return SocketChannel
+        elif self.channel_type == 'shared_memory':
+            return SharedMemoryChannel
         else:
             raise exceptions.AmuseException("Cannot create a channel with type {0!r}, type is not supported".format(self.channel_type))
     
@@ -6,10 +6,13 @@ import numpy
 import sys
 import os
 import socket
+import inspect
 
 
 from amuse.rfi.channel import ClientSideMPIMessage
 from amuse.rfi.channel import SocketMessage
+from amuse.rfi.channel import SharedMemoryMessage
+from amuse.rfi.channel import SharedMemoryBuffer
 
 from amuse.rfi.channel import pack_array
 from amuse.rfi.channel import unpack_array
@@ -26,6 +29,126 @@ class ValueHolder(object):
     def __str__(self):
         return "V({0!s})".format(self.value)
 
+def vectorized(method):
+    """
+    Marks a method of a python implementation as accepting numpy
+    arrays for its input parameters. The method is then called
+    once per message (instead of once per element) with an array
+    for every input parameter, output parameters are ValueHolders
+    that must be set to arrays (or scalars, these are broadcast
+    to all elements). This is the same calling convention as used
+    for functions that specify must_handle_array.
+    """
+    method.is_vectorized = True
+    return method
+
+class CallPlan(object):
+    """
+    Describes, for one legacy function, where the arguments of 
+    the function are found in the input message and where
+    the results go in the output message. The plan is made once 
+    per function and reused for every message, so calls 
+    on all elements of a message are done in a tight loop.
+    """
+    IN = 0
+    INOUT = 1
+    OUT = 2
+    LENGTH = 3
+    
+    def __init__(self, specification, method, dtype_to_message_attribute):
+        self.specification = specification
+        self.method = method
+        self.names = []
+        self.parameters = []
+        self.outputs = []
+        
+        for position, parameter in enumerate(specification.parameters):
+            attribute = dtype_to_message_attribute[parameter.datatype]
+            if parameter.direction == LegacyFunctionSpecification.IN:
+                kind = self.IN
+            elif parameter.direction == LegacyFunctionSpecification.INOUT:
+                kind = self.INOUT
+            elif parameter.direction == LegacyFunctionSpecification.OUT:
+                kind = self.OUT
+            elif parameter.direction == LegacyFunctionSpecification.LENGTH:
+                kind = self.LENGTH
+            self.names.append(parameter.name)
+            self.parameters.append((kind, attribute, parameter.input_index))
+            if kind == self.INOUT or kind == self.OUT:
+                self.outputs.append((position, attribute, parameter.output_index))
+        
+        if specification.result_type is None:
+            self.result_attribute = None
+        else:
+            self.result_attribute = dtype_to_message_attribute[specification.result_type]
+            
+        self.must_call_with_positional_arguments = not self.accepts_keyword_arguments(method, self.names)
+        
+    @classmethod
+    def accepts_keyword_arguments(cls, method, names):
+        try:
+            arguments, varargs, keywords, defaults = inspect.getargspec(method)
+        except TypeError:
+            return True
+        if not keywords is None:
+            return True
+        return all([name in arguments for name in names])
+        
+    def call_for_each_element(self, input_message, output_message):
+        call_count = input_message.call_count
+        
+        inputs = []
+        holders = []
+        arguments = [None] * len(self.parameters)
+        for position, (kind, attribute, input_index) in enumerate(self.parameters):
+            if kind == self.IN or kind == self.INOUT:
+                column = getattr(input_message, attribute)[input_index]
+                if hasattr(column, 'tolist'):
+                    column = column.tolist()
+            
+            if kind == self.IN:
+                inputs.append((position, column))
+            elif kind == self.LENGTH:
+                arguments[position] = call_count
+            else:
+                holder = ValueHolder()
+                arguments[position] = holder
+                holders.append((holder, column if kind == self.INOUT else None))
+        
+        result_column = [None] * call_count
+        output_columns = [[None] * call_count for x in holders]
+        outputs = zip([x[0] for x in holders], output_columns)
+        
+        method = self.method
+        names = self.names
+        must_call_with_positional_arguments = self.must_call_with_positional_arguments
+        
+        for index in range(call_count):
+            for position, column in inputs:
+                arguments[position] = column[index]
+            for holder, column in holders:
+                holder.value = None if column is None else column[index]
+                    
+            if must_call_with_positional_arguments:
+                result = method(*arguments)
+            else:
+                result = method(**dict(zip(names, arguments)))
+            
+            result_column[index] = result
+            for holder, output_column in outputs:
+                output_column[index] = holder.value
+        
+        if not self.result_attribute is None:
+            self.store_column(getattr(output_message, self.result_attribute), 0, result_column)
+            
+        for (position, attribute, output_index), output_column in zip(self.outputs, output_columns):
+            self.store_column(getattr(output_message, attribute), output_index, output_column)
+    
+    def store_column(self, arrays, index, values):
+        if isinstance(arrays[index], numpy.ndarray):
+            arrays[index][:] = values
+        else:
+            arrays[index] = values
     
 class PythonImplementation(object):
     dtype_to_message_attribute = { 
@@ -80,13 +203,15 @@ class PythonImplementation(object):
     def start_socket(self, port, host):
         client_socket = socket.create_connection((host, port))
         
+        shared_memory = SharedMemoryBuffer.from_environment()
+        
         self.must_run = True
         while self.must_run:
             
-            message = SocketMessage()
+            message = self.new_socket_message(shared_memory, SharedMemoryBuffer.TO_WORKER)
             message.receive(client_socket)
                 
-            result_message = SocketMessage(message.call_id, message.function_id, message.call_count)
+            result_message = self.new_socket_message(shared_memory, SharedMemoryBuffer.FROM_WORKER, message.call_id, message.function_id, message.call_count)
             
             if message.function_id == 0:
                 self.must_run = False
@@ -104,6 +229,15 @@ class PythonImplementation(object):
         
         client_socket.close()
         
+        if not shared_memory is None:
+            shared_memory.close()
+        
+    def new_socket_message(self, shared_memory, slot, *arguments):
+        if shared_memory is None:
+            return SocketMessage(*arguments)
+        else:
+            return SharedMemoryMessage(*arguments, shared_memory = shared_memory, slot = slot)
+        
     def handle_message(self, input_message, output_message):
         legacy_function = self.mapping_from_tag_to_legacy_function[input_message.function_id]
         specification = legacy_function.specification
@@ -129,18 +263,13 @@ class PythonImplementation(object):
             unpacked = unpack_array(array, input_message.call_count, type)
             setattr(input_message,attribute, unpacked)
             
-        if specification.must_handle_array:
-            keyword_arguments = self.new_keyword_arguments_from_message(input_message, None,  specification)
+        if specification.must_handle_array or getattr(method, 'is_vectorized', False):
+            keyword_arguments = self.new_keyword_arguments_from_message(input_message, None,  specification, True)
             result = method(**keyword_arguments)
-            self.fill_output_message(output_message, None, result, keyword_arguments, specification)
+            self.fill_output_message(output_message, None, result, keyword_arguments, specification, True)
         else:
-            for index in range(input_message.call_count):
-                keyword_arguments = self.new_keyword_arguments_from_message(input_message, index,  specification)
-                try:
-                    result = method(**keyword_arguments)
-                except TypeError:
-                    result = method(*list(keyword_arguments))
-                self.fill_output_message(output_message, index, result, keyword_arguments, specification)
+            plan = self.get_call_plan(specification, method)
+            plan.call_for_each_element(input_message, output_message)
         
             
         for type, attribute in self.dtype_to_message_attribute.iteritems():
@@ -148,18 +277,25 @@ class PythonImplementation(object):
             packed = pack_array(array, input_message.call_count, type)
             setattr(output_message, attribute, packed)
     
-    def new_keyword_arguments_from_message(self, input_message, index, specification):
+    def get_call_plan(self, specification, method):
+        if not specification.id in self.mapping_from_tag_to_call_plan:
+            self.mapping_from_tag_to_call_plan[specification.id] = CallPlan(specification, method, self.dtype_to_message_attribute)
+        return self.mapping_from_tag_to_call_plan[specification.id]
+        
+    def new_keyword_arguments_from_message(self, input_message, index, specification, must_handle_array = None):
+        if must_handle_array is None:
+            must_handle_array = specification.must_handle_array
         keyword_arguments = OrderedDictionary()
         for parameter in specification.parameters:
             attribute = self.dtype_to_message_attribute[parameter.datatype]
             argument_value = None
             if parameter.direction == LegacyFunctionSpecification.IN:
-                if specification.must_handle_array:
+                if must_handle_array:
                     argument_value = getattr(input_message, attribute)[parameter.input_index]
                 else:
                     argument_value = getattr(input_message, attribute)[parameter.input_index][index]
             elif parameter.direction == LegacyFunctionSpecification.INOUT:
-                if specification.must_handle_array:
+                if must_handle_array:
                     argument_value = ValueHolder(getattr(input_message, attribute)[parameter.input_index])
                 else:
                     argument_value = ValueHolder(getattr(input_message, attribute)[parameter.input_index][index])
@@ -170,11 +306,13 @@ class PythonImplementation(object):
             keyword_arguments[parameter.name] = argument_value
         return keyword_arguments
         
-    def fill_output_message(self, output_message, index, result, keyword_arguments, specification):
+    def fill_output_message(self, output_message, index, result, keyword_arguments, specification, must_handle_array = None):
+        if must_handle_array is None:
+            must_handle_array = specification.must_handle_array
         
         if not specification.result_type is None:
             attribute = self.dtype_to_message_attribute[specification.result_type]
-            if specification.must_handle_array:
+            if must_handle_array:
                 getattr(output_message, attribute)[0] = result
             else:
                 getattr(output_message, attribute)[0][index] = result
@@ -184,7 +322,7 @@ class PythonImplementation(object):
             if (parameter.direction == LegacyFunctionSpecification.OUT or 
                parameter.direction == LegacyFunctionSpecification.INOUT):
                 argument_value = keyword_arguments[parameter.name]
-                if specification.must_handle_array:
+                if must_handle_array:
                     getattr(output_message, attribute)[parameter.output_index] = argument_value.value
                 else:
                     getattr(output_message, attribute)[parameter.output_index][index] = argument_value.value
@@ -202,6 +340,10 @@ class PythonImplementation(object):
         
         return dtype_to_count
         
+    @late
+    def mapping_from_tag_to_call_plan(self):
+        return {}
+        
     @late
     def mapping_from_tag_to_legacy_function(self):
         result = {}
@@ -1019,7 +1019,8 @@ class ParticleSetDefinition(AbstractParticleSetDefinition):
             number_of_particles_method,
             setters,
             getters,
-            self.name_of_indexing_attribute
+            self.name_of_indexing_attribute,
+            use_cache = getattr(interface, 'cache_particle_attributes', False)
         )
 
     
@@ -1315,6 +1316,16 @@ class InCodeComponentImplementation(OldObjectsBindingMixin, OptionalAttributes):
     def must_handle_state(self):
         return True
     
+    @option(type='boolean', sections=("code",))
+    def cache_particle_attributes(self):
+        """
+        If True, the values of the attributes of the particles in 
+        the code are kept after reading and read again only after 
+        the next call to the code (see the use_cache argument of 
+        :class:`~amuse.datamodel.incode_storage.InCodeAttributeStorage`)
+        """
+        return False
+    
     def setup(self):
         for x in self._handlers:
             x.setup(self)
@@ -38,6 +38,83 @@ class system(object):
         return (get_system_with_name, (self.name,))
     
     
+class UnitCache(object):
+    """
+    Bounded cache for the results of unit algebra, keyed on the
+    identity of the units involved. Quantity operations ask for the
+    same simple forms and conversion factors over and over, for the
+    handful of units used in a simulation loop.
+    
+    An entry holds a reference to its units, so the identity of a
+    unit cannot be reused by another unit while the entry exists.
+    When the cache is full all entries are dropped.
+    
+    Counting of hits and misses is off by default, to switch it on:
+    
+    >>> unit_cache.start_counting()
+    >>> unit_cache.hit_rates() # doctest:+SKIP
+    {'conversion factor': (20, 1, 0.952...), ...}
+    >>> unit_cache.stop_counting()
+    """
+    SIMPLE_FORM = 'simple form'
+    REDUCED_FORM = 'reduced form'
+    FACTOR_AND_REDUCED_FORM = 'factor and reduced form'
+    CONVERSION_FACTOR = 'conversion factor'
+    PRODUCT = 'product'
+    QUOTIENT = 'quotient'
+    
+    def __init__(self, maximum_number_of_entries = 10000):
+        self.maximum_number_of_entries = maximum_number_of_entries
+        self.is_enabled = True
+        self.must_count = False
+        self.entries = {}
+        self.reset_counters()
+    
+    def get(self, key):
+        if not self.is_enabled:
+            return None
+        entry = self.entries.get(key)
+        if self.must_count:
+            counters = self.hits if entry is not None else self.misses
+            counters[key[0]] = counters.get(key[0], 0) + 1
+        if entry is None:
+            return None
+        return entry[1]
+    
+    def put(self, key, units, value):
+        if not self.is_enabled:
+            return
+        if len(self.entries) >= self.maximum_number_of_entries:
+            self.entries.clear()
+        self.entries[key] = (units, value)
+        
+    def clear(self):
+        self.entries.clear()
+        
+    def start_counting(self):
+        self.must_count = True
+        
+    def stop_counting(self):
+        self.must_count = False
+        
+    def reset_counters(self):
+        self.hits = {}
+        self.misses = {}
+        
+    def hit_rates(self):
+        """
+        Returns a dictionary with, for every kind of cached result,
+        the number of hits, the number of misses and the hit rate.
+        """
+        result = {}
+        for kind in set(self.hits.keys()) | set(self.misses.keys()):
+            hits = self.hits.get(kind, 0)
+            misses = self.misses.get(kind, 0)
+            result[kind] = (hits, misses, hits * 1.0 / (hits + misses))
+        return result
+        
+unit_cache = UnitCache()
+
 class unit(object):
     """
     Abstract base class for unit objects.
@@ -177,7 +254,14 @@ class unit(object):
         >>> J.to_simple_form()
         unit<m**2 * kg * s**-2>
         """
+        key = (UnitCache.SIMPLE_FORM, id(self))
+        result = unit_cache.get(key)
+        if result is None:
+            result = self._to_simple_form()
+            unit_cache.put(key, self, result)
+        return result
         
+    def _to_simple_form(self):
         if not self.base:
             return none_unit('none', 'none') * self.factor
         
@@ -196,7 +280,14 @@ class unit(object):
     def to_reduced_form(self):
         """Convert unit to a reduced (simpler) form 
         """
+        key = (UnitCache.REDUCED_FORM, id(self))
+        result = unit_cache.get(key)
+        if result is None:
+            result = self._to_reduced_form()
+            unit_cache.put(key, self, result)
+        return result
         
+    def _to_reduced_form(self):
         if not self.base:
             return none_unit('none', 'none') * self.factor
         
@@ -221,7 +312,14 @@ class unit(object):
     def to_factor_and_reduced_form(self):
         """Convert unit to a reduced (simpler) form 
         """
+        key = (UnitCache.FACTOR_AND_REDUCED_FORM, id(self))
+        result = unit_cache.get(key)
+        if result is None:
+            result = self._to_factor_and_reduced_form()
+            unit_cache.put(key, self, result)
+        return result
         
+    def _to_factor_and_reduced_form(self):
         if not self.base:
             return none_unit('none', 'none') * self.factor
         
@@ -255,6 +353,14 @@ class unit(object):
         return True
                         
     def conversion_factor_from(self, x):
+        key = (UnitCache.CONVERSION_FACTOR, id(self), id(x))
+        result = unit_cache.get(key)
+        if result is None:
+            result = self._conversion_factor_from(x)
+            unit_cache.put(key, (self, x), result)
+        return result
+        
+    def _conversion_factor_from(self, x):
         if x.base is None:
             return self.factor * 1.0
         elif self.base == x.base:
@@ -264,6 +370,38 @@ class unit(object):
         else:
             raise IncompatibleUnitsException(x, self)
       
+    def simple_form_of_product(self, other):
+        """
+        Multiply this unit with the other unit and convert
+        the product to a simple form (see :meth:`to_simple_form`)
+        
+        >>> from amuse.units import units
+        >>> (units.m / units.s).simple_form_of_product(units.s)
+        unit<m>
+        """
+        key = (UnitCache.PRODUCT, id(self), id(other))
+        result = unit_cache.get(key)
+        if result is None:
+            result = (self * other).to_simple_form()
+            unit_cache.put(key, (self, other), result)
+        return result
+        
+    def simple_form_of_quotient(self, other):
+        """
+        Divide this unit by the other unit and convert
+        the quotient to a simple form (see :meth:`to_simple_form`)
+        
+        >>> from amuse.units import units
+        >>> units.m.simple_form_of_quotient(units.s)
+        unit<m * s**-1>
+        """
+        key = (UnitCache.QUOTIENT, id(self), id(other))
+        result = unit_cache.get(key)
+        if result is None:
+            result = (self / other).to_simple_form()
+            unit_cache.put(key, (self, other), result)
+        return result
+        
     def in_(self, x):
         """Express this quantity in the given unit
         
@@ -510,7 +648,7 @@ class zero_unit(none_unit):
         return None
 
                         
-    def conversion_factor_from(self, x):
+    def _conversion_factor_from(self, x):
         if x.base is None:
             return 1.0
         else:
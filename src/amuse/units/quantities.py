@@ -117,7 +117,7 @@ class Quantity(object):
 
     def __mul__(self, other):
         other = to_quantity(other)
-        return new_quantity_nonone(self.number * other.number, (self.unit * other.unit).to_simple_form())
+        return new_quantity_nonone(self.number * other.number, self.unit.simple_form_of_product(other.unit))
 
     __rmul__ = __mul__
 
@@ -126,7 +126,7 @@ class Quantity(object):
 
     def __truediv__(self, other):
         other = to_quantity(other)
-        return new_quantity_nonone(self.number / other.number, (self.unit / other.unit).to_simple_form())
+        return new_quantity_nonone(self.number / other.number, self.unit.simple_form_of_quotient(other.unit))
 
     def __rtruediv__(self, other):
         return new_quantity_nonone(other / self.number, (1.0 / self.unit).to_simple_form())
@@ -441,7 +441,7 @@ class VectorQuantity(Quantity):
         quantity<14.0 m**2>
         """
         other = to_quantity(other)
-        return new_quantity_nonone(numpy.inner(self._number, other._number), (self.unit * other.unit).to_simple_form())
+        return new_quantity_nonone(numpy.inner(self._number, other._number), self.unit.simple_form_of_product(other.unit))
 
 
     def length_squared(self):
@@ -805,7 +805,7 @@ class VectorQuantity(Quantity):
         other = to_quantity(other)
         return new_quantity_nonone(
             numpy.cross(self.number, other.number, axisa=axisa, axisb=axisb, axisc=axisc, axis=axis),
-            (self.unit * other.unit).to_simple_form()
+            self.unit.simple_form_of_product(other.unit)
         )
 
     def dot(self, other, out=None):
@@ -820,7 +820,7 @@ class VectorQuantity(Quantity):
         other = to_quantity(other)
         return new_quantity_nonone(
             numpy.dot(self.number, other.number,out=out),
-            (self.unit * other.unit).to_simple_form()
+            self.unit.simple_form_of_product(other.unit)
         )
 
 
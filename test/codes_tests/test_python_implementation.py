@@ -9,12 +9,14 @@ import parser
 import sys
 import os
 import time
+import threading
 from amuse.units import nbody_system
 from amuse.units import units
 from amuse import datamodel
 from amuse.rfi import python_code
 from amuse.rfi.core import *
 from amuse.rfi.channel import AsyncRequestsPool
+from amuse.rfi.channel import AbstractMessageChannel
 from amuse.rfi.tools.create_python_worker import CreateAPythonWorker
 
 class ForTestingInterface(PythonCodeInterface):
@@ -296,6 +298,47 @@ class TestCreatePythonWorker(TestCase):
         except SyntaxError, ex:
             self.fail("Compilation error {0}".format(ex))
             
+class BrokenReceiveChannel(AbstractMessageChannel):
+    
+    def __init__(self):
+        AbstractMessageChannel.__init__(self)
+        self.sent = []
+        self.number_of_receives = 0
+    
+    def send_block(self, call_id, function_id, arguments):
+        self.sent.append(arguments)
+    
+    def receive_block(self, call_id, function_id):
+        self.number_of_receives += 1
+        raise ValueError("receive failed")
+
+class TestSplitMessages(TestCase):
+    
+    def test1(self):
+        channel = BrokenReceiveChannel()
+        number_of_threads = threading.active_count()
+        self.assertRaises(ValueError, channel._send_and_receive_blocks, 1, 2, 100, 3, 
+            lambda i : i, lambda i, result : None)
+        self.assertEquals(threading.active_count(), number_of_threads)
+        self.assertEquals(channel.number_of_receives, 1)
+        self.assertTrue(len(channel.sent) <= 4)
+    
+    def test2(self):
+        channel = BrokenReceiveChannel()
+        channel.split_message_join_timeout = 0.1
+        blocked = threading.Event()
+        def send_block(call_id, function_id, arguments):
+            if len(channel.sent) > 0:
+                # a send that nobody receives
+                blocked.wait()
+            channel.sent.append(arguments)
+        channel.send_block = send_block
+        t0 = time.time()
+        self.assertRaises(ValueError, channel._send_and_receive_blocks, 1, 2, 100, 3, 
+            lambda i : i, lambda i, result : None)
+        self.assertTrue(time.time() - t0 < 5.0)
+        blocked.set()
+
 class TestInterface(TestWithMPI):
     
     
@@ -741,3 +784,89 @@ class TestInterface(TestWithMPI):
         instance.stop()
         self.assertEquals(error1, 0)
         self.assertEquals(output1, 100000)
+    
+    def test26(self):
+        x = ForTesting(max_message_length = 10, split_message_window = 3)
+        self.assertTrue(x.legacy_interface.channel.is_pipelining_supported())
+        for N in (100, 101, 35):
+            doubles = x.echo_double([1.0 * i for i in range(N)])
+            self.assertEquals(list(doubles), [1.0 * i for i in range(N)])
+            products = x.multiply_ints(range(N), range(N))
+            self.assertEquals(list(products), [i * i for i in range(N)])
+            strings1, strings2 = x.echo_strings(['REDRUM'] * N, ['stressed'] * N)
+            self.assertEquals(list(strings1), ['MURDER'] * N)
+            self.assertEquals(list(strings2), ['desserts'] * N)
+        x.stop()
+    
+    def test27(self):
+        x = ForTestingInterface()
+        y = ForTestingInterface(channel_type = 'sockets')
+        pool = AsyncRequestsPool()
+        finished_requests = []
+        
+        def handle_result(request, index):
+            self.assertEquals(request.result(), 0)
+            finished_requests.append(index)
+            
+        pool.add_request(x.sleep.async(1.5), handle_result, [1])
+        pool.add_request(y.sleep.async(0.1), handle_result, [2])
+        self.assertEquals(pool.poll(), 0)
+        self.assertEquals(pool.wait(timeout = 0.01), 0)
+        
+        t0 = time.time()
+        self.assertEquals(pool.wait(), 1)
+        self.assertTrue(time.time() - t0 < 1.0)
+        self.assertEquals(finished_requests, [2])
+        self.assertFalse(pool.wait_all(timeout = 0.01))
+        self.assertTrue(pool.wait_all())
+        self.assertEquals(finished_requests, [2, 1])
+        
+        request1 = x.sleep.async(1.0)
+        request2 = y.sleep.async(0.1)
+        pool.add_request(request1, handle_result, [3])
+        pool.add_request(request2, handle_result, [4])
+        self.assertEquals(list(pool.as_completed(timeout = 0.01)), [])
+        self.assertEquals(list(pool.as_completed()), [request2, request1])
+        self.assertEquals(finished_requests, [2, 1, 4, 3])
+        self.assertEquals(len(pool), 0)
+        
+        x.stop()
+        y.stop()
+    
+    def test28(self):
+        x = ForTestingInterface()
+        y = ForTestingInterface()
+        # with only MPI requests the pool waits on MPI, a polling
+        # pool would sleep the polling interval
+        pool = AsyncRequestsPool(polling_interval = 10.0)
+        finished_requests = []
+        
+        def handle_result(request, index):
+            self.assertEquals(request.result(), 0)
+            finished_requests.append(index)
+        
+        pool.add_request(x.sleep.async(0.1), handle_result, [1])
+        pool.add_request(y.sleep.async(0.3), handle_result, [2])
+        t0 = time.time()
+        self.assertTrue(pool.wait_all())
+        self.assertTrue(time.time() - t0 < 5.0)
+        self.assertEquals(sorted(finished_requests), [1, 2])
+        
+        x.stop()
+        y.stop()
+    
+    def test29(self):
+        class FailingImplementation(ForTestingImplementation):
+            number_of_calls = 0
+            def echo_int(self, int_in, int_out):
+                self.number_of_calls += 1
+                raise TypeError("error in the implementation")
+        
+        implementation = FailingImplementation()
+        x = python_code.PythonImplementation(implementation, ForTestingInterface)
+        input_message = python_code.ClientSideMPIMessage(0, 12, 1)
+        input_message.ints = [20]
+        output_message = python_code.ClientSideMPIMessage(0, 10, 1)
+        
+        self.assertRaises(TypeError, x.handle_message, input_message, output_message)
+        self.assertEquals(implementation.number_of_calls, 1)
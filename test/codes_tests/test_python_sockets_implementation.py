@@ -124,6 +124,18 @@ class ForTestingInterface(PythonCodeInterface):
         function.can_handle_array = True
         return function  
     
+    @legacy_function
+    def initialize_code():
+        function = LegacyFunctionSpecification()
+        function.result_type = 'int32'
+        return function
+    
+    @legacy_function
+    def cleanup_code():
+        function = LegacyFunctionSpecification()
+        function.result_type = 'int32'
+        return function
+    
     @legacy_function
     def get_position():
         function = LegacyFunctionSpecification()
@@ -210,6 +222,14 @@ class ForTestingImplementation(object):
         int_out.value = int_in1 * int_in2
         return 0
     
+    def initialize_code(self):
+        self.masses = [0.0] * 100
+        return 0
+    
+    def cleanup_code(self):
+        self.masses = None
+        return 0
+    
     def get_position(self, index_of_the_particle, x, y, z, length):
         try:
             x.value = self._particle_data[index_of_the_particle, 0]
@@ -229,6 +249,19 @@ class ForTestingImplementation(object):
             return -1
     
 
+class ForTestingVectorizedImplementation(ForTestingImplementation):
+    
+    def __init__(self):
+        ForTestingImplementation.__init__(self)
+        self.number_of_calls = 0
+        
+    @python_code.vectorized
+    def sum_doubles(self, double_in1, double_in2, double_out):
+        self.number_of_calls += 1
+        double_out.value = double_in1 + double_in2
+        return 0
+    
+
 class ForTesting(InCodeComponentImplementation):
     
     def __init__(self, **options):
@@ -238,6 +271,25 @@ class ForTesting(InCodeComponentImplementation):
         object.add_method("sleep", (units.s,), (object.ERROR_CODE,))
 
 
+class ForTestingWithParticles(ForTesting):
+    
+    def new_particle(self, mass):
+        index_of_the_particle = numpy.arange(len(mass))
+        self.set_mass(index_of_the_particle, mass)
+        return index_of_the_particle
+    
+    def delete_particle(self, index_of_the_particle):
+        pass
+    
+    def define_particle_sets(self, object):
+        object.define_set('particles', 'index_of_the_particle')
+        object.set_new('particles', 'new_particle')
+        object.set_delete('particles', 'delete_particle')
+        object.add_getter('particles', 'get_mass', names = ('mass',))
+        object.add_setter('particles', 'set_mass', names = ('mass',))
+        object.add_getter('particles', 'get_position', names = ('x', 'y', 'z'))
+        object.add_setter('particles', 'set_position', names = ('x', 'y', 'z'))
+
             
 class TestInterface(TestWithMPI):
     def setUp(self):
@@ -561,5 +613,264 @@ class TestInterface(TestWithMPI):
         y.stop()
         x.stop()
 
+    def test24(self):
+        x = ForTestingInterface(channel_type = 'shared_memory')
+        
+        int_out, error = x.echo_int(20)
+        self.assertEquals(error, 0)
+        self.assertEquals(int_out, 20)
+        self.assertTrue(x.channel.shared_memory.is_used_by_peer)
+        
+        double_out, error = x.echo_double(numpy.arange(100000.0))
+        self.assertEquals(error, 0)
+        self.assertEquals(double_out, numpy.arange(100000.0))
+        
+        str1_out, str2_out, error = x.echo_strings(["abc", "def"], ["ghi", "jkl"])
+        self.assertEquals(error[0], 0)
+        self.assertEquals(str1_out[0], "cba")
+        self.assertEquals(str2_out[1], "lkj")
+        
+        filename = x.channel.shared_memory.filename
+        self.assertTrue(os.path.exists(filename))
+        x.stop()
+        self.assertFalse(os.path.exists(filename))
+        
+    def test25(self):
+        x = ForTestingInterface(channel_type = 'shared_memory', shared_memory_size = 1024)
+        
+        double_out, error = x.echo_double(numpy.arange(1000.0))
+        self.assertEquals(error, 0)
+        self.assertEquals(double_out, numpy.arange(1000.0))
+        
+        double_out, error = x.echo_double(numpy.arange(10.0))
+        self.assertEquals(double_out, numpy.arange(10.0))
+        
+        request = x.sleep.async(0.01)
+        request.wait()
+        self.assertEquals(request.result(), 0)
+        x.stop()
+
+    def test26(self):
+        implementation = ForTestingVectorizedImplementation()
+        x = python_code.PythonImplementation(implementation, ForTestingInterface)
+        
+        function_id = ForTestingInterface.sum_doubles.specification.id
+        input_message = python_code.SocketMessage(0, function_id, 3)
+        input_message.doubles = numpy.array([1.0, 2.0, 3.0, 10.0, 20.0, 30.0])
+        output_message = python_code.SocketMessage(0, function_id, 3)
+        
+        x.handle_message(input_message, output_message)
+        
+        self.assertEquals(implementation.number_of_calls, 1)
+        self.assertEquals(output_message.ints, [0, 0, 0])
+        self.assertEquals(output_message.doubles, [11.0, 22.0, 33.0])
+        
+    def test27(self):
+        implementation = ForTestingImplementation()
+        x = python_code.PythonImplementation(implementation, ForTestingInterface)
+        
+        function_id = ForTestingInterface.echo_strings.specification.id
+        for i in range(2):
+            input_message = python_code.SocketMessage(0, function_id, 2)
+            input_message.strings = ["abc", "def", "ghi", "jkl"]
+            output_message = python_code.SocketMessage(0, function_id, 2)
+            x.handle_message(input_message, output_message)
+        
+        self.assertEquals(len(x.mapping_from_tag_to_call_plan), 1)
+        self.assertEquals(output_message.ints, [0, 0])
+        self.assertEquals(output_message.strings, ["cba", "fed", "ihg", "lkj"])
+        
+    def test28(self):
+        pool = WorkerPool(maximum_number_of_workers = 1, idle_timeout = 60)
+        x = ForTestingInterface(channel_type = 'sockets', worker_pool = pool)
+        self.assertEquals(x.initialize_code(), 0)
+        self.assertEquals(x.set_mass(1, 3.5), 0)
+        x.stop()
+        self.assertEquals(len(pool), 1)
+        
+        y = ForTestingInterface(channel_type = 'sockets', worker_pool = pool)
+        self.assertEquals(len(pool), 0)
+        self.assertEquals(pool.number_of_started_workers, 1)
+        self.assertEquals(pool.number_of_reused_workers, 1)
+        mass, error = y.get_mass(1)
+        self.assertEquals(error, -1)
+        self.assertEquals(y.initialize_code(), 0)
+        mass, error = y.get_mass(1)
+        self.assertEquals(error, 0)
+        self.assertEquals(mass, 0.0)
+        
+        z = ForTestingInterface(channel_type = 'sockets', worker_pool = pool)
+        self.assertEquals(pool.number_of_started_workers, 2)
+        y.stop()
+        z.stop()
+        self.assertEquals(len(pool), 1)
+        
+        pool.idle_timeout = 0
+        pool.stop_idle_workers()
+        self.assertEquals(len(pool), 0)
+        x = ForTestingInterface(channel_type = 'sockets', worker_pool = pool)
+        self.assertEquals(pool.number_of_started_workers, 3)
+        int_out, error = x.echo_int(12)
+        self.assertEquals(int_out, 12)
+        x.stop()
+        pool.stop()
+        self.assertEquals(len(pool), 0)
+    
+    def test29(self):
+        x = ForTestingInterface(channel_type = 'sockets')
+        x.echo_double([1.0, 2.0, 3.0])
+        self.assertEquals(len(call_profile.rows()), 0)
+        
+        call_profile.reset()
+        call_profile.start()
+        try:
+            x.echo_double([1.0, 2.0, 3.0])
+            x.echo_double([4.0])
+            x.echo_string("abc")
+            request = x.echo_int.async(5)
+            int_out, error = request.result()
+        finally:
+            call_profile.stop()
+        x.echo_int(12)
+        x.stop()
+        
+        rows = dict(((row[0], row[1]), row) for row in call_profile.rows())
+        self.assertEquals(len(rows), 3)
+        code, name, function_id, calls, elements, bytes_sent, bytes_received, serialise, wait, convert = rows[('ForTestingInterface', 'echo_double')]
+        self.assertEquals(calls, 2)
+        self.assertEquals(elements, 2.0)
+        self.assertEquals(bytes_sent, 4 * 8)
+        self.assertEquals(bytes_received, 4 * 8 + 4 * 4)
+        self.assertTrue(wait > 0)
+        self.assertTrue(serialise >= 0 and convert >= 0)
+        self.assertEquals(rows[('ForTestingInterface', 'echo_string')][5:7], (3, 3 + 4))
+        self.assertEquals(rows[('ForTestingInterface', 'echo_int')][3:7], (1, 1, 4, 8))
+        filename = os.path.join(self.get_path_to_results(), "test29.txt")
+        call_profile.write_to_file(filename)
+        with open(filename, "r") as stream:
+            self.assertTrue('echo_double' in stream.read())
+        call_profile.reset()
+        self.assertEquals(len(call_profile.rows()), 0)
+
+    def test30(self):
+        x = ForTestingWithParticles(channel_type = 'sockets')
+        y = ForTestingWithParticles(channel_type = 'sockets')
+        particles = datamodel.Particles(3, mass = [0.0, 0.0, 0.0])
+        for code in (x, y):
+            code.initialize_code()
+            code.particles.add_particles(particles)
+        
+        self.assertTrue(x.particles.can_get_values_in_store_async(["x", "mass"]))
+        self.assertFalse(x.particles.can_get_values_in_store_async(["x", "luminosity"]))
+        request = x.particles.get_values_in_store_async(None, ["z", "mass", "x"])
+        z, mass, x_values = request.result()
+        self.assertEquals(z, [2.0, 5.0, 8.0])
+        self.assertEquals(mass, [0.0, 0.0, 0.0])
+        self.assertEquals(x_values, [0.0, 3.0, 6.0])
+        
+        particles.mass = [1.0, 2.0, 3.0]
+        particles.x = [10.0, 11.0, 12.0]
+        particles.y = [20.0, 21.0, 22.0]
+        particles.z = [30.0, 31.0, 32.0]
+        particles.new_channel_to(x.particles).copy_attributes(["mass", "x", "y", "z"])
+        self.assertEquals(x.particles.mass, [1.0, 2.0, 3.0])
+        self.assertEquals(x.particles.z, [30.0, 31.0, 32.0])
+        
+        channel_to_y = x.particles.new_channel_to(y.particles)
+        self.assertTrue(channel_to_y.can_copy_attributes_async(["mass"]))
+        channel_to_y.copy_attributes(["mass"])
+        self.assertEquals(y.particles.mass, [1.0, 2.0, 3.0])
+        
+        copy_of_particles = particles.copy()
+        request1 = x.particles.new_channel_to(copy_of_particles).copy_attributes_async(["x", "y", "z"])
+        request2 = y.particles.new_channel_to(particles).copy_attributes_async(["mass", "y"], ["mass", "z"])
+        self.assertEquals(request1.is_mpi_request(), False)
+        pool = request1.join(request2)
+        while len(pool) > 0:
+            pool.wait()
+        self.assertEquals(copy_of_particles.y, [20.0, 21.0, 22.0])
+        self.assertEquals(particles.mass, [1.0, 2.0, 3.0])
+        self.assertEquals(particles.z, [1.0, 4.0, 7.0])
+        
+        request = x.particles.get_values_in_store_async([], ["mass", "x"])
+        self.assertEquals(request.result(), [[], []])
+        x.stop()
+        y.stop()
 
+    def test31(self):
+        for channel_type, window in (('sockets', 3), ('sockets', 1), ('shared_memory', 3)):
+            x = ForTesting(channel_type = channel_type, max_message_length = 10, split_message_window = window)
+            for N in (100, 101, 35):
+                doubles = x.echo_double([1.0 * i for i in range(N)])
+                self.assertEquals(list(doubles), [1.0 * i for i in range(N)])
+                products = x.multiply_ints(range(N), range(N))
+                self.assertEquals(list(products), [i * i for i in range(N)])
+                strings1, strings2 = x.echo_strings(['REDRUM'] * N, ['stressed'] * N)
+                self.assertEquals(list(strings1), ['MURDER'] * N)
+                self.assertEquals(list(strings2), ['desserts'] * N)
+            x.stop()
 
+    def test32(self):
+        for channel_type in ('sockets', 'mpi'):
+            x = ForTestingWithParticles(channel_type = channel_type, max_message_length = 10)
+            x.initialize_code()
+            particles = datamodel.Particles(25, mass = numpy.arange(25.0))
+            x.particles.add_particles(particles)
+            
+            copy_of_particles = particles.copy()
+            copy_of_particles.mass = numpy.zeros(25)
+            x.particles.new_channel_to(copy_of_particles).copy_attributes(["mass", "x", "z"])
+            self.assertEquals(copy_of_particles.mass, numpy.arange(25.0))
+            self.assertEquals(copy_of_particles.x, numpy.arange(0.0, 75.0, 3.0))
+            self.assertEquals(copy_of_particles.z, numpy.arange(2.0, 75.0, 3.0))
+            
+            request = x.particles.get_values_in_store_async(None, ["y", "mass"])
+            self.assertTrue(request.is_result_available())
+            y, mass = request.result()
+            self.assertEquals(y, numpy.arange(1.0, 75.0, 3.0))
+            self.assertEquals(mass, numpy.arange(25.0))
+            x.stop()
+
+    def test33(self):
+        for channel_type in ('sockets', 'mpi'):
+            x = ForTestingInterface(channel_type = channel_type, max_message_length = 10)
+            request = x.echo_int.async(range(25))
+            self.assertTrue(request.is_result_available())
+            self.assertEquals(list(request.result()['int_out']), range(25))
+            
+            results = []
+            pool = AsyncRequestsPool()
+            pool.add_request(x.echo_double.async([1.0] * 35), lambda request: results.append(len(request.result()['double_out'])))
+            pool.add_request(x.echo_int.async(range(5)), lambda request: results.append(len(request.result()['int_out'])))
+            self.assertTrue(pool.wait_all(timeout = 10.0))
+            self.assertEquals(sorted(results), [5, 35])
+            x.stop()
+    
+    def test34(self):
+        pool = WorkerPool(maximum_number_of_workers = 1, idle_timeout = 60)
+        self.assertFalse(pool.is_registered())
+        x = ForTestingInterface(channel_type = 'sockets', worker_pool = pool)
+        request = x.initialize_code.async()
+        self.assertEquals(request.result(), 0)
+        self.assertEquals(x.set_mass(1, 3.5), 0)
+        x.stop()
+        self.assertEquals(len(pool), 1)
+        self.assertTrue(pool.is_registered())
+        
+        y = ForTestingInterface(channel_type = 'sockets', worker_pool = pool)
+        self.assertEquals(pool.number_of_reused_workers, 1)
+        mass, error = y.get_mass(1)
+        self.assertEquals(error, -1)
+        self.assertEquals(y.initialize_code(), 0)
+        self.assertEquals(y.set_mass(1, 3.5), 0)
+        request = y.cleanup_code.async()
+        self.assertEquals(request.result(), 0)
+        self.assertFalse(y._is_code_initialized)
+        y.stop()
+        self.assertEquals(len(pool), 1)
+        
+        number_of_pools = len(WorkerPool.pools)
+        pool.stop()
+        self.assertEquals(len(pool), 0)
+        self.assertFalse(pool.is_registered())
+        self.assertEquals(len(WorkerPool.pools), number_of_pools - 1)
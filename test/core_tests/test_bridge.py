@@ -1,4 +1,6 @@
 import numpy
+import sys
+import traceback
 
 from amuse.units import units, constants, nbody_system
 from amuse.units.quantities import zero, AdaptingVectorQuantity, VectorQuantity
@@ -137,6 +139,67 @@ class TestCalculateFieldForParticles(amusetest.TestCase):
       instance2 = bridge.CalculateFieldForParticles(gravity_constant = "dummy")
       instance2.particles.add_particles(q)
       self.assertEqual(len(instance2.particles),5)
+    
+    def test7(self):
+        print "CalculateFieldForParticles, cache of the most recent result"
+        numpy.random.seed(12345)
+        stars = new_plummer_model(20)
+        instance = bridge.CalculateFieldForParticles(particles = stars, gravity_constant = nbody_system.G, 
+            use_cache = True)
+        
+        zeros = numpy.zeros(3) | nbody_system.length
+        points = numpy.linspace(-1.0, 1.0, 3) | nbody_system.length
+        ax, ay, az = instance.get_gravity_at_point(zeros, points, zeros, zeros)
+        self.assertEqual((instance.cache.hits, instance.cache.misses), (0, 1))
+        ax2, ay2, az2 = instance.get_gravity_at_point(zeros, points, zeros, zeros)
+        self.assertEqual((instance.cache.hits, instance.cache.misses), (1, 1))
+        self.assertEqual(ax2, ax)
+        ax2 *= 2
+        self.assertEqual(instance.get_gravity_at_point(zeros, points, zeros, zeros)[0], ax)
+        
+        instance.get_potential_at_point(zeros, points, zeros, zeros)
+        instance.get_gravity_at_point(zeros, points * 0.5, zeros, zeros)
+        self.assertEqual((instance.cache.hits, instance.cache.misses), (2, 3))
+        
+        stars[0].x += 0.1 | nbody_system.length
+        ax3, ay3, az3 = instance.get_gravity_at_point(zeros, points, zeros, zeros)
+        self.assertEqual((instance.cache.hits, instance.cache.misses), (2, 4))
+        self.assertEqual(ax3, bridge.CalculateFieldForParticles(particles = stars, 
+            gravity_constant = nbody_system.G).get_gravity_at_point(zeros, points, zeros, zeros)[0])
+        self.assertFalse((ax3 == ax).all())
+    
+    def test8(self):
+        print "CalculateFieldForCodes, upload the particles of the input codes once"
+        convert = nbody_system.nbody_to_si(1.e5 | units.MSun, 1.0 | units.parsec)
+        numpy.random.seed(12345)
+        stars = new_plummer_model(20, convert_nbody=convert)
+        cluster = system_from_particles(ExampleGravityCodeInterface, dict(), stars, 0.01 | units.parsec)
+        
+        field_code = ExampleGravityCodeInterface()
+        field_code.parameters.epsilon_squared = cluster.parameters.epsilon_squared
+        instance = bridge.CalculateFieldForCodesUsingRemove(field_code, (cluster,), 
+            use_cache = True)
+        zeros = numpy.zeros(3) | units.parsec
+        points = numpy.linspace(-1.0, 1.0, 3) | units.parsec
+        potential = instance.get_potential_at_point(zeros, points, zeros, zeros)
+        instance.get_potential_at_point(zeros, points, zeros, zeros)
+        instance.get_gravity_at_point(zeros, points, zeros, zeros)
+        self.assertEqual(instance.number_of_uploads, 1)
+        self.assertEqual((instance.cache.hits, instance.cache.misses), (1, 2))
+        self.assertAlmostRelativeEqual(potential, cluster.get_potential_at_point(zeros, points, zeros, zeros))
+        
+        cluster.evolve_model(cluster.next_timestep)
+        self.assertAlmostRelativeEqual(instance.get_potential_at_point(zeros, points, zeros, zeros),
+            cluster.get_potential_at_point(zeros, points, zeros, zeros))
+        self.assertEqual(instance.number_of_uploads, 2)
+        self.assertEqual(len(instance.code.particles), 20)
+        
+        cluster.particles.remove_particle(cluster.particles[0])
+        instance.get_potential_at_point(zeros, points, zeros, zeros)
+        self.assertEqual(instance.number_of_uploads, 3)
+        self.assertEqual(len(instance.code.particles), 19)
+        instance.clear_cache()
+        self.assertEqual(len(instance.code.particles), 0)
       
     
 
@@ -258,6 +321,50 @@ class ExampleGravityCodeInterface(object):
             self.model_time += dt
             self.set_next_timestep()
 
+class ExampleAsyncGravityCodeInterface(ExampleGravityCodeInterface):
+    """
+    Gravity code with a get_gravity_at_point that can be called
+    asynchronously, like the methods of a community code. The result
+    is calculated when the request is made and returned when asked,
+    at most one request can be pending.
+    """
+    
+    def __init__(self, *args, **kwargs):
+        ExampleGravityCodeInterface.__init__(self, *args, **kwargs)
+        self.number_of_async_calls = 0
+        self.has_pending_request = False
+        code = self
+        
+        class GravityAtPoint(object):
+            is_async_supported = True
+            
+            def __call__(self, *arguments):
+                return ExampleGravityCodeInterface.get_gravity_at_point(code, *arguments)
+            
+            def async(self, *arguments):
+                if code.has_pending_request:
+                    raise Exception("code is already handling a request")
+                code.has_pending_request = True
+                code.number_of_async_calls += 1
+                return ExampleRequest(code, self(*arguments))
+        
+        self.get_gravity_at_point = GravityAtPoint()
+
+class ExampleRequest(object):
+    
+    def __init__(self, code, result):
+        self.code = code
+        self._result = result
+    
+    def result(self):
+        self.code.has_pending_request = False
+        return self._result
+
+class ExampleFailingRequest(object):
+    
+    def result(self):
+        raise AmuseException("no gravity")
+
 def system_from_particles(base_class, kwargs, particles, eps=None):
     interface = base_class(**kwargs)
     interface.initialize_code()
@@ -384,4 +491,84 @@ class TestBridge(amusetest.TestCase):
         self.assertAlmostRelativeEqual(cluster.potential_energy, bridgesys.potential_energy)
         self.assertAlmostRelativeEqual(cluster.kinetic_energy, bridgesys.kinetic_energy)
     
-
+    def test5(self):
+        print "Bridge evolve_model, with and without asynchronous kicks"
+        convert = nbody_system.nbody_to_si(1.e5 | units.MSun, 1.0 | units.parsec)
+        epsilon = 1.0e-2 | units.parsec
+        
+        numpy.random.seed(12345)
+        stars = new_plummer_model(100, convert_nbody=convert)
+        first_half = stars.select_array(lambda x: (x > 0 | units.m), ['x'] )
+        second_half = stars - first_half
+        
+        results = []
+        for test_class, use_async_kicks in ((ExampleGravityCodeInterface, False), 
+                (ExampleAsyncGravityCodeInterface, True)):
+            cluster1 = system_from_particles(test_class, dict(), first_half, epsilon)
+            cluster2 = system_from_particles(test_class, dict(), second_half, epsilon)
+            field = bridge.CalculateFieldForParticles(particles = cluster2.particles)
+            bridgesys = bridge.Bridge(use_async_kicks = use_async_kicks)
+            bridgesys.add_system(cluster1, (cluster2, field))
+            bridgesys.add_system(cluster2, (cluster1, cluster1))
+            
+            one_timestep = cluster1.next_timestep
+            bridgesys.evolve_model(2 * one_timestep, timestep = one_timestep)
+            results.append((cluster1.particles.velocity, cluster2.particles.velocity))
+            self.assertTrue(bridgesys.kick_seconds > 0)
+            self.assertTrue(bridgesys.drift_seconds > 0)
+        
+        self.assertEqual(cluster1.number_of_async_calls, 6)
+        self.assertEqual(cluster2.number_of_async_calls, 3)
+        self.assertFalse(cluster1.has_pending_request)
+        self.assertEqual(results[0][0], results[1][0])
+        self.assertEqual(results[0][1], results[1][1])
+    
+    def test6(self):
+        print "Bridge evolve_model, with and without copy free kicks"
+        convert = nbody_system.nbody_to_si(1.e5 | units.MSun, 1.0 | units.parsec)
+        epsilon = 1.0e-2 | units.parsec
+        
+        numpy.random.seed(12345)
+        stars = new_plummer_model(100, convert_nbody=convert)
+        stars.radius = epsilon
+        first_half = stars.select_array(lambda x: (x > 0 | units.m), ['x'] )
+        second_half = stars - first_half
+        
+        results = []
+        for copy_free_kick, track_kick_energy, use_async_kicks in ((False, True, False), 
+                (True, True, False), (True, True, True), (True, False, True)):
+            cluster1 = system_from_particles(ExampleAsyncGravityCodeInterface, dict(), first_half, epsilon)
+            cluster2 = system_from_particles(ExampleGravityCodeInterface, dict(), second_half, epsilon)
+            bridgesys = bridge.Bridge(use_async_kicks = use_async_kicks)
+            bridgesys.add_system(cluster1, (cluster2,), copy_free_kick = copy_free_kick, 
+                track_kick_energy = track_kick_energy)
+            bridgesys.add_system(cluster2, (cluster1,), radius_is_eps = True, 
+                copy_free_kick = copy_free_kick, track_kick_energy = track_kick_energy)
+            
+            one_timestep = cluster1.next_timestep
+            bridgesys.evolve_model(2 * one_timestep, timestep = one_timestep)
+            results.append((cluster1.particles.velocity, cluster2.particles.velocity, bridgesys.kick_energy))
+        
+        for velocities1, velocities2, kick_energy in results[1:]:
+            self.assertAlmostRelativeEqual(velocities1, results[0][0], 12)
+            self.assertAlmostRelativeEqual(velocities2, results[0][1], 12)
+        self.assertAlmostRelativeEqual(results[1][2], results[0][2], 8)
+        self.assertAlmostRelativeEqual(results[2][2], results[0][2], 8)
+        self.assertEqual(results[3][2], zero)
+    
+    def test7(self):
+        print "Bridge, errors in asynchronous kicks"
+        self.assertFalse(bridge.Bridge().use_async_kicks)
+        
+        class Kick(object):
+            accelerations = [None, None]
+        
+        kick = Kick()
+        bridgesys = bridge.Bridge(use_async_kicks = True)
+        try:
+            bridgesys._gather_gravity([(kick, 0, ExampleFailingRequest()), (kick, 1, ExampleRequest(kick, 1.0))])
+            self.fail("expected an exception")
+        except AmuseException, ex:
+            self.assertEqual(str(ex), "no gravity")
+            self.assertEqual(traceback.extract_tb(sys.exc_info()[2])[-1][2], "result")
+        self.assertEqual(kick.accelerations[1], 1.0)
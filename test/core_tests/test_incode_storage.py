@@ -7,6 +7,7 @@ import time
 from amuse.units import units
 from amuse.units import constants
 from amuse.units import nbody_system
+from amuse.support import exceptions
 
 class TestParticles(amusetest.TestCase):
     
@@ -451,7 +452,72 @@ class TestParticles(amusetest.TestCase):
         self.assertEquals(mass[1], 50 )
         self.assertEquals(mass[0], 40 )
         
-    
+    def test8(self):
+        class Code(object):
+            def __init__(self):
+                self.data = {}
+                self.next_index = 100
+                
+            def get_number_of_particles(self):
+                return len(self.data)
+                
+            def get_mass(self,index):
+                return units.kg([self.data[i] for i in index])
+                
+            def new_particle(self, mass):
+                indices = range(self.next_index, self.next_index + len(mass))
+                self.next_index += 2 * len(mass)
+                for i, x in zip(indices, mass.value_in(units.kg)):
+                    self.data[i] = x
+                return indices
+                
+            def delete_particle(self, index):
+                for i in index:
+                    del self.data[i]
+                
+        code = Code()
+        storage = InCodeAttributeStorage(
+            code,
+            NewParticleMethod(code.new_particle,("mass",)),
+            code.delete_particle,
+            code.get_number_of_particles,
+            [],
+            [
+                ParticleGetAttributesMethod(code.get_mass,("mass",)),
+            ],
+            name_of_the_index = "index"
+        )
+        
+        random = numpy.random.RandomState(123)
+        keys = random.permutation(numpy.arange(1, 1001, dtype='uint64') << 40)
+        storage.add_particles_to_store(keys[:600], ["mass"], [units.kg(keys[:600] >> 40)])
+        storage.add_particles_to_store(keys[600:], ["mass"], [units.kg(keys[600:] >> 40)])
+        self.assertEquals(len(storage), 1000)
+        
+        removed_keys = keys[random.permutation(1000)[:300]]
+        storage.remove_particles_from_store(storage.get_indices_of(removed_keys))
+        storage._add_indices([1, 3, 5])
+        code.data.update({1:-1, 3:-3, 5:-5})
+        storage._remove_indices([3, 7])
+        self.assertEquals(len(storage), 702)
+        self.assertEquals(len(code.data), 703)
+        
+        remaining_keys = numpy.setdiff1d(keys, removed_keys)
+        indices = storage.get_indices_of(remaining_keys)
+        mass, = storage.get_values_in_store(indices, ["mass"])
+        self.assertEquals(mass, units.kg(remaining_keys >> 40))
+        self.assertEquals(storage._get_keys_for_indices_in_the_code(indices), remaining_keys)
+        self.assertEquals(storage._get_keys_for_indices_in_the_code([3, 7]), [0, 0])
+        self.assertEquals(storage.get_indices_of(storage.particle_keys), storage.code_indices)
+        self.assertEquals(storage.get_key_indices_of(remaining_keys[:2]), 
+            sorted(storage.get_key_indices_of(remaining_keys[:2])))
+        
+        self.assertTrue(storage.has_key_in_store(remaining_keys[0]))
+        self.assertFalse(storage.has_key_in_store(removed_keys[0]))
+        self.assertRaises(Exception, storage.get_indices_of, removed_keys[:2], 
+            expected_message = "Keys not found in storage: {0}".format(removed_keys[:2]))
+        self.assertRaises(exceptions.AmuseException, storage._add_indices, [1], 
+            expected_message = "adding an index '1' that is already managed, bookkeeping is broken")
         
         
 
@@ -1129,6 +1129,70 @@ class TestParticlesWithBinding(amusetest.TestCase):
         self.assertEquals(len(subset), 2)
         self.assertEquals(subset[0], local_particles[0])
         self.assertEquals(subset[1], local_particles[3])
+        
+    def test8(self):
+        class CountingInterface(self.TestInterface):
+            number_of_calls = 0
+            number_of_get_mass_calls = 0
+            
+            def __getattribute__(self, name):
+                result = object.__getattribute__(self, name)
+                if not name.startswith('number_of') and not name.startswith('__') and callable(result):
+                    self.number_of_calls += 1
+                return result
+                
+            def get_mass(self, id):
+                self.number_of_get_mass_calls += 1
+                return TestParticlesWithBinding.TestInterface.get_mass(self, id)
+                
+            def delete_particle(self, id):
+                for x in id:
+                    del self.masses[x]
+                return [0] * len(id)
+                
+        original = CountingInterface()
+        
+        instance = interface.InCodeComponentImplementation(original, cache_particle_attributes = True)
+        
+        handler = instance.get_handler('METHOD')
+        handler.add_method('get_mass',(handler.NO_UNIT,), (units.kg, handler.ERROR_CODE))
+        handler.add_method('set_mass',(handler.NO_UNIT, units.kg,), (handler.ERROR_CODE,))
+        handler.add_method('new_particle',(units.kg,), (handler.NO_UNIT, handler.ERROR_CODE))
+        handler.add_method('delete_particle',(handler.NO_UNIT,), (handler.ERROR_CODE,))
+        handler.add_method('add_1_to_mass',(handler.NO_UNIT,), (handler.ERROR_CODE,))
+        
+        handler = instance.get_handler('PARTICLES')
+        handler.define_set('particles', 'id')
+        handler.set_new('particles', 'new_particle')
+        handler.set_delete('particles', 'delete_particle')
+        handler.add_setter('particles', 'set_mass')
+        handler.add_getter('particles', 'get_mass', names = ('mass',))
+        
+        local_particles = datamodel.Particles(4)
+        local_particles.mass = units.kg.new_quantity([3.0, 4.0, 5.0, 6.0])
+        instance.particles.add_particles(local_particles)
+        
+        self.assertEquals(instance.particles.mass, [3.0, 4.0, 5.0, 6.0] | units.kg)
+        self.assertEquals(instance.particles[1:3].mass, [4.0, 5.0] | units.kg)
+        self.assertEquals(instance.particles[2].mass, 5.0 | units.kg)
+        self.assertEquals(original.number_of_get_mass_calls, 1)
+        
+        instance.particles[1:2].mass = [10.0] | units.kg
+        self.assertEquals(instance.particles.mass, [3.0, 10.0, 5.0, 6.0] | units.kg)
+        self.assertEquals(original.number_of_get_mass_calls, 2)
+        
+        instance.add_1_to_mass([0, 1])
+        self.assertEquals(instance.particles.mass, [4.0, 11.0, 5.0, 6.0] | units.kg)
+        self.assertEquals(original.number_of_get_mass_calls, 3)
+        
+        mass = instance.particles.mass
+        mass += 1.0 | units.kg
+        self.assertEquals(instance.particles.mass, [4.0, 11.0, 5.0, 6.0] | units.kg)
+        self.assertEquals(original.number_of_get_mass_calls, 3)
+        
+        instance.particles.remove_particle(instance.particles[3])
+        self.assertEquals(instance.particles.mass, [4.0, 11.0, 5.0] | units.kg)
+        self.assertEquals(original.number_of_get_mass_calls, 4)
     
 class TestGridWithBinding(amusetest.TestCase):
     class TestInterface(object):
@@ -326,3 +326,40 @@ class FormatTests(amusetest.TestCase):
         for x in all_formats:
             options = base.get_options_for_format('txt')
             self.assertTrue(len(options) >= 0)
+    
+    def test13(self):
+        print "Testing writing sets in the background"
+        filename = os.path.join(self.get_path_to_results(), "background_writer.h5")
+        if os.path.exists(filename):
+            os.remove(filename)
+        
+        x = datamodel.Particles(3)
+        x.mass = [1.0, 2.0, 3.0] | units.kg
+        writer = io.BackgroundWriter(maximum_number_of_pending_writes = 1)
+        requests = []
+        for i in range(3):
+            requests.append(writer.write_set_to_file(x, filename, "hdf5", version = "2.0"))
+            self.assertTrue(writer.number_of_pending_writes <= 1)
+            x.mass += 1 | units.kg
+        self.assertEquals(requests[0].number_of_bytes, 3 * 8 + 3 * 8)
+        writer.flush()
+        self.assertEquals(writer.number_of_pending_writes, 0)
+        self.assertEquals(writer.number_of_pending_bytes, 0)
+        for request in requests:
+            self.assertTrue(request.is_result_available())
+            request.result()
+        
+        y = io.read_set_from_file(filename, "hdf5", version = "2.0")
+        history = list(y.history)
+        self.assertEquals(len(history), 3)
+        for i, snapshot in enumerate(history):
+            self.assertEquals(snapshot.mass, [1.0 + i, 2.0 + i, 3.0 + i] | units.kg)
+        
+        request = writer.write_set_to_file(x, filename, "unknown")
+        self.assertRaises(base.UnsupportedFormatException, request.result)
+        self.assertRaises(base.UnsupportedFormatException, writer.flush)
+        writer.flush()
+        writer.close()
+        self.assertRaises(AmuseException, writer.write_set_to_file, x, filename, "hdf5",
+            expected_message = "IO exception: cannot write '{0}', the background writer is closed".format(filename))
+        os.remove(filename)
@@ -7,6 +7,7 @@ from amuse.units import units
 from amuse.units import constants
 from amuse.units import nbody_system
 from amuse.support.interface import ConvertArgumentsException
+from amuse.support import exceptions
 
 from amuse.ic.plummer import new_plummer_sphere
 from amuse.ic.salpeter import new_salpeter_mass_distribution_nbody
@@ -128,7 +129,7 @@ class TestParticlesAttributes(amusetest.TestCase):
         
         nbody_plummer = new_plummer_sphere(100)
         # Hop wasn't stopped, unit_converters don't match:
-        self.assertRaises(AttributeError, nbody_plummer.new_particle_from_cluster_core, 
+        self.assertRaises(AttributeError, nbody_plummer.new_particle_from_cluster_core, use_hop=True,
             expected_message="Cannot combine units from different systems: m and length")
         
         result = plummer.new_particle_from_cluster_core(unit_converter=converter, reuse_hop=False)
@@ -139,8 +140,8 @@ class TestParticlesAttributes(amusetest.TestCase):
         self.assertRaises(ConvertArgumentsException, plummer.new_particle_from_cluster_core, unit_converter=converter,#,
             expected_message="error while converting parameter 'mass', error: Cannot express kg in mass, the units do not have the same bases")
         
-        result = nbody_plummer.new_particle_from_cluster_core(reuse_hop=False)
-        result = plummer.new_particle_from_cluster_core(unit_converter=converter, reuse_hop=False)
+        result = nbody_plummer.new_particle_from_cluster_core(use_hop=True, reuse_hop=False)
+        result = plummer.new_particle_from_cluster_core(unit_converter=converter, use_hop=True, reuse_hop=False)
     
     def test6(self):
         print "Test all particle attributes using Hop - each different function creates its own instance of Hop"
@@ -172,16 +173,16 @@ class TestParticlesAttributes(amusetest.TestCase):
         
         # Close all Hop instances:
         nbody_results = []
-        nbody_results.append(nbody_plummer.new_particle_from_cluster_core(reuse_hop=False))
-        nbody_results.append(nbody_plummer.bound_subset(G=nbody_system.G, reuse_hop=False))
-        nbody_results.append(nbody_plummer.mass_segregation_Gini_coefficient(reuse_hop=False))
-        nbody_results.append(nbody_plummer.LagrangianRadii(reuse_hop=False))
-        nbody_results.append(nbody_plummer.densitycentre_coreradius_coredens(reuse_hop=False))
+        nbody_results.append(nbody_plummer.new_particle_from_cluster_core(use_hop=True, reuse_hop=False))
+        nbody_results.append(nbody_plummer.bound_subset(G=nbody_system.G, use_hop=True, reuse_hop=False))
+        nbody_results.append(nbody_plummer.mass_segregation_Gini_coefficient(use_hop=True, reuse_hop=False))
+        nbody_results.append(nbody_plummer.LagrangianRadii(use_hop=True, reuse_hop=False))
+        nbody_results.append(nbody_plummer.densitycentre_coreradius_coredens(use_hop=True, reuse_hop=False))
         
         # Now it works, because the Hop instances were closed, and new ones will be instantiated
         si_results = []
         for function_using_hop in functions_using_hop:
-            si_results.append(function_using_hop(unit_converter=converter))
+            si_results.append(function_using_hop(unit_converter=converter, use_hop=True))
         
         convert = converter.as_converter_from_si_to_nbody()
         self.assertAlmostRelativeEqual(si_results[0].position, 
@@ -449,6 +450,194 @@ class TestParticlesAttributes(amusetest.TestCase):
             self.assertAlmostEquals(sigma, 0.4, 1)
     
 
+    def test15(self):
+        print "Test potential_energy, potential and potential_energy_in_field in blocks and with threads"
+        numpy.random.seed(123)
+        particles = new_plummer_sphere(200)
+        field = new_plummer_sphere(50)
+        epsilon_squared = 0.01 | nbody_system.length**2
+        
+        energy = particles.potential_energy(epsilon_squared, G=nbody_system.G)
+        potentials = particles.potential(epsilon_squared, G=nbody_system.G)
+        energy_in_field = particles.potential_energy_in_field(field, epsilon_squared, G=nbody_system.G)
+        self.assertAlmostRelativeEquals(0.5 * (particles.mass * potentials).sum(), energy, 12)
+        
+        for max_array_length, number_of_threads in ((100, 1), (1000, 3), (3*200*200, 2)):
+            self.assertAlmostRelativeEquals(energy, particles.potential_energy(epsilon_squared, G=nbody_system.G,
+                max_array_length=max_array_length, number_of_threads=number_of_threads), 12)
+            self.assertAlmostRelativeEquals(potentials, particles.potential(epsilon_squared, G=nbody_system.G,
+                max_array_length=max_array_length, number_of_threads=number_of_threads), 12)
+            self.assertAlmostRelativeEquals(energy_in_field, particles.potential_energy_in_field(field, epsilon_squared,
+                G=nbody_system.G, max_array_length=max_array_length, number_of_threads=number_of_threads), 12)
+        
+        elements_per_chunk = particle_attributes.ELEMENTS_PER_CHUNK
+        particle_attributes.ELEMENTS_PER_CHUNK = 1000
+        try:
+            self.assertAlmostRelativeEquals(energy, particles.potential_energy(epsilon_squared, G=nbody_system.G), 12)
+            self.assertAlmostRelativeEquals(potentials, particles.potential(epsilon_squared, G=nbody_system.G), 12)
+        finally:
+            particle_attributes.ELEMENTS_PER_CHUNK = elements_per_chunk
+        
+        number_of_particles = 10**5
+        rows_per_block = particle_attributes._rows_per_block(number_of_particles, 10000000)
+        number_of_blocks = len(range(0, number_of_particles, rows_per_block))
+        number_of_chunks = len(particle_attributes._column_chunks(0, number_of_particles, rows_per_block))
+        self.assertEqual(rows_per_block, 64)
+        self.assertTrue(number_of_blocks * number_of_chunks < number_of_particles / 5)
+        self.assertEqual(particle_attributes._rows_per_block(1000, 3000000), 1000)
+    
+    def test16(self):
+        print "Test potential_energy, potential and potential_energy_in_field with a tree code approximation"
+        numpy.random.seed(123)
+        particles = new_plummer_sphere(2000)
+        field = new_plummer_sphere(500)
+        field.x += 2.0 | nbody_system.length
+        
+        energy = particles.potential_energy(G=nbody_system.G)
+        potentials = particles.potential(G=nbody_system.G)
+        energy_in_field = particles.potential_energy_in_field(field, G=nbody_system.G)
+        
+        self.assertAlmostRelativeEquals(particles.potential_energy(G=nbody_system.G, opening_angle=0.5), energy, 3)
+        self.assertAlmostRelativeEquals(particles.potential(G=nbody_system.G, opening_angle=0.5), potentials, 2)
+        self.assertAlmostRelativeEquals(particles.potential_energy_in_field(field, G=nbody_system.G, opening_angle=0.5), 
+            energy_in_field, 3)
+        self.assertAlmostRelativeEquals(particles.potential_energy(G=nbody_system.G, opening_angle=0.5, number_of_threads=2), 
+            particles.potential_energy(G=nbody_system.G, opening_angle=0.5), 12)
+        self.assertAlmostRelativeEquals(particles.potential_energy(G=nbody_system.G, opening_angle=0.0), energy, 12)
+
+    def test17(self):
+        print "Test nearest_neighbour and find_closest_particle_to with the spatial index"
+        numpy.random.seed(123)
+        particles = new_plummer_sphere(500)
+        field = new_plummer_sphere(300)
+
+        distances = particles.distances_squared(particles).number
+        distances[numpy.diag_indices(len(particles))] = numpy.inf
+        self.assertEqual(particles.nearest_neighbour().key, particles[distances.argmin(axis=1)].key)
+        distances = particles.distances_squared(field).number
+        self.assertEqual(particles.nearest_neighbour(field).key, field[distances.argmin(axis=1)].key)
+        self.assertEqual(particles.nearest_neighbour(max_array_length=100).key, particles.nearest_neighbour().key)
+
+        self.assertEqual(field.find_closest_particle_to(*particles[0].position).key, field[distances[0].argmin()].key)
+        field.x += 100 | nbody_system.length
+        field[-1].position = particles[0].position
+        self.assertEqual(field.find_closest_particle_to(*particles[0].position).key, field[-1].key)
+
+    def test18(self):
+        print "Test connected_components with the spatial index"
+        particles = Particles(7)
+        particles.x = [0.0, 0.5, 10.0, 1.2, 20.0, 10.9, 30.0] | units.m
+        particles.y = 0 | units.m
+        particles.z = 0 | units.m
+
+        components = particles.connected_components(threshold = 1 | units.m)
+        self.assertEqual([len(x) for x in components], [1, 2, 1, 3])
+        self.assertEqual(components[1].x, [10.0, 10.9] | units.m)
+        self.assertEqual(components[3].x, [0.0, 0.5, 1.2] | units.m)
+
+        distfunc = lambda p, q : ((p.x - q.x)**2 + (p.y - q.y)**2 + (p.z - q.z)**2).sqrt()
+        expected = particles.connected_components(threshold = 1 | units.m, distfunc = distfunc)
+        self.assertEqual(sorted([sorted(x.key) for x in components]), sorted([sorted(x.key) for x in expected]))
+
+        numpy.random.seed(123)
+        particles = new_plummer_sphere(300)
+        components = particles.connected_components(threshold = 0.1 | nbody_system.length)
+        expected = particles.connected_components(threshold = 0.1 | nbody_system.length, distfunc = distfunc)
+        self.assertEqual(sorted([sorted(x.key) for x in components]), sorted([sorted(x.key) for x in expected]))
+
+    def test19(self):
+        print "Test minimum_spanning_tree_length, Qparameter and mass_segregation_ratio with the Euclidean MST"
+        numpy.random.seed(123)
+        particles = new_plummer_sphere(100)
+        graph = particle_attributes.Graph()
+        for i, particle in enumerate(particles):
+            distances = (particle.position - particles.position).lengths()
+            for j in range(i + 1, len(particles)):
+                graph.add_edge(i, j, distances[j])
+        expected = sum([edge[0] for edge in particle_attributes.MinimumSpanningTreeFromEdges(graph.all_edges())], 
+            0 | nbody_system.length)
+        self.assertAlmostRelativeEquals(particles.minimum_spanning_tree_length(), expected, 12)
+        
+        distfunc = lambda p, q : (((p.x-q.x)**2+(p.y-q.y)**2)**0.5).value_in(p.x.unit)
+        self.assertAlmostRelativeEquals(particles.Qparameter(), particles.Qparameter(distfunc), 12)
+        
+        particles.mass = numpy.random.uniform(1.0, 2.0, len(particles)) | nbody_system.mass
+        random.seed(456)
+        expected = particles.mass_segregation_ratio(number_of_particles=10, number_of_random_sets=10)
+        random.seed(456)
+        self.assertAlmostRelativeEquals(particles.mass_segregation_ratio(number_of_particles=10, 
+            number_of_random_sets=10, number_of_processes=2), expected, 12)
+
+    def test20(self):
+        print "Test get_binaries with the spatial index"
+        numpy.random.seed(123)
+        particles = new_plummer_sphere(200)
+        for i in range(0, 20, 2):
+            particles[i+1].position = particles[i].position + ([0.001, 0.0, 0.0] | nbody_system.length)
+            particles[i+1].velocity = particles[i].velocity
+        
+        hardness = 10
+        kinetic_energy = 0.5 * (particles.mass * particles.velocity.lengths_squared()).sum() / particles.mass.sum()
+        expected = []
+        for i, j in sorted([sorted([a, b], key = lambda k : particles[k].x) 
+                for a in range(len(particles)) for b in range(a + 1, len(particles))], 
+                key = lambda (a, b) : (particles[a].x, particles[b].x)):
+            eb = (nbody_system.G * (particles[i].mass + particles[j].mass) / (particles[i].position - particles[j].position).length() 
+                - 0.5 * (particles[i].velocity - particles[j].velocity).length_squared())
+            if eb > hardness * kinetic_energy:
+                expected.append((i, j, eb))
+        self.assertEqual(len(expected), 10)
+        
+        binaries = particles.get_binaries(hardness = hardness, G = nbody_system.G, as_particle_sets = False)
+        self.assertEqual(binaries.i, [x[0] for x in expected])
+        self.assertEqual(binaries.j, [x[1] for x in expected])
+        self.assertAlmostRelativeEquals(binaries.binding_energy, [x[2].number for x in expected] | nbody_system.speed**2, 12)
+        self.assertAlmostRelativeEquals(binaries.hardness, binaries.binding_energy / kinetic_energy, 12)
+        
+        binaries = particles.get_binaries(hardness = hardness, G = nbody_system.G)
+        self.assertEqual(len(binaries), 10)
+        for binary, (i, j, eb) in zip(binaries, expected):
+            self.assertEqual(binary.key, particles[[i, j]].key)
+            self.assertAlmostRelativeEquals(binary.hardness, eb / kinetic_energy, 12)
+        
+        self.assertEqual(len(particles[:1].get_binaries(G = nbody_system.G)), 0)
+
+    def test21(self):
+        print "Test local_densities and the functions using the densities without Hop"
+        numpy.random.seed(123)
+        particles = new_plummer_sphere(200)
+        particles.mass = new_salpeter_mass_distribution_nbody(200)
+        densities = particles.local_densities(number_of_neighbours = 7)
+        for particle, density in zip(particles, densities):
+            distances = (particles.position - particle.position).lengths()
+            nearest = distances.argsort()[:8]
+            expected = particles[nearest[:-1]].mass.sum() / (4.0 / 3.0 * numpy.pi * distances[nearest[-1]]**3)
+            self.assertAlmostRelativeEquals(density, expected, 12)
+        self.assertRaises(exceptions.AmuseException, particles[:7].local_densities, 
+            expected_message = "Cannot calculate the local densities with 7 neighbours for a particles set with 7 particles.")
+        
+        particles = new_plummer_sphere(10000)
+        result = particles.new_particle_from_cluster_core(density_weighting_power=1)
+        # Casertano & Hut (1985, ApJ, 298, 80):  density weighted core radius = 0.6791 * r_plummer
+        plummer_radius = 3 * constants.pi / 16.0 | nbody_system.length
+        self.assertAlmostRelativeEqual(result.radius, 0.6791 * plummer_radius, 2)
+        self.assertAlmostEqual(result.position, [0.0, 0.0, 0.0] | nbody_system.length, 1)
+        
+        nbody_plummer = particles[:100].copy()
+        nbody_plummer.mass = new_salpeter_mass_distribution_nbody(100)
+        converter = nbody_system.nbody_to_si(1.0|units.MSun, 1.0 | units.parsec)
+        si_plummer = ParticlesWithUnitsConverted(nbody_plummer, converter.as_converter_from_si_to_nbody())
+        convert = converter.as_converter_from_si_to_nbody()
+        
+        nbody_result = nbody_plummer.densitycentre_coreradius_coredens()
+        for in_si, in_nbody in zip(si_plummer.densitycentre_coreradius_coredens(), nbody_result):
+            self.assertAlmostRelativeEqual(in_si, convert.from_target_to_source(in_nbody), 10)
+        self.assertAlmostRelativeEqual(si_plummer.LagrangianRadii()[0], 
+            convert.from_target_to_source(nbody_plummer.LagrangianRadii()[0]), 10)
+        self.assertAlmostRelativeEqual(si_plummer.mass_segregation_Gini_coefficient(), 
+            nbody_plummer.mass_segregation_Gini_coefficient(), 10)
+        self.assertEqual(si_plummer.bound_subset().key, nbody_plummer.bound_subset(G=nbody_system.G).key)
+
 class TestParticlesDomainAttributes(amusetest.TestCase):
     
     def test1(self):
@@ -4550,3 +4550,55 @@ class TestParticlesOverlay(amusetest.TestCase):
 
         print set2
         self.assertAlmostRelativeEquals(set1.x, set2.x)
+
+class TestParticlesRaw(amusetest.TestCase):
+
+    def test1(self):
+        particles = datamodel.Particles(2)
+        particles.x = [1.0, 2.0] | units.m
+        particles.mass = [3.0, 4.0] | units.kg
+        raw = particles.raw()
+        self.assertTrue(isinstance(raw.x, numpy.ndarray))
+        self.assertEqual(raw.x.tolist(), [1.0, 2.0])
+        self.assertEqual(raw.mass.tolist(), [3.0, 4.0])
+        self.assertEqual(raw.unit_of('x'), units.m)
+        self.assertEqual(raw.unit_of('mass'), units.kg)
+        self.assertTrue(raw.x is raw.x)
+
+    def test2(self):
+        particles = datamodel.Particles(2)
+        particles.x = [1.0, 2.0] | units.parsec
+        particles.y = [1.0, 2.0] | units.AU
+        particles.vx = [1.0, 2.0] | units.kms
+        raw = particles.raw()
+        self.assertEqual(raw.x.tolist(), [1.0, 2.0])
+        self.assertEqual(raw.unit_of('y'), units.parsec)
+        self.assertAlmostRelativeEquals(raw.y | units.parsec, [1.0, 2.0] | units.AU)
+        self.assertEqual(raw.unit_of('vx'), units.parsec / units.s)
+        self.assertAlmostRelativeEquals(raw.vx | raw.unit_of('vx'), [1.0, 2.0] | units.kms)
+        self.assertAlmostRelativeEquals(raw.number_of((1.0 | units.parsec)**2), 1.0)
+        self.assertEqual(raw.number_of(quantities.zero), 0)
+
+    def test3(self):
+        particles = datamodel.Particles(2)
+        particles.position = [[1.0, 2.0, 3.0], [4.0, 5.0, 6.0]] | units.km
+        raw = particles.raw(units = [units.m, units.Myr])
+        self.assertEqual(raw.position.shape, (2, 3))
+        self.assertAlmostRelativeEquals(raw.position[1], [4000.0, 5000.0, 6000.0])
+        self.assertEqual(raw.unit_of('position'), units.m)
+        self.assertEqual(raw.unit_for(units.kms), units.m / units.Myr)
+        self.assertRaises(AmuseException, particles.raw, units = [units.kms],
+            expected_message = "Cannot declare unit 'kms' for a raw view, only units of one dimension can be declared")
+
+    def test4(self):
+        particles = datamodel.Particles(2)
+        particles.x = [1.0, 2.0] | units.km
+        other = datamodel.Particles(1)
+        other.x = [1.0] | units.m
+        raw = particles.raw()
+        self.assertEqual(raw.x.tolist(), [1.0, 2.0])
+        other_raw = raw.for_set(other)
+        self.assertAlmostRelativeEquals(other_raw.x, [0.001])
+        self.assertEqual(other_raw.unit_of('x'), units.km)
+        self.assertRaises(AmuseException, setattr, raw, 'x', [1.0, 2.0],
+            expected_message = "A raw view on the attributes of a set is read only")
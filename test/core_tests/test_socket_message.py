@@ -0,0 +1,88 @@
+from amuse.test import amusetest
+
+import numpy
+import socket
+import threading
+
+from amuse.rfi.channel import SocketMessage
+from amuse.support import exceptions
+
+class TestSocketMessage(amusetest.TestCase):
+
+    def send_and_receive(self, message):
+        sender, receiver = socket.socketpair()
+        try:
+            thread = threading.Thread(target = message.send, args = (sender,))
+            thread.start()
+            result = SocketMessage()
+            result.receive(receiver)
+            thread.join()
+        finally:
+            sender.close()
+            receiver.close()
+        return result
+
+    def test1(self):
+        message = SocketMessage(
+            10,
+            12,
+            3,
+            {
+                'int32': [[1, 2, 3]],
+                'float64': [[1.5, 2.5, 3.5],[4.0, 5.0, 6.0]],
+            }
+        )
+        result = self.send_and_receive(message)
+        self.assertEqual(result.call_id, 10)
+        self.assertEqual(result.function_id, 12)
+        self.assertEqual(result.call_count, 3)
+        self.assertFalse(result.error)
+        self.assertEqual(list(result.ints), [1, 2, 3])
+        self.assertEqual(list(result.doubles), [1.5, 2.5, 3.5, 4.0, 5.0, 6.0])
+        self.assertEqual(result.doubles.dtype, numpy.float64)
+        self.assertEqual(len(result.floats), 0)
+        self.assertEqual(len(result.strings), 0)
+
+    def test2(self):
+        message = SocketMessage(
+            1,
+            2,
+            2,
+            {
+                'int64': [[2**40, -1]],
+                'float32': [[0.5, 0.25]],
+                'bool': [[True, False]],
+                'string': [['abc', 'de']],
+            }
+        )
+        result = self.send_and_receive(message)
+        self.assertEqual(list(result.longs), [2**40, -1])
+        self.assertEqual(list(result.floats), [0.5, 0.25])
+        self.assertEqual(list(result.booleans), [1, 0])
+        self.assertEqual(result.strings, ['abc', 'de'])
+
+    def test3(self):
+        n = 500000
+        x = numpy.random.random(n)
+        message = SocketMessage(1, 3, n, {'float64': [x, 2 * x, 3 * x], 'int32':[numpy.arange(n)]})
+        result = self.send_and_receive(message)
+        self.assertEqual(result.call_count, n)
+        self.assertEqual(len(result.doubles), 3 * n)
+        self.assertTrue(numpy.all(result.doubles[n:2*n] == 2 * x))
+        self.assertTrue(numpy.all(result.ints == numpy.arange(n)))
+
+    def test4(self):
+        message = SocketMessage(1, 3, 1)
+        message.set_error("failure in code")
+        result = self.send_and_receive(message)
+        self.assertTrue(result.error)
+        self.assertEqual(result.strings, ["failure in code"])
+
+    def test5(self):
+        sender, receiver = socket.socketpair()
+        sender.sendall(b'\x00' * 12)
+        sender.close()
+        message = SocketMessage()
+        self.assertRaises(exceptions.CodeException, message.receive, receiver,
+            expected_message = "lost connection to code")
+        receiver.close()
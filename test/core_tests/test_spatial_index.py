@@ -0,0 +1,154 @@
+from amuse.test import amusetest
+
+import numpy
+
+from amuse.units import units
+from amuse.datamodel import Particle
+from amuse.datamodel import Particles
+from amuse.datamodel.spatial_index import KDTree
+from amuse.datamodel.spatial_index import connected_component_labels
+
+class TestKDTree(amusetest.TestCase):
+
+    def distances(self, points, positions):
+        return numpy.sqrt(((points[:, numpy.newaxis, :] - positions[numpy.newaxis, :, :])**2).sum(-1))
+
+    def test1(self):
+        numpy.random.seed(123)
+        positions = numpy.random.random((1000, 3))
+        points = numpy.random.random((200, 3))
+        tree = KDTree(positions)
+        self.assertEqual(len(tree), 1000)
+        self.assertEqual(sorted(tree.order), range(1000))
+
+        distances, indices = tree.query(points, k = 4)
+        expected = self.distances(points, positions)
+        self.assertEqual(indices, numpy.argsort(expected, axis = 1)[:, :4])
+        self.assertAlmostRelativeEquals(distances, numpy.sort(expected, axis = 1)[:, :4], 14)
+        self.assertEqual(tree.query(points, k = 4, max_array_length = 100)[1], indices)
+
+    def test2(self):
+        numpy.random.seed(123)
+        positions = numpy.random.random((500, 3))
+        tree = KDTree(positions)
+        expected = self.distances(positions, positions)
+        expected[numpy.diag_indices(500)] = numpy.inf
+
+        distances, indices = tree.query(positions, k = 2, exclude = numpy.arange(500))
+        self.assertEqual(indices, numpy.argsort(expected, axis = 1)[:, :2])
+
+        i, j = tree.query_pairs(0.1)
+        self.assertEqual(len(i), numpy.triu(expected < 0.1).sum())
+        self.assertTrue(numpy.all(expected[i, j] < 0.1))
+        self.assertEqual(len(set(zip(numpy.minimum(i, j), numpy.maximum(i, j)))), len(i))
+        self.assertEqual(sorted(zip(*tree.query_pairs(0.1, max_array_length = 50))), sorted(zip(i, j)))
+
+        points, indices = tree.query_radius(positions[:10], 0.2)
+        self.assertEqual(len(points), (self.distances(positions[:10], positions) < 0.2).sum())
+        self.assertTrue(numpy.all(self.distances(positions[:10], positions)[points, indices] < 0.2))
+
+    def test3(self):
+        tree = KDTree(numpy.array([[0.0, 0.0, 0.0], [1.0, 0.0, 0.0]]))
+        distances, indices = tree.query(numpy.array([0.0, 0.5, 0.0]), k = 3)
+        self.assertEqual(indices, [[0, 1, -1]])
+        self.assertEqual(distances[0, 2], numpy.inf)
+
+        tree = KDTree(numpy.zeros((0, 3)))
+        distances, indices = tree.query(numpy.zeros((2, 3)))
+        self.assertEqual(indices, [[-1], [-1]])
+        self.assertEqual(len(tree.query_pairs(1.0)[0]), 0)
+
+    def test4(self):
+        labels = connected_component_labels(6, numpy.array([5, 1, 3]), numpy.array([4, 0, 5]))
+        self.assertEqual(labels, [0, 0, 2, 3, 3, 3])
+        self.assertEqual(connected_component_labels(3, numpy.array([], dtype=int), numpy.array([], dtype=int)), [0, 1, 2])
+
+    def test5(self):
+        numpy.random.seed(123)
+        positions = numpy.random.random((300, 2))
+        positions[:100] += 3.0
+        i, j, lengths = KDTree(positions).minimum_spanning_tree()
+        self.assertEqual(len(i), 299)
+        self.assertEqual(set(connected_component_labels(300, i, j)), set([0]))
+        self.assertAlmostRelativeEquals(lengths, numpy.sqrt(((positions[i] - positions[j])**2).sum(-1)), 14)
+        self.assertTrue(numpy.all(numpy.diff(lengths) >= 0))
+
+        # Prim's algorithm on all distances
+        distances = self.distances(positions, positions)
+        is_in_tree = numpy.zeros(300, dtype=bool)
+        is_in_tree[0] = True
+        nearest = distances[0].copy()
+        expected = 0.0
+        for k in range(299):
+            nearest[is_in_tree] = numpy.inf
+            m = nearest.argmin()
+            expected += nearest[m]
+            is_in_tree[m] = True
+            nearest = numpy.minimum(nearest, distances[m])
+        self.assertAlmostRelativeEquals(lengths.sum(), expected, 12)
+        self.assertAlmostRelativeEquals(KDTree(positions).minimum_spanning_tree(number_of_neighbours = 1,
+            max_array_length = 1000)[2].sum(), expected, 12)
+
+        grid = numpy.array([[x, y] for x in range(10) for y in range(10)], dtype='float64')
+        i, j, lengths = KDTree(grid).minimum_spanning_tree()
+        self.assertEqual(len(i), 99)
+        self.assertEqual(lengths.sum(), 99.0)
+        self.assertEqual(set(connected_component_labels(100, i, j)), set([0]))
+
+class TestParticlesSpatialIndex(amusetest.TestCase):
+
+    def test1(self):
+        particles = Particles(4)
+        particles.position = [[0, 0, 0], [1, 0, 0], [3, 0, 0], [6, 0, 0]] | units.m
+        index = particles.spatial_index()
+        self.assertTrue(particles.spatial_index() is index)
+
+        distances, indices = index.query_neighbours()
+        self.assertEqual(distances[..., 0], [1, 1, 2, 3] | units.m)
+        self.assertEqual(indices[..., 0], [1, 0, 1, 2])
+
+        distances, indices = index.query([[2.5, 0, 0], [0.7, 0, 0]] | units.km, k = 2)
+        self.assertEqual(indices, [[3, 2], [3, 2]])
+        self.assertEqual(index.query_pairs(2.5 | units.m)[0].tolist(), [0, 1])
+        self.assertEqual(index.query_radius([2.0, 0, 0] | units.m, 150 | units.cm)[1].tolist(), [1, 2])
+
+    def test2(self):
+        particles = Particles(3)
+        particles.position = [[0, 0, 0], [1, 0, 0], [3, 0, 0]] | units.m
+        index = particles.spatial_index()
+
+        particles[2].x = 0.5 | units.m
+        self.assertFalse(particles.spatial_index() is index)
+        index = particles.spatial_index()
+        self.assertEqual(index.query_neighbours()[1][..., 0], [2, 2, 0])
+
+        particles.add_particle(Particle(position = [0, 0, 0] | units.m))
+        self.assertFalse(particles.spatial_index() is index)
+        self.assertEqual(particles.spatial_index().query_neighbours()[1][..., 0], [3, 2, 0, 0])
+
+    def test3(self):
+        particles = Particles(3)
+        particles.position = [[0, 0, 0], [1, 0, 0], [3, 0, 0]] | units.m
+        storage = particles._private.attribute_storage
+        get_values_in_store = storage.get_values_in_store
+        requested = []
+        def counting_get_values_in_store(indices, attributes):
+            requested.extend(attributes)
+            return get_values_in_store(indices, attributes)
+        storage.get_values_in_store = counting_get_values_in_store
+
+        index = particles.spatial_index()
+        del requested[:]
+        self.assertTrue(particles.spatial_index() is index)
+        self.assertEqual(requested, [])
+
+        subset = particles[1:]
+        subset_index = subset.spatial_index()
+        self.assertTrue(subset.spatial_index() is subset_index)
+
+        particles.x += 1 | units.m
+        self.assertFalse(particles.spatial_index() is index)
+        self.assertFalse(subset.spatial_index() is subset_index)
+        index = particles.spatial_index()
+        particles.mass = 1 | units.kg
+        self.assertFalse(particles.spatial_index() is index)
@@ -797,3 +797,149 @@ class TestStoreHDFV2(_AbstractTestStoreHDF):
         self.assertEquals(id(attributes.particles), id(loaded_particles))
         self.assertAlmostRelativeEquals(attributes.gridpoint.y, 1.0 | units.km)
         self.assertAlmostRelativeEquals(attributes.grid[0][0].y, 1.0 | units.km)
+    
+    def test57(self):
+        test_results_path = self.get_path_to_results()
+        output_file = os.path.join(test_results_path, "test57"+self.store_version()+".hdf5")
+        if os.path.exists(output_file):
+            os.remove(output_file)
+
+        p = Particles(10)
+        p.mass = numpy.arange(10.0) | units.kg
+        p.x = numpy.arange(10.0) | units.km
+        p.name = "star"
+        
+        for i in range(3):
+            if i == 2:
+                p.add_particle(Particles(1))
+            io.write_set_to_file(p, output_file, "hdf5", version = self.store_version(), incremental = True)
+            p.x += 1 | units.km
+        
+        processor = store_v2.StoreHDF(output_file, open_for_writing = False)
+        data = processor.data_group()
+        first, second, third = [data[x] for x in sorted(data.keys())]
+        self.assertEquals(first["keys"], second["keys"])
+        self.assertEquals(first["attributes/mass"], second["attributes/mass"])
+        self.assertEquals(first["attributes/name"], second["attributes/name"])
+        self.assertNotEquals(first["attributes/x"], second["attributes/x"])
+        self.assertNotEquals(second["keys"], third["keys"])
+        self.assertNotEquals(second["attributes/mass"], third["attributes/mass"])
+        processor.close()
+        
+        loaded = io.read_set_from_file(output_file, "hdf5", version = self.store_version())
+        history = list(loaded.history)
+        self.assertEquals(len(history), 3)
+        self.assertEquals(history[1].mass, numpy.arange(10.0) | units.kg)
+        self.assertEquals(history[1].x, numpy.arange(1.0, 11.0) | units.km)
+        self.assertEquals(history[1].name, ["star"] * 10)
+        self.assertEquals(len(history[2]), 11)
+        self.assertEquals(history[2].x[:10], numpy.arange(2.0, 12.0) | units.km)
+        
+        self.assertRaises(Exception, io.write_set_to_file, p, output_file, "hdf5", incremental = True,
+            expected_message = "these options are only available for version 2.0: incremental")
+        self.assertRaises(Exception, io.write_set_to_file, p, output_file, "hdf5", 
+            compression = "gzip", compression_opts = 0, resizable = True,
+            expected_message = "these options are only available for version 2.0: compression, compression_opts, resizable")
+        
+        output_file = os.path.join(test_results_path, "test57"+self.store_version()+"v1.hdf5")
+        if os.path.exists(output_file):
+            os.remove(output_file)
+        io.write_set_to_file(p, output_file, "hdf5")
+        self.assertRaises(Exception, io.read_set_from_file, output_file, "hdf5", memory_mapped = True,
+            expected_message = "memory mapped reading is only available for version 2.0 files")
+    
+    def test58(self):
+        test_results_path = self.get_path_to_results()
+        output_file = os.path.join(test_results_path, "test58"+self.store_version()+".hdf5")
+        if os.path.exists(output_file):
+            os.remove(output_file)
+
+        p = Particles(10)
+        p.mass = numpy.arange(10.0) | units.kg
+        io.write_set_to_file(p, output_file, "hdf5", version = self.store_version(), 
+            chunks = (4,), compression = "gzip", compression_opts = 4, shuffle = True, resizable = True)
+        
+        processor = store_v2.StoreHDF(output_file, open_for_writing = True)
+        dataset = processor.data_group()["0000000001/attributes/mass"]
+        self.assertEquals(dataset.chunks, (4,))
+        self.assertEquals(dataset.compression, "gzip")
+        self.assertEquals(dataset.compression_opts, 4)
+        self.assertTrue(dataset.shuffle)
+        self.assertEquals(dataset.maxshape, (None,))
+        
+        loaded = processor.load()
+        self.assertEquals(loaded.mass, numpy.arange(10.0) | units.kg)
+        attribute = store_v2.HDF5Attribute.load_attribute("mass", dataset, processor)
+        attribute.increase_to_length(12)
+        self.assertEquals(len(dataset), 12)
+        processor.close()
+    
+    def test59(self):
+        test_results_path = self.get_path_to_results()
+        output_file = os.path.join(test_results_path, "test59"+self.store_version()+".hdf5")
+        if os.path.exists(output_file):
+            os.remove(output_file)
+
+        p = Particles(4)
+        p.mass = numpy.arange(4.0) | units.kg
+        p.x = numpy.arange(4.0) | units.km
+        for i in range(4):
+            if i == 3:
+                p.y = 1 | units.km
+            io.write_set_to_file(p, output_file, "hdf5", version = self.store_version(), 
+                append_to_time_axis = True, timestamp = i | units.s)
+            p.x += 1 | units.km
+        
+        processor = store_v2.StoreHDF(output_file, open_for_writing = False)
+        data = processor.data_group()
+        self.assertEquals(len(data), 2)
+        self.assertEquals(data["0000000001"].attrs["number_of_versions"], 3)
+        self.assertEquals(data["0000000001/attributes/x"].shape, (3, 4))
+        self.assertEquals(data["0000000001/attributes/x"][:,1], [1.0, 2.0, 3.0])
+        self.assertEquals(data["0000000002"].attrs["number_of_versions"], 1)
+        processor.close()
+        
+        loaded = io.read_set_from_file(output_file, "hdf5", version = self.store_version())
+        history = list(loaded.history)
+        self.assertEquals(len(history), 4)
+        for i, x in enumerate(history):
+            self.assertEquals(x.x, numpy.arange(i, i + 4.0) | units.km)
+            self.assertEquals(x.mass, numpy.arange(4.0) | units.kg)
+            self.assertEquals(x.collection_attributes.timestamp, i | units.s)
+        self.assertEquals(history[3].y, [1] * 4 | units.km)
+        self.assertEquals(loaded.get_timeline_of_attribute_as_vector(p[1].key, "x")[1], [1.0, 2.0, 3.0, 4.0] | units.km)
+        
+        copy = loaded.copy()
+        self.assertEquals(copy[2].x, 5 | units.km)
+        
+    def test60(self):
+        test_results_path = self.get_path_to_results()
+        output_file = os.path.join(test_results_path, "test60"+self.store_version()+".hdf5")
+        if os.path.exists(output_file):
+            os.remove(output_file)
+
+        p = Particles(10)
+        p.mass = numpy.arange(10.0) | units.kg
+        p.x = numpy.arange(10.0) | units.km
+        p.y = 0 | units.km
+        p.z = 0 | units.km
+        p.name = "p"
+        io.write_set_to_file(p, output_file, "hdf5", version = self.store_version())
+        io.write_set_to_file(p, output_file, "hdf5", version = self.store_version(), chunks = (3,))
+        
+        loaded = io.read_set_from_file(output_file, "hdf5", version = self.store_version(), memory_mapped = True)
+        history = list(loaded.history)
+        self.assertTrue(isinstance(history[0].mass.number.base, numpy.memmap))
+        self.assertFalse(isinstance(history[1].mass.number.base, numpy.memmap))
+        for x in history:
+            self.assertEquals(x.mass, p.mass)
+            self.assertEquals(x.name, p.name)
+            self.assertEquals(x.total_mass(), 45 | units.kg)
+            self.assertAlmostRelativeEquals(x.center_of_mass(), [57.0/9.0, 0, 0] | units.km)
+            
+            subset = x[x.mass > 6 | units.kg]
+            self.assertEquals(len(subset), 3)
+            self.assertEquals(subset.x, [7.0, 8.0, 9.0] | units.km)
+            self.assertEquals(x[[8, 1, 5]].mass, [8.0, 1.0, 5.0] | units.kg)
+            self.assertTrue(x.has_key_in_store(p[4].key))
+            self.assertFalse(x.has_key_in_store(p[4].key + 1000))
@@ -167,3 +167,69 @@ class TestNonNumericUnits(amusetest.TestCase):
         self.assertFalse(1 | test_unit <  0 | test_unit)
         
     
+
+class TestUnitCache(amusetest.TestCase):
+    def setUp(self):
+        self.cache = core.unit_cache
+        self.cache.clear()
+        self.cache.reset_counters()
+        self.cache.start_counting()
+        
+    def tearDown(self):
+        self.cache.is_enabled = True
+        self.cache.stop_counting()
+        self.cache.reset_counters()
+        
+    def test1(self):
+        km = 1000 * m
+        self.assertEqual(1000, km.value_in(m))
+        self.assertEqual(1000, km.value_in(m))
+        hits, misses, rate = self.cache.hit_rates()[core.UnitCache.CONVERSION_FACTOR]
+        self.assertEqual(hits, 1)
+        self.assertEqual(misses, 1)
+        self.assertAlmostRelativeEquals(rate, 0.5)
+        
+    def test2(self):
+        x = 2.0 | m / s
+        y = 3.0 | s
+        first = (x * y).unit
+        second = (x * y).unit
+        self.assertTrue(first is second)
+        self.assertEqual(first, m)
+        self.assertEqual((x / (1.0 | m)).unit, s**-1)
+        self.assertEqual(self.cache.hit_rates()[core.UnitCache.PRODUCT][:2], (1, 1))
+        
+    def test3(self):
+        self.assertRaises(core.IncompatibleUnitsException, m.conversion_factor_from, s)
+        self.assertRaises(core.IncompatibleUnitsException, m.conversion_factor_from, s)
+        self.assertEqual(self.cache.hit_rates()[core.UnitCache.CONVERSION_FACTOR][:2], (0, 2))
+        
+    def test4(self):
+        cache = core.UnitCache(maximum_number_of_entries = 2)
+        cache.put((core.UnitCache.SIMPLE_FORM, id(m)), m, m)
+        cache.put((core.UnitCache.SIMPLE_FORM, id(s)), s, s)
+        self.assertEqual(cache.get((core.UnitCache.SIMPLE_FORM, id(s))), s)
+        cache.put((core.UnitCache.SIMPLE_FORM, id(kg)), kg, kg)
+        self.assertEqual(len(cache.entries), 1)
+        self.assertEqual(cache.get((core.UnitCache.SIMPLE_FORM, id(m))), None)
+        cache.is_enabled = False
+        cache.put((core.UnitCache.SIMPLE_FORM, id(m)), m, m)
+        self.assertEqual(cache.get((core.UnitCache.SIMPLE_FORM, id(m))), None)
+        
+    def test5(self):
+        key = (core.UnitCache.CONVERSION_FACTOR, id(m), id(m))
+        cache = core.UnitCache()
+        cache.put(key, (m, m), 1.0)
+        cache.is_enabled = False
+        self.assertEqual(cache.get(key), None)
+        cache.is_enabled = True
+        self.assertEqual(cache.get(key), 1.0)
+        
+        km = 1000 * m
+        self.assertEqual(1000, km.value_in(m))
+        self.cache.is_enabled = False
+        self.assertEqual(1000, km.value_in(m))
+        self.assertEqual(self.cache.hit_rates()[core.UnitCache.CONVERSION_FACTOR][:2], (0, 1))
+        self.cache.is_enabled = True
+        self.assertEqual(1000, km.value_in(m))
+        self.assertEqual(self.cache.hit_rates()[core.UnitCache.CONVERSION_FACTOR][:2], (1, 1))
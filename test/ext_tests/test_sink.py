@@ -147,6 +147,54 @@ class TestSinkParticles(TestCase):
         self.assertEqual(particles.total_momentum(), copy.total_momentum()) # momentum is conserved
         self.assertEqual(particles.total_angular_momentum()+sinks.angular_momentum.sum(axis=0), copy.total_angular_momentum()) # angular_momentum is conserved
 
+    def test6(self):
+        print "Testing SinkParticles accrete, many particles within the radii of several sinks"
+        numpy.random.seed(123)
+        particles = Particles(1000)
+        particles.mass = numpy.random.uniform(1.0, 2.0, 1000) | units.MSun
+        particles.radius = numpy.random.uniform(0.1, 0.4, 1000) | units.parsec
+        particles.position = numpy.random.uniform(-1.0, 1.0, (1000, 3)) | units.parsec
+        particles.velocity = numpy.random.normal(0.0, 1.0, (1000, 3)) | units.km/units.s
+        copy = particles.copy()
+
+        sinks = SinkParticles(particles[:20], looping_over=self.looping_over)
+        accreted = sinks.accrete(particles)
+
+        expected = [[] for i in range(20)]
+        for particle in copy[20:]:
+            d2 = (copy[:20].position - particle.position).lengths_squared()
+            candidates = numpy.flatnonzero(d2 < copy[:20].radius**2)
+            if len(candidates):
+                attraction = copy[:20].mass[candidates] / d2[candidates]
+                expected[candidates[attraction.argmax()]].append(particle)
+        self.assertEqual(len(accreted), sum([len(x) for x in expected]))
+        self.assertEqual(len(particles), 1000 - len(accreted))
+        self.assertEqual(set(accreted.key), set([particle.key for x in expected for particle in x]))
+        self.assertAlmostRelativeEquals(sinks.mass, copy[:20].mass + 
+            ([sum([particle.mass.value_in(units.MSun) for particle in x]) for x in expected] | units.MSun), 12)
+        self.assertAlmostRelativeEquals(particles.total_mass(), copy.total_mass(), 12)
+        self.assertAlmostRelativeEquals(particles.total_momentum(), copy.total_momentum(), 12)
+        self.assertAlmostRelativeEquals(particles.total_angular_momentum()+sinks.angular_momentum.sum(axis=0), 
+            copy.total_angular_momentum(), 12)
+
+    def test7(self):
+        print "Testing SinkParticles resolve_duplicates"
+        particles = Particles(6)
+        particles.mass = [1.0, 4.0, 1.0, 1.0, 1.0, 1.0] | units.MSun
+        particles.radius = 3.0 | units.parsec
+        particles.position = [[0, 0, 0], [4, 0, 0], [1, 0, 0], [2, 0, 0], [3, 0, 0], [-1, 0, 0]] | units.parsec
+        particles.velocity = [0.0, 0.0, 0.0] | units.km/units.s
+        sinks = SinkParticles(particles[:2], looping_over=self.looping_over)
+        others = particles[2:]
+
+        too_close = sinks.select_too_close(others)
+        self.assertEqual([len(x) for x in too_close], [3, 2])
+        resolved = sinks.resolve_duplicates(too_close, others)
+        self.assertEqual(len(resolved), 2)
+        self.assertEqual(set(resolved[0].key), set(particles[[2, 5]].key))
+        self.assertEqual(set(resolved[1].key), set(particles[[3, 4]].key))
+        self.assertEqual([len(x) for x in sinks.resolve_duplicates([others[0:0], others[0:0]], others)], [0, 0])
+
 
 class TestSinkParticlesLoopingOverSources(TestSinkParticles):
 
@@ -0,0 +1,105 @@
+"""
+Measures the time needed to calculate the potential at a number of
+points in many instances of the twobody code, with a blocking call
+to every code after each other and with asynchronous calls to all
+codes at once, handled in a request pool as they finish. With
+--channel_type=mixed half of the codes use MPI and half sockets.
+
+to run (in the amuse root directory):
+
+./amuse.sh test/reports/async_pool_speed.py --codes=24 --channel_type=mixed
+
+"""
+
+from amuse.community.twobody.interface import TwoBodyInterface
+from amuse.rfi.channel import AsyncRequestsPool
+from amuse.support.thirdparty import texttable
+
+import time
+import numpy
+
+from optparse import OptionParser
+
+def new_codes(number_of_codes, channel_type):
+    result = []
+    for i in range(number_of_codes):
+        if channel_type == 'mixed':
+            code = TwoBodyInterface(channel_type = ('mpi', 'sockets')[i % 2])
+        else:
+            code = TwoBodyInterface(channel_type = channel_type)
+        code.initialize_code()
+        code.new_particle([1.0, 1.0], [0.0, 1.0], [0.0, 0.0], [0.0, 0.0], [0.0, 0.0], [0.0, 0.5], [0.0, 0.0], [0.0, 0.0])
+        code.commit_particles()
+        result.append(code)
+    return result
+
+def measure_blocking(codes, x, zeros):
+    t0 = time.time()
+    for code in codes:
+        code.get_potential_at_point(zeros, x, zeros, zeros)
+    t1 = time.time()
+    return t1 - t0
+
+def measure_pool(codes, x, zeros):
+    t0 = time.time()
+    pool = AsyncRequestsPool()
+    for code in codes:
+        pool.add_request(code.get_potential_at_point.async(zeros, x, zeros, zeros), lambda request: request.result())
+    for request in pool.as_completed():
+        pass
+    t1 = time.time()
+    return t1 - t0
+
+def run(number_of_codes, number_of_points, channel_type, number_of_repeats):
+    codes = new_codes(number_of_codes, channel_type)
+    x = numpy.linspace(2.0, 3.0, number_of_points)
+    zeros = numpy.zeros(number_of_points)
+
+    table = texttable.Texttable()
+    table.set_cols_dtype(['t', 'i', 'i', 'f'])
+    table.set_cols_align(["l", "r", "r", "r"])
+    rows = [('calls', 'codes', 'points', 'seconds')]
+    rows.append(('blocking', number_of_codes, number_of_points,
+        min([measure_blocking(codes, x, zeros) for i in range(number_of_repeats)])))
+    rows.append(('pool', number_of_codes, number_of_points,
+        min([measure_pool(codes, x, zeros) for i in range(number_of_repeats)])))
+    table.add_rows(rows)
+    print table.draw()
+
+    for code in codes:
+        code.stop()
+
+def new_option_parser():
+    result = OptionParser()
+    result.add_option(
+        "-c", "--codes",
+        dest="number_of_codes",
+        type="int",
+        default=24,
+        help="number of codes to start"
+    )
+    result.add_option(
+        "-n", "--points",
+        dest="number_of_points",
+        type="int",
+        default=100000,
+        help="number of points per call"
+    )
+    result.add_option(
+        "-t", "--channel_type",
+        dest="channel_type",
+        default="mixed",
+        help="channel to the codes (mpi, sockets or mixed)"
+    )
+    result.add_option(
+        "-r", "--repeats",
+        dest="number_of_repeats",
+        type="int",
+        default=3,
+        help="number of measurements, the fastest is reported"
+    )
+    return result
+
+if __name__ == '__main__':
+    options, arguments = new_option_parser().parse_args()
+    run(options.number_of_codes, options.number_of_points, options.channel_type, options.number_of_repeats)
@@ -0,0 +1,106 @@
+"""
+Measures the time needed to evolve a particle set and write a
+snapshot after every step, with the snapshots written in the
+simulation loop and with the snapshots written by a background
+writer. The evolve step is simulated with a fixed amount of numpy work.
+
+to run (in the amuse root directory):
+
+./amuse.sh test/reports/background_writer_speed.py --particles=100000 --snapshots=20
+
+"""
+
+from amuse import io
+from amuse.units import nbody_system
+from amuse.ic.plummer import new_plummer_model
+from amuse.support.thirdparty import texttable
+
+import os
+import time
+import numpy
+
+from optparse import OptionParser
+
+def evolve(particles, work):
+    for i in range(work):
+        numpy.sort(numpy.random.random(len(particles)))
+    particles.position += particles.velocity * (0.001 | nbody_system.time)
+
+def measure(particles, number_of_snapshots, work, filename, writer):
+    if os.path.exists(filename):
+        os.remove(filename)
+
+    t0 = time.time()
+    maximum_number_of_pending_bytes = 0
+    for i in range(number_of_snapshots):
+        evolve(particles, work)
+        if writer is None:
+            io.write_set_to_file(particles, filename, "hdf5", version = '2.0')
+        else:
+            writer.write_set_to_file(particles, filename, "hdf5", version = '2.0')
+            maximum_number_of_pending_bytes = max(maximum_number_of_pending_bytes, writer.number_of_pending_bytes)
+    if writer is not None:
+        writer.close()
+    t1 = time.time()
+
+    os.remove(filename)
+    return t1 - t0, maximum_number_of_pending_bytes
+
+def run(number_of_particles, number_of_snapshots, work, maximum_number_of_pending_writes, filename):
+    numpy.random.seed(123)
+    particles = new_plummer_model(number_of_particles)
+
+    table = texttable.Texttable()
+    table.set_cols_dtype(['t', 'i', 'i', 'f', 'i'])
+    table.set_cols_align(["l", "r", "r", "r", "r"])
+    rows = [('writer', 'particles', 'snapshots', 'total (s)', 'max pending (bytes)')]
+    rows.append(('in loop', number_of_particles, number_of_snapshots) +
+        measure(particles.copy(), number_of_snapshots, work, filename, None))
+    writer = io.BackgroundWriter(maximum_number_of_pending_writes)
+    rows.append(('background', number_of_particles, number_of_snapshots) +
+        measure(particles.copy(), number_of_snapshots, work, filename, writer))
+    table.add_rows(rows)
+    print table.draw()
+
+def new_option_parser():
+    result = OptionParser()
+    result.add_option(
+        "-n", "--particles",
+        dest="number_of_particles",
+        type="int",
+        default=100000,
+        help="number of particles in the set"
+    )
+    result.add_option(
+        "-s", "--snapshots",
+        dest="number_of_snapshots",
+        type="int",
+        default=20,
+        help="number of snapshots to write"
+    )
+    result.add_option(
+        "-w", "--work",
+        dest="work",
+        type="int",
+        default=5,
+        help="amount of work in an evolve step (number of sorts of the set)"
+    )
+    result.add_option(
+        "-p", "--pending",
+        dest="maximum_number_of_pending_writes",
+        type="int",
+        default=2,
+        help="maximum number of pending writes of the background writer"
+    )
+    result.add_option(
+        "-f", "--filename",
+        dest="filename",
+        default="background_writer_speed.hdf5",
+        help="file to write the snapshots to (removed afterwards)"
+    )
+    return result
+
+if __name__ == '__main__':
+    options, arguments = new_option_parser().parse_args()
+    run(options.number_of_particles, options.number_of_snapshots, options.work,
+        options.maximum_number_of_pending_writes, options.filename)
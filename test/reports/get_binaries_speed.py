@@ -0,0 +1,120 @@
+"""
+Measures the time needed to find the hard binaries in a plummer
+sphere (with some binaries added), comparing the original sweep
+over the particles sorted on x (a loop over the candidate pairs
+in python) with the search of the candidate pairs in the spatial
+index of the set (get_binaries).
+
+to run (in the amuse root directory):
+
+./amuse.sh test/reports/get_binaries_speed.py --n_order=4
+
+"""
+
+from amuse.datamodel import particle_attributes
+from amuse.ic.plummer import new_plummer_model
+from amuse.units import nbody_system
+from amuse.support.thirdparty import texttable
+
+import time
+import numpy
+
+from optparse import OptionParser
+
+def get_binaries_with_sweep(particles, hardness = 10, G = nbody_system.G):
+    n=len(particles)
+    total_Ek=(0.5*particles.mass*(particles.vx**2+particles.vy**2+particles.vz**2)).sum()
+    average_Ek=total_Ek/particles.mass.sum()
+    max_mass=particles.mass.amax()
+    limitE=hardness*average_Ek
+
+    a=numpy.argsort(particles.x.number)
+
+    binaries=[]
+
+    for i in range(n-1):
+        j=i+1
+        while j<n and (particles.x[a[j]]-particles.x[a[i]])<2*G*max_mass/limitE:
+            r2=(particles.x[a[j]]-particles.x[a[i]])**2+ \
+               (particles.y[a[j]]-particles.y[a[i]])**2+ \
+               (particles.z[a[j]]-particles.z[a[i]])**2 
+            v2=(particles.vx[a[j]]-particles.vx[a[i]])**2+ \
+               (particles.vy[a[j]]-particles.vy[a[i]])**2+ \
+               (particles.vz[a[j]]-particles.vz[a[i]])**2 
+            r=r2**0.5
+            eb=G*(particles.mass[a[i]]+particles.mass[a[j]])/r-0.5*v2
+            if eb > limitE:
+                binary=particles[[a[i],a[j]]].copy()
+                binary.hardness=eb/average_Ek
+                binaries.append(binary)
+            j+=1  
+
+    return binaries
+
+def new_particles(number_of_particles, number_of_binaries):
+    numpy.random.seed(123)
+    particles = new_plummer_model(number_of_particles)
+    first = particles[:number_of_binaries]
+    second = particles[number_of_binaries:2 * number_of_binaries]
+    second.position = first.position + (numpy.random.uniform(-1e-4, 1e-4, (number_of_binaries, 3)) | nbody_system.length)
+    second.velocity = first.velocity
+    return particles
+
+def seconds_of(function, *arguments):
+    t0 = time.time()
+    result = function(*arguments)
+    t1 = time.time()
+    return t1 - t0, result
+
+def run(n_order, number_of_binaries, max_order_of_sweep):
+    table = texttable.Texttable()
+    table.set_cols_dtype(['i', 'i', 't', 'f', 'f'])
+    table.set_cols_align(["r", "r", "r", "r", "r"])
+    rows = [('particles', 'binaries', 'sweep (s)', 'sets (s)', 'pairs (s)')]
+    for order in range(3, n_order + 1):
+        number_of_particles = 10 ** order
+        particles = new_particles(number_of_particles, number_of_binaries)
+        
+        if order <= max_order_of_sweep:
+            seconds, expected = seconds_of(get_binaries_with_sweep, particles)
+            seconds_of_sweep = '{0:.3f}'.format(seconds)
+        else:
+            expected = None
+            seconds_of_sweep = '-'
+        seconds_of_sets, binaries = seconds_of(particle_attributes.get_binaries, particles, 10, nbody_system.G)
+        seconds_of_pairs, pairs = seconds_of(particle_attributes.get_binaries, particles, 10, nbody_system.G, False)
+        
+        if len(binaries) != len(pairs.i) or (expected is not None and len(expected) != len(binaries)):
+            raise Exception("number of binaries differs between the implementations")
+        rows.append((number_of_particles, len(pairs.i), seconds_of_sweep, seconds_of_sets, seconds_of_pairs))
+    table.add_rows(rows)
+    print table.draw()
+
+def new_option_parser():
+    result = OptionParser()
+    result.add_option(
+        "-n", "--n_order",
+        dest="n_order",
+        type="int",
+        default=4,
+        help="largest set has 10**n particles"
+    )
+    result.add_option(
+        "-b", "--binaries",
+        dest="number_of_binaries",
+        type="int",
+        default=100,
+        help="number of binaries added to the set"
+    )
+    result.add_option(
+        "-s", "--sweep_order",
+        dest="max_order_of_sweep",
+        type="int",
+        default=4,
+        help="the sweep is only measured for sets up to 10**n particles"
+    )
+    return result
+
+if __name__ == '__main__':
+    options, arguments = new_option_parser().parse_args()
+    run(options.n_order, options.number_of_binaries, options.max_order_of_sweep)
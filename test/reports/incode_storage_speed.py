@@ -0,0 +1,110 @@
+"""
+Measures the time needed to add particles to a set stored in a
+code, to find the indices in the code of all particles (in the
+order of the set and shuffled) and of a random 1% of the particles,
+to find the positions in the set of these 1% and to remove a random
+10% of the particles. The code is a numpy
+array in this process, so only the bookkeeping of the keys and
+indices in the code is measured.
+
+to run (in the amuse root directory):
+
+./amuse.sh test/reports/incode_storage_speed.py --n_order=7
+
+"""
+
+from amuse.datamodel.incode_storage import InCodeAttributeStorage
+from amuse.datamodel.incode_storage import NewParticleMethod
+from amuse.datamodel.incode_storage import ParticleGetAttributesMethod
+from amuse.datamodel import Particles
+from amuse.units import units
+from amuse.support.thirdparty import texttable
+
+import time
+import numpy
+
+from optparse import OptionParser
+
+class Code(object):
+
+    def __init__(self):
+        self.mass = numpy.zeros(0)
+
+    def get_number_of_particles(self):
+        return len(self.mass)
+
+    def get_mass(self, index):
+        return units.kg(self.mass[index])
+
+    def new_particle(self, mass):
+        first = len(self.mass)
+        self.mass = numpy.concatenate((self.mass, mass.value_in(units.kg)))
+        return numpy.arange(first, len(self.mass))
+
+    def delete_particle(self, index):
+        pass
+
+def new_storage(code):
+    return InCodeAttributeStorage(
+        code,
+        NewParticleMethod(code.new_particle, ("mass",)),
+        code.delete_particle,
+        code.get_number_of_particles,
+        [],
+        [ParticleGetAttributesMethod(code.get_mass, ("mass",))],
+        name_of_the_index = "index"
+    )
+
+def seconds_of(function, *arguments):
+    t0 = time.time()
+    function(*arguments)
+    t1 = time.time()
+    return t1 - t0
+
+def measure(number_of_particles):
+    numpy.random.seed(123)
+    keys = Particles(number_of_particles).key
+    masses = units.kg(numpy.random.uniform(1.0, 2.0, number_of_particles))
+    storage = new_storage(Code())
+    shuffled_keys = keys[numpy.random.permutation(number_of_particles)]
+    selected_keys = shuffled_keys[:number_of_particles // 100]
+    removed_keys = shuffled_keys[-(number_of_particles // 10):]
+
+    result = (
+        seconds_of(storage.add_particles_to_store, keys, ["mass"], [masses]),
+        seconds_of(storage.get_indices_of, keys),
+        seconds_of(storage.get_indices_of, shuffled_keys),
+        seconds_of(storage.get_indices_of, selected_keys),
+        seconds_of(storage.get_key_indices_of, selected_keys),
+        seconds_of(lambda : storage.remove_particles_from_store(storage.get_indices_of(removed_keys))),
+    )
+
+    if len(storage) != number_of_particles - len(removed_keys):
+        raise Exception("number of particles in the storage is wrong after the removal")
+    return result
+
+def run(n_order):
+    table = texttable.Texttable()
+    table.set_cols_dtype(['i', 'f', 'f', 'f', 'f', 'f', 'f'])
+    table.set_cols_align(["r", "r", "r", "r", "r", "r", "r"])
+    rows = [('particles', 'add (s)', 'lookup all (s)', 'lookup shuffled (s)', 'lookup 1% (s)', 'positions 1% (s)', 'remove 10% (s)')]
+    for order in range(4, n_order + 1):
+        number_of_particles = 10 ** order
+        rows.append((number_of_particles,) + measure(number_of_particles))
+    table.add_rows(rows)
+    print table.draw()
+
+def new_option_parser():
+    result = OptionParser()
+    result.add_option(
+        "-n", "--n_order",
+        dest="n_order",
+        type="int",
+        default=6,
+        help="largest set has 10**n particles"
+    )
+    return result
+
+if __name__ == '__main__':
+    options, arguments = new_option_parser().parse_args()
+    run(options.n_order)
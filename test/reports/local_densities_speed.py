@@ -0,0 +1,96 @@
+"""
+Measures the time needed to calculate the density centre, core
+radius and core density of a plummer sphere (with
+densitycentre_coreradius_coredens), with the densities calculated
+in process (local_densities, on the spatial index of the set) and
+with the densities calculated by a Hop worker (a new worker for
+every call and a worker reused between the calls). The largest
+relative difference between the densities of both methods is
+also reported.
+
+to run (in the amuse root directory):
+
+./amuse.sh test/reports/local_densities_speed.py --n_order=5
+
+"""
+
+from amuse.datamodel.particle_attributes import HopContainer
+from amuse.ic.plummer import new_plummer_model
+from amuse.support.thirdparty import texttable
+
+import time
+import numpy
+
+from optparse import OptionParser
+
+def hop_densities(particles, number_of_neighbours):
+    container = HopContainer()
+    container.initialize(None)
+    hop = container.code
+    hop.particles.add_particles(particles)
+    hop.parameters.density_method = 2
+    hop.parameters.number_of_neighbors_for_local_density = number_of_neighbours
+    hop.calculate_densities()
+    result = hop.particles.density.copy()
+    hop.stop()
+    return result
+
+def measure(particles, number_of_neighbours, number_of_repeats, **options):
+    seconds = []
+    for i in range(number_of_repeats):
+        t0 = time.time()
+        particles.densitycentre_coreradius_coredens(number_of_neighbours = number_of_neighbours, **options)
+        t1 = time.time()
+        seconds.append(t1 - t0)
+    return min(seconds)
+
+def run(n_order, number_of_neighbours, number_of_repeats):
+    table = texttable.Texttable()
+    table.set_cols_dtype(['i', 'f', 'f', 'f', 'e'])
+    table.set_cols_align(["r", "r", "r", "r", "r"])
+    rows = [('particles', 'in process (s)', 'hop (s)', 'reused hop (s)', 'max difference')]
+    for order in range(3, n_order + 1):
+        numpy.random.seed(123)
+        number_of_particles = 10 ** order
+        particles = new_plummer_model(number_of_particles)
+        
+        in_process = measure(particles, number_of_neighbours, number_of_repeats)
+        with_hop = measure(particles, number_of_neighbours, number_of_repeats, use_hop = True)
+        container = HopContainer()
+        with_reused_hop = measure(particles, number_of_neighbours, number_of_repeats, reuse_hop = True, hop = container)
+        container.code.stop()
+        
+        densities = particles.local_densities(number_of_neighbours)
+        difference = abs(hop_densities(particles, number_of_neighbours) / densities - 1).max()
+        rows.append((number_of_particles, in_process, with_hop, with_reused_hop, difference))
+    table.add_rows(rows)
+    print table.draw()
+
+def new_option_parser():
+    result = OptionParser()
+    result.add_option(
+        "-n", "--n_order",
+        dest="n_order",
+        type="int",
+        default=5,
+        help="largest set has 10**n particles"
+    )
+    result.add_option(
+        "-k", "--neighbours",
+        dest="number_of_neighbours",
+        type="int",
+        default=7,
+        help="number of neighbours for the densities"
+    )
+    result.add_option(
+        "-r", "--repeats",
+        dest="number_of_repeats",
+        type="int",
+        default=3,
+        help="number of calls per measurement, the fastest is reported"
+    )
+    return result
+
+if __name__ == '__main__':
+    options, arguments = new_option_parser().parse_args()
+    run(options.n_order, options.number_of_neighbours, options.number_of_repeats)
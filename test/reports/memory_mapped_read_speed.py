@@ -0,0 +1,105 @@
+"""
+Measures the time needed to read a particle set from a version 2.0
+hdf5 file and to calculate the total mass, the center of mass and
+the mean position of a small subset of the particles. Compares
+reading the attributes from the file, reading the attributes in
+memory maps and reading a file written in chunks (which is read
+in blocks). The files are written in another process, the maximum
+resident memory of this process is reported after each measurement,
+run the script with --read to measure one kind of read only.
+
+to run (in the amuse root directory):
+
+./amuse.sh test/reports/memory_mapped_read_speed.py --particles=1000000
+
+"""
+
+from amuse import io
+from amuse.units import nbody_system
+from amuse.ic.plummer import new_plummer_model
+from amuse.support.thirdparty import texttable
+
+import os
+import time
+import numpy
+import resource
+
+from multiprocessing import Pool
+
+from optparse import OptionParser
+
+def write_files(number_of_particles, filename):
+    numpy.random.seed(123)
+    particles = new_plummer_model(number_of_particles)
+    for name, storage_options in (
+            ('contiguous', dict()),
+            ('chunked', dict(chunks = (1 << 16,)))):
+        if os.path.exists(filename + name):
+            os.remove(filename + name)
+        io.write_set_to_file(particles, filename + name, "hdf5", version = '2.0', **storage_options)
+    return particles.total_mass()
+
+def measure(filename, memory_mapped, expected_total_mass):
+    t0 = time.time()
+    particles = io.read_set_from_file(filename, "hdf5", version = '2.0', memory_mapped = memory_mapped)
+    t1 = time.time()
+    total_mass = particles.total_mass()
+    center_of_mass = particles.center_of_mass()
+    t2 = time.time()
+    subset = particles[::1000]
+    mean_position = subset.position.mean(axis = 0)
+    t3 = time.time()
+    if abs(total_mass - expected_total_mass) > 1e-10 * expected_total_mass:
+        raise Exception("total mass differs from the total mass of the stored set")
+    maximum_resident_memory = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return t1 - t0, t2 - t1, t3 - t2, maximum_resident_memory
+
+def run(number_of_particles, filename, reads):
+    pool = Pool(1)
+    expected_total_mass = pool.apply(write_files, (number_of_particles, filename))
+    pool.close()
+
+    table = texttable.Texttable()
+    table.set_cols_dtype(['t', 'i', 'f', 'f', 'f', 'i'])
+    table.set_cols_align(["l", "r", "r", "r", "r", "r"])
+    rows = [('read', 'particles', 'open (s)', 'mass and center (s)', 'subset (s)', 'max resident (kB)')]
+    for name, file_kind, memory_mapped in (
+            ('from file', 'contiguous', False),
+            ('memory mapped', 'contiguous', True),
+            ('in blocks', 'chunked', True)):
+        if reads and not name in reads:
+            continue
+        rows.append((name, number_of_particles) + measure(filename + file_kind, memory_mapped, expected_total_mass))
+    table.add_rows(rows)
+    print table.draw()
+
+    for file_kind in ('contiguous', 'chunked'):
+        os.remove(filename + file_kind)
+
+def new_option_parser():
+    result = OptionParser()
+    result.add_option(
+        "-n", "--particles",
+        dest="number_of_particles",
+        type="int",
+        default=1000000,
+        help="number of particles in the set"
+    )
+    result.add_option(
+        "-f", "--filename",
+        dest="filename",
+        default="memory_mapped_read_speed.hdf5",
+        help="name of the temporary files"
+    )
+    result.add_option(
+        "-r", "--read",
+        dest="reads",
+        action="append",
+        default=[],
+        help="measure only this read ('from file', 'memory mapped' or 'in blocks'), can be repeated"
+    )
+    return result
+
+if __name__ == '__main__':
+    options, arguments = new_option_parser().parse_args()
+    run(options.number_of_particles, options.filename, options.reads)
@@ -0,0 +1,126 @@
+"""
+Measures the time needed to calculate the length of the minimum
+spanning tree of a plummer sphere, with the original implementation
+(a complete graph of the particles and Kruskal's algorithm) and with
+the Euclidean minimum spanning tree on the spatial index. The original
+implementation is skipped for sets larger than --max_graph particles.
+Also measures the mass segregation ratio with the random sets in
+one and in --processes processes.
+
+to run (in the amuse root directory):
+
+./amuse.sh test/reports/minimum_spanning_tree_speed.py --n_order=5
+
+"""
+
+from amuse.units import nbody_system
+from amuse.ic.plummer import new_plummer_model
+from amuse.ext.basicgraph import Graph, MinimumSpanningTree
+from amuse.support.thirdparty import texttable
+
+import numpy
+import time
+
+from optparse import OptionParser
+
+def graph_minimum_spanning_tree_length(particles):
+    """
+    The minimum spanning tree length as implemented before the
+    Euclidean minimum spanning tree, kept here as the reference
+    for the measurements.
+    """
+    graph = Graph()
+    for particle in particles:
+        others = particles - particle
+        distances = (particle.position - others.position).lengths()
+        for other, distance in zip(others, distances):
+            graph.add_edge(particle, other, distance)
+    return sum([edge[0] for edge in MinimumSpanningTree(graph)], 0 | nbody_system.length)
+
+def measure(number_of_particles, max_graph):
+    numpy.random.seed(123)
+    particles = new_plummer_model(number_of_particles)
+
+    if number_of_particles <= max_graph:
+        t0 = time.time()
+        expected = graph_minimum_spanning_tree_length(particles)
+        t1 = time.time()
+        graph_seconds = t1 - t0
+    else:
+        expected = None
+        graph_seconds = -1
+
+    t0 = time.time()
+    length = particles.minimum_spanning_tree_length()
+    t1 = time.time()
+
+    if expected is not None and abs(length - expected) > 1e-10 * expected:
+        raise Exception("length of the Euclidean minimum spanning tree differs from the graph")
+
+    return graph_seconds, t1 - t0, length.value_in(nbody_system.length)
+
+def measure_mass_segregation_ratio(number_of_processes, number_of_random_sets):
+    numpy.random.seed(123)
+    particles = new_plummer_model(100000)
+    particles.mass = numpy.random.uniform(1.0, 2.0, len(particles)) | nbody_system.mass
+    t0 = time.time()
+    particles.mass_segregation_ratio(number_of_particles=1000, number_of_random_sets=number_of_random_sets,
+        number_of_processes=number_of_processes)
+    t1 = time.time()
+    return t1 - t0
+
+def run(n_order, max_graph, number_of_processes, number_of_random_sets):
+    table = texttable.Texttable()
+    table.set_cols_dtype(['i', 'f', 'f', 'f'])
+    table.set_cols_align(["r", "r", "r", "r"])
+    rows = [('particles', 'graph (s)', 'euclidean (s)', 'length')]
+    for order in range(2, n_order + 1):
+        number_of_particles = 10 ** order
+        rows.append((number_of_particles,) + measure(number_of_particles, max_graph))
+    table.add_rows(rows)
+    print table.draw()
+
+    table = texttable.Texttable()
+    table.set_cols_dtype(['i', 'i', 'f'])
+    table.set_cols_align(["r", "r", "r"])
+    rows = [('processes', 'random sets', 'mass segregation ratio (s)')]
+    for processes in sorted(set([1, number_of_processes])):
+        rows.append((processes, number_of_random_sets, measure_mass_segregation_ratio(processes, number_of_random_sets)))
+    table.add_rows(rows)
+    print table.draw()
+
+def new_option_parser():
+    result = OptionParser()
+    result.add_option(
+        "-n", "--n_order",
+        dest="n_order",
+        type="int",
+        default=5,
+        help="largest set has 10**n particles"
+    )
+    result.add_option(
+        "-g", "--max_graph",
+        dest="max_graph",
+        type="int",
+        default=1000,
+        help="largest set to calculate with the complete graph (-1 in the table if skipped)"
+    )
+    result.add_option(
+        "-p", "--processes",
+        dest="number_of_processes",
+        type="int",
+        default=4,
+        help="number of processes for the random sets of the mass segregation ratio"
+    )
+    result.add_option(
+        "-r", "--random_sets",
+        dest="number_of_random_sets",
+        type="int",
+        default=50,
+        help="number of random sets for the mass segregation ratio"
+    )
+    return result
+
+if __name__ == '__main__':
+    options, arguments = new_option_parser().parse_args()
+    run(options.n_order, options.max_graph, options.number_of_processes, options.number_of_random_sets)
@@ -0,0 +1,120 @@
+"""
+Measures the time needed by the functions defined on particle
+sets in amuse.datamodel.particle_attributes, comparing the
+original implementations (arithmetic on quantities) with the
+implementations on a raw view of the set (arithmetic on numpy
+arrays, see AbstractSet.raw).
+
+to run (in the amuse root directory):
+
+./amuse.sh test/reports/particle_attributes_speed.py --n_order=3
+
+"""
+
+from amuse.datamodel import particle_attributes
+from amuse.ic.plummer import new_plummer_model
+from amuse.units import constants
+from amuse.units import nbody_system
+from amuse.units import units
+from amuse.units.quantities import zero
+from amuse.support.thirdparty import texttable
+
+import time
+
+from optparse import OptionParser
+
+def center_of_mass_with_quantities(particles):
+    masses = particles.mass
+    pos = particles.position
+    total_mass = masses.sum()
+    massx = (masses * pos[:,0]).sum()
+    massy = (masses * pos[:,1]).sum()
+    massz = (masses * pos[:,2]).sum()
+    return [massx / total_mass, massy / total_mass, massz / total_mass]
+
+def kinetic_energy_with_quantities(particles):
+    mass = particles.mass
+    vx = particles.vx
+    vy = particles.vy
+    vz = particles.vz
+    v_squared = (vx * vx) + (vy * vy) + (vz * vz)
+    m_v_squared = mass * v_squared
+    return 0.5 * m_v_squared.sum()
+
+def potential_energy_with_quantities(particles, smoothing_length_squared = zero, G = constants.G):
+    mass = particles.mass
+    x_vector = particles.x
+    y_vector = particles.y
+    z_vector = particles.z
+    sum_of_energies = zero
+    for i in range(len(particles) - 1):
+        x = x_vector[i]
+        y = y_vector[i]
+        z = z_vector[i]
+        dx = x - x_vector[i+1:]
+        dy = y - y_vector[i+1:]
+        dz = z - z_vector[i+1:]
+        dr_squared = (dx * dx) + (dy * dy) + (dz * dz)
+        dr = (dr_squared+smoothing_length_squared).sqrt()
+        m_m = mass[i] * mass[i+1:]
+        sum_of_energies -= (m_m / dr).sum()
+    return G * sum_of_energies
+
+def distances_squared_with_quantities(particles, other_particles):
+    transposed_positions = particles.position.reshape((len(particles), 1, -1))
+    dxdydz = transposed_positions - other_particles.position
+    return (dxdydz**2).sum(-1)
+
+def measure(function, particles, number_of_repeats):
+    t0 = time.time()
+    for i in range(number_of_repeats):
+        function(particles)
+    t1 = time.time()
+    return (t1 - t0) / number_of_repeats
+
+def run(n_order, number_of_repeats):
+    converter = nbody_system.nbody_to_si(1000 | units.MSun, 1 | units.parsec)
+    table = texttable.Texttable()
+    table.set_cols_dtype(['i', 't', 'e', 'e', 'f'])
+    table.set_cols_align(["r", "l", "r", "r", "r"])
+    rows = [('particles', 'function', 'quantities (s)', 'raw (s)', 'speedup')]
+    for order in range(1, n_order + 1):
+        number_of_particles = 10 ** order
+        particles = new_plummer_model(number_of_particles, convert_nbody = converter)
+        particles.position = particles.position.as_quantity_in(units.parsec)
+        particles.mass = particles.mass.as_quantity_in(units.MSun)
+        for name, function_with_quantities, function in (
+                ('center_of_mass', center_of_mass_with_quantities, particle_attributes.center_of_mass),
+                ('kinetic_energy', kinetic_energy_with_quantities, particle_attributes.kinetic_energy),
+                ('potential_energy', potential_energy_with_quantities, particle_attributes.potential_energy),
+                ('distances_squared',
+                    lambda x : distances_squared_with_quantities(x, x),
+                    lambda x : particle_attributes.distances_squared(x, x)),
+            ):
+            seconds_with_quantities = measure(function_with_quantities, particles, number_of_repeats)
+            seconds = measure(function, particles, number_of_repeats)
+            rows.append((number_of_particles, name, seconds_with_quantities, seconds, seconds_with_quantities / seconds))
+    table.add_rows(rows)
+    print table.draw()
+
+def new_option_parser():
+    result = OptionParser()
+    result.add_option(
+        "-n", "--n_order",
+        dest="n_order",
+        type="int",
+        default=3,
+        help="largest set has 10**n particles"
+    )
+    result.add_option(
+        "-r", "--repeats",
+        dest="number_of_repeats",
+        type="int",
+        default=3,
+        help="number of calls of every function for every measurement"
+    )
+    return result
+
+if __name__ == '__main__':
+    options, arguments = new_option_parser().parse_args()
+    run(options.n_order, options.number_of_repeats)
@@ -0,0 +1,93 @@
+"""
+Measures the time needed to calculate the potential energy of
+a plummer sphere, comparing the original loop over the particles
+with the blocked pairwise summation and the tree code approximation
+of amuse.datamodel.particle_attributes.potential_energy. Also prints
+the relative error of the tree code approximation.
+
+to run (in the amuse root directory):
+
+./amuse.sh test/reports/potential_energy_speed.py --n_order=4 --threads=4
+
+"""
+
+from amuse.ic.plummer import new_plummer_model
+from amuse.units import nbody_system
+from amuse.support.thirdparty import texttable
+
+import numpy
+import time
+
+from optparse import OptionParser
+
+def potential_energy_in_a_loop(particles):
+    raw = particles.raw()
+    mass = raw.mass
+    x_vector = raw.x
+    y_vector = raw.y
+    z_vector = raw.z
+    sum_of_energies = 0.0
+    for i in range(len(particles) - 1):
+        dx = x_vector[i] - x_vector[i+1:]
+        dy = y_vector[i] - y_vector[i+1:]
+        dz = z_vector[i] - z_vector[i+1:]
+        dr = numpy.sqrt((dx * dx) + (dy * dy) + (dz * dz))
+        sum_of_energies -= (mass[i] * mass[i+1:] / dr).sum()
+    return nbody_system.G * (sum_of_energies | nbody_system.mass**2 / nbody_system.length)
+
+def measure(function):
+    t0 = time.time()
+    result = function()
+    t1 = time.time()
+    return result, t1 - t0
+
+def run(n_order, number_of_threads, opening_angle):
+    table = texttable.Texttable()
+    table.set_cols_dtype(['i', 't', 'e', 'e'])
+    table.set_cols_align(["r", "l", "r", "r"])
+    rows = [('particles', 'method', 'seconds', 'relative error')]
+    numpy.random.seed(123)
+    for order in range(2, n_order + 1):
+        particles = new_plummer_model(10 ** order)
+        exact, seconds = measure(lambda : particles.potential_energy(G = nbody_system.G))
+        for name, function in (
+                ('loop', lambda : potential_energy_in_a_loop(particles)),
+                ('blocks', lambda : particles.potential_energy(G = nbody_system.G)),
+                ('blocks, {0} threads'.format(number_of_threads),
+                    lambda : particles.potential_energy(G = nbody_system.G, number_of_threads = number_of_threads)),
+                ('tree, opening angle {0}'.format(opening_angle),
+                    lambda : particles.potential_energy(G = nbody_system.G, opening_angle = opening_angle)),
+            ):
+            energy, seconds = measure(function)
+            rows.append((len(particles), name, seconds, abs((energy - exact) / exact)))
+    table.add_rows(rows)
+    print table.draw()
+
+def new_option_parser():
+    result = OptionParser()
+    result.add_option(
+        "-n", "--n_order",
+        dest="n_order",
+        type="int",
+        default=4,
+        help="largest set has 10**n particles"
+    )
+    result.add_option(
+        "-t", "--threads",
+        dest="number_of_threads",
+        type="int",
+        default=4,
+        help="number of threads for the blocked summation"
+    )
+    result.add_option(
+        "-a", "--opening_angle",
+        dest="opening_angle",
+        type="float",
+        default=0.5,
+        help="opening angle of the tree code approximation"
+    )
+    return result
+
+if __name__ == '__main__':
+    options, arguments = new_option_parser().parse_args()
+    run(options.n_order, options.number_of_threads, options.opening_angle)
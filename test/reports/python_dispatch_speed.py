@@ -0,0 +1,128 @@
+"""
+Measures the number of calls per second handled by the
+python implementation of a community code, for a legacy function
+called with arrays of N elements. Compares the original per element
+dispatch (keyword arguments made for every element), the
+dispatch with a call plan made once per function, and a vectorized
+implementation of the function.
+
+to run (in the amuse root directory):
+
+./amuse.sh test/reports/python_dispatch_speed.py --n_order=5
+
+"""
+
+from amuse.rfi import python_code
+from amuse.rfi.core import legacy_function
+from amuse.rfi.core import LegacyFunctionSpecification
+from amuse.rfi.core import PythonCodeInterface
+from amuse.support.thirdparty import texttable
+
+import numpy
+import time
+
+from optparse import OptionParser
+
+class DispatchSpeedInterface(PythonCodeInterface):
+
+    @legacy_function
+    def get_state():
+        function = LegacyFunctionSpecification()
+        function.addParameter('index_of_the_particle', dtype='int32', direction=function.IN)
+        for x in ['mass', 'x', 'y', 'z', 'vx', 'vy', 'vz', 'radius']:
+            function.addParameter(x, dtype='float64', direction=function.OUT)
+        function.result_type = 'int32'
+        function.can_handle_array = True
+        return function
+
+class DispatchSpeedImplementation(object):
+
+    def __init__(self, number_of_particles):
+        self.state = numpy.random.random((8, number_of_particles))
+
+    def get_state(self, index_of_the_particle, mass, x, y, z, vx, vy, vz, radius):
+        for i, value in enumerate([mass, x, y, z, vx, vy, vz, radius]):
+            value.value = self.state[i][index_of_the_particle]
+        return 0
+
+class VectorizedDispatchSpeedImplementation(DispatchSpeedImplementation):
+
+    @python_code.vectorized
+    def get_state(self, index_of_the_particle, mass, x, y, z, vx, vy, vz, radius):
+        return DispatchSpeedImplementation.get_state(self, index_of_the_particle, mass, x, y, z, vx, vy, vz, radius)
+
+class PerElementPythonImplementation(python_code.PythonImplementation):
+    """
+    The dispatch for functions that do not handle arrays, as
+    implemented before the call plans, kept here as the reference
+    for the measurements.
+    """
+
+    def get_call_plan(self, specification, method):
+        implementation = self
+
+        class PerElementCall(object):
+            def call_for_each_element(self, input_message, output_message):
+                for index in range(input_message.call_count):
+                    keyword_arguments = implementation.new_keyword_arguments_from_message(input_message, index,  specification)
+                    try:
+                        result = method(**keyword_arguments)
+                    except TypeError:
+                        result = method(*list(keyword_arguments))
+                    implementation.fill_output_message(output_message, index, result, keyword_arguments, specification)
+
+        return PerElementCall()
+
+def measure(implementation_class, python_implementation_class, number_of_particles, number_of_repeats):
+    implementation = implementation_class(number_of_particles)
+    x = python_implementation_class(implementation, DispatchSpeedInterface)
+    function_id = DispatchSpeedInterface.get_state.specification.id
+
+    t0 = time.time()
+    for i in range(number_of_repeats):
+        input_message = python_code.SocketMessage(0, function_id, number_of_particles)
+        input_message.ints = numpy.arange(number_of_particles, dtype='int32')
+        output_message = python_code.SocketMessage(0, function_id, number_of_particles)
+        x.handle_message(input_message, output_message)
+    t1 = time.time()
+
+    return (t1 - t0) / number_of_repeats
+
+def run(n_order, number_of_repeats):
+    table = texttable.Texttable()
+    table.set_cols_dtype(['i', 't', 'f', 'f'])
+    table.set_cols_align(["r", "l", "r", "r"])
+    rows = [('elements', 'dispatch', 'seconds', 'calls/s')]
+    for order in range(1, n_order + 1):
+        number_of_particles = 10 ** order
+        for name, implementation_class, python_implementation_class in (
+                ('per element', DispatchSpeedImplementation, PerElementPythonImplementation),
+                ('call plan', DispatchSpeedImplementation, python_code.PythonImplementation),
+                ('vectorized', VectorizedDispatchSpeedImplementation, python_code.PythonImplementation),
+            ):
+            seconds = measure(implementation_class, python_implementation_class, number_of_particles, number_of_repeats)
+            rows.append((number_of_particles, name, seconds, number_of_particles / seconds))
+    table.add_rows(rows)
+    print table.draw()
+
+def new_option_parser():
+    result = OptionParser()
+    result.add_option(
+        "-n", "--n_order",
+        dest="n_order",
+        type="int",
+        default=5,
+        help="largest call is done for 10**n elements"
+    )
+    result.add_option(
+        "-r", "--repeats",
+        dest="number_of_repeats",
+        type="int",
+        default=3,
+        help="number of calls to handle for every measurement"
+    )
+    return result
+
+if __name__ == '__main__':
+    options, arguments = new_option_parser().parse_args()
+    run(options.n_order, options.number_of_repeats)
@@ -0,0 +1,89 @@
+"""
+Profiles the calls to a community code, for every function it
+reports the number of calls, the elements per call, the bytes sent
+and received and the time spent serialising the arguments, waiting on
+the worker and converting the results.
+
+to run (in the amuse root directory):
+
+./amuse.sh test/reports/rpc_profile.py --code=bhtree --particles=1000 --channel_type=sockets
+
+"""
+
+from amuse.rfi.core import call_profile
+from amuse.units import nbody_system
+from amuse.ic.plummer import new_plummer_model
+
+from optparse import OptionParser
+
+def new_code_factory(name):
+    if name == 'bhtree':
+        from amuse.community.bhtree.interface import BHTree
+        return BHTree
+    elif name == 'hermite':
+        from amuse.community.hermite0.interface import Hermite
+        return Hermite
+    elif name == 'phigrape':
+        from amuse.community.phiGRAPE.interface import PhiGRAPE
+        return PhiGRAPE
+    else:
+        raise Exception("unknown code {0!r}, use bhtree, hermite or phigrape".format(name))
+
+def run(code_name, number_of_particles, number_of_steps, channel_type, filename):
+    particles = new_plummer_model(number_of_particles)
+    code = new_code_factory(code_name)(channel_type = channel_type)
+    code.parameters.epsilon_squared = 0.01 | nbody_system.length ** 2
+
+    call_profile.start()
+    code.particles.add_particles(particles)
+    channel = code.particles.new_channel_to(particles)
+    for step in range(1, number_of_steps + 1):
+        code.evolve_model(step * (1.0 / 64) | nbody_system.time)
+        channel.copy()
+        code.get_total_energy()
+    call_profile.stop()
+    code.stop()
+
+    print call_profile.as_table()
+    if filename:
+        call_profile.write_to_file(filename)
+
+def new_option_parser():
+    result = OptionParser()
+    result.add_option(
+        "-c", "--code",
+        dest="code_name",
+        default="bhtree",
+        help="code to profile (bhtree, hermite or phigrape)"
+    )
+    result.add_option(
+        "-n", "--particles",
+        dest="number_of_particles",
+        type="int",
+        default=1000,
+        help="number of particles"
+    )
+    result.add_option(
+        "-s", "--steps",
+        dest="number_of_steps",
+        type="int",
+        default=10,
+        help="number of steps to evolve the model"
+    )
+    result.add_option(
+        "-t", "--channel_type",
+        dest="channel_type",
+        default="mpi",
+        help="channel to the worker (mpi or sockets)"
+    )
+    result.add_option(
+        "-o", "--output",
+        dest="filename",
+        default="",
+        help="also write the table to this file"
+    )
+    return result
+
+if __name__ == '__main__':
+    options, arguments = new_option_parser().parse_args()
+    run(options.code_name, options.number_of_particles, options.number_of_steps, options.channel_type, options.filename)
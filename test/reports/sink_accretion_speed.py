@@ -0,0 +1,194 @@
+"""
+Measures the time needed to accrete the gas particles within the
+radii of a number of sinks, comparing the original accretion (a
+loop over the sinks or over the gas particles in python, with the
+particles in more than one sink radius resolved one at a time)
+with the accretion on a k-d tree of the sinks (SinkParticles.accrete).
+The sinks are randomly placed in a uniform sphere of gas and accrete
+about 1% of the gas.
+
+to run (in the amuse root directory):
+
+./amuse.sh test/reports/sink_accretion_speed.py --n_order=5 --sinks=100
+
+"""
+
+from amuse.ext.sink import SinkParticles, angular_momentum
+from amuse.datamodel import Particles
+from amuse.units import units
+from amuse.units.quantities import AdaptingVectorQuantity
+from amuse.support.exceptions import AmuseException
+from amuse.support.thirdparty import texttable
+
+import time
+import numpy
+
+from optparse import OptionParser
+
+class OriginalSinkParticles(SinkParticles):
+
+    def select_too_close(self, others):
+        too_close = []
+        for pos, r_squared in zip(self.position, self.sink_radius**2):
+            subset = others[(others.position-pos).lengths_squared() < r_squared]
+            too_close.append(subset)
+        return too_close
+
+    def accrete_looping_over_sinks(self, orgparticles):
+        particles=orgparticles.copy()
+        others = (particles - self.get_intersecting_subset_in(particles))
+        too_close = self.select_too_close(others)
+        try:
+            all_too_close = sum(too_close, particles[0:0])
+        except AmuseException as ex:
+            too_close = self.resolve_duplicates(too_close, particles)
+            all_too_close = sum(too_close, particles[0:0])
+        if len(all_too_close):
+            self.aggregate_mass(too_close)
+            orgparticles.remove_particles(all_too_close)
+        return all_too_close
+
+    def resolve_duplicates(self, too_close, particles):
+        # Find the particles that are within more than one sink's radius
+        duplicates = particles[0:0]
+        keys = set()
+        for subset in too_close:
+            for particle in subset:
+                if (particle.key in keys) and (particle.key not in duplicates.key):
+                    duplicates += particle
+                else:
+                    keys.add(particle.key)
+
+        # Determine which sink's attraction is strongest
+        strongest_sinks = []
+        for duplicate in duplicates:
+            candidate_sinks = []
+            for index, subset in enumerate(too_close):
+                if duplicate in subset:
+                    candidate_sinks.append(index)
+            attraction = self[candidate_sinks].mass/(self[candidate_sinks].position-duplicate.position).lengths_squared()
+            strongest_sinks.append(candidate_sinks[numpy.where(attraction==attraction.amax())[0][0]])
+        # Define a new list with particles to be accreted, without the duplicates
+        result = []
+        for index, subset in enumerate(too_close):
+            for duplicate, strongest_sink in zip(duplicates, strongest_sinks):
+                if duplicate in subset and not index == strongest_sink:
+                    subset -= duplicate
+            result.append(subset)
+        return result
+
+    def accrete_looping_over_sources(self, orgparticles):
+        if len(self) == 0:
+            return
+        particles=orgparticles.copy()
+        others = (particles - self.get_intersecting_subset_in(particles))
+        too_close = [particles[0:0] for p in self]
+        all_too_close=particles[0:0]
+        positions=self.position
+        masses=self.mass
+        sink_radii2=self.sink_radius**2
+        for p in others:
+            d2=(positions-p.position).lengths_squared()
+            a=numpy.where(d2<sink_radii2)[0]
+            if len(a) > 0:
+                amin=(d2[a]/masses[a]).argmin()
+                too_close[a[amin]]+=p
+                all_too_close+=p
+        if len(all_too_close):
+            self.aggregate_mass(too_close)
+            orgparticles.remove_particles(all_too_close)
+        return all_too_close
+
+    def aggregate_mass(self,too_close):
+        corrected_masses = AdaptingVectorQuantity()
+        corrected_positions = AdaptingVectorQuantity()
+        corrected_velocities = AdaptingVectorQuantity()
+        corrected_angular_momenta = AdaptingVectorQuantity()
+        for subset, m, pos, vel, Lin in zip(too_close, self.mass, self.position, self.velocity, self.angular_momentum):
+            if len(subset):
+                total_mass = subset.total_mass() + m
+                cmpos=(m*pos + subset.total_mass()*subset.center_of_mass())/total_mass
+                cmvel=(m*vel + subset.total_mass()*subset.center_of_mass_velocity())/total_mass
+                L=Lin+angular_momentum(m,pos-cmpos,vel-cmvel)+angular_momentum(subset.mass,subset.position-cmpos,subset.velocity-cmvel).sum(axis=0)
+                corrected_masses.append(total_mass)
+                corrected_positions.append(cmpos)
+                corrected_velocities.append(cmvel)
+                corrected_angular_momenta.append(L)
+            else:
+                corrected_masses.append(m)
+                corrected_positions.append(pos)
+                corrected_velocities.append(vel)
+                corrected_angular_momenta.append(Lin)
+        self.mass = corrected_masses
+        self.position = corrected_positions
+        self.velocity = corrected_velocities
+        self.angular_momentum = corrected_angular_momenta
+
+def new_particles(number_of_particles, number_of_sinks):
+    numpy.random.seed(123)
+    particles = Particles(number_of_particles)
+    particles.mass = numpy.random.uniform(1.0, 2.0, number_of_particles) | units.MSun
+    particles.position = numpy.random.uniform(-1.0, 1.0, (number_of_particles, 3)) | units.parsec
+    particles.velocity = numpy.random.normal(0.0, 1.0, (number_of_particles, 3)) | units.kms
+    # about 1% of the volume of the cube is within the radius of a sink
+    particles.radius = (0.01 * 8 / (4.0 / 3.0 * numpy.pi * number_of_sinks))**(1.0 / 3.0) | units.parsec
+    return particles
+
+def measure(sink_factory, number_of_particles, number_of_sinks, looping_over):
+    particles = new_particles(number_of_particles, number_of_sinks)
+    sinks = sink_factory(particles[:number_of_sinks], looping_over = looping_over)
+    t0 = time.time()
+    accreted = sinks.accrete(particles)
+    t1 = time.time()
+    return t1 - t0, len(accreted), sinks.mass.sum()
+
+def run(n_order, number_of_sinks, max_order_of_original):
+    table = texttable.Texttable()
+    table.set_cols_dtype(['i', 'i', 'i', 't', 't', 'f'])
+    table.set_cols_align(["r", "r", "r", "r", "r", "r"])
+    rows = [('particles', 'sinks', 'accreted', 'over sinks (s)', 'over sources (s)', 'vectorised (s)')]
+    for order in range(3, n_order + 1):
+        number_of_particles = 10 ** order
+        seconds, number_of_accreted, mass = measure(SinkParticles, number_of_particles, number_of_sinks, "sinks")
+        original = []
+        for looping_over in ("sinks", "sources"):
+            if order <= max_order_of_original:
+                original_seconds, original_number_of_accreted, original_mass = measure(
+                    OriginalSinkParticles, number_of_particles, number_of_sinks, looping_over)
+                if original_number_of_accreted != number_of_accreted or abs(original_mass - mass) > 1e-12 * mass:
+                    raise Exception("accreted particles differ between the implementations")
+                original.append('{0:.3f}'.format(original_seconds))
+            else:
+                original.append('-')
+        rows.append((number_of_particles, number_of_sinks, number_of_accreted, original[0], original[1], seconds))
+    table.add_rows(rows)
+    print table.draw()
+
+def new_option_parser():
+    result = OptionParser()
+    result.add_option(
+        "-n", "--n_order",
+        dest="n_order",
+        type="int",
+        default=5,
+        help="largest set has 10**n particles"
+    )
+    result.add_option(
+        "-s", "--sinks",
+        dest="number_of_sinks",
+        type="int",
+        default=100,
+        help="number of sinks"
+    )
+    result.add_option(
+        "-o", "--original_order",
+        dest="max_order_of_original",
+        type="int",
+        default=4,
+        help="the original accretion is only measured for sets up to 10**n particles"
+    )
+    return result
+
+if __name__ == '__main__':
+    options, arguments = new_option_parser().parse_args()
+    run(options.n_order, options.number_of_sinks, options.max_order_of_original)
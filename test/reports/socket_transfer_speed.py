@@ -0,0 +1,123 @@
+"""
+Measures the throughput (bytes per second) of transferring
+particle state messages over a socket, comparing the
+original chunked, copying implementation of the socket
+message with the current zero-copy implementation.
+
+to run (in the amuse root directory):
+
+./amuse.sh test/reports/socket_transfer_speed.py --n_order=6
+
+"""
+
+from amuse.rfi.channel import SocketMessage
+from amuse.support import exceptions
+from amuse.support.thirdparty import texttable
+
+import numpy
+import socket
+import threading
+import time
+
+from optparse import OptionParser
+
+class CopyingSocketMessage(SocketMessage):
+    """
+    The socket message as implemented before the zero-copy
+    transport, kept here as the reference for the measurements.
+    """
+
+    def _receive_all(self, nbytes, thesocket):
+        result = []
+        while nbytes > 0:
+            chunk = min(nbytes, 10240)
+            data_bytes = thesocket.recv(chunk)
+            if len(data_bytes) == 0:
+                raise exceptions.CodeException("lost connection to code")
+            result.append(data_bytes)
+            nbytes -= len(data_bytes)
+        return "".join(result)
+
+    def _receive_array(self, thesocket, count, dtype):
+        data_bytes = self._receive_all(count * numpy.dtype(dtype).itemsize, thesocket)
+        return numpy.copy(numpy.frombuffer(data_bytes, dtype=dtype))
+
+    def send(self, socket):
+        for x in self.buffers_to_send():
+            if isinstance(x, numpy.ndarray):
+                x = x.tostring()
+            socket.sendall(x)
+
+def new_state_message(message_class, number_of_particles):
+    """
+    A message with the same layout as the reply of a get_state
+    call (mass, x, y, z, vx, vy, vz and radius for every particle)
+    """
+    doubles = [numpy.random.random(number_of_particles) for i in range(8)]
+    ints = [numpy.zeros(number_of_particles, dtype='int32')]
+    return message_class(1, 1, number_of_particles, {'float64': doubles, 'int32':ints})
+
+def measure(message_class, number_of_particles, number_of_repeats):
+    message = new_state_message(message_class, number_of_particles)
+    number_of_bytes = sum([x.nbytes for x in message.buffers_to_send()])
+
+    sender, receiver = socket.socketpair()
+
+    def send_all():
+        for i in range(number_of_repeats):
+            message.send(sender)
+
+    thread = threading.Thread(target = send_all)
+
+    t0 = time.time()
+    thread.start()
+    for i in range(number_of_repeats):
+        message_class().receive(receiver)
+    thread.join()
+    t1 = time.time()
+
+    sender.close()
+    receiver.close()
+
+    return number_of_bytes, (t1 - t0) / number_of_repeats
+
+def run(n_order, number_of_repeats):
+    table = texttable.Texttable()
+    table.set_cols_dtype(['i', 'i', 't', 'f', 'f'])
+    table.set_cols_align(["r", "r", "l", "r", "r"])
+    rows = [('particles', 'bytes', 'message', 'seconds', 'MB/s')]
+    for order in range(2, n_order + 1):
+        number_of_particles = 10 ** order
+        for message_class in (CopyingSocketMessage, SocketMessage):
+            number_of_bytes, seconds = measure(message_class, number_of_particles, number_of_repeats)
+            rows.append((
+                number_of_particles,
+                number_of_bytes,
+                message_class.__name__,
+                seconds,
+                number_of_bytes / seconds / 1.0e6
+            ))
+    table.add_rows(rows)
+    print table.draw()
+
+def new_option_parser():
+    result = OptionParser()
+    result.add_option(
+        "-n", "--n_order",
+        dest="n_order",
+        type="int",
+        default=6,
+        help="largest message holds the state of 10**n particles"
+    )
+    result.add_option(
+        "-r", "--repeats",
+        dest="number_of_repeats",
+        type="int",
+        default=5,
+        help="number of messages to send for every measurement"
+    )
+    return result
+
+if __name__ == '__main__':
+    options, arguments = new_option_parser().parse_args()
+    run(options.n_order, options.number_of_repeats)
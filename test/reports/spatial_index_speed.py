@@ -0,0 +1,97 @@
+"""
+Measures the time needed to find the nearest neighbour of every
+particle in a plummer sphere, with the original direct search (all
+distances, computed in batches) and with the spatial index (k-d
+tree) of the particle set. Also reports the time to build the index
+and to find all pairs of particles closer than the mean
+interparticle distance. The direct search is skipped for sets
+larger than --max_direct particles.
+
+to run (in the amuse root directory):
+
+./amuse.sh test/reports/spatial_index_speed.py --n_order=6
+
+"""
+
+from amuse.units import nbody_system
+from amuse.ic.plummer import new_plummer_model
+from amuse.datamodel.spatial_index import ParticlesSpatialIndex
+from amuse.support.thirdparty import texttable
+
+import numpy
+import time
+
+from optparse import OptionParser
+
+def direct_nearest_neighbour(particles, max_array_length = 10000000):
+    """
+    The nearest neighbour search as implemented before the spatial
+    index, kept here as the reference for the measurements.
+    """
+    neighbour_indices = []
+    particles_per_batch = max(1, max_array_length // (3 * len(particles)))
+    for first in range(0, len(particles), particles_per_batch):
+        indices = numpy.arange(first, min(first + particles_per_batch, len(particles)))
+        distances_squared = particles[indices].distances_squared(particles)
+        distances_squared.number[numpy.arange(len(indices)), indices] = numpy.inf
+        neighbour_indices.append(distances_squared.argmin(axis=1))
+    return particles[numpy.concatenate(neighbour_indices)]
+
+def measure(number_of_particles, max_direct):
+    numpy.random.seed(123)
+    particles = new_plummer_model(number_of_particles)
+
+    if number_of_particles <= max_direct:
+        t0 = time.time()
+        expected = direct_nearest_neighbour(particles)
+        t1 = time.time()
+        direct_seconds = t1 - t0
+    else:
+        expected = None
+        direct_seconds = -1
+
+    t0 = time.time()
+    index = ParticlesSpatialIndex(particles)
+    t1 = time.time()
+    neighbours = particles[index.query_neighbours()[1][:, 0]]
+    t2 = time.time()
+    i, j = index.query_pairs(number_of_particles ** (-1.0/3.0) | nbody_system.length)
+    t3 = time.time()
+
+    if expected is not None and not numpy.all(expected.key == neighbours.key):
+        raise Exception("nearest neighbours found with the spatial index differ from the direct search")
+
+    return direct_seconds, t1 - t0, t2 - t1, t3 - t2, len(i)
+
+def run(n_order, max_direct):
+    table = texttable.Texttable()
+    table.set_cols_dtype(['i', 'f', 'f', 'f', 'f', 'i'])
+    table.set_cols_align(["r", "r", "r", "r", "r", "r"])
+    rows = [('particles', 'direct (s)', 'build (s)', 'neighbours (s)', 'pairs (s)', 'pairs')]
+    for order in range(2, n_order + 1):
+        number_of_particles = 10 ** order
+        rows.append((number_of_particles,) + measure(number_of_particles, max_direct))
+    table.add_rows(rows)
+    print table.draw()
+
+def new_option_parser():
+    result = OptionParser()
+    result.add_option(
+        "-n", "--n_order",
+        dest="n_order",
+        type="int",
+        default=6,
+        help="largest set has 10**n particles"
+    )
+    result.add_option(
+        "-d", "--max_direct",
+        dest="max_direct",
+        type="int",
+        default=20000,
+        help="largest set to search directly (-1 in the table if skipped)"
+    )
+    return result
+
+if __name__ == '__main__':
+    options, arguments = new_option_parser().parse_args()
+    run(options.n_order, options.max_direct)
@@ -0,0 +1,113 @@
+"""
+Measures the throughput of a call that is split in blocks
+(a call of get_potential_at_point of the twobody code, for
+many points), for several block lengths (max_message_length) and
+numbers of blocks send before the first reply is received
+(split_message_window). With a window of 1 every block waits for
+the reply to the previous block.
+
+to run (in the amuse root directory):
+
+./amuse.sh test/reports/split_message_speed.py --points=1000000 --channel_type=sockets
+
+"""
+
+from amuse.community.twobody.interface import TwoBodyInterface
+from amuse.support.thirdparty import texttable
+
+import time
+import numpy
+
+from optparse import OptionParser
+
+# 4 doubles send and 1 double and 1 int received per point
+BYTES_PER_POINT = 4 * 8 + 8 + 4
+
+def new_code(channel_type, max_message_length, split_message_window):
+    code = TwoBodyInterface(
+        channel_type = channel_type,
+        max_message_length = max_message_length,
+        split_message_window = split_message_window
+    )
+    code.initialize_code()
+    code.new_particle([1.0, 1.0], [0.0, 1.0], [0.0, 0.0], [0.0, 0.0], [0.0, 0.0], [0.0, 0.5], [0.0, 0.0], [0.0, 0.0])
+    code.commit_particles()
+    return code
+
+def measure(number_of_points, channel_type, max_message_length, split_message_window, number_of_repeats):
+    code = new_code(channel_type, max_message_length, split_message_window)
+    x = numpy.linspace(2.0, 3.0, number_of_points)
+    zeros = numpy.zeros(number_of_points)
+    seconds = []
+    for i in range(number_of_repeats):
+        t0 = time.time()
+        result = code.get_potential_at_point(zeros, x, zeros, zeros)
+        t1 = time.time()
+        seconds.append(t1 - t0)
+    code.stop()
+    if len(result['phi']) != number_of_points:
+        raise Exception("number of potentials differs from the number of points")
+    seconds = min(seconds)
+    return seconds, number_of_points * BYTES_PER_POINT / seconds / 1e6
+
+def run(number_of_points, channel_type, block_lengths, windows, number_of_repeats):
+    table = texttable.Texttable()
+    table.set_cols_dtype(['i', 'i', 'i', 'f', 'f'])
+    table.set_cols_align(["r", "r", "r", "r", "r"])
+    rows = [('points', 'block length', 'window', 'seconds', 'throughput (MB/s)')]
+    for max_message_length in block_lengths:
+        for split_message_window in windows:
+            rows.append((number_of_points, max_message_length, split_message_window) +
+                measure(number_of_points, channel_type, max_message_length, split_message_window, number_of_repeats))
+    table.add_rows(rows)
+    print table.draw()
+
+def new_option_parser():
+    result = OptionParser()
+    result.add_option(
+        "-n", "--points",
+        dest="number_of_points",
+        type="int",
+        default=1000000,
+        help="number of points in the call"
+    )
+    result.add_option(
+        "-t", "--channel_type",
+        dest="channel_type",
+        default="mpi",
+        help="channel to the worker (mpi or sockets)"
+    )
+    result.add_option(
+        "-b", "--block_length",
+        dest="block_lengths",
+        type="int",
+        action="append",
+        default=[],
+        help="length of the blocks, can be repeated (default 10000, 100000 and 1000000)"
+    )
+    result.add_option(
+        "-w", "--window",
+        dest="windows",
+        type="int",
+        action="append",
+        default=[],
+        help="number of blocks in flight, can be repeated (default 1, 2 and 4)"
+    )
+    result.add_option(
+        "-r", "--repeats",
+        dest="number_of_repeats",
+        type="int",
+        default=3,
+        help="number of calls per measurement, the fastest is reported"
+    )
+    return result
+
+if __name__ == '__main__':
+    options, arguments = new_option_parser().parse_args()
+    run(
+        options.number_of_points,
+        options.channel_type,
+        options.block_lengths or [10000, 100000, 1000000],
+        options.windows or [1, 2, 4],
+        options.number_of_repeats
+    )
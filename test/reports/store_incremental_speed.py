@@ -0,0 +1,90 @@
+"""
+Measures the time needed to store a number of snapshots of a
+particle set, where only the positions and velocities change between
+snapshots, and the size of the resulting file. Compares the
+version 2.0 hdf5 format with and without incremental storage, with
+compression and with the attributes stored along the time axis.
+
+to run (in the amuse root directory):
+
+./amuse.sh test/reports/store_incremental_speed.py --particles=100000 --snapshots=20
+
+"""
+
+from amuse import io
+from amuse.units import nbody_system
+from amuse.ic.plummer import new_plummer_model
+from amuse.support.thirdparty import texttable
+
+import os
+import time
+import numpy
+
+from optparse import OptionParser
+
+def measure(particles, number_of_snapshots, filename, storage_options):
+    if os.path.exists(filename):
+        os.remove(filename)
+    dt = 0.001 | nbody_system.time
+
+    t0 = time.time()
+    for i in range(number_of_snapshots):
+        io.write_set_to_file(particles, filename, "hdf5", version = '2.0', **storage_options)
+        particles.position += particles.velocity * dt
+        particles.velocity *= 1.001
+    t1 = time.time()
+
+    number_of_bytes = os.path.getsize(filename)
+    loaded = io.read_set_from_file(filename, "hdf5", version = '2.0', close_file = True)
+    if not (loaded.mass == particles.mass).all():
+        raise Exception("loaded mass differs from the stored mass")
+    os.remove(filename)
+    return t1 - t0, number_of_bytes
+
+def run(number_of_particles, number_of_snapshots, filename):
+    numpy.random.seed(123)
+    particles = new_plummer_model(number_of_particles)
+    particles.radius = 0.01 | nbody_system.length
+
+    table = texttable.Texttable()
+    table.set_cols_dtype(['t', 'i', 'i', 'f', 'i'])
+    table.set_cols_align(["l", "r", "r", "r", "r"])
+    rows = [('storage', 'particles', 'snapshots', 'store (s)', 'file size (bytes)')]
+    for name, storage_options in (
+            ('full', dict()),
+            ('incremental', dict(incremental = True)),
+            ('incremental, gzip', dict(incremental = True, compression = "gzip", shuffle = True)),
+            ('time axis', dict(append_to_time_axis = True)),
+            ('time axis, gzip', dict(append_to_time_axis = True, compression = "gzip", shuffle = True))):
+        seconds, number_of_bytes = measure(particles.copy(), number_of_snapshots, filename, storage_options)
+        rows.append((name, number_of_particles, number_of_snapshots, seconds, number_of_bytes))
+    table.add_rows(rows)
+    print table.draw()
+
+def new_option_parser():
+    result = OptionParser()
+    result.add_option(
+        "-n", "--particles",
+        dest="number_of_particles",
+        type="int",
+        default=100000,
+        help="number of particles in the set"
+    )
+    result.add_option(
+        "-s", "--snapshots",
+        dest="number_of_snapshots",
+        type="int",
+        default=20,
+        help="number of snapshots to store"
+    )
+    result.add_option(
+        "-f", "--filename",
+        dest="filename",
+        default="store_incremental_speed.hdf5",
+        help="file to store the snapshots in (removed afterwards)"
+    )
+    return result
+
+if __name__ == '__main__':
+    options, arguments = new_option_parser().parse_args()
+    run(options.number_of_particles, options.number_of_snapshots, options.filename)
@@ -0,0 +1,78 @@
+"""
+Measures the number of quantity operations per second, for
+scalar quantities (where the unit algebra dominates), with and
+without the cache of simple forms and conversion factors in
+amuse.units.core. Also reports the hit rates of the cache.
+
+to run (in the amuse root directory):
+
+./amuse.sh test/reports/unit_conversion_speed.py --repeats=10000
+
+"""
+
+from amuse.units import core
+from amuse.units import units
+from amuse.support.thirdparty import texttable
+
+import time
+
+from optparse import OptionParser
+
+def operations(number_of_repeats):
+    mass = 1.0 | units.MSun
+    distance = 1.0 | units.parsec
+    velocity = 1.0 | units.kms
+    for i in range(number_of_repeats):
+        energy = mass * velocity * velocity
+        acceleration = energy / (mass * distance)
+        acceleration.value_in(units.m / units.s**2)
+        (distance / velocity).value_in(units.Myr)
+        
+def measure(is_enabled, number_of_repeats):
+    core.unit_cache.clear()
+    core.unit_cache.is_enabled = is_enabled
+    t0 = time.time()
+    operations(number_of_repeats)
+    t1 = time.time()
+    core.unit_cache.is_enabled = True
+    return t1 - t0
+
+def run(number_of_repeats):
+    table = texttable.Texttable()
+    table.set_cols_dtype(['t', 'f', 'f'])
+    table.set_cols_align(["l", "r", "r"])
+    rows = [('cache', 'seconds', 'loops/s')]
+    for is_enabled in (False, True):
+        seconds = measure(is_enabled, number_of_repeats)
+        rows.append(('on' if is_enabled else 'off', seconds, number_of_repeats / seconds))
+    table.add_rows(rows)
+    print table.draw()
+    
+    core.unit_cache.clear()
+    core.unit_cache.start_counting()
+    operations(number_of_repeats)
+    core.unit_cache.stop_counting()
+    
+    table = texttable.Texttable()
+    table.set_cols_dtype(['t', 'i', 'i', 'f'])
+    table.set_cols_align(["l", "r", "r", "r"])
+    rows = [('kind', 'hits', 'misses', 'hit rate')]
+    for kind, (hits, misses, rate) in sorted(core.unit_cache.hit_rates().items()):
+        rows.append((kind, hits, misses, rate))
+    table.add_rows(rows)
+    print table.draw()
+
+def new_option_parser():
+    result = OptionParser()
+    result.add_option(
+        "-r", "--repeats",
+        dest="number_of_repeats",
+        type="int",
+        default=10000,
+        help="number of times to do the quantity operations"
+    )
+    return result
+
+if __name__ == '__main__':
+    options, arguments = new_option_parser().parse_args()
+    run(options.number_of_repeats)
@@ -0,0 +1,82 @@
+"""
+Measures the time needed to create, initialize and stop an
+instance of a community code, with a new worker for every
+instance and with the workers taken from a worker pool.
+
+to run (in the amuse root directory):
+
+./amuse.sh test/reports/worker_pool_speed.py --code=bhtree --instances=100
+
+"""
+
+from amuse.rfi.core import WorkerPool
+from amuse.support.thirdparty import texttable
+
+import time
+
+from optparse import OptionParser
+
+def new_code_factory(name):
+    if name == 'bhtree':
+        from amuse.community.bhtree.interface import BHTree
+        return BHTree
+    elif name == 'sse':
+        from amuse.community.sse.interface import SSE
+        return SSE
+    elif name == 'twobody':
+        from amuse.community.twobody.interface import TwoBody
+        return TwoBody
+    else:
+        raise Exception("unknown code {0!r}, use bhtree, sse or twobody".format(name))
+
+def measure(code_factory, number_of_instances, worker_pool, channel_type):
+    t0 = time.time()
+    for i in range(number_of_instances):
+        instance = code_factory(worker_pool = worker_pool, channel_type = channel_type)
+        instance.initialize_code()
+        instance.stop()
+    t1 = time.time()
+    return (t1 - t0) / number_of_instances
+
+def run(code_name, number_of_instances, channel_type):
+    code_factory = new_code_factory(code_name)
+    pool = WorkerPool(maximum_number_of_workers = 1)
+
+    table = texttable.Texttable()
+    table.set_cols_dtype(['t', 'i', 'f', 'i', 'i'])
+    table.set_cols_align(["l", "r", "r", "r", "r"])
+    rows = [('workers', 'instances', 'seconds per instance', 'started', 'reused')]
+    rows.append(('new', number_of_instances, measure(code_factory, number_of_instances, None, channel_type),
+        number_of_instances, 0))
+    rows.append(('pool', number_of_instances, measure(code_factory, number_of_instances, pool, channel_type),
+        pool.number_of_started_workers, pool.number_of_reused_workers))
+    pool.stop()
+    table.add_rows(rows)
+    print table.draw()
+
+def new_option_parser():
+    result = OptionParser()
+    result.add_option(
+        "-c", "--code",
+        dest="code_name",
+        default="bhtree",
+        help="code to start (bhtree, sse or twobody)"
+    )
+    result.add_option(
+        "-n", "--instances",
+        dest="number_of_instances",
+        type="int",
+        default=100,
+        help="number of instances to create and stop"
+    )
+    result.add_option(
+        "-t", "--channel_type",
+        dest="channel_type",
+        default="mpi",
+        help="channel to the workers (mpi or sockets)"
+    )
+    return result
+
+if __name__ == '__main__':
+    options, arguments = new_option_parser().parse_args()
+    run(options.code_name, options.number_of_instances, options.channel_type)